@@ -8,14 +8,15 @@ from typing import Any, Text, Dict, List
 from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet, FollowupAction
-from jinja2 import Template
 
 # Import EmailMCP
 from utils.email_mcp import EmailMCP
+from utils.message_refs import compact_emails, load_thread_refs
+from utils.draft_generation import clean_generated_text, get_prompt_template, render_draft_prompt
 
 # Import OpenAI utilities 
 try:
-    from utils.openai_utils import OpenAIClient
+    from utils.openai_utils import OpenAIClient, get_openai_client
 except ImportError:
     # Fallback if OpenAI utils aren't available
     import os
@@ -32,6 +33,26 @@ except ImportError:
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json"
             }
+            # Keep-alive session shared by all requests of this client
+            self.session = requests.Session()
+
+        def chat_completion(self, messages, model="gpt-3.5-turbo", task=None, **params):
+            response = self.session.post(f"{self.base_url}/chat/completions", headers=self.headers,
+                                         json={"model": model, "messages": messages, **params},
+                                         timeout=(5, 60))
+            response.raise_for_status()
+            result = response.json()
+            if 'choices' in result and len(result['choices']) > 0:
+                return result['choices'][0]['message']['content'].strip()
+            raise ValueError("No content in OpenAI response")
+
+    _fallback_client = None
+
+    def get_openai_client():
+        global _fallback_client
+        if _fallback_client is None:
+            _fallback_client = OpenAIClient()
+        return _fallback_client
 
 
 def load_imap_settings():
@@ -60,6 +81,9 @@ def make_json_serializable(obj):
         return [make_json_serializable(item) for item in obj]
     elif isinstance(obj, (int, float, str, bool, type(None))):
         return obj
+    elif hasattr(obj, 'to_dict'):
+        # Email records (e.g. EmailEnvelope) convert themselves
+        return make_json_serializable(obj.to_dict())
     else:
         # For other types, convert to string
         return str(obj)
@@ -81,7 +105,7 @@ class ActionCheckEmail(Action):
         context = {
             "connected": False,
             "emails": [],
-            "recent_emails": [],
+            "email_refs": [],
             "unread_count": 0
         }
 
@@ -90,6 +114,7 @@ class ActionCheckEmail(Action):
             return [SlotSet("mcp_context", context),
                     SlotSet("email_connected", False)]
 
+        mcp = None
         try:
             # Initialize MCP
             mcp = EmailMCP(imap_settings)
@@ -101,21 +126,25 @@ class ActionCheckEmail(Action):
             limit = 5
 
             if connected:
-                # Select folder
-                mcp.select_folder(folder)
+                # Select folder read-only, checking mail must not mark anything as read
+                mcp.select_folder(folder, readonly=True)
 
                 # Get unread count
                 unread_count = mcp.get_unread_count()
 
-                # Get unread emails
-                emails = mcp.get_unread_emails(limit=limit)
-
-                # Update context
-                context = mcp.get_context()
-                context["connected"] = True
-                context["emails"] = emails
-                context["recent_emails"] = emails
-                context["unread_count"] = unread_count
+                # Headers only, the bodies are loaded on demand through the refs
+                emails = mcp.get_unread_emails(limit=limit, headers_only=True)
+
+                # Slots and the frontend get compact envelopes with refs,
+                # bodies are loaded on demand through /api/messages/<ref>
+                compact = compact_emails(mcp, emails)
+                context = {
+                    "connected": True,
+                    "current_folder": mcp.context.get("current_folder", folder),
+                    "emails": compact,
+                    "email_refs": [email["ref"] for email in compact if email["ref"]],
+                    "unread_count": unread_count
+                }
 
                 # Format response
                 if emails:
@@ -127,16 +156,17 @@ class ActionCheckEmail(Action):
                     response = f"I checked your {folder} folder, but didn't find any unread emails."
             else:
                 # Connection failed
-                context = mcp.get_context()  # Get error information
-                response = f"I couldn't connect to your email server. Error: {context.get('error', 'Unknown error')}"
-
-            # Close connection
-            mcp.disconnect()
+                context["error"] = mcp.get_context().get("error")
+                response = f"I couldn't connect to your email server. Error: {context.get('error') or 'Unknown error'}"
 
         except Exception as e:
             print(f"Error in email action: {e}")
             context["error"] = str(e)
             response = f"Sorry, I encountered an error checking your emails: {str(e)}"
+        finally:
+            # Close connection, also after an error so the session goes back to the pool
+            if mcp:
+                mcp.disconnect()
 
         # Send response with both text and custom message format
         dispatcher.utter_message(text=response)
@@ -186,6 +216,8 @@ class ActionTestEmailConnection(Action):
                 text="Missing email settings. Please provide your IMAP server details.")
             return [SlotSet("email_connected", False)]
 
+        mcp = None
+        connected = False
         try:
             # Initialize MCP
             mcp = EmailMCP(imap_settings)
@@ -217,12 +249,13 @@ class ActionTestEmailConnection(Action):
             else:
                 response = f"Failed to connect to your email server. Error: {context.get('error', 'Unknown error')}"
 
-            # Close connection
-            mcp.disconnect()
-
         except Exception as e:
             context = {"connected": False, "error": str(e)}
             response = f"Error testing email connection: {str(e)}"
+        finally:
+            # Close connection, also after an error so the session goes back to the pool
+            if mcp:
+                mcp.disconnect()
 
         # Send response with both text and custom message format
         dispatcher.utter_message(text=response)
@@ -327,16 +360,36 @@ class ActionSearchEmails(Action):
             # Load settings
             imap_settings = load_imap_settings()
             
-            # For now, we'll let the frontend do the search
-            # Just send the search criteria
+            # The local full-text index answers when the folder is fully
+            # synced, otherwise search_emails() asks the server
+            search_results = []
+            total_results = 0
+            if imap_settings:
+                mcp = EmailMCP(imap_settings)
+                try:
+                    if mcp.connect():
+                        mcp.select_folder("INBOX", readonly=True)
+                    emails = mcp.search_emails({**search_criteria, "folder": "INBOX", "limit": 10,
+                                                "headers_only": True})
+                    search_results = compact_emails(mcp, emails)
+                    total_results = len(search_results)
+                finally:
+                    mcp.disconnect()
+            
+            if search_results:
+                dispatcher.utter_message(text=f"I found {total_results} matching email(s).")
+            
+            # The frontend still gets the criteria to search its own cache as well
             dispatcher.utter_message(
                 json_message={
                     "action": {
                         "name": "search_emails",
-                        "criteria": search_criteria
+                        "criteria": search_criteria,
+                        "total": total_results
                     },
                     "context": {
-                        "search_criteria": search_criteria
+                        "search_criteria": search_criteria,
+                        "search_results": search_results
                     }
                 }
             )
@@ -366,6 +419,11 @@ class ActionSaveDraft(Action):
         subject = tracker.get_slot("subject")
         content = tracker.get_slot("content")
         
+        # Drafts streamed in the web app never pass through the content slot
+        metadata = tracker.get_latest_message().get("metadata", {})
+        if not content and metadata.get("draft_content"):
+            content = metadata.get("draft_content")
+        
         # Debug info - print the slot values
         print(f"Debug - Slots: recipient='{recipient}', subject='{subject}', content='{content}'")
         
@@ -399,6 +457,7 @@ class ActionSaveDraft(Action):
             saved_to_imap = False
             save_error = None
             
+            mcp = None
             try:
                 if imap_settings:
                     mcp = EmailMCP(imap_settings)
@@ -406,10 +465,12 @@ class ActionSaveDraft(Action):
                         saved_to_imap = mcp.save_draft(draft_email)
                         if not saved_to_imap:
                             save_error = mcp.get_context().get('error', 'Unknown error')
-                        mcp.disconnect()
             except Exception as e:
                 save_error = str(e)
                 print(f"Error saving draft to IMAP: {e}")
+            finally:
+                if mcp:
+                    mcp.disconnect()
             
             # Send draft to frontend regardless of IMAP result
             dispatcher.utter_message(text=f"I've saved your draft email to {recipient} with subject: {subject}" + 
@@ -459,6 +520,11 @@ class ActionSendEmail(Action):
         subject = tracker.get_slot("subject")
         content = tracker.get_slot("content")
         
+        # Drafts streamed in the web app never pass through the content slot
+        metadata = tracker.get_latest_message().get("metadata", {})
+        if not content and metadata.get("draft_content"):
+            content = metadata.get("draft_content")
+        
         # Debug info - print the slot values
         print(f"Debug - Sending email: recipient='{recipient}', subject='{subject}', content='{content}'")
         
@@ -488,13 +554,15 @@ class ActionSendEmail(Action):
                 "from": imap_settings["username"] if imap_settings and "username" in imap_settings else ""
             }
             
-            # Initialize MCP and send the email
+            # Write the email to the outbound spool, delivery happens in the background
             sent_success = False
             send_error = None
+            outbox_id = None
             
             try:
                 mcp = EmailMCP(imap_settings)
-                sent_success = mcp.send_email(email_data)
+                outbox_id = mcp.queue_email(email_data)
+                sent_success = outbox_id is not None
                 if not sent_success:
                     send_error = mcp.get_context().get('error', 'Unknown error')
             except Exception as e:
@@ -503,7 +571,7 @@ class ActionSendEmail(Action):
             
             # Send response to user based on success/failure
             if sent_success:
-                dispatcher.utter_message(text=f"I've sent your email to {recipient} with subject: {subject}")
+                dispatcher.utter_message(text=f"I'm sending your email to {recipient} with subject: {subject}")
             else:
                 dispatcher.utter_message(
                     text=f"I couldn't send your email. {send_error if send_error else 'Please check your email settings and try again.'}"
@@ -515,12 +583,14 @@ class ActionSendEmail(Action):
                     "action": {
                         "name": "send_email",
                         "email_data": email_data,
-                        "success": sent_success
+                        "success": sent_success,
+                        "outbox_id": outbox_id
                     },
                     "context": {
                         "email_data": email_data,
                         "email_sent": sent_success,
-                        "send_error": send_error
+                        "send_error": send_error,
+                        "outbox_id": outbox_id
                     }
                 }
             )
@@ -545,31 +615,14 @@ class ActionGenerateDraft(Action):
 
     def get_prompt_template(self) -> Text:
         """Load the email draft prompt template from file."""
-        try:
-            current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            template_path = os.path.join(current_dir, 'prompts', 'email-draft-prompt.jinja2')
-            
-            if os.path.exists(template_path):
-                with open(template_path, 'r') as file:
-                    return file.read()
-            else:
-                print(f"Warning: Email draft prompt template not found at {template_path}")
-                # Fallback to a basic template
-                return """You are an AI email assistant.
-                Draft an email with subject: {{ subject }}, in a {{ tone }} tone.
-                {% if email_thread %}Based on this thread: {{ email_thread }}{% endif %}
-                ONLY RETURN THE DRAFT TEXT."""
-        except Exception as e:
-            print(f"Error loading prompt template: {e}")
-            return "Write an email draft about {{ subject }} in a {{ tone }} tone."
+        return get_prompt_template()
 
     def call_openai_api(self, prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 800) -> str:
         """Make a direct call to OpenAI API"""
         try:
-            # First try using our OpenAI utility class if available
+            # Shared client, its pooled connection and parsed config are reused across drafts
+            openai_client = get_openai_client()
             try:
-                # Create OpenAI client with no config path - it will use the absolute path internally
-                openai_client = OpenAIClient()
                 # Use draft_generator model if defined in config
                 model_to_use = openai_client.config['models'].get('draft_generator', model)
                 
@@ -583,36 +636,17 @@ class ActionGenerateDraft(Action):
             except Exception as e:
                 print(f"OpenAI utility error: {e}")
                 
-                # Fall back to direct API call
-                api_key = os.environ.get("OPENAI_API_KEY")
-                if not api_key:
-                    raise ValueError("OPENAI_API_KEY environment variable not set")
-                
-                headers = {
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                url = "https://api.openai.com/v1/chat/completions"
-                payload = {
-                    "model": model,
-                    "messages": [
+                # Fall back to the basic model and parameters over the same connection
+                print("Falling back to direct OpenAI API call")
+                return openai_client.chat_completion(
+                    [
                         {"role": "system", "content": "You are an AI email assistant tasked with drafting professional emails."},
                         {"role": "user", "content": prompt}
                     ],
-                    "max_tokens": max_tokens,
-                    "temperature": 0.7
-                }
-                
-                print("Falling back to direct OpenAI API call")
-                response = requests.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                
-                result = response.json()
-                if 'choices' in result and len(result['choices']) > 0:
-                    return result['choices'][0]['message']['content'].strip()
-                else:
-                    raise ValueError("No content in OpenAI response")
+                    model=model,
+                    max_tokens=max_tokens,
+                    temperature=0.7
+                )
                 
         except Exception as e:
             print(f"Error calling OpenAI API: {e}")
@@ -638,6 +672,22 @@ class ActionGenerateDraft(Action):
             dispatcher.utter_message(text="I need a subject to draft an email. What's the email about?")
             return [SlotSet("auto_draft", False)]
         
+        # Replying to an email: reconstruct its conversation from the thread index
+        metadata = tracker.get_latest_message().get("metadata", {})
+        imap_settings = load_imap_settings()
+        events = []
+        if not email_thread and imap_settings and (current_email_id or metadata.get("email_ref")):
+            try:
+                folder = (tracker.get_slot("mcp_context") or {}).get("current_folder") or "INBOX"
+                refs = load_thread_refs(imap_settings, ref=metadata.get("email_ref"),
+                                        uid=current_email_id, folder=folder)
+                if refs:
+                    # Only the refs go into the slot, render_draft_prompt loads and compacts the bodies
+                    email_thread = {"refs": refs}
+                    events.append(SlotSet("email_thread", email_thread))
+            except Exception as e:
+                print(f"Error loading email thread: {e}")
+
         # Debug info
         print(f"Generating draft with subject='{subject}', tone='{tone}', recipient='{recipient}'")
         print(f"Additional context: current_email_id='{current_email_id}', has_thread={email_thread is not None}")
@@ -651,13 +701,28 @@ class ActionGenerateDraft(Action):
             "additional_instructions": additional_instructions
         }
         
+        # The web app streams the draft itself through /api/draft_stream,
+        # so the user sees it being written instead of waiting for all of it
+        if metadata.get("stream_drafts"):
+            dispatcher.utter_message(
+                json_message={
+                    "action": {
+                        "name": "stream_draft",
+                        "request": variables
+                    },
+                    "context": {
+                        "draft_subject": subject
+                    }
+                }
+            )
+            return events + [
+                SlotSet("auto_draft", True),
+                SlotSet("draft_generated", True)
+            ]
+        
         try:
-            # Get prompt template
-            template_text = self.get_prompt_template()
-            
-            # Render the template with variables
-            template = Template(template_text)
-            rendered_prompt = template.render(**variables)
+            # Render the prompt template with variables
+            rendered_prompt = render_draft_prompt(variables, imap_settings)
             
             # Call OpenAI
             generated_content = self.call_openai_api(rendered_prompt)
@@ -703,7 +768,7 @@ class ActionGenerateDraft(Action):
                 )
                 
                 # Return SlotSet actions to update the slots
-                return [
+                return events + [
                     SlotSet("content", clean_content),
                     SlotSet("auto_draft", True),
                     SlotSet("draft_generated", True)
@@ -726,66 +791,4 @@ class ActionGenerateDraft(Action):
     
     def clean_generated_text(self, text: str) -> str:
         """Clean the generated text by removing unnecessary elements."""
-        if not text:
-            return ""
-            
-        # Debug original text
-        print(f"Original draft text ({len(text)} chars):\n{text[:100]}...")
-            
-        # Remove typical LLM explanations or formatting
-        lines = text.strip().split('\n')
-            
-        # Track if we've found content markers
-        content_lines = []
-        capture = False
-        
-        # Markers for explanatory content we want to skip
-        skip_markers = [
-            "here's a draft", "here is a draft", "draft email", "email draft", 
-            "subject:", "to:", "from:", "draft for you", "here is the", "here's the"
-        ]
-        
-        # Process each line
-        for i, line in enumerate(lines):
-            lower_line = line.lower().strip()
-            
-            # Skip empty lines at the beginning
-            if not content_lines and not lower_line:
-                continue
-                
-            # Check if this line contains a skip marker
-            should_skip = False
-            is_header = False
-            
-            if i < 5:  # Only check first few lines for efficiency
-                should_skip = any(marker in lower_line for marker in skip_markers)
-                is_header = lower_line.startswith("subject:") or lower_line.startswith("to:") or lower_line.startswith("from:")
-            
-            if should_skip:
-                if is_header:
-                    # Skip email header lines
-                    continue
-                else:
-                    # This is a marker line, start capturing from next line
-                    capture = True
-                    continue
-            
-            # Always capture content once we've started or if no markers found
-            if capture or len(content_lines) > 0 or i > 2:  # Start capturing after line 2 if nothing captured yet
-                content_lines.append(line)
-        
-        # If we didn't capture anything meaningful, return the original text with minimal cleaning
-        if not content_lines:
-            print("No content captured! Using original text with minimal cleaning")
-            # Skip first line if it looks like an explanation, otherwise use full text
-            if len(lines) > 1 and any(marker in lines[0].lower() for marker in skip_markers):
-                result = '\n'.join(lines[1:])
-            else:
-                result = '\n'.join(lines)
-        else:
-            # Join captured lines
-            result = '\n'.join(content_lines)
-            
-        # Debug cleaned text
-        print(f"Cleaned draft text ({len(result)} chars):\n{result[:100]}...")
-        return result
\ No newline at end of file
+        return clean_generated_text(text)
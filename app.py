@@ -1,11 +1,19 @@
 import json
 import os
+import queue
+import threading
 import requests
 import logging
-from flask import Flask, send_from_directory, request, jsonify
+from flask import Flask, Response, send_from_directory, request, jsonify
 from flask_cors import CORS
 from requests.exceptions import RequestException, Timeout, ConnectionError
 
+from utils.idle_watcher import IdleWatcher
+from utils.message_refs import load_referenced_email
+from utils.draft_generation import clean_generated_text, render_draft_prompt
+from utils.openai_utils import get_openai_client
+from utils.smtp_spool import get_smtp_spool, start_smtp_spool
+
 # Setup logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,6 +27,61 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 # Default Rasa server URL
 DEFAULT_RASA_URL = 'http://localhost:5005/webhooks/rest/webhook'
 
+# Seconds between keep-alive comments on the email event stream
+EMAIL_EVENTS_KEEPALIVE = 15
+
+# Server-side new-mail watcher, started on the first event stream subscriber
+email_watcher = None
+email_watcher_lock = threading.Lock()
+
+
+def load_imap_settings():
+    """Load IMAP settings from JSON file"""
+    try:
+        settings_file = os.path.join(app.root_path, 'settings', 'imap_settings.json')
+        if os.path.exists(settings_file):
+            with open(settings_file, 'r') as f:
+                return json.load(f)
+        return None
+    except Exception as e:
+        logger.error(f"Error loading IMAP settings: {e}")
+        return None
+
+
+@app.before_request
+def start_background_workers():
+    """
+    Start the outbound spool worker in the process that serves requests
+
+    Runs under both "flask run" and "python app.py", but not when the module
+    is only imported (or in the reloader's parent process). Delivers mail
+    left in the outbox by the previous run, including mail queued by the
+    action server.
+    """
+    start_smtp_spool()
+
+
+def get_email_watcher():
+    """Get the running IMAP IDLE watcher, starting it if needed"""
+    global email_watcher
+    with email_watcher_lock:
+        if email_watcher is None:
+            settings = load_imap_settings()
+            if not settings:
+                return None
+            email_watcher = IdleWatcher(settings, folders=["INBOX"])
+            email_watcher.start()
+        return email_watcher
+
+
+def reset_email_watcher():
+    """Stop the IMAP IDLE watcher so it restarts with fresh settings"""
+    global email_watcher
+    with email_watcher_lock:
+        if email_watcher is not None:
+            email_watcher.stop()
+            email_watcher = None
+
 # Serve frontend files
 
 
@@ -187,6 +250,95 @@ def process_rasa_response(response, original_context):
 
     return result
 
+@app.route('/api/email_events', methods=['GET'])
+def email_events():
+    """Stream new-mail events from the IMAP IDLE watcher as server-sent events"""
+    watcher = get_email_watcher()
+    if watcher is None:
+        return jsonify({"error": "IMAP settings are not configured"}), 404
+
+    events = queue.Queue()
+    token = watcher.subscribe(events.put)
+
+    def stream():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = events.get(timeout=EMAIL_EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            watcher.unsubscribe(token)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/draft_stream', methods=['POST'])
+def draft_stream():
+    """
+    Generate an email draft and stream it to the browser as server-sent events
+
+    "token" events carry text as the model produces it, a final "done" event
+    the draft after clean_generated_text(), "error" events a failure.
+    """
+    variables = request.json or {}
+    if not variables.get("subject"):
+        return jsonify({"error": "A subject is required"}), 400
+
+    try:
+        client = get_openai_client()
+        prompt = render_draft_prompt(variables, load_imap_settings())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    def stream():
+        pieces = []
+        try:
+            for text in client.generate_text_stream(prompt):
+                pieces.append(text)
+                yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+            content = clean_generated_text(''.join(pieces))
+            yield f"event: done\ndata: {json.dumps({'content': content})}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming draft: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/outbox', methods=['GET'])
+def list_outbox():
+    """List spooled outgoing emails and their delivery state (?status=queued|sending|sent|failed)"""
+    try:
+        limit = int(request.args.get('limit', 50))
+        messages = get_smtp_spool().list_messages(status=request.args.get('status'), limit=limit)
+        return jsonify({"messages": messages})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/outbox/<int:outbox_id>', methods=['GET'])
+def outbox_status(outbox_id):
+    """Delivery state of a spooled outgoing email"""
+    status = get_smtp_spool().get_status(outbox_id)
+    if status is None:
+        return jsonify({"error": "Unknown outbox id"}), 404
+    return jsonify(status)
+
+@app.route('/api/messages/<ref>', methods=['GET'])
+def get_message(ref):
+    """Full email (body and attachments) behind a message ref from an action payload"""
+    settings = load_imap_settings()
+    if not settings:
+        return jsonify({"error": "IMAP settings are not configured"}), 404
+
+    email_data = load_referenced_email(settings, ref)
+    if email_data is None:
+        return jsonify({"error": "Unknown or expired message ref"}), 404
+    return jsonify(email_data)
+
 @app.route('/api/save_imap_settings', methods=['POST'])
 def save_imap_settings():
     try:
@@ -200,6 +352,10 @@ def save_imap_settings():
         settings_file = os.path.join(settings_dir, 'imap_settings.json')
         with open(settings_file, 'w') as f:
             json.dump(settings, f, indent=4)
+
+        # New credentials or server, let the watcher reconnect with them
+        reset_email_watcher()
+        get_smtp_spool().register_account(settings)
         
         return jsonify({"success": True, "message": "IMAP settings saved successfully"})
     except Exception as e:
@@ -126,7 +126,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // State
     let isTyping = false;
-    let conversationContext = {};
+    // stream_drafts: drafts are streamed through /api/draft_stream instead of
+    // arriving in one piece from the draft action
+    let conversationContext = { stream_drafts: true };
 
     // Initialize
     chatInput.focus();
@@ -567,6 +569,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     getFullEmailContent(action.emailId).then(email => {
                         if (email) {
                             markEmailAsRead(action.emailId);
+                            // A draft written next is a reply, its thread is loaded through this ref
+                            conversationContext.email_ref = email.ref || null;
                             const formattedEmail = formatEmailForDisplay(email);
                             addMessageToChat('bot', formattedEmail, new Date());
                         }
@@ -683,6 +687,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
                 break;
             
+            case 'stream_draft':
+                if (action.request) {
+                    streamDraft(action.request);
+                }
+                break;
+
             // case 'handle_llm_fallback':
             //     if (action.response) {
             //         addMessageToChat('bot', action.response, new Date());
@@ -694,6 +704,90 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    /**
+     * Generate a draft and show it in the chat while it is being written
+     * @param {Object} request - Draft variables (subject, tone, recipient, ...)
+     */
+    async function streamDraft(request) {
+        const draftId = `draft-stream-${Date.now()}`;
+        addMessageToChat('bot', `
+            <div class="email-draft">
+                <h4>📝 ${request.subject || 'Email Draft'}</h4>
+                <div class="draft-content" id="${draftId}"></div>
+            </div>`, new Date());
+        const draftDiv = document.getElementById(draftId);
+
+        try {
+            const response = await fetch('/api/draft_stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(request)
+            });
+            if (!response.ok || !response.body) {
+                throw new Error(`Server responded with ${response.status}: ${response.statusText}`);
+            }
+
+            // Server-sent events: "event: <type>\ndata: <json>\n\n"
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let streamed = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    const type = (rawEvent.match(/^event: (.*)$/m) || [])[1];
+                    const data = (rawEvent.match(/^data: (.*)$/m) || [])[1];
+                    if (!type || !data) continue;
+                    const payload = JSON.parse(data);
+
+                    if (type === 'token') {
+                        streamed += payload.text;
+                        draftDiv.textContent = streamed;
+                        scrollToBottom();
+                    } else if (type === 'done') {
+                        draftDiv.innerHTML = escapeDraftText(payload.content).replace(/\n/g, '<br>');
+                        // Sent along with the next message so send/save use this draft
+                        conversationContext.draft_content = payload.content;
+                        draftDiv.insertAdjacentHTML('afterend', `
+                            <div class="draft-actions">
+                                <button class="draft-action-btn" data-action="send">Send</button>
+                                <button class="draft-action-btn" data-action="edit">Edit</button>
+                                <button class="draft-action-btn" data-action="discard">Discard</button>
+                            </div>`);
+                        draftDiv.parentElement.querySelectorAll('.draft-action-btn').forEach(btn => {
+                            btn.addEventListener('click', handleDraftAction);
+                        });
+                    } else if (type === 'error') {
+                        throw new Error(payload.error);
+                    }
+                }
+            }
+        } catch (error) {
+            console.error('Error streaming draft:', error);
+            addMessageToChat('bot', 'Sorry, I encountered an error generating your draft.', new Date());
+        }
+    }
+
+    /**
+     * Escape generated text for display as HTML
+     * @param {string} text - Plain text
+     * @returns {string} - HTML-safe text
+     */
+    function escapeDraftText(text) {
+        const div = document.createElement('div');
+        div.textContent = text || '';
+        return div.innerHTML;
+    }
+
     /**
      * Get the full email content from the database
      * @param {number} emailId - ID of the email to retrieve
@@ -701,7 +795,9 @@ document.addEventListener('DOMContentLoaded', () => {
      */
     async function getFullEmailContent(emailId) {
         try {
-            return await window.mailoDB.db.emails.get(emailId);
+            const email = await window.mailoDB.db.emails.get(emailId);
+            // Emails from action payloads only carry a ref, load the body on first open
+            return await window.emailService.loadReferencedBody(email);
         } catch (error) {
             console.error('Error fetching email content:', error);
             throw error;
@@ -924,7 +1020,7 @@ document.addEventListener('DOMContentLoaded', () => {
             clearConversationsFromDB();
 
             // Reset conversation context
-            conversationContext = {};
+            conversationContext = { stream_drafts: true };
 
             // Add a confirmation message
             showTypingIndicator();
@@ -130,6 +130,8 @@
                 const updatedEmail = {
                     ...existingEmail,
                     ...emailData,
+                    // Envelopes from action payloads carry no body, keep one loaded earlier
+                    body: emailData.body || existingEmail.body || '',
                     id: existingEmail.id // Keep the same ID
                 };
                 
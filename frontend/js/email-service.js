@@ -231,6 +231,21 @@ const SIMULATION_PROBABILITY = 0.2; // 20% chance of generating emails in demo m
             // Immediately check for emails
             // this.checkEmails();
 
+            // Listen for new-mail events pushed by the server's IMAP IDLE watcher
+            if (window.EventSource) {
+                this.eventSource = new EventSource('/api/email_events');
+                this.eventSource.addEventListener('new_mail', (event) => {
+                    const data = JSON.parse(event.data);
+                    console.log(`New mail in ${data.folder}:`, data.uids);
+                    this.checkEmails();
+                });
+                this.eventSource.onerror = () => {
+                    // EventSource reconnects on its own, just log it
+                    console.warn('Email event stream interrupted, reconnecting...');
+                };
+                return;
+            }
+
             // Set up interval for checking emails
             this.checkInterval = setInterval(() => {
                 // this.checkEmails();
@@ -246,6 +261,10 @@ const SIMULATION_PROBABILITY = 0.2; // 20% chance of generating emails in demo m
             }
 
             console.log('Stopping email service...');
+            if (this.eventSource) {
+                this.eventSource.close();
+                this.eventSource = null;
+            }
             clearInterval(this.checkInterval);
             this.isRunning = false;
         }
@@ -682,10 +701,40 @@ const SIMULATION_PROBABILITY = 0.2; // 20% chance of generating emails in demo m
                 read: !!mcpEmail.read,
                 folder: mcpEmail.folder || this.currentFolder,
                 attachments: mcpEmail.attachments || [],
-                has_attachments: mcpEmail.has_attachments || false
+                has_attachments: mcpEmail.has_attachments || false,
+                // Server-side message reference, the body is loaded through it on demand
+                ref: mcpEmail.ref || null,
+                preview: mcpEmail.preview || ''
             };
         }
 
+        /**
+         * Load the body of an email that only has a message ref
+         * @param {Object} email - Email from the local database
+         * @returns {Promise<Object>} - The email with body and attachments filled in
+         */
+        async loadReferencedBody(email) {
+            if (!email || email.body || !email.ref) {
+                return email;
+            }
+
+            const response = await fetch(`/api/messages/${encodeURIComponent(email.ref)}`);
+            if (!response.ok) {
+                console.warn(`Could not load message ${email.ref}: status ${response.status}`);
+                return email;
+            }
+
+            const data = await response.json();
+            const updates = {
+                body: data.body || '',
+                attachments: data.attachments || email.attachments || []
+            };
+            if (email.id && window.mailoDB && window.mailoDB.db) {
+                await window.mailoDB.db.emails.update(email.id, updates);
+            }
+            return { ...email, ...updates };
+        }
+
         /**
          * Search for emails with specific criteria
          * @param {Object} criteria - Search criteria (sender, subject, date, etc.)
@@ -841,8 +890,8 @@ const SIMULATION_PROBABILITY = 0.2; // 20% chance of generating emails in demo m
                 const fromParts = from.split('<');
                 const senderName = fromParts[0].trim() || from;
                 
-                // Get a short preview of the body
-                const bodyPreview = (email.body || email.content || "")
+                // Get a short preview of the body (compact envelopes carry one from the server)
+                const bodyPreview = email.preview || (email.body || email.content || "")
                     .replace(/<[^>]*>/g, '') // Remove HTML tags
                     .substring(0, 100) + ((email.body?.length > 100 || email.content?.length > 100) ? '...' : '');
                 
@@ -967,7 +1016,7 @@ const SIMULATION_PROBABILITY = 0.2; // 20% chance of generating emails in demo m
                     const email = await window.mailoDB.db.emails.get(parseInt(emailId));
                     if (email) {
                         console.log('Found email in local database:', email);
-                        return email;
+                        return await this.loadReferencedBody(email);
                     }
                 }
                 
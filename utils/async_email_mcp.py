@@ -0,0 +1,549 @@
+"""
+Asyncio variant of EmailMCP for MailoBot
+
+Offers the public API of EmailMCP as coroutines on top of
+AsyncIMAPConnection, so one event loop can serve many accounts and folders
+and independent commands of an operation are pipelined on the connection
+instead of waiting for each other.
+"""
+import asyncio
+import functools
+from typing import Dict, List, Any, Optional
+
+from utils.async_imap import AsyncIMAPConnection, IMAPResponse
+from utils.email_mcp import EmailMCP
+from utils.imap_utils import (build_uid_set, chunked, get_literal, is_message_literal, parse_esearch_response,
+                              parse_fetch_response, parse_list_response, parse_status_response, quote_mailbox)
+from utils.mime_stream import StreamingMimeParser
+
+
+class _MessageSink:
+    """Streams a message literal into the MIME parser and the local message store"""
+
+    def __init__(self, parser: StreamingMimeParser, writer):
+        self.parser = parser
+        self.writer = writer
+        self.parsed = None
+
+    def feed(self, chunk: bytes):
+        self.parser.feed(chunk)
+        if self.writer:
+            self.writer.write(chunk)
+
+    def close(self):
+        self.parsed = self.parser.close()
+        return self
+
+    def discard(self):
+        """Release spooled parts and drop the store blob unless it was committed"""
+        if self.parsed:
+            self.parsed.close()
+        if self.writer:
+            self.writer.abort()
+            self.writer = None
+
+
+class AsyncEmailMCP:
+    """
+    EmailMCP on asyncio streams with pipelined IMAP commands
+
+    Each instance owns one connection. Parsing, the email context, the local
+    message store and the search index are shared with a (never connected)
+    EmailMCP, so both variants produce the same email records.
+
+    Commands of one instance are written in call order, so an instance is
+    meant to serve one conversation at a time; run one instance per account
+    or folder to work on several concurrently on the same event loop.
+
+    Example:
+        mcp = AsyncEmailMCP(settings)
+        await mcp.connect()
+        count, emails = await asyncio.gather(
+            mcp.get_unread_count(), mcp.get_recent_emails(5))
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the AsyncEmailMCP with optional settings
+
+        Args:
+            settings: Dictionary with IMAP settings (host, port, username, password, tls)
+        """
+        self._local = EmailMCP(settings, use_pool=False)
+        self.context = self._local.context
+        self.imap_conn: Optional[AsyncIMAPConnection] = None
+        # Folder selected on the connection, None until a SELECT completed
+        self._selected_folder: Optional[str] = None
+
+    @property
+    def settings(self) -> Optional[Dict[str, Any]]:
+        return self._local.settings
+
+    async def connect(self, settings: Optional[Dict[str, Any]] = None):
+        """
+        Connect to the email server using IMAP
+
+        Args:
+            settings: Dictionary with IMAP settings (can override init settings)
+
+        Returns:
+            bool: True if connection successful, False otherwise
+        """
+        if settings:
+            self._local.settings = settings
+        elif not self.settings:
+            self._local.load_settings_from_file()
+
+        if not self.settings:
+            raise ValueError("Email settings not provided")
+
+        if self.imap_conn:
+            await self.disconnect()
+
+        tls = self.settings.get('tls', True)
+        conn = AsyncIMAPConnection(self.settings['host'],
+                                   int(self.settings.get('port', 993 if tls else 143)), tls)
+        try:
+            await conn.open()
+            await conn.login(self.settings['username'], self.settings['password'])
+            self.imap_conn = conn
+            self._selected_folder = None
+            self.context["connected"] = True
+            return True
+        except Exception as e:
+            print(f"Error connecting to email server: {e}")
+            await conn.close()
+            self.context["connected"] = False
+            self.context["error"] = str(e)
+            return False
+
+    async def disconnect(self):
+        """Log out and close the connection"""
+        if self.imap_conn:
+            try:
+                await self.imap_conn.logout()
+            except Exception:
+                pass
+            self.imap_conn = None
+            self._selected_folder = None
+            self.context["connected"] = False
+
+    def is_connected(self):
+        """Check if connected to email server"""
+        return self.imap_conn is not None and self.imap_conn.is_open and self.context.get("connected", False)
+
+    def get_account_id(self) -> str:
+        """Get a stable identifier for the configured account (user@host)"""
+        return self._local.get_account_id()
+
+    def get_context(self):
+        """Get the current MCP context"""
+        return self.context
+
+    async def _run_blocking(self, func, *args):
+        """Run SQLite, message store and MIME parsing work in the default executor, off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+    def has_capability(self, name: str) -> bool:
+        """Check whether the server advertises a capability (e.g. ESEARCH)"""
+        return self.is_connected() and name.upper() in self.imap_conn.capabilities
+
+    def _submit_select(self, folder: str) -> asyncio.Future:
+        """Queue a SELECT; later commands may be submitted right away"""
+        self._selected_folder = None
+        return self.imap_conn.submit('SELECT', quote_mailbox(folder))
+
+    async def _apply_select(self, folder: str, response: IMAPResponse) -> bool:
+        """Record the state reported by a completed SELECT, like EmailMCP.select_folder"""
+        if not response.ok:
+            return False
+
+        self._selected_folder = folder
+        self._local._apply_selection({
+            "folder": folder,
+            "exists": response.data('EXISTS'),
+            "uidvalidity": response.code('UIDVALIDITY'),
+            "uidnext": response.code('UIDNEXT'),
+            "highestmodseq": response.code('HIGHESTMODSEQ')
+        })
+        await self._run_blocking(self._local._purge_stale, folder, self.context["uidvalidity"])
+        return True
+
+    async def select_folder(self, folder: str = "INBOX"):
+        """
+        Select a mailbox folder
+
+        Args:
+            folder: Mailbox folder name
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not self.is_connected():
+            return False
+
+        try:
+            response = await asyncio.wait_for(self._submit_select(folder), self.imap_conn.timeout)
+            return await self._apply_select(folder, response)
+        except Exception as e:
+            print(f"Error selecting folder {folder}: {e}")
+            return False
+
+    async def _ensure_selected(self) -> bool:
+        """Make sure the current folder is selected on the connection"""
+        if self._selected_folder == self.context["current_folder"]:
+            return True
+        return await self.select_folder(self.context["current_folder"])
+
+    async def _command_in_folder(self, name: str, *args: str) -> Optional[IMAPResponse]:
+        """
+        Run a command against the current folder
+
+        If the folder is not selected yet, the SELECT is pipelined with the
+        command instead of waiting for it.
+
+        Returns:
+            The command's response, None if the folder could not be selected
+        """
+        folder = self.context["current_folder"]
+        if self._selected_folder == folder:
+            return await self.imap_conn.command(name, *args)
+
+        select = self._submit_select(folder)
+        request = self.imap_conn.submit(name, *args)
+        select_response, response = await asyncio.wait_for(
+            asyncio.gather(select, request), self.imap_conn.timeout)
+        if not await self._apply_select(folder, select_response):
+            return None
+        return response
+
+    async def _extended_search(self, name: str, *args: str) -> Optional[Dict[str, Any]]:
+        """Run UID SEARCH/SORT with RETURN options and parse its ESEARCH response, see EmailMCP"""
+        response = await self._command_in_folder(name, *args)
+        if response is None or not response.ok:
+            return None
+        return parse_esearch_response(response.data('ESEARCH'))
+
+    async def _search_uids(self, query: str) -> Optional[List[int]]:
+        """UIDs matching a plain UID SEARCH, in ascending order (None if it failed)"""
+        response = await self._command_in_folder('UID SEARCH', query)
+        if response is None or not response.ok:
+            return None
+        return sorted(int(uid) for uid in b" ".join(item for item in response.data('SEARCH') if item).split())
+
+    async def _newest_uids(self, query: str = 'ALL', limit: int = 5, offset: int = 0) -> Optional[List[int]]:
+        """UIDs of the newest emails matching a SEARCH query, newest first, see EmailMCP._newest_uids()"""
+        window = f"{offset + 1}:{offset + limit}"
+
+        if self.has_capability("SORT"):
+            if self.has_capability("ESORT") and self.has_capability("CONTEXT=SORT"):
+                result = await self._extended_search(
+                    'UID SORT', 'RETURN', f'(PARTIAL {window})', '(REVERSE DATE)', 'UTF-8', query)
+                if result is not None:
+                    return result.get("PARTIAL", [])
+
+            response = await self._command_in_folder('UID SORT', '(REVERSE DATE)', 'UTF-8', query)
+            if response is not None and response.ok:
+                uids = [int(uid) for uid in b" ".join(item for item in response.data('SORT') if item).split()]
+                return uids[offset:offset + limit]
+
+        if self.has_capability("PARTIAL"):
+            result = await self._extended_search(
+                'UID SEARCH', 'RETURN', f'(PARTIAL -{offset + 1}:-{offset + limit})', query)
+            if result is not None:
+                return sorted(result.get("PARTIAL", []), reverse=True)
+
+        if self.has_capability("ESEARCH"):
+            result = await self._extended_search('UID SEARCH', 'RETURN', '(ALL)', query)
+            if result is not None:
+                return result.get("ALL", [])[::-1][offset:offset + limit]
+
+        uids = await self._search_uids(query)
+        if uids is None:
+            return None
+        return uids[::-1][offset:offset + limit]
+
+    async def get_unread_count(self):
+        """Get the number of unread emails in the current folder (from STATUS, no SELECT needed)"""
+        if not self.is_connected():
+            return 0
+
+        folder = self.context["current_folder"]
+        try:
+            response = await self.imap_conn.command('STATUS', quote_mailbox(folder), '(UNSEEN)')
+            status = parse_status_response(response.data('STATUS')).get(folder, {}) if response.ok else {}
+            if "UNSEEN" in status:
+                count = status["UNSEEN"]
+            elif self.has_capability("ESEARCH"):
+                result = await self._extended_search('UID SEARCH', 'RETURN', '(COUNT)', 'UNSEEN')
+                if result is None:
+                    return 0
+                count = result.get("COUNT", 0)
+            else:
+                unread_ids = await self._search_uids('UNSEEN')
+                if unread_ids is None:
+                    return 0
+                count = len(unread_ids)
+            self.context["unread_count"] = count
+            return count
+        except Exception as e:
+            print(f"Error getting unread count: {e}")
+            return 0
+
+    async def get_recent_emails(self, limit: int = 5):
+        """
+        Get the most recent emails
+
+        Args:
+            limit: Maximum number of emails to retrieve
+
+        Returns:
+            List of EmailRecord objects
+        """
+        if not self.is_connected():
+            print("Cannot get recent emails - not connected")
+            return []
+
+        try:
+            # Most recent first, without listing every UID in the folder
+            recent_ids = await self._newest_uids('ALL', limit)
+            if not recent_ids:
+                return []
+
+            emails = await self.fetch_emails(recent_ids)
+            self.context["recent_emails"] = emails
+            return emails
+        except Exception as e:
+            print(f"Error getting recent emails: {e}")
+            return []
+
+    async def fetch_email(self, email_id):
+        """
+        Fetch a single email by UID
+
+        Args:
+            email_id: Email UID to fetch
+
+        Returns:
+            EmailRecord or None if error
+        """
+        emails = await self.fetch_emails([email_id])
+        return emails[0] if emails else None
+
+    async def fetch_emails(self, email_ids: List[Any], chunk_size: Optional[int] = None):
+        """
+        Fetch several emails by UID from the current folder
+
+        The FLAGS fetch for messages in the local store and the FETCH commands
+        for every chunk of missing messages are all pipelined. Message literals
+        are streamed into the MIME parser and the message store as they arrive;
+        that work, the local store and the indexes run in the default executor
+        so they do not hold up the event loop.
+
+        Args:
+            email_ids: Email UIDs to fetch
+            chunk_size: Maximum UIDs per FETCH command (defaults to fetch_chunk_size)
+
+        Returns:
+            List of EmailRecord objects in the order of email_ids
+        """
+        if not self.is_connected() or not email_ids:
+            return []
+        if not await self._ensure_selected():
+            print(f"Cannot fetch emails - folder {self.context['current_folder']} not selected")
+            return []
+
+        local = self._local
+        chunk_size = chunk_size or local.fetch_chunk_size
+        keys = [local._uid_str(email_id) for email_id in email_ids]
+        cached = await self._run_blocking(local._cached_paths, keys)
+        missing = [key for key in keys if key not in cached]
+
+        sinks: List[_MessageSink] = []
+
+        def open_sink(prefix: bytes, size: int) -> Optional[_MessageSink]:
+            if not is_message_literal(prefix):
+                return None
+            sink = _MessageSink(StreamingMimeParser(local.spool_threshold), local._open_store_writer())
+            sinks.append(sink)
+            return sink
+
+        def collect(responses: List[Any]) -> Dict[str, Any]:
+            fetched = {}
+            for response in responses[:len(flag_requests)]:
+                if not isinstance(response, IMAPResponse) or not response.ok:
+                    continue
+                for message in parse_fetch_response(response.data('FETCH')):
+                    key = str(message["uid"])
+                    if key in cached:
+                        email_data = local._parse_email_file(cached[key], key, message["flags"])
+                        if email_data:
+                            fetched[key] = email_data
+
+            if cached:
+                local._index_flags({int(key): ["\\Seen"] if fetched[key]["read"] else []
+                                    for key in cached if key in fetched})
+
+            for response in responses[len(flag_requests):]:
+                if isinstance(response, Exception):
+                    print(f"Error fetching emails: {response}")
+                    continue
+                if not response.ok:
+                    continue
+                for message in parse_fetch_response(response.data('FETCH')):
+                    sink = get_literal(message, 'RFC822', 'BODY[]')
+                    if not isinstance(sink, _MessageSink) or message["uid"] is None:
+                        continue
+                    if sink.writer:
+                        local._commit_store_writer(sink.writer, message["uid"])
+                        sink.writer = None
+                    email_data = local._build_email_data(sink.parsed, str(message["uid"]), message["flags"])
+                    if email_data:
+                        fetched[email_data["id"]] = email_data
+            return fetched
+
+        def finish(fetched: Dict[str, Any]):
+            for sink in sinks:
+                sink.discard()
+            local._index_emails([fetched[key] for key in missing if key in fetched])
+
+        flag_requests = [self.imap_conn.submit('UID FETCH', build_uid_set(chunk), '(UID FLAGS)')
+                         for chunk in chunked(list(cached), chunk_size)]
+        fetch_requests = [self.imap_conn.submit('UID FETCH', build_uid_set(chunk), '(UID FLAGS BODY.PEEK[])',
+                                                literal_handler=open_sink)
+                          for chunk in chunked(missing, chunk_size)]
+        fetched = {}
+        try:
+            responses = await asyncio.wait_for(
+                asyncio.gather(*flag_requests, *fetch_requests, return_exceptions=True),
+                self.imap_conn.timeout * (len(flag_requests) + len(fetch_requests)))
+            fetched = await self._run_blocking(collect, responses)
+        except Exception as e:
+            print(f"Error fetching emails: {e}")
+        finally:
+            await self._run_blocking(finish, fetched)
+        return [fetched[key] for key in keys if key in fetched]
+
+    async def search_emails(self, criteria: Dict[str, Any]):
+        """
+        Search for emails using various criteria
+
+        The local search index answers when the folder's sync checkpoint
+        shows every message of it was indexed (unless criteria['local'] is
+        False); otherwise the server is searched.
+
+        Args:
+            criteria: Dictionary with search parameters (sender, subject, date, etc.)
+
+        Returns:
+            List of EmailRecord objects matching criteria
+        """
+        local = self._local
+        folder = criteria.get('folder', self.context["current_folder"])
+        if local.search_index and criteria.get('local', True) and await self.is_fully_indexed(folder):
+            results = await self._run_blocking(local.search_local, criteria)
+            return [local._record_from_index(hit) for hit in results["results"]]
+
+        if not self.is_connected():
+            return []
+
+        try:
+            # Newest matches first, limited on the server where possible
+            limit = criteria.get('limit', 10)
+            offset = (max(1, int(criteria.get('page', 1))) - 1) * limit
+            email_ids = await self._newest_uids(local._build_search_query(criteria), limit, offset)
+            if not email_ids:
+                return []
+            return await self.fetch_emails(email_ids)
+        except Exception as e:
+            print(f"Error searching emails: {e}")
+            return []
+
+    async def is_fully_indexed(self, folder: Optional[str] = None) -> bool:
+        """Whether the local search index holds every message of a folder, see EmailMCP.is_fully_indexed()"""
+        folder = folder or self.context["current_folder"]
+        checkpoint = self._local._complete_checkpoint(folder)
+        if checkpoint is None:
+            return False
+        if not self.is_connected():
+            return True
+
+        try:
+            response = await self.imap_conn.command('STATUS', quote_mailbox(folder), '(UIDNEXT UIDVALIDITY)')
+        except Exception as e:
+            print(f"Error getting status of {folder}: {e}")
+            return False
+        status = parse_status_response(response.data('STATUS')).get(folder, {}) if response.ok else {}
+        return self._local._checkpoint_current(checkpoint, status)
+
+    async def mark_as_read(self, email_id):
+        """Mark an email as read"""
+        if not self.is_connected():
+            return False
+
+        try:
+            response = await self._command_in_folder(
+                'UID STORE', self._local._uid_str(email_id), '+FLAGS.SILENT', '(\\Seen)')
+            return response is not None and response.ok
+        except Exception as e:
+            print(f"Error marking email as read: {e}")
+            return False
+
+    async def get_special_folders(self, use_cache: bool = True) -> Dict[str, str]:
+        """Map folder roles to folder names, see EmailMCP.get_special_folders()"""
+        roles = self._local.cached_special_folders() if use_cache else None
+        if roles is not None:
+            return roles
+        if not self.is_connected():
+            return {}
+
+        if 'SPECIAL-USE' in self.imap_conn.capabilities:
+            response = await self.imap_conn.command('LIST', '""', '"*"', 'RETURN', '(SPECIAL-USE)')
+            if not response.ok:
+                response = await self.imap_conn.command('LIST', '""', '"*"')
+        else:
+            response = await self.imap_conn.command('LIST', '""', '"*"')
+        if not response.ok:
+            print(f"Failed to list folders: {response.text}")
+            return {}
+        return dict(self._local._cache_folders(parse_list_response(response.data('LIST')))[1])
+
+    async def save_draft(self, draft_data: Dict[str, Any]) -> bool:
+        """
+        Save a draft email to the IMAP server
+
+        Args:
+            draft_data: Dictionary with email draft data (to, subject, body, etc.)
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not self.is_connected():
+            print("Not connected to email server")
+            return False
+
+        try:
+            raw_message = self._local._build_draft_message(draft_data)
+            drafts_folder = (await self.get_special_folders()).get("drafts", "Drafts")
+            response = await self.imap_conn.command(
+                'APPEND', quote_mailbox(drafts_folder), '(\\Draft)', literal=raw_message)
+            if not response.ok:
+                # The cached folder may have been renamed or deleted, look again once
+                self._local.invalidate_folders()
+                rediscovered = (await self.get_special_folders()).get("drafts", "Drafts")
+                if rediscovered != drafts_folder:
+                    drafts_folder = rediscovered
+                    response = await self.imap_conn.command(
+                        'APPEND', quote_mailbox(drafts_folder), '(\\Draft)', literal=raw_message)
+
+            if response.ok:
+                print(f"Draft saved to {drafts_folder} folder")
+                self.context.setdefault('drafts', []).append(draft_data)
+                return True
+
+            print(f"Failed to save draft: {response.text}")
+            return False
+        except Exception as e:
+            print(f"Error saving draft: {e}")
+            self.context['error'] = str(e)
+            return False
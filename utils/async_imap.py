@@ -0,0 +1,356 @@
+"""
+Asyncio IMAP client session for MailoBot
+
+A minimal IMAP4rev1 client on asyncio streams. Commands are tagged and
+written as soon as they are submitted, so several commands can be in flight
+on one connection (pipelining) while a single reader task matches tagged
+completions to their callers. Untagged data is shaped like imaplib's, so the
+parsers in utils.imap_utils work on it unchanged.
+"""
+import asyncio
+import itertools
+import re
+import ssl
+from collections import OrderedDict
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+_LITERAL_MARKER_RE = re.compile(rb'\{(\d+)\+?\}$')
+_TAGGED_RE = re.compile(rb'^(\S+) (OK|NO|BAD)(?: (.*))?$', re.IGNORECASE)
+_UNTAGGED_NUMBERED_RE = re.compile(rb'^\* (\d+) (\S+)(?: (.*))?$', re.DOTALL)
+_UNTAGGED_RE = re.compile(rb'^\* (\S+)(?: (.*))?$', re.DOTALL)
+_RESPONSE_CODE_RE = re.compile(rb'^\[([A-Z\-]+)(?: ([^\]]*))?\]')
+
+# Untagged responses that describe mailbox state rather than answer a command
+_UNSOLICITED = ("EXISTS", "RECENT", "EXPUNGE", "FLAGS", "CAPABILITY", "BYE")
+
+
+class AsyncIMAPError(Exception):
+    """Raised when the connection fails or a command cannot be sent"""
+
+
+class IMAPResponse:
+    """Completion of a tagged command plus the untagged data it received"""
+
+    __slots__ = ("status", "text", "responses")
+
+    def __init__(self, status: str, text: bytes, responses: Dict[str, List[Any]]):
+        self.status = status
+        self.text = text
+        self.responses = responses
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "OK"
+
+    def data(self, name: str) -> List[Any]:
+        """Untagged data of a response type, in the format imaplib returns it"""
+        return self.responses.get(name.upper(), [])
+
+    def code(self, name: str) -> Optional[int]:
+        """Numeric response code (e.g. UIDVALIDITY) seen while the command ran"""
+        values = self.responses.get(name.upper())
+        if not values:
+            return None
+        try:
+            return int(values[-1])
+        except (TypeError, ValueError):
+            return None
+
+
+class _PendingCommand:
+    __slots__ = ("future", "responses", "literal_handler")
+
+    def __init__(self, future: asyncio.Future, literal_handler: Optional[Callable]):
+        self.future = future
+        self.responses: Dict[str, List[Any]] = {}
+        self.literal_handler = literal_handler
+
+
+class AsyncIMAPConnection:
+    """
+    IMAP session with pipelined, tagged commands
+
+    Untagged responses are attributed to the oldest command still in
+    flight, which is how servers answer pipelined commands. Commands that
+    depend on the selected mailbox are simply submitted after the SELECT
+    that sets it up; they do not have to wait for its completion.
+
+    Example:
+        conn = AsyncIMAPConnection(host, 993)
+        await conn.open()
+        await conn.login(user, password)
+        select, search = await asyncio.gather(
+            conn.command('SELECT', 'INBOX'),
+            conn.command('UID SEARCH', 'UNSEEN'))
+    """
+
+    # Longest response line accepted (long UID SEARCH results)
+    MAX_LINE = 1000000
+
+    # Bytes read at a time when a literal is handed to a literal handler
+    LITERAL_READ_SIZE = 64 * 1024
+
+    def __init__(self, host: str, port: int = 993, tls: bool = True, timeout: float = 60.0):
+        """
+        Initialize the connection
+
+        Args:
+            host: IMAP server host
+            port: IMAP server port
+            tls: Use implicit TLS
+            timeout: Seconds to wait for the completion of a command
+        """
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.timeout = timeout
+        self.capabilities: Tuple[str, ...] = ()
+        self.untagged_responses: Dict[str, List[Any]] = {}
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._sender_task: Optional[asyncio.Task] = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._pending: "OrderedDict[bytes, _PendingCommand]" = OrderedDict()
+        self._continuation: Optional[asyncio.Future] = None
+        self._tags = itertools.count(1)
+        self._closed = True
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed
+
+    async def open(self):
+        """Connect, read the greeting and load the capabilities"""
+        ssl_context = ssl.create_default_context() if self.tls else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context, limit=self.MAX_LINE),
+            self.timeout)
+
+        greeting = await asyncio.wait_for(self._reader.readline(), self.timeout)
+        if not greeting.startswith(b'* OK') and not greeting.startswith(b'* PREAUTH'):
+            self._writer.close()
+            raise AsyncIMAPError(f"Unexpected greeting: {greeting!r}")
+
+        self._closed = False
+        self._outbox = asyncio.Queue()
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+        self._sender_task = asyncio.ensure_future(self._send_loop())
+        await self.refresh_capabilities()
+
+    async def refresh_capabilities(self):
+        response = await self.command('CAPABILITY')
+        data = response.data('CAPABILITY')
+        if data:
+            self.capabilities = tuple(data[-1].decode('ascii', errors='replace').upper().split())
+
+    async def login(self, username: str, password: str) -> IMAPResponse:
+        response = await self.command('LOGIN', _quote(username), _quote(password))
+        if not response.ok:
+            raise AsyncIMAPError(f"Login failed: {response.text.decode(errors='replace')}")
+        # Servers may advertise more capabilities once authenticated
+        await self.refresh_capabilities()
+        return response
+
+    async def logout(self):
+        """Log out and close the connection"""
+        if self._closed:
+            return
+        try:
+            await asyncio.wait_for(self.command('LOGOUT'), 5)
+        except Exception:
+            pass
+        await self.close()
+
+    async def close(self):
+        """Close the connection without logging out"""
+        self._closed = True
+        for task in (self._sender_task, self._reader_task):
+            if task and not task.done():
+                task.cancel()
+        if self._writer:
+            try:
+                self._writer.close()
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._fail_pending(AsyncIMAPError("Connection closed"))
+
+    def submit(self, name: str, *args: str, literal: Optional[bytes] = None,
+               literal_handler: Optional[Callable[[bytes, int], Any]] = None) -> asyncio.Future:
+        """
+        Queue a command without waiting for it
+
+        Commands are written in the order they are submitted, so a command
+        submitted after SELECT runs against the newly selected mailbox.
+
+        Args:
+            name: Command name, e.g. 'SELECT' or 'UID FETCH'
+            args: Command arguments, already quoted where needed
+            literal: Data sent as a literal after the arguments (e.g. APPEND)
+            literal_handler: Called with (prefix, size) for every literal in
+                the response; if it returns a sink (feed(chunk) and close()),
+                the literal is streamed into it instead of being buffered and
+                the sink's close() result takes its place in the data. The
+                handler and the sink run in the default executor, so they
+                may block.
+
+        Returns:
+            Future resolving to an IMAPResponse
+        """
+        if self._closed:
+            raise AsyncIMAPError("Connection is not open")
+
+        tag = b'M%d' % next(self._tags)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tag] = _PendingCommand(future, literal_handler)
+
+        line = tag + b' ' + ' '.join((name,) + args).encode('utf-8')
+        self._outbox.put_nowait((line, literal))
+        return future
+
+    async def command(self, name: str, *args: str, literal: Optional[bytes] = None,
+                      literal_handler: Optional[Callable[[bytes, int], Any]] = None) -> IMAPResponse:
+        """Run a command and wait for its completion (see submit for the arguments)"""
+        future = self.submit(name, *args, literal=literal, literal_handler=literal_handler)
+        return await asyncio.wait_for(future, self.timeout)
+
+    async def _send_loop(self):
+        try:
+            while True:
+                line, literal = await self._outbox.get()
+                if literal is None:
+                    self._writer.write(line + b'\r\n')
+                elif "LITERAL+" in self.capabilities:
+                    self._writer.write(line + b' {%d+}\r\n' % len(literal) + literal + b'\r\n')
+                else:
+                    # Synchronizing literal, nothing else may be written until the server is ready
+                    self._continuation = asyncio.get_running_loop().create_future()
+                    self._writer.write(line + b' {%d}\r\n' % len(literal))
+                    await self._writer.drain()
+                    await asyncio.wait_for(self._continuation, self.timeout)
+                    self._writer.write(literal + b'\r\n')
+                await self._writer.drain()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._abort(e)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise AsyncIMAPError("Connection closed by server")
+                line = line.rstrip(b'\r\n')
+
+                if line.startswith(b'+'):
+                    if self._continuation and not self._continuation.done():
+                        self._continuation.set_result(line)
+                    continue
+
+                if line.startswith(b'* '):
+                    await self._handle_untagged(line)
+                    continue
+
+                match = _TAGGED_RE.match(line)
+                pending = self._pending.pop(match.group(1), None) if match else None
+                if pending and not pending.future.done():
+                    pending.future.set_result(IMAPResponse(
+                        match.group(2).decode().upper(), match.group(3) or b"", pending.responses))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._abort(e)
+
+    async def _handle_untagged(self, line: bytes):
+        pending = next(iter(self._pending.values()), None)
+        loop = asyncio.get_running_loop()
+
+        # Read the complete response, literals included
+        items: List[Any] = []
+        while True:
+            marker = _LITERAL_MARKER_RE.search(line)
+            if not marker:
+                items.append(line)
+                break
+            size = int(marker.group(1))
+            sink = None
+            if pending and pending.literal_handler:
+                # Handlers and sinks may touch the disk or parse, keep that off the event loop
+                sink = await loop.run_in_executor(None, pending.literal_handler, line, size)
+            if sink is None:
+                items.append((line, await self._reader.readexactly(size)))
+            else:
+                remaining = size
+                while remaining > 0:
+                    chunk = await self._reader.readexactly(min(remaining, self.LITERAL_READ_SIZE))
+                    remaining -= len(chunk)
+                    await loop.run_in_executor(None, sink.feed, chunk)
+                items.append((line, await loop.run_in_executor(None, sink.close)))
+            line = (await self._reader.readline()).rstrip(b'\r\n')
+
+        name, items = _split_untagged(items)
+        targets = [self.untagged_responses] if pending is None or name in _UNSOLICITED else []
+        if pending is not None:
+            targets.append(pending.responses)
+
+        for target in targets:
+            target.setdefault(name, []).extend(items)
+            # Response codes such as "* OK [UIDVALIDITY 42]" are filed under their own name
+            if name in ("OK", "NO", "BAD") and isinstance(items[0], bytes):
+                code = _RESPONSE_CODE_RE.match(items[0])
+                if code:
+                    target.setdefault(code.group(1).decode(), []).append(code.group(2) or b"")
+
+        if name == "BYE":
+            self._closed = True
+
+    async def _abort(self, error: Exception):
+        if not self._closed:
+            print(f"IMAP connection to {self.host} failed: {error}")
+        self._closed = True
+        self._fail_pending(error if isinstance(error, AsyncIMAPError) else AsyncIMAPError(str(error)))
+        if self._writer:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+
+    def _fail_pending(self, error: Exception):
+        pending, self._pending = list(self._pending.values()), OrderedDict()
+        for command in pending:
+            if not command.future.done():
+                command.future.set_exception(error)
+        if self._continuation and not self._continuation.done():
+            self._continuation.set_exception(error)
+
+
+def _split_untagged(items: List[Any]) -> Tuple[str, List[Any]]:
+    """
+    Turn a raw untagged response into (name, imaplib-style data)
+
+    "* 3 FETCH (UID 9 ...)" becomes ("FETCH", ["3 (UID 9 ..."]) and
+    "* SEARCH 1 2" becomes ("SEARCH", ["1 2"]), with literals kept as
+    (prefix, literal) tuples.
+    """
+    first = items[0][0] if isinstance(items[0], tuple) else items[0]
+    numbered = _UNTAGGED_NUMBERED_RE.match(first)
+    if numbered:
+        name = numbered.group(2).decode('ascii', errors='replace').upper()
+        head = numbered.group(1) + (b' ' + numbered.group(3) if numbered.group(3) is not None else b'')
+        if name in ("EXISTS", "RECENT", "EXPUNGE"):
+            head = numbered.group(1)
+    else:
+        plain = _UNTAGGED_RE.match(first)
+        name = plain.group(1).decode('ascii', errors='replace').upper()
+        head = plain.group(2) or b""
+
+    if isinstance(items[0], tuple):
+        return name, [(head, items[0][1])] + items[1:]
+    return name, [head] + items[1:]
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
@@ -0,0 +1,83 @@
+"""
+Shared pytest fixtures for the MailoBot tests
+
+Fake IMAP and SMTP servers run in-process on localhost; local stores (search
+index, sync checkpoints, outbox, message refs, thread index) live under the
+test's temporary directory so tests never touch settings/cache. Override
+imap_capabilities with pytest.mark.parametrize to run a test against a
+server with other extensions.
+"""
+import pytest
+
+from utils.email_mcp import EmailMCP
+from utils import message_refs, thread_index
+from utils.fake_mail_server import FakeIMAPServer, FakeSMTPServer, make_message
+from utils.message_refs import MessageRefStore
+from utils.search_index import SearchIndex
+from utils.sync_state import SyncStateStore
+from utils.thread_index import ThreadIndex
+
+# Messages the INBOX of the fake IMAP server starts with
+INBOX_MESSAGES = 10
+
+
+@pytest.fixture
+def imap_capabilities():
+    """Capabilities advertised by the fake IMAP server"""
+    return FakeIMAPServer.DEFAULT_CAPABILITIES
+
+
+@pytest.fixture
+def imap_server(imap_capabilities):
+    """Fake IMAP server whose INBOX holds INBOX_MESSAGES unread messages (UIDs 1..n)"""
+    server = FakeIMAPServer(imap_capabilities).start()
+    inbox = server.mailbox("INBOX")
+    for number in range(1, INBOX_MESSAGES + 1):
+        inbox.add(make_message(number))
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def smtp_server():
+    """Fake SMTP server recording the messages it accepts"""
+    server = FakeSMTPServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def search_index(tmp_path):
+    return SearchIndex(str(tmp_path / "search.db"))
+
+
+@pytest.fixture
+def sync_state(tmp_path):
+    return SyncStateStore(str(tmp_path / "sync_state.db"))
+
+
+@pytest.fixture
+def ref_store(tmp_path, monkeypatch):
+    """Process-wide message ref store, under the temporary directory"""
+    store = MessageRefStore(str(tmp_path / "message_refs.db"))
+    monkeypatch.setattr(message_refs, "_default_store", store)
+    return store
+
+
+@pytest.fixture
+def threads(tmp_path, monkeypatch):
+    """Process-wide thread index, under the temporary directory"""
+    index = ThreadIndex(str(tmp_path / "threads.db"))
+    monkeypatch.setattr(thread_index, "_default_index", index)
+    return index
+
+
+@pytest.fixture
+def mcp(imap_server, search_index, sync_state):
+    """EmailMCP connected to the fake IMAP server, indexing into the temporary stores"""
+    client = EmailMCP(imap_server.settings())
+    client.search_index = search_index
+    client.sync_state = sync_state
+    assert client.connect()
+    yield client
+    client.disconnect()
@@ -0,0 +1,139 @@
+"""
+Email draft generation helpers for MailoBot
+
+Prompt rendering and cleanup of the generated text, shared by the draft
+action (complete drafts) and the streaming draft endpoint of the web app.
+"""
+import os
+from typing import Any, Dict, List, Optional, Text, Union
+
+from jinja2 import Template
+
+from utils.message_refs import load_thread_emails
+from utils.openai_utils import load_openai_config
+from utils.prompt_compaction import DEFAULT_THREAD_TOKEN_BUDGET, compact_thread
+
+# Used when prompts/email-draft-prompt.jinja2 does not exist
+DEFAULT_DRAFT_TEMPLATE = """You are an AI email assistant.
+                Draft an email with subject: {{ subject }}, in a {{ tone }} tone.
+                {% if email_thread %}Based on this thread: {{ email_thread }}{% endif %}
+                ONLY RETURN THE DRAFT TEXT."""
+
+
+def get_prompt_template() -> Text:
+    """Load the email draft prompt template from file."""
+    try:
+        current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        template_path = os.path.join(current_dir, 'prompts', 'email-draft-prompt.jinja2')
+
+        if os.path.exists(template_path):
+            with open(template_path, 'r') as file:
+                return file.read()
+        else:
+            print(f"Warning: Email draft prompt template not found at {template_path}")
+            # Fallback to a basic template
+            return DEFAULT_DRAFT_TEMPLATE
+    except Exception as e:
+        print(f"Error loading prompt template: {e}")
+        return "Write an email draft about {{ subject }} in a {{ tone }} tone."
+
+
+def render_draft_prompt(variables: Dict[str, Any], settings: Optional[Dict[str, Any]] = None) -> Text:
+    """
+    Render the draft prompt
+
+    A thread given as message refs ({"refs": [...]}, see
+    message_refs.load_thread_refs) is loaded here, so slots and action
+    payloads never carry the bodies. The email thread is then compacted
+    (quoted history, signatures and disclaimers removed, newest turns kept
+    within the token budget set as prompt_compaction.thread_token_budget
+    in config/openai.yml).
+
+    Args:
+        variables: subject, tone, recipient, email_thread (text, list of
+            emails or message refs) and additional_instructions
+        settings: Email settings used to load a thread given as refs
+
+    Returns:
+        Prompt text
+    """
+    thread = variables.get("email_thread")
+    if isinstance(thread, dict):
+        thread = load_thread_emails(settings, thread.get("refs") or []) if settings else []
+    variables = {**variables, "email_thread": compact_draft_thread(thread) if thread else ""}
+    return Template(get_prompt_template()).render(**variables)
+
+
+def compact_draft_thread(thread: Union[str, List[Any]]) -> Text:
+    """Compact an email thread (text or list of emails) to the draft prompt's token budget"""
+    config = load_openai_config()
+    budget = (config.get('prompt_compaction') or {}).get('thread_token_budget', DEFAULT_THREAD_TOKEN_BUDGET)
+    model = (config.get('models') or {}).get('draft_generator')
+    return compact_thread(thread, int(budget), model)
+
+
+def clean_generated_text(text: str) -> str:
+    """Clean the generated text by removing unnecessary elements."""
+    if not text:
+        return ""
+        
+    # Debug original text
+    print(f"Original draft text ({len(text)} chars):\n{text[:100]}...")
+        
+    # Remove typical LLM explanations or formatting
+    lines = text.strip().split('\n')
+        
+    # Track if we've found content markers
+    content_lines = []
+    capture = False
+    
+    # Markers for explanatory content we want to skip
+    skip_markers = [
+        "here's a draft", "here is a draft", "draft email", "email draft", 
+        "subject:", "to:", "from:", "draft for you", "here is the", "here's the"
+    ]
+    
+    # Process each line
+    for i, line in enumerate(lines):
+        lower_line = line.lower().strip()
+        
+        # Skip empty lines at the beginning
+        if not content_lines and not lower_line:
+            continue
+            
+        # Check if this line contains a skip marker
+        should_skip = False
+        is_header = False
+        
+        if i < 5:  # Only check first few lines for efficiency
+            should_skip = any(marker in lower_line for marker in skip_markers)
+            is_header = lower_line.startswith("subject:") or lower_line.startswith("to:") or lower_line.startswith("from:")
+        
+        if should_skip:
+            if is_header:
+                # Skip email header lines
+                continue
+            else:
+                # This is a marker line, start capturing from next line
+                capture = True
+                continue
+        
+        # Always capture content once we've started or if no markers found
+        if capture or len(content_lines) > 0 or i > 2:  # Start capturing after line 2 if nothing captured yet
+            content_lines.append(line)
+    
+    # If we didn't capture anything meaningful, return the original text with minimal cleaning
+    if not content_lines:
+        print("No content captured! Using original text with minimal cleaning")
+        # Skip first line if it looks like an explanation, otherwise use full text
+        if len(lines) > 1 and any(marker in lines[0].lower() for marker in skip_markers):
+            result = '\n'.join(lines[1:])
+        else:
+            result = '\n'.join(lines)
+    else:
+        # Join captured lines
+        result = '\n'.join(content_lines)
+        
+    # Debug cleaned text
+    print(f"Cleaned draft text ({len(result)} chars):\n{result[:100]}...")
+    return result
@@ -1,34 +1,156 @@
 """
 Model Context Protocol (MCP) implementation for email connectivity in MailoBot
 """
+import base64
+import binascii
+import functools
 import imaplib
 import email
+import email.parser
 import json
 import os
+import quopri
 import re
-import smtplib
+import threading
+import time
 from email.header import decode_header
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Dict, List, Any, Optional, Text
 
-# Increase the default timeout for IMAP connections
-imaplib._MAXLINE = 1000000
+from utils.imap_pool import get_pool, create_imap_connection
+from utils.email_records import EmailEnvelope, EmailRecord, LazyBody, MessageUnavailableError
+from utils.flag_queue import get_flag_queue
+from utils.html_text import DEFAULT_MAX_CHARS as DEFAULT_HTML_TEXT_LIMIT, html_to_text
+from utils.message_store import get_message_store
+from utils.mime_stream import DEFAULT_SPOOL_THRESHOLD, StreamingMimeParser, parse_file
+from utils.search_index import get_search_index
+from utils.smtp_spool import get_smtp_spool, open_smtp_session
+from utils.sync_state import get_sync_state_store
+from utils.thread_index import get_thread_index, normalize_message_id, parse_references
+from utils.imap_utils import (build_uid_set, chunked, extract_fetch_item, get_literal,
+                              get_response_code, is_message_literal, parse_esearch_response,
+                              parse_fetch_response, parse_list_response, parse_status_response,
+                              quote_mailbox, quote_string, resolve_special_folders, walk_bodystructure)
+
+_LITERAL_MARKER_RE = re.compile(rb'\{(\d+)\}$')
+_UNTAGGED_FETCH_RE = re.compile(rb'^\* (\d+) FETCH ', re.IGNORECASE)
+
+
+class _StatusCache:
+    """Short-lived per-account cache of STATUS results shared by all EmailMCP instances"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, tuple] = {}
+
+    def get(self, account: str, folder: str, items: List[str], ttl: float) -> Optional[Dict[str, int]]:
+        with self._lock:
+            entry = self._entries.get((account, folder))
+        if not entry or time.monotonic() - entry[0] > ttl:
+            return None
+        if any(item not in entry[1] for item in items):
+            return None
+        return {item: entry[1][item] for item in items}
+
+    def put(self, account: str, folder: str, values: Dict[str, int]):
+        with self._lock:
+            self._entries[(account, folder)] = (time.monotonic(), dict(values))
+
+    def invalidate(self, account: str, folder: Optional[str] = None):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == account and folder in (None, key[1])]:
+                del self._entries[key]
+
+
+_status_cache = _StatusCache()
+
+
+class _FolderCache:
+    """Per-account cache of the folder list and special-use roles shared by all EmailMCP instances"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, tuple] = {}
+
+    def get(self, account: str, ttl: float) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(account)
+        if not entry or time.monotonic() - entry[0] > ttl:
+            return None
+        return entry[1], entry[2]
+
+    def put(self, account: str, folders: List[Dict[str, Any]], roles: Dict[str, str]):
+        with self._lock:
+            self._entries[account] = (time.monotonic(), folders, roles)
+
+    def invalidate(self, account: str):
+        with self._lock:
+            self._entries.pop(account, None)
+
+
+_folder_cache = _FolderCache()
+
+
 class EmailMCP:
     """
     A Model Context Protocol implementation for email connectivity
     Maintains context about email sessions and provides methods for email operations
     """
 
-    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+    # Maximum number of UIDs sent in a single FETCH command
+    DEFAULT_FETCH_CHUNK_SIZE = 100
+
+    # Header fields fetched for envelope listings
+    ENVELOPE_HEADER_FIELDS = "SUBJECT FROM TO DATE MESSAGE-ID IN-REPLY-TO REFERENCES"
+
+    # Header fields fetched to place messages missing from the thread index
+    THREAD_HEADER_FIELDS = "SUBJECT FROM DATE MESSAGE-ID IN-REPLY-TO REFERENCES"
+
+    # Message-IDs looked up by a single SEARCH command
+    THREAD_SEARCH_CHUNK_SIZE = 50
+
+    # Rounds of looking up ancestors named by the headers of found ancestors
+    THREAD_FETCH_ROUNDS = 3
+
+    # Byte budgets for text previews
+    DEFAULT_PREVIEW_BYTES = 4096
+    DEFAULT_PREVIEW_TOTAL_BYTES = 256 * 1024
+
+    # Maximum number of UIDs changed by a single STORE/MOVE/COPY/EXPUNGE command
+    DEFAULT_BULK_CHUNK_SIZE = 1000
+
+    # Seconds the folder list and special-use roles are reused before listing again
+    DEFAULT_FOLDER_CACHE_TTL = 3600.0
+
+    # Seconds STATUS counters are reused before asking the server again
+    DEFAULT_STATUS_CACHE_TTL = 10.0
+
+    # Bytes read from the socket at a time while streaming a message
+    STREAM_READ_SIZE = 64 * 1024
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, use_pool: bool = True):
         """
         Initialize the EmailMCP with optional settings
         
         Args:
             settings: Dictionary with IMAP settings (host, port, username, password, tls)
+            use_pool: Borrow authenticated sessions from the shared connection pool
         """
         self.imap_conn = None
         self.settings = settings
+        self.use_pool = use_pool
+        self._discard_conn = False
+        self.fetch_chunk_size = self.DEFAULT_FETCH_CHUNK_SIZE
+        self.spool_threshold = DEFAULT_SPOOL_THRESHOLD
+        self.bulk_chunk_size = self.DEFAULT_BULK_CHUNK_SIZE
+        self.folder_cache_ttl = self.DEFAULT_FOLDER_CACHE_TTL
+        self.html_text_limit = DEFAULT_HTML_TEXT_LIMIT
+        self.status_cache_ttl = self.DEFAULT_STATUS_CACHE_TTL
+        self.message_store = None
+        self.search_index = None
+        self.thread_index = None
+        self.sync_state = None
         self.context = {
             "connected": False,
             "mailbox": None,
@@ -42,6 +164,42 @@ class EmailMCP:
         if not self.settings:
             self.load_settings_from_file()
 
+        if self.settings and self.settings.get('fetch_chunk_size'):
+            self.fetch_chunk_size = int(self.settings['fetch_chunk_size'])
+        if self.settings and self.settings.get('html_text_limit'):
+            self.html_text_limit = int(self.settings['html_text_limit'])
+        if self.settings and self.settings.get('folder_cache_ttl') is not None:
+            self.folder_cache_ttl = float(self.settings['folder_cache_ttl'])
+        if self.settings and self.settings.get('bulk_chunk_size'):
+            self.bulk_chunk_size = int(self.settings['bulk_chunk_size'])
+        if self.settings and self.settings.get('spool_threshold'):
+            self.spool_threshold = int(self.settings['spool_threshold'])
+        if self.settings and self.settings.get('status_cache_ttl') is not None:
+            self.status_cache_ttl = float(self.settings['status_cache_ttl'])
+
+        # Raw messages are cached on disk unless disabled in the settings
+        if not self.settings or self.settings.get('cache_messages', True):
+            try:
+                self.message_store = get_message_store()
+            except Exception as e:
+                print(f"Local message store unavailable: {e}")
+
+        # Fetched mail is indexed for local full-text search unless disabled
+        if not self.settings or self.settings.get('index_messages', True):
+            try:
+                self.search_index = get_search_index()
+                # Sync checkpoints tell whether the index holds a whole folder
+                self.sync_state = get_sync_state_store()
+            except Exception as e:
+                print(f"Local search index unavailable: {e}")
+
+        # Fetched mail is linked into conversation threads unless disabled
+        if not self.settings or self.settings.get('index_threads', True):
+            try:
+                self.thread_index = get_thread_index()
+            except Exception as e:
+                print(f"Local thread index unavailable: {e}")
+
     def load_settings_from_file(self):
         """Load IMAP settings from JSON file if available"""
         try:
@@ -77,18 +235,17 @@ class EmailMCP:
         if not self.settings:
             raise ValueError("Email settings not provided")
 
+        # Reconnecting replaces any session we still hold
+        if self.imap_conn:
+            self.disconnect()
+
         try:
-            # Connect to the IMAP server
-            if self.settings.get('tls', True):
-                self.imap_conn = imaplib.IMAP4_SSL(
-                    self.settings['host'], int(self.settings.get('port', 993)))
+            # Borrow an authenticated session from the pool, or log in directly
+            if self.use_pool:
+                self.imap_conn = get_pool().acquire(self.settings)
             else:
-                self.imap_conn = imaplib.IMAP4(
-                    self.settings['host'], int(self.settings.get('port', 143)))
-
-            # Login with credentials
-            self.imap_conn.login(
-                self.settings['username'], self.settings['password'])
+                self.imap_conn = create_imap_connection(self.settings)
+            self._discard_conn = False
 
             # Update context
             self.context["connected"] = True
@@ -101,21 +258,33 @@ class EmailMCP:
             return False
 
     def disconnect(self):
-        """Close the IMAP connection if active"""
+        """Release the IMAP connection back to the pool (or close it if not pooled)"""
         if self.imap_conn:
             try:
-                self.imap_conn.logout()
+                if self.use_pool:
+                    # A session left mid-response by a failed stream must not be reused
+                    get_pool().release(self.imap_conn, discard=self._discard_conn)
+                else:
+                    self.imap_conn.logout()
             except:
                 pass
             self.imap_conn = None
             self.context["connected"] = False
 
-    def select_folder(self, folder: str = "INBOX"):
+    def select_folder(self, folder: str = "INBOX", readonly: bool = False, force: bool = False):
         """
         Select a mailbox folder
         
+        The selection is remembered on the connection, so selecting the
+        folder that is already selected costs no round trip, but only when
+        the selection was opened with the same readonly state: a pooled
+        session may still hold a SELECT from an earlier caller, and a
+        read-only request must not run on it.
+        
         Args:
             folder: Mailbox folder name
+            readonly: Open the folder with EXAMINE (nothing, not even \\Seen, can change)
+            force: Select again even if already selected, to refresh UIDNEXT/HIGHESTMODSEQ
         
         Returns:
             bool: True if successful, False otherwise
@@ -123,79 +292,426 @@ class EmailMCP:
         if not self.is_connected():
             return False
 
+        selected = self.imap_conn.selected_mailbox
+        if (not force and selected and selected["folder"] == folder
+                and selected["readonly"] == readonly):
+            self._apply_selection(selected)
+            return True
+
         try:
-            status, data = self.imap_conn.select(folder)
+            status, data = self.imap_conn.select(folder, readonly=readonly)
             if status == "OK":
-                self.context["current_folder"] = folder
-                self.context["mailbox"] = data
+                # Checkpoint values reported by the server for this mailbox
+                selected = {
+                    "folder": folder,
+                    "readonly": readonly,
+                    "exists": data,
+                    "uidvalidity": get_response_code(self.imap_conn, 'UIDVALIDITY'),
+                    "uidnext": get_response_code(self.imap_conn, 'UIDNEXT'),
+                    "highestmodseq": get_response_code(self.imap_conn, 'HIGHESTMODSEQ')
+                }
+                self.imap_conn.selected_mailbox = selected
+                self._apply_selection(selected)
+                self._purge_stale(folder, selected["uidvalidity"])
                 return True
+            # A failed SELECT leaves no mailbox selected
+            self.imap_conn.selected_mailbox = None
             return False
         except Exception as e:
+            self.imap_conn.selected_mailbox = None
             print(f"Error selecting folder {folder}: {e}")
             return False
 
+    def _apply_selection(self, selected: Dict[str, Any]):
+        self.context["current_folder"] = selected["folder"]
+        self.context["mailbox"] = selected["exists"]
+        self.context["uidvalidity"] = selected["uidvalidity"]
+        self.context["uidnext"] = selected["uidnext"]
+        self.context["highestmodseq"] = selected["highestmodseq"]
+
+    def _purge_stale(self, folder: str, uidvalidity: Optional[int]):
+        """Drop cached and indexed messages of a folder from an older UIDVALIDITY, their UIDs no longer match"""
+        if not uidvalidity:
+            return
+        if self.message_store:
+            self.message_store.purge_stale(self.get_account_id(), folder, uidvalidity)
+        if self.search_index:
+            self.search_index.remove(self.get_account_id(), folder, keep_uidvalidity=uidvalidity)
+        if self.thread_index:
+            self.thread_index.remove(self.get_account_id(), folder, keep_uidvalidity=uidvalidity)
+
+    def _ensure_selected(self, readonly: Optional[bool] = None) -> bool:
+        """
+        Make sure the current folder is selected on the (possibly freshly borrowed) session
+        
+        Args:
+            readonly: Selection mode the caller needs. None (reads, which only
+                use BODY.PEEK) keeps a selection of either kind and opens the
+                folder read-only if it is not selected.
+        """
+        folder = self.context["current_folder"]
+        if readonly is None:
+            selected = self.imap_conn.selected_mailbox if self.imap_conn else None
+            readonly = selected["readonly"] if selected and selected["folder"] == folder else True
+        return self.select_folder(folder, readonly=readonly)
+
     def is_connected(self):
         """Check if connected to email server"""
         return self.imap_conn is not None and self.context.get("connected", False)
 
+    def get_account_id(self) -> str:
+        """Get a stable identifier for the configured account (user@host)"""
+        if not self.settings:
+            return ""
+        return f"{self.settings.get('username', '')}@{self.settings.get('host', '')}"
+
+    def has_capability(self, name: str) -> bool:
+        """Check whether the server advertises a capability (e.g. CONDSTORE)"""
+        if not self.is_connected():
+            return False
+        return name.upper() in self.imap_conn.capabilities
+
+    def is_enabled(self, name: str) -> bool:
+        """Check whether an extension (e.g. QRESYNC) was ENABLEd on the session"""
+        if not self.is_connected():
+            return False
+        return name.upper() in getattr(self.imap_conn, 'enabled_extensions', ())
+
+    def list_folders(self, use_cache: bool = True) -> List[Dict[str, Any]]:
+        """
+        List the folders of the account
+        
+        Args:
+            use_cache: Reuse the list cached for the account (see folder_cache_ttl)
+            
+        Returns:
+            List of {"name", "delimiter", "flags"} dictionaries
+        """
+        cached = _folder_cache.get(self.get_account_id(), self.folder_cache_ttl) if use_cache else None
+        if cached is None:
+            cached = self._discover_folders()
+        return cached[0] if cached else []
+
+    def get_special_folders(self, use_cache: bool = True) -> Dict[str, str]:
+        """
+        Map folder roles (drafts, sent, trash, archive, junk) to folder names
+        
+        Discovered with a single LIST ... RETURN (SPECIAL-USE) per account and
+        cached; servers without special-use attributes fall back to common names.
+        
+        Args:
+            use_cache: Reuse the roles cached for the account
+            
+        Returns:
+            Mapping of role to folder name for the roles that were found
+        """
+        roles = self.cached_special_folders() if use_cache else None
+        if roles is not None:
+            return roles
+        cached = self._discover_folders()
+        return dict(cached[1]) if cached else {}
+
+    def get_special_folder(self, role: str, default: Optional[str] = None, use_cache: bool = True) -> Optional[str]:
+        """Folder name of a role (e.g. "drafts"), or default if the account has none"""
+        return self.get_special_folders(use_cache).get(role.lower(), default)
+
+    def cached_special_folders(self) -> Optional[Dict[str, str]]:
+        """Folder roles from the folder cache shared by all instances, None if not cached (or expired)"""
+        cached = _folder_cache.get(self.get_account_id(), self.folder_cache_ttl)
+        return dict(cached[1]) if cached else None
+
+    def invalidate_folders(self):
+        """Forget the cached folder list, e.g. after folders were created or renamed"""
+        _folder_cache.invalidate(self.get_account_id())
+
+    def _discover_folders(self) -> Optional[tuple]:
+        """LIST all folders (with special-use attributes if supported) and cache the result"""
+        if not self.is_connected():
+            return None
+
+        try:
+            data = None
+            if self.has_capability("SPECIAL-USE"):
+                typ, dat = self.imap_conn._simple_command('LIST', '""', '"*"', 'RETURN', '(SPECIAL-USE)')
+                typ, data = self.imap_conn._untagged_response(typ, dat, 'LIST')
+                if typ != "OK":
+                    data = None
+            if data is None:
+                typ, data = self.imap_conn.list()
+                if typ != "OK":
+                    print(f"Failed to list folders: {typ}")
+                    return None
+        except self.imap_conn.abort:
+            raise
+        except Exception as e:
+            print(f"Error listing folders: {e}")
+            return None
+
+        return self._cache_folders(parse_list_response(data))
+
+    def _cache_folders(self, folders: List[Dict[str, Any]]) -> tuple:
+        roles = resolve_special_folders(folders)
+        _folder_cache.put(self.get_account_id(), folders, roles)
+        return folders, roles
+
+    def get_folder_status(self, folder: Optional[str] = None, items: Optional[List[str]] = None,
+                          use_cache: bool = True):
+        """
+        Get mailbox counters with STATUS, without selecting the folder
+        
+        Args:
+            folder: Mailbox folder name (defaults to the current folder)
+            items: STATUS items to request (defaults to MESSAGES UNSEEN UIDNEXT UIDVALIDITY)
+            use_cache: Accept values cached for up to status_cache_ttl seconds
+            
+        Returns:
+            Dictionary of item name to value, empty if the call failed
+        """
+        folder = folder or self.context["current_folder"]
+        return self.get_folders_status([folder], items, use_cache).get(folder, {})
+
+    def get_folders_status(self, folders: List[str], items: Optional[List[str]] = None,
+                           use_cache: bool = True) -> Dict[str, Dict[str, int]]:
+        """
+        Get counters of several folders in one round trip
+        
+        The STATUS commands are pipelined: all are sent before the first
+        response is read. Results are cached per account for
+        status_cache_ttl seconds.
+        
+        Args:
+            folders: Mailbox folder names
+            items: STATUS items to request (defaults to MESSAGES UNSEEN UIDNEXT UIDVALIDITY)
+            use_cache: Accept values cached for up to status_cache_ttl seconds
+            
+        Returns:
+            Dictionary of folder name to {item name: value}; folders whose
+            STATUS failed are missing
+        """
+        if not self.is_connected() or not folders:
+            return {}
+
+        items = items or ["MESSAGES", "UNSEEN", "UIDNEXT", "UIDVALIDITY"]
+        if "HIGHESTMODSEQ" in items and not self.has_capability("CONDSTORE"):
+            items = [item for item in items if item != "HIGHESTMODSEQ"]
+
+        account = self.get_account_id()
+        results = {}
+        if use_cache and self.status_cache_ttl > 0:
+            for folder in folders:
+                cached = _status_cache.get(account, folder, items, self.status_cache_ttl)
+                if cached is not None:
+                    results[folder] = cached
+
+        missing = [folder for folder in folders if folder not in results]
+        if not missing:
+            return results
+
+        conn = self.imap_conn
+        try:
+            tags = [(folder, conn._command('STATUS', quote_mailbox(folder), f"({' '.join(items)})"))
+                    for folder in missing]
+            for folder, tag in tags:
+                try:
+                    conn._command_complete('STATUS', tag)
+                except conn.abort:
+                    raise
+                except conn.error as e:
+                    print(f"Error getting status of folder {folder}: {e}")
+            _, data = conn._untagged_response('OK', [None], 'STATUS')
+        except Exception as e:
+            print(f"Error getting status of folders {', '.join(missing)}: {e}")
+            return results
+
+        parsed = parse_status_response(data)
+        for folder in missing:
+            values = parsed.get(folder)
+            if values is None and len(missing) == 1 and parsed:
+                # Some servers echo the name in a different form
+                values = next(iter(parsed.values()))
+            if values is not None:
+                _status_cache.put(account, folder, values)
+                results[folder] = values
+        return results
+
     def get_unread_count(self):
-        """Get the number of unread emails in the current folder"""
+        """Get the number of unread emails in the current folder (from STATUS, no SELECT needed)"""
         if not self.is_connected():
             return 0
 
+        status = self.get_folder_status(self.context["current_folder"], ["MESSAGES", "UNSEEN", "UIDNEXT"])
+        if "UNSEEN" in status:
+            self.context["unread_count"] = status["UNSEEN"]
+            return status["UNSEEN"]
+
         try:
-            self.select_folder(self.context["current_folder"])
-            status, data = self.imap_conn.search(None, 'UNSEEN')
-            if status == "OK":
-                unread_ids = data[0].split()
-                count = len(unread_ids)
-                self.context["unread_count"] = count
-                return count
-            return 0
+            self._ensure_selected()
+            summary = self._summarize_uids('UNSEEN')
+            if summary is None:
+                return 0
+            self.context["unread_count"] = summary["count"]
+            return summary["count"]
         except Exception as e:
             print(f"Error getting unread count: {e}")
             return 0
 
-    def get_recent_emails(self, limit: int = 5):
+    def summarize_search(self, criteria: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Count the emails of the current folder matching search criteria without listing them
+        
+        With ESEARCH this is a single SEARCH RETURN (COUNT MIN MAX) whose
+        response size does not depend on the number of matches.
+        
+        Args:
+            criteria: Dictionary with search parameters, as for search_emails
+            
+        Returns:
+            Dictionary with count, min_uid and max_uid (None when nothing matched)
+        """
+        empty = {"count": 0, "min_uid": None, "max_uid": None}
+        if not self.is_connected():
+            return empty
+        try:
+            self._ensure_selected()
+            return self._summarize_uids(self._build_search_query(criteria)) or empty
+        except Exception as e:
+            print(f"Error counting emails: {e}")
+            return empty
+
+    def _summarize_uids(self, query: str) -> Optional[Dict[str, Any]]:
+        """COUNT/MIN/MAX of the UIDs matching a SEARCH query, None if the search failed"""
+        if self.has_capability("ESEARCH"):
+            result = self._extended_search('SEARCH', 'RETURN', '(COUNT MIN MAX)', query)
+            if result is not None:
+                return {"count": result.get("COUNT", 0),
+                        "min_uid": result.get("MIN"), "max_uid": result.get("MAX")}
+
+        status, data = self.imap_conn.uid('SEARCH', None, query)
+        if status != "OK":
+            return None
+        uids = [int(uid) for uid in (data[0] or b"").split()]
+        return {"count": len(uids), "min_uid": min(uids) if uids else None,
+                "max_uid": max(uids) if uids else None}
+
+    def _newest_uids(self, query: str = 'ALL', limit: int = 5, offset: int = 0) -> Optional[List[int]]:
+        """
+        UIDs of the newest emails matching a SEARCH query, newest first
+        
+        Picks the cheapest method the server supports, so neither latency
+        nor response size grows with the folder:
+        UID SORT RETURN (PARTIAL) by date (ESORT and CONTEXT=SORT), UID SORT
+        by date, UID SEARCH RETURN (PARTIAL) from the end (PARTIAL),
+        UID SEARCH RETURN (ALL) as a compressed set (ESEARCH), and finally
+        a plain UID SEARCH where arrival order stands in for date order.
+        
+        Args:
+            query: IMAP SEARCH criteria
+            limit: Number of UIDs to return
+            offset: Number of newest matches to skip (for paging)
+            
+        Returns:
+            List of UIDs, or None if the search failed
+        """
+        window = f"{offset + 1}:{offset + limit}"
+
+        if self.has_capability("SORT"):
+            if self.has_capability("ESORT") and self.has_capability("CONTEXT=SORT"):
+                result = self._extended_search(
+                    'SORT', 'RETURN', f'(PARTIAL {window})', '(REVERSE DATE)', 'UTF-8', query)
+                if result is not None:
+                    return result.get("PARTIAL", [])
+
+            status, data = self.imap_conn.uid('SORT', '(REVERSE DATE)', 'UTF-8', query)
+            if status == "OK":
+                uids = [int(uid) for uid in b" ".join(item for item in data if item).split()]
+                return uids[offset:offset + limit]
+
+        if self.has_capability("PARTIAL"):
+            result = self._extended_search(
+                'SEARCH', 'RETURN', f'(PARTIAL -{offset + 1}:-{offset + limit})', query)
+            if result is not None:
+                return sorted(result.get("PARTIAL", []), reverse=True)
+
+        if self.has_capability("ESEARCH"):
+            result = self._extended_search('SEARCH', 'RETURN', '(ALL)', query)
+            if result is not None:
+                uids = result.get("ALL", [])
+                return uids[::-1][offset:offset + limit]
+
+        status, data = self.imap_conn.uid('SEARCH', None, query)
+        if status != "OK":
+            print(f"Search failed with status: {status}")
+            return None
+        uids = [int(uid) for uid in (data[0] or b"").split()]
+        return uids[::-1][offset:offset + limit]
+
+    def search_uids(self, query: str = 'ALL') -> Optional[List[int]]:
+        """
+        UIDs of the current folder matching a SEARCH query
+        
+        Args:
+            query: IMAP SEARCH criteria
+            
+        Returns:
+            UIDs in ascending order, or None if the search failed
+        """
+        if self.has_capability("ESEARCH"):
+            # Returned as a compressed sequence set instead of one number per message
+            result = self._extended_search('SEARCH', 'RETURN', '(ALL)', query)
+            if result is not None:
+                return sorted(result.get("ALL", []))
+
+        status, data = self.imap_conn.uid('SEARCH', None, query)
+        if status != "OK":
+            return None
+        return sorted(int(uid) for uid in (data[0] or b"").split())
+
+    def _extended_search(self, command: str, *args: str) -> Optional[Dict[str, Any]]:
+        """Run UID SEARCH/SORT with RETURN options and parse its ESEARCH response"""
+        conn = self.imap_conn
+        conn.untagged_responses.pop('ESEARCH', None)
+        try:
+            status, _ = conn.uid(command, *args)
+        except conn.abort:
+            raise
+        except conn.error as e:
+            print(f"Extended {command} not accepted: {e}")
+            return None
+        data = conn.untagged_responses.pop('ESEARCH', [])
+        if status != "OK":
+            return None
+        return parse_esearch_response(data)
+
+    def get_recent_emails(self, limit: int = 5, headers_only: bool = False):
         """
         Get the most recent emails
         
         Args:
             limit: Maximum number of emails to retrieve
+            headers_only: Return EmailEnvelope records whose body loads on first access
             
         Returns:
-            List of email dictionaries
+            List of EmailRecord (or EmailEnvelope) objects
         """
         if not self.is_connected():
             print("Cannot get recent emails - not connected")
             return []
 
         try:
-            self.select_folder(self.context["current_folder"])
-            status, data = self.imap_conn.search(None, 'ALL')
-            if status != "OK":
-                print(f"Search failed with status: {status}")
-                return []
+            self._ensure_selected()
 
-            email_ids = data[0].split()
-
-            if not email_ids:
+            # Most recent first, without listing every UID in the folder
+            recent_ids = self._newest_uids('ALL', limit)
+            if not recent_ids:
                 print("No email IDs found in folder")
                 return []
 
-            # Get the most recent emails (last N emails)
-            recent_ids = email_ids[-limit:] if len(
-                email_ids) > limit else email_ids
-            recent_ids.reverse()  # Most recent first
+            print(f"Found {len(recent_ids)} recent emails")
 
-            print(
-                f"Found {len(recent_ids)} recent emails out of {len(email_ids)} total")
-
-            emails = []
-            for email_id in recent_ids:
-                email_data = self.fetch_email(email_id)
-                if email_data:
-                    emails.append(email_data)
+            if headers_only:
+                emails = self.list_envelopes(recent_ids)
+            else:
+                emails = self.fetch_emails(recent_ids)
 
             # Update context
             self.context["recent_emails"] = emails
@@ -207,115 +723,555 @@ class EmailMCP:
 
     def fetch_email(self, email_id):
         """
-        Fetch a single email by ID
+        Fetch a single email by UID
         
         Args:
-            email_id: Email ID to fetch
+            email_id: Email UID to fetch
             
         Returns:
-            Email data dictionary or None if error
+            EmailRecord or None if error
+        """
+        emails = self.fetch_emails([email_id])
+        return emails[0] if emails else None
+
+    def _load_body(self, folder: str, uidvalidity: Optional[int], email_id: str) -> EmailRecord:
+        """
+        Download the email behind an envelope from the folder it was listed in
+        
+        The folder is selected again if the session moved on (and the
+        previous selection restored afterwards); a changed UIDVALIDITY means
+        the UID now names another message.
+        
+        Raises:
+            MessageUnavailableError: If not connected, the folder cannot be
+                selected, its UIDVALIDITY changed or the message is gone
         """
         if not self.is_connected():
+            raise MessageUnavailableError(f"Cannot load email {email_id} from {folder}: not connected")
+
+        previous = self.imap_conn.selected_mailbox
+        if not self.select_folder(folder, readonly=True):
+            raise MessageUnavailableError(f"Cannot load email {email_id}: folder {folder} cannot be selected")
+        try:
+            if uidvalidity is not None and self.context.get("uidvalidity") != uidvalidity:
+                raise MessageUnavailableError(
+                    f"Cannot load email {email_id}: UIDVALIDITY of {folder} changed")
+            email_data = self.fetch_email(email_id)
+            if email_data is None:
+                raise MessageUnavailableError(f"Email {email_id} no longer exists in {folder}")
+            return email_data
+        finally:
+            if previous and previous["folder"] != folder:
+                self.select_folder(previous["folder"], readonly=previous["readonly"])
+
+    def fetch_emails(self, email_ids: List[Any], chunk_size: Optional[int] = None, index_bodies: bool = False):
+        """
+        Fetch several emails by UID with batched FETCH commands
+        
+        Each chunk of UIDs costs a single UID FETCH round trip that returns
+        both the message and its flags. Messages are parsed while they
+        stream in from the socket (and are written to the local message
+        store at the same time), so large attachments are spooled to disk
+        instead of being held in memory. Messages already in the local
+        store are parsed from disk and only their flags are fetched.
+        
+        Downloaded emails are added to the search index by their headers,
+        bodies stay undecoded until they are read. Background sync passes
+        index_bodies to index the body text as well.
+        
+        Args:
+            email_ids: Email UIDs to fetch
+            chunk_size: Maximum UIDs per FETCH command (defaults to fetch_chunk_size)
+            index_bodies: Decode the bodies to index their text, also of
+                emails read from the local store
+            
+        Returns:
+            List of EmailRecord objects in the order of email_ids
+        """
+        if not self.is_connected() or not email_ids:
+            return []
+        self._ensure_selected()
+
+        chunk_size = chunk_size or self.fetch_chunk_size
+        keys = [self._uid_str(email_id) for email_id in email_ids]
+        fetched = {}
+
+        # Read through the local store, flags can change so they always come from the server
+        cached = self._cached_paths(keys)
+        for chunk in chunked(list(cached), chunk_size):
+            try:
+                status, data = self.imap_conn.uid('FETCH', build_uid_set(chunk), '(UID FLAGS)')
+                if status != "OK":
+                    continue
+                for message in parse_fetch_response(data):
+                    key = str(message["uid"])
+                    if key in cached:
+                        email_data = self._parse_email_file(cached[key], key, message["flags"])
+                        if email_data:
+                            fetched[key] = email_data
+            except Exception as e:
+                print(f"Error fetching flags of emails {chunk[0]}..{chunk[-1]}: {e}")
+
+        if cached:
+            self._index_flags({int(key): ["\\Seen"] if fetched[key]["read"] else []
+                               for key in cached if key in fetched})
+
+        def collect(email_data: Dict[str, Any]):
+            fetched[email_data["id"]] = email_data
+
+        missing = [key for key in keys if key not in fetched]
+        for chunk in chunked(missing, chunk_size):
+            try:
+                if not self._stream_fetch(chunk, collect):
+                    print(f"Failed to fetch emails {chunk[0]}..{chunk[-1]}")
+            except Exception as e:
+                print(f"Error fetching emails {chunk[0]}..{chunk[-1]}: {e}")
+
+        indexed = keys if index_bodies else missing
+        self._index_emails([fetched[key] for key in indexed if key in fetched], index_bodies)
+        return [fetched[key] for key in keys if key in fetched]
+
+    def _stream_fetch(self, uids: List[str], callback) -> bool:
+        """
+        Run UID FETCH (UID FLAGS BODY.PEEK[]) and parse each message as it arrives
+        
+        imaplib buffers every literal of a response in memory, so the command
+        is sent and its response read here instead. Message literals are read
+        in STREAM_READ_SIZE chunks, fed to a StreamingMimeParser and written
+        to the local message store in the same pass.
+        
+        Args:
+            uids: UIDs to fetch
+            callback: Called with the EmailRecord of every message
+            
+        Returns:
+            True if the server completed the command with OK
+        """
+        conn = self.imap_conn
+        tag = conn._new_tag()
+        try:
+            conn.send(tag + b' UID FETCH ' + build_uid_set(uids).encode('ascii') + b' (UID FLAGS BODY.PEEK[])\r\n')
+            while True:
+                line = conn.readline()
+                if not line:
+                    raise conn.abort("Connection closed during FETCH")
+                if line.startswith(tag + b' '):
+                    return line[len(tag) + 1:].upper().startswith(b'OK')
+                fetch = _UNTAGGED_FETCH_RE.match(line)
+                if not fetch:
+                    continue
+                # Same shape as imaplib's FETCH data: "<seq> (<items>"
+                self._read_fetch_message(fetch.group(1) + b' ' + line[fetch.end():], callback)
+        except Exception:
+            # The rest of the response is still on the wire, the session is unusable
+            self._discard_conn = True
+            raise
+        finally:
+            conn.tagged_commands.pop(tag, None)
+
+    def _read_fetch_message(self, line: bytes, callback):
+        """Read one untagged FETCH response, streaming its message literal"""
+        conn = self.imap_conn
+        data = []
+        parsed = None
+        writer = None
+        try:
+            while True:
+                line = line.rstrip(b'\r\n')
+                marker = _LITERAL_MARKER_RE.search(line)
+                if not marker:
+                    data.append(line)
+                    break
+
+                size = int(marker.group(1))
+                if is_message_literal(line):
+                    parser = StreamingMimeParser(self.spool_threshold)
+                    writer = self._open_store_writer()
+                    remaining = size
+                    while remaining > 0:
+                        chunk = conn.read(min(remaining, self.STREAM_READ_SIZE))
+                        if not chunk:
+                            raise conn.abort("Connection closed during FETCH")
+                        remaining -= len(chunk)
+                        parser.feed(chunk)
+                        if writer:
+                            writer.write(chunk)
+                    parsed = parser.close()
+                    data.append((line, b""))
+                else:
+                    data.append((line, conn.read(size)))
+                line = conn.readline()
+
+            messages = parse_fetch_response(data)
+            if parsed is None or not messages or messages[0]["uid"] is None:
+                return
+            message = messages[0]
+            if writer:
+                self._commit_store_writer(writer, message["uid"])
+                writer = None
+            email_data = self._build_email_data(parsed, str(message["uid"]), message["flags"])
+            if email_data:
+                callback(email_data)
+        finally:
+            if writer:
+                writer.abort()
+            if parsed:
+                parsed.close()
+
+    def _index_emails(self, emails: List[Dict[str, Any]], index_bodies: bool = False):
+        """Add downloaded emails of the current folder to the local search and thread indexes"""
+        uidvalidity = self.context.get("uidvalidity")
+        if self.search_index and uidvalidity and emails:
+            try:
+                self.search_index.index_emails(
+                    self.get_account_id(), self.context["current_folder"], uidvalidity, emails,
+                    decode_bodies=index_bodies)
+            except Exception as e:
+                print(f"Error updating search index: {e}")
+        self._index_threads(emails)
+
+    def _index_threads(self, emails: List[Dict[str, Any]]):
+        """Link emails (or envelopes) of the current folder into their threads"""
+        uidvalidity = self.context.get("uidvalidity")
+        if not self.thread_index or not uidvalidity or not emails:
+            return
+        try:
+            self.thread_index.add_messages(
+                self.get_account_id(), self.context["current_folder"], uidvalidity, emails)
+        except Exception as e:
+            print(f"Error updating thread index: {e}")
+
+    def _index_flags(self, flag_changes: Dict[int, List[str]]):
+        """Refresh read state of indexed emails of the current folder"""
+        uidvalidity = self.context.get("uidvalidity")
+        if not self.search_index or not uidvalidity or not flag_changes:
+            return
+        try:
+            self.search_index.update_flags(
+                self.get_account_id(), self.context["current_folder"], uidvalidity, flag_changes)
+        except Exception as e:
+            print(f"Error updating search index: {e}")
+
+    def _message_key(self, email_id_str: str) -> Optional[tuple]:
+        """Identity of an email of the current folder for per-message memos (None if unknown)"""
+        uidvalidity = self.context.get("uidvalidity")
+        if not uidvalidity:
             return None
+        return self.get_account_id(), self.context["current_folder"], uidvalidity, email_id_str
+
+    def _cached_paths(self, keys: List[str]) -> Dict[str, str]:
+        """Get blob paths of UIDs of the current folder that are in the local store"""
+        uidvalidity = self.context.get("uidvalidity")
+        if not self.message_store or not uidvalidity:
+            return {}
+
+        cached = {}
+        account = self.get_account_id()
+        folder = self.context["current_folder"]
+        for key in keys:
+            try:
+                path = self.message_store.get_path(account, folder, uidvalidity, int(key))
+            except Exception as e:
+                print(f"Error reading message store: {e}")
+                return cached
+            if path is not None:
+                cached[key] = path
+        return cached
 
+    def _open_store_writer(self):
+        """Start writing a downloading message to the local store (None if disabled)"""
+        if not self.message_store or not self.context.get("uidvalidity"):
+            return None
         try:
-            status, data = self.imap_conn.fetch(email_id, '(RFC822)')
-            if status != "OK" or not data[0]:
-                print(f"Failed to fetch email {email_id}: {status}")
-                return None
+            return self.message_store.open_writer()
+        except Exception as e:
+            print(f"Error writing message store: {e}")
+            return None
 
-            raw_email = data[0][1]
-            msg = email.message_from_bytes(raw_email)
+    def _commit_store_writer(self, writer, uid: int):
+        """Record a fully downloaded message in the local store"""
+        try:
+            writer.commit(self.get_account_id(), self.context["current_folder"],
+                          self.context["uidvalidity"], uid)
+        except Exception as e:
+            writer.abort()
+            print(f"Error writing message store: {e}")
 
+    def _parse_email_file(self, path: str, email_id_str: str, flags: List[str]):
+        """Build an EmailRecord from a raw message file, streaming it from disk"""
+        try:
+            with parse_file(path, self.spool_threshold) as parsed:
+                return self._build_email_data(parsed, email_id_str, flags)
+        except Exception as e:
+            print(f"Error parsing email {email_id_str}: {e}")
+            return None
+
+    def _build_email_data(self, parsed, email_id_str: str, flags: List[str]):
+        """
+        Build an EmailRecord from a streamed parse
+        
+        Args:
+            parsed: ParsedEmail from utils.mime_stream
+            email_id_str: Email UID as a string
+            flags: IMAP flags of the message
+            
+        Returns:
+            EmailRecord or None if error
+        """
+        try:
             # Extract headers
-            subject = self._decode_header(msg["Subject"])
-            from_header = self._decode_header(msg["From"])
-            to_header = self._decode_header(msg.get("To", ""))
-            date = msg["Date"]
+            subject = self._decode_header(parsed["Subject"])
+            from_header = self._decode_header(parsed["From"])
+            to_header = self._decode_header(parsed.get("To", ""))
+            date = parsed["Date"]
 
             # Extract email address from the From header
-            sender = from_header
-            if '<' in from_header and '>' in from_header:
-                sender = re.search(r'<([^>]+)>', from_header).group(1)
+            sender = self._extract_address(from_header)
 
-            # Extract body
+            # Extract body, preferring plain text over HTML; it is decoded on first access
             body = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    content_type = part.get_content_type()
-                    content_disposition = str(part.get("Content-Disposition"))
+            part = None
+            if parsed.is_multipart:
+                part = parsed.find_body_part("text/plain") or parsed.find_body_part("text/html")
+            elif parsed.parts:
+                part = parsed.parts[0]
+            if part is not None:
+                body = LazyBody(part.read(), part.charset, part.content_type == "text/html",
+                                self._message_key(email_id_str), self.html_text_limit)
+
+            # Attachment metadata was collected during the same pass
+            attachments = [(attachment['filename'], attachment['content_type'])
+                           for attachment in parsed.attachments] if parsed.is_multipart else []
+
+            email_data = EmailRecord(
+                id=email_id_str,
+                message_id=parsed.get("Message-ID", f"msg_{email_id_str}"),
+                references=parse_references(parsed.get("References"), parsed.get("In-Reply-To")),
+                subject=subject,
+                sender=sender,
+                to=to_header,
+                date=date,
+                read='\\Seen' in flags,
+                folder=self.context["current_folder"],
+                uidvalidity=self.context.get("uidvalidity"),
+                attachments=attachments,
+                body=body
+            )
 
-                    # Skip attachments
-                    if "attachment" in content_disposition:
+            return email_data
+        except Exception as e:
+            print(f"Error parsing email {email_id_str}: {e}")
+            return None
+
+    def list_envelopes(self, email_ids: List[Any], chunk_size: Optional[int] = None):
+        """
+        List emails without downloading their bodies
+        
+        Fetches only selected header fields, flags, size and BODYSTRUCTURE,
+        so listing messages with large attachments moves kilobytes. Body and
+        attachment details load on first access through fetch_email.
+        
+        Args:
+            email_ids: Email UIDs to list
+            chunk_size: Maximum UIDs per FETCH command (defaults to fetch_chunk_size)
+            
+        Returns:
+            List of EmailEnvelope records in the order of email_ids
+        """
+        if not self.is_connected() or not email_ids:
+            return []
+        self._ensure_selected()
+
+        chunk_size = chunk_size or self.fetch_chunk_size
+        keys = [self._uid_str(email_id) for email_id in email_ids]
+        header_item = f"BODY.PEEK[HEADER.FIELDS ({self.ENVELOPE_HEADER_FIELDS})]"
+        listed = {}
+
+        for chunk in chunked(keys, chunk_size):
+            try:
+                status, data = self.imap_conn.uid(
+                    'FETCH', build_uid_set(chunk),
+                    f'(UID FLAGS RFC822.SIZE BODYSTRUCTURE {header_item})')
+                if status != "OK":
+                    print(f"Failed to list emails {chunk[0]}..{chunk[-1]}: {status}")
+                    continue
+
+                for message in parse_fetch_response(data):
+                    if message["uid"] is None:
                         continue
+                    envelope = self._parse_envelope(message)
+                    listed[envelope["id"]] = envelope
+            except Exception as e:
+                print(f"Error listing emails {chunk[0]}..{chunk[-1]}: {e}")
 
-                    # Get text content
-                    if content_type == "text/plain":
-                        try:
-                            body = part.get_payload(decode=True).decode()
-                            break
-                        except Exception as e:
-                            print(f"Error decoding email body: {e}")
-                            body = "Error: Could not decode email body"
-                            pass
-                    elif content_type == "text/html" and not body:
-                        try:
-                            # Simple HTML to text conversion - if needed, enhance this
-                            html = part.get_payload(decode=True).decode()
-                            # Simple HTML tag removal
-                            body = re.sub('<[^<]+?>', ' ', html)
-                        except Exception as e:
-                            print(f"Error processing HTML body: {e}")
-                            pass
-            else:
-                try:
-                    body = msg.get_payload(decode=True).decode()
-                except Exception as e:
-                    print(f"Error decoding single-part message: {e}")
-                    body = "Unable to decode message body"
-
-            # Extract attachments
-            attachments = []
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_maintype() == 'multipart':
+        envelopes = [listed[key] for key in keys if key in listed]
+        self._index_threads(envelopes)
+        return envelopes
+
+    def fetch_previews(self, email_ids: List[Any],
+                       max_bytes: int = DEFAULT_PREVIEW_BYTES,
+                       max_total_bytes: int = DEFAULT_PREVIEW_TOTAL_BYTES):
+        """
+        Fetch the beginning of each email's text part under a byte budget
+        
+        The text/plain (or text/html) section is located from BODYSTRUCTURE
+        and only its first bytes are fetched with a partial BODY.PEEK range,
+        so the cost is bounded regardless of message size and the \\Seen
+        flag is never set.
+        
+        Args:
+            email_ids: Email UIDs to preview
+            max_bytes: Maximum raw bytes fetched per message
+            max_total_bytes: Maximum raw bytes fetched for the whole request
+            
+        Returns:
+            List of dictionaries (id, preview, content_type, truncated) in
+            the order of email_ids
+        """
+        if not self.is_connected() or not email_ids:
+            return []
+        self._ensure_selected()
+
+        keys = [self._uid_str(email_id) for email_id in email_ids]
+        text_parts = {}
+
+        # Locate the text section of every message
+        for chunk in chunked(keys, self.fetch_chunk_size):
+            try:
+                status, data = self.imap_conn.uid('FETCH', build_uid_set(chunk), '(UID BODYSTRUCTURE)')
+                if status != "OK":
+                    continue
+                for message in parse_fetch_response(data):
+                    if message["uid"] is None:
                         continue
-                    if part.get('Content-Disposition') is None:
+                    part = self._find_text_part(
+                        walk_bodystructure(extract_fetch_item(message["text"], 'BODYSTRUCTURE')))
+                    if part:
+                        text_parts[str(message["uid"])] = part
+            except Exception as e:
+                print(f"Error reading structure of emails {chunk[0]}..{chunk[-1]}: {e}")
+
+        # Spread the request budget over the messages that have text
+        wanted = [key for key in keys if key in text_parts]
+        per_message = min(max_bytes, max_total_bytes // len(wanted)) if wanted else 0
+
+        # One partial FETCH per distinct (section, length) over its UID set
+        groups = {}
+        for key in wanted:
+            part = text_parts[key]
+            length = min(per_message, part["size"]) if part["size"] else per_message
+            if length > 0:
+                groups.setdefault((part["section"], length), []).append(key)
+
+        raw_previews = {}
+        for (section, length), uids in groups.items():
+            for chunk in chunked(uids, self.fetch_chunk_size):
+                try:
+                    status, data = self.imap_conn.uid(
+                        'FETCH', build_uid_set(chunk), f'(UID BODY.PEEK[{section}]<0.{length}>)')
+                    if status != "OK":
                         continue
+                    for message in parse_fetch_response(data):
+                        raw = get_literal(message, f"BODY[{section}]<0>", f"BODY[{section}]")
+                        if message["uid"] is not None and raw is not None:
+                            raw_previews[str(message["uid"])] = raw
+                except Exception as e:
+                    print(f"Error fetching previews of emails {chunk[0]}..{chunk[-1]}: {e}")
 
-                    filename = part.get_filename()
-                    if filename:
-                        attachments.append({
-                            'filename': filename,
-                            'content_type': part.get_content_type()
-                        })
-
-            # Check read status
-            status, read_data = self.imap_conn.fetch(email_id, '(FLAGS)')
-            read = b'\\Seen' in read_data[0]
-
-            # Format the email ID for consistency
-            email_id_str = email_id.decode() if isinstance(
-                email_id, bytes) else str(email_id)
-
-            email_data = {
-                "id": email_id_str,
-                "message_id": msg.get("Message-ID", f"msg_{email_id_str}"),
-                "subject": subject,
-                "from": sender,
-                "to": to_header,
-                "date": date,
-                "body": body,
-                "read": read,
-                "has_attachments": len(attachments) > 0,
-                "attachments": attachments,
-                "folder": self.context["current_folder"]
-            }
+        previews = []
+        for key in keys:
+            part = text_parts.get(key)
+            raw = raw_previews.get(key)
+            if part is None or raw is None:
+                previews.append({"id": key, "preview": "", "content_type": None, "truncated": False})
+                continue
+            previews.append({
+                "id": key,
+                "preview": self._decode_partial(raw, part),
+                "content_type": part["content_type"],
+                "truncated": bool(part["size"]) and len(raw) < part["size"]
+            })
+        return previews
 
-            return email_data
-        except Exception as e:
-            print(f"Error fetching email {email_id}: {e}")
-            return None
+    @staticmethod
+    def _find_text_part(parts: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Pick the text/plain part of a message, or its text/html part"""
+        for content_type in ("text/plain", "text/html"):
+            for part in parts:
+                if part["content_type"] == content_type and not part["is_attachment"]:
+                    return part
+        return None
+
+    @staticmethod
+    def _decode_partial(raw: bytes, part: Dict[str, Any]) -> str:
+        """Decode a possibly truncated section using its transfer encoding and charset"""
+        data = raw
+        try:
+            if part["encoding"] == "base64":
+                compact = re.sub(rb'\s+', b'', raw)
+                data = base64.b64decode(compact[:len(compact) - len(compact) % 4])
+            elif part["encoding"] == "quoted-printable":
+                # Drop an escape sequence cut in half by the byte range
+                data = quopri.decodestring(re.sub(rb'=[0-9A-Fa-f]?$', b'', raw))
+        except (binascii.Error, ValueError) as e:
+            print(f"Error decoding preview: {e}")
+
+        text = data.decode(part.get("charset") or "utf-8", errors="replace") if data else ""
+        if part["content_type"] == "text/html":
+            # The range may end inside a tag, partial drops the unterminated tail
+            text = html_to_text(text, partial=True)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    def _parse_envelope(self, message: Dict[str, Any]) -> EmailEnvelope:
+        """Build an EmailEnvelope from a parsed header/BODYSTRUCTURE fetch"""
+        email_id_str = str(message["uid"])
+        headers = self._parse_header_fields(message, self.ENVELOPE_HEADER_FIELDS)
+
+        parts = walk_bodystructure(extract_fetch_item(message["text"], 'BODYSTRUCTURE'))
+        attachments = [(part["filename"], part["content_type"])
+                       for part in parts if part["is_attachment"]]
+
+        return EmailEnvelope({
+            "id": email_id_str,
+            "message_id": headers.get("Message-ID", f"msg_{email_id_str}"),
+            "references": parse_references(headers.get("References"), headers.get("In-Reply-To")),
+            "subject": self._decode_header(headers["Subject"]),
+            "from": self._extract_address(self._decode_header(headers["From"])),
+            "to": self._decode_header(headers.get("To", "")),
+            "date": headers["Date"],
+            "read": '\\Seen' in message["flags"],
+            "flags": message["flags"],
+            "size": message["size"],
+            "has_attachments": len(attachments) > 0,
+            "folder": self.context["current_folder"],
+            "uidvalidity": self.context.get("uidvalidity"),
+            "attachment_names": attachments
+        }, loader=functools.partial(self._load_body, self.context["current_folder"],
+                                    self.context.get("uidvalidity"), email_id_str))
+
+    @staticmethod
+    def _parse_header_fields(message: Dict[str, Any], fields: str):
+        """Parse the BODY[HEADER.FIELDS (...)] literal of a parsed fetch response"""
+        header_bytes = get_literal(message, f"BODY[HEADER.FIELDS ({fields})]") or b""
+        if not header_bytes:
+            # Some servers echo the field list differently, take any header literal
+            header_bytes = next((value for name, value in message["literals"].items()
+                                 if name.startswith("BODY[HEADER")), b"")
+        return email.parser.BytesHeaderParser().parsebytes(header_bytes)
+
+    @staticmethod
+    def _extract_address(from_header: str) -> str:
+        """Extract the email address from a decoded From header"""
+        if '<' in from_header and '>' in from_header:
+            match = re.search(r'<([^>]+)>', from_header)
+            if match:
+                return match.group(1)
+        return from_header
+
+    @staticmethod
+    def _uid_str(email_id) -> str:
+        """Normalize a UID given as bytes, int or str"""
+        return email_id.decode() if isinstance(email_id, bytes) else str(email_id)
 
     def _decode_header(self, header):
         """
@@ -357,75 +1313,494 @@ class EmailMCP:
 
     def mark_as_read(self, email_id):
         """Mark an email as read"""
-        if not self.is_connected():
+        return self.mark_emails_read([email_id])
+
+    def mark_emails_read(self, email_ids: List[Any], read: bool = True, defer: bool = False) -> bool:
+        """
+        Mark emails of the current folder as read or unread
+        
+        Args:
+            email_ids: Email UIDs
+            read: True to set \\Seen, False to clear it
+            defer: Queue the change in the write-behind queue instead of sending it now
+            
+        Returns:
+            bool: True if every batch succeeded (or the change was queued)
+        """
+        return self.set_flags(email_ids, ['\\Seen'], add=read, defer=defer)
+
+    def flag_emails(self, email_ids: List[Any], flagged: bool = True, defer: bool = False) -> bool:
+        """Set or clear \\Flagged on emails of the current folder, see mark_emails_read"""
+        return self.set_flags(email_ids, ['\\Flagged'], add=flagged, defer=defer)
+
+    def set_flags(self, email_ids: List[Any], flags: List[str], add: bool = True,
+                  defer: bool = False, chunk_size: Optional[int] = None) -> bool:
+        """
+        Add or remove flags on many emails of the current folder
+        
+        UIDs are compressed into ranges and sent as UID STORE +FLAGS.SILENT
+        (or -FLAGS.SILENT) commands of at most chunk_size UIDs, so changing
+        thousands of messages takes a handful of commands.
+        
+        Args:
+            email_ids: Email UIDs
+            flags: Flags to change, e.g. ['\\Seen']
+            add: Add the flags (True) or remove them (False)
+            defer: Coalesce the change in the write-behind queue and send it later
+            chunk_size: Maximum UIDs per command (defaults to bulk_chunk_size)
+            
+        Returns:
+            bool: True if every batch succeeded (or the change was queued)
+        """
+        if not email_ids or not flags:
+            return True
+
+        folder = self.context["current_folder"]
+        if defer:
+            get_flag_queue(self.settings).queue(folder, email_ids, flags, add, self.context.get("uidvalidity"))
+            return True
+
+        if not self.is_connected() or not self._ensure_selected(readonly=False):
             return False
 
-        try:
-            self.imap_conn.store(email_id, '+FLAGS', '\\Seen')
+        chunk_size = chunk_size or self.bulk_chunk_size
+        uids = [self._uid_str(email_id) for email_id in email_ids]
+        operation = ('+FLAGS.SILENT' if add else '-FLAGS.SILENT')
+        success = True
+        for chunk in chunked(uids, chunk_size):
+            try:
+                status, _ = self.imap_conn.uid('STORE', build_uid_set(chunk), operation, f"({' '.join(flags)})")
+                if status != "OK":
+                    print(f"Failed to update flags of emails {chunk[0]}..{chunk[-1]}: {status}")
+                    success = False
+            except Exception as e:
+                print(f"Error updating flags of emails {chunk[0]}..{chunk[-1]}: {e}")
+                success = False
+
+        _status_cache.invalidate(self.get_account_id(), folder)
+        if '\\Seen' in flags:
+            self._index_flags({int(uid): ['\\Seen'] if add else [] for uid in uids})
+        return success
+
+    def move_emails(self, email_ids: List[Any], destination: str, chunk_size: Optional[int] = None) -> bool:
+        """
+        Move emails of the current folder to another folder
+        
+        Uses UID MOVE when the server supports it, otherwise UID COPY,
+        \\Deleted and a UID EXPUNGE of the copied messages. Without UIDPLUS
+        the originals are left flagged \\Deleted until expunge() is called.
+        
+        Args:
+            email_ids: Email UIDs
+            destination: Target folder name
+            chunk_size: Maximum UIDs per command (defaults to bulk_chunk_size)
+            
+        Returns:
+            bool: True if every batch succeeded
+        """
+        if not email_ids:
             return True
+        if not self.is_connected() or not self._ensure_selected(readonly=False):
+            return False
+
+        chunk_size = chunk_size or self.bulk_chunk_size
+        uids = [self._uid_str(email_id) for email_id in email_ids]
+        target = quote_mailbox(destination)
+        moved = []
+        success = True
+        for chunk in chunked(uids, chunk_size):
+            uid_set = build_uid_set(chunk)
+            try:
+                if self.has_capability("MOVE"):
+                    status, _ = self.imap_conn.uid('MOVE', uid_set, target)
+                else:
+                    status, _ = self.imap_conn.uid('COPY', uid_set, target)
+                    if status == "OK":
+                        status, _ = self.imap_conn.uid('STORE', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+                        # A plain EXPUNGE would also remove every other \\Deleted email of the folder
+                        if status == "OK" and self.has_capability("UIDPLUS"):
+                            status = "OK" if self._expunge_uids(chunk) else "NO"
+                if status == "OK":
+                    moved.extend(chunk)
+                else:
+                    print(f"Failed to move emails {chunk[0]}..{chunk[-1]} to {destination}: {status}")
+                    success = False
+            except Exception as e:
+                print(f"Error moving emails {chunk[0]}..{chunk[-1]} to {destination}: {e}")
+                success = False
+
+        self.forget_emails(moved)
+        # Both folders' counters changed
+        _status_cache.invalidate(self.get_account_id(), self.context["current_folder"])
+        _status_cache.invalidate(self.get_account_id(), destination)
+        return success
+
+    def delete_emails(self, email_ids: List[Any], expunge: bool = True) -> bool:
+        """
+        Flag emails of the current folder as \\Deleted and optionally expunge them
+        
+        Args:
+            email_ids: Email UIDs
+            expunge: Permanently remove them right away
+            
+        Returns:
+            bool: True if successful
+        """
+        if not self.set_flags(email_ids, ['\\Deleted']):
+            return False
+        return self.expunge(email_ids) if expunge else True
+
+    def expunge(self, email_ids: Optional[List[Any]] = None) -> bool:
+        """
+        Permanently remove \\Deleted emails from the current folder
+        
+        Args:
+            email_ids: Only expunge these UIDs (needs UIDPLUS; without it
+                nothing is expunged, the emails stay flagged \\Deleted and
+                False is returned); every \\Deleted email if None
+            
+        Returns:
+            bool: True if successful
+        """
+        if not self.is_connected() or not self._ensure_selected(readonly=False):
+            return False
+
+        try:
+            if email_ids is None:
+                # EXPUNGE reports sequence numbers, so look up the UIDs it is about to remove
+                deleted = self.search_uids('DELETED')
+                status, _ = self.imap_conn.expunge()
+                _status_cache.invalidate(self.get_account_id(), self.context["current_folder"])
+                if status != "OK":
+                    return False
+                self.forget_emails(deleted or [])
+                return True
+
+            uids = [self._uid_str(email_id) for email_id in email_ids]
+            success = True
+            for chunk in chunked(uids, self.bulk_chunk_size):
+                if self._expunge_uids(chunk):
+                    self.forget_emails(chunk)
+                else:
+                    success = False
+            return success
+        except Exception as e:
+            print(f"Error expunging emails: {e}")
+            return False
+
+    def _expunge_uids(self, uids: List[str]) -> bool:
+        """Expunge specific UIDs with UID EXPUNGE; False without UIDPLUS, nothing is expunged then"""
+        if not self.has_capability("UIDPLUS"):
+            print(f"Server does not support UIDPLUS, emails {uids[0]}..{uids[-1]} stay flagged \\Deleted "
+                  f"(expunge() without UIDs removes every \\Deleted email of the folder)")
+            return False
+        status, _ = self.imap_conn.uid('EXPUNGE', build_uid_set(uids))
+        _status_cache.invalidate(self.get_account_id(), self.context["current_folder"])
+        return status == "OK"
+
+    def forget_emails(self, uids: List[Any]):
+        """
+        Drop emails that left the current folder from the local store and indexes
+        
+        Called after MOVE/EXPUNGE and by MailboxSync for UIDs the server
+        reports as vanished.
+        
+        Args:
+            uids: UIDs of the current folder that no longer exist
+        """
+        if not uids:
+            return
+        uidvalidity = self.context.get("uidvalidity")
+        if self.message_store and uidvalidity:
+            try:
+                self.message_store.remove(self.get_account_id(), self.context["current_folder"],
+                                          uidvalidity, [int(uid) for uid in uids])
+            except Exception as e:
+                print(f"Error updating message store: {e}")
+        if self.search_index:
+            try:
+                self.search_index.remove(self.get_account_id(), self.context["current_folder"],
+                                         [int(uid) for uid in uids])
+            except Exception as e:
+                print(f"Error updating search index: {e}")
+        if self.thread_index:
+            try:
+                self.thread_index.remove(self.get_account_id(), self.context["current_folder"],
+                                         [int(uid) for uid in uids])
+            except Exception as e:
+                print(f"Error updating thread index: {e}")
+
+    def search_local(self, criteria: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Search the local full-text index without contacting the server
+        
+        Args:
+            criteria: Dictionary with search parameters (text, sender, subject,
+                since, until, unread, has_attachments, folder, page, limit)
+            
+        Returns:
+            Dictionary with total, page, page_size and results
+        """
+        empty = {"total": 0, "page": 1, "page_size": criteria.get('limit', 10), "results": []}
+        if not self.search_index:
+            return empty
+
+        try:
+            return self.search_index.search(
+                self.get_account_id(),
+                text=criteria.get('text') or criteria.get('body'),
+                folder=criteria.get('folder', self.context["current_folder"]),
+                sender=criteria.get('sender') or criteria.get('from'),
+                subject=criteria.get('subject'),
+                since=criteria.get('since'),
+                until=criteria.get('until'),
+                unread=True if criteria.get('unread') else None,
+                has_attachments=True if criteria.get('has_attachments') else None,
+                page=criteria.get('page', 1),
+                page_size=criteria.get('limit', 10))
         except Exception as e:
-            print(f"Error marking email as read: {e}")
+            print(f"Error searching local index: {e}")
+            return empty
+
+    def is_fully_indexed(self, folder: Optional[str] = None) -> bool:
+        """
+        Whether the local search index holds every message of a folder
+        
+        True when the last sync of the folder started from its first
+        message and, if connected, the folder has not changed since
+        (same UIDVALIDITY and UIDNEXT).
+        
+        Args:
+            folder: Mailbox folder name (defaults to the current folder)
+        """
+        folder = folder or self.context["current_folder"]
+        checkpoint = self._complete_checkpoint(folder)
+        if checkpoint is None:
             return False
+        if not self.is_connected():
+            return True
+        return self._checkpoint_current(checkpoint, self.get_folder_status(folder))
+
+    def _complete_checkpoint(self, folder: str) -> Optional[Dict[str, Any]]:
+        """Sync checkpoint of a folder if that sync indexed every message of it"""
+        if not self.sync_state:
+            return None
+        checkpoint = self.sync_state.get(self.get_account_id(), folder)
+        if not checkpoint or not checkpoint.get("complete") or checkpoint.get("messages") is None:
+            return None
+        return checkpoint
+
+    @staticmethod
+    def _checkpoint_current(checkpoint: Dict[str, Any], status: Dict[str, int]) -> bool:
+        """Whether no message arrived and no UIDs were reset since the checkpoint"""
+        return (bool(status) and status.get("UIDVALIDITY") == checkpoint.get("uidvalidity")
+                and status.get("UIDNEXT") == checkpoint.get("uidnext"))
+
+    def _record_from_index(self, hit: Dict[str, Any], headers_only: bool = False) -> EmailRecord:
+        """Turn a local search hit into the record type the server search returns"""
+        if headers_only:
+            attachments = [(item["filename"], item["content_type"]) for item in hit.get("attachments") or []]
+            return EmailEnvelope(dict(hit, attachment_names=attachments), loader=functools.partial(
+                self._load_body, hit["folder"], hit["uidvalidity"], hit["id"]))
+        return EmailRecord.from_dict(hit)
 
     def search_emails(self, criteria: Dict[str, Any]):
         """
         Search for emails using various criteria
         
+        The local search index answers when the folder's sync checkpoint
+        shows every message of it was indexed (unless criteria['local'] is
+        False); otherwise the server is searched.
+        
         Args:
-            criteria: Dictionary with search parameters (sender, subject, date, etc.)
+            criteria: Dictionary with search parameters (sender, subject, date, etc.),
+                set headers_only to get EmailEnvelope records
             
         Returns:
-            List of email dictionaries matching criteria
+            List of EmailRecord (EmailEnvelope with headers_only) matching criteria
         """
+        folder = criteria.get('folder', self.context["current_folder"])
+        if self.search_index and criteria.get('local', True) and self.is_fully_indexed(folder):
+            return [self._record_from_index(hit, criteria.get('headers_only'))
+                    for hit in self.search_local(criteria)["results"]]
+
         if not self.is_connected():
             return []
 
         try:
-            search_query = []
+            query = self._build_search_query(criteria)
 
-            if 'sender' in criteria:
-                search_query.append(f'FROM "{criteria["sender"]}"')
+            # Execute search
+            self._ensure_selected()
 
-            if 'subject' in criteria:
-                search_query.append(f'SUBJECT "{criteria["subject"]}"')
+            # Newest matches first, limited on the server where possible
+            limit = criteria.get('limit', 10)
+            offset = (max(1, int(criteria.get('page', 1))) - 1) * limit
+            email_ids = self._newest_uids(query, limit, offset)
+            if not email_ids:
+                return []
 
-            if 'since' in criteria:
-                search_query.append(f'SINCE "{criteria["since"]}"')
+            # Fetch emails
+            if criteria.get('headers_only'):
+                return self.list_envelopes(email_ids)
+            return self.fetch_emails(email_ids)
+        except Exception as e:
+            print(f"Error searching emails: {e}")
+            return []
 
-            if 'unread' in criteria and criteria['unread']:
-                search_query.append('UNSEEN')
+    @staticmethod
+    def _build_search_query(criteria: Dict[str, Any]) -> str:
+        """Build IMAP SEARCH criteria from a search_emails criteria dictionary"""
+        search_query = []
 
-            if 'has_attachments' in criteria and criteria['has_attachments']:
-                search_query.append('BODY "Content-Disposition: attachment"')
+        sender = criteria.get('sender') or criteria.get('from')
+        if sender:
+            search_query.append(f'FROM "{sender}"')
 
-            # Convert the query to IMAP format
-            query = ' '.join(search_query)
+        if 'subject' in criteria:
+            search_query.append(f'SUBJECT "{criteria["subject"]}"')
 
-            # Execute search
-            self.select_folder(self.context["current_folder"])
-            status, data = self.imap_conn.search(None, query)
-            if status != "OK":
-                return []
+        if 'since' in criteria:
+            search_query.append(f'SINCE "{criteria["since"]}"')
 
-            email_ids = data[0].split()
+        # Same keys as search_local(), so either can answer a criteria dict
+        text = criteria.get('text') or criteria.get('body')
+        if text:
+            search_query.append(f'TEXT "{text}"')
 
-            # Limit results
-            limit = criteria.get('limit', 10)
-            if len(email_ids) > limit:
-                email_ids = email_ids[:limit]
+        if 'unread' in criteria and criteria['unread']:
+            search_query.append('UNSEEN')
 
-            # Fetch emails
-            results = []
-            for email_id in email_ids:
-                email_data = self.fetch_email(email_id)
-                if email_data:
-                    results.append(email_data)
+        if 'has_attachments' in criteria and criteria['has_attachments']:
+            search_query.append('BODY "Content-Disposition: attachment"')
 
-            return results
+        # Convert the query to IMAP format
+        return ' '.join(search_query) or 'ALL'
+
+    def get_thread(self, message_id: str, fetch_missing: bool = True,
+                   folders: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Get the conversation a message belongs to
+        
+        Answered from the local thread index. Ancestors that replies refer
+        to but that are not indexed yet are looked up on the server first
+        (see fetch_thread_headers); the mailbox is never rescanned.
+        
+        Args:
+            message_id: Message-ID of any message of the thread
+            fetch_missing: Look up referenced messages missing from the index
+            folders: Folders searched for missing messages (defaults to the
+                current folder and the sent folder)
+            
+        Returns:
+            Thread entries (message_id, parent_id, depth, folder, uidvalidity,
+            id, subject, from, date) in chronological order
+        """
+        if not self.thread_index or not message_id:
+            return []
+
+        account = self.get_account_id()
+        try:
+            if fetch_missing and self.is_connected():
+                missing = self.thread_index.missing_messages(account, message_id)
+                if missing:
+                    self.fetch_thread_headers(missing, folders)
+            return self.thread_index.get_thread(account, message_id)
         except Exception as e:
-            print(f"Error searching emails: {e}")
+            print(f"Error reading thread index: {e}")
             return []
 
+    def fetch_thread_headers(self, message_ids: List[str], folders: Optional[List[str]] = None) -> int:
+        """
+        Find messages by Message-ID and add them to the thread index
+        
+        A folder costs one UID SEARCH per THREAD_SEARCH_CHUNK_SIZE
+        Message-IDs and one header-only FETCH of the matches. Ancestors
+        named by the fetched headers that are still missing are looked up
+        the same way, for at most THREAD_FETCH_ROUNDS rounds. The
+        previously selected folder is selected again afterwards.
+        
+        Args:
+            message_ids: Message-IDs to look up
+            folders: Folders to search (defaults to the current folder and the sent folder)
+            
+        Returns:
+            Number of messages found
+        """
+        if not self.thread_index or not self.is_connected():
+            return 0
+
+        selected = self.imap_conn.selected_mailbox
+        original = self.context["current_folder"]
+        if folders is None:
+            folders = [original]
+            sent = self.get_special_folder("sent")
+            if sent and sent != original:
+                folders.append(sent)
+
+        account = self.get_account_id()
+        wanted = {normalize_message_id(message_id) for message_id in message_ids} - {None}
+        tried = set()
+        found = 0
+        try:
+            for _ in range(self.THREAD_FETCH_ROUNDS):
+                if not wanted:
+                    break
+                tried |= wanted
+                located = set()
+                for folder in folders:
+                    remaining = wanted - located
+                    if not remaining:
+                        break
+                    if self.select_folder(folder, readonly=True):
+                        located |= self._fetch_thread_headers(sorted(remaining))
+                found += len(located)
+
+                # Found ancestors may name older ones through their own References
+                wanted = set()
+                for message_id in located:
+                    wanted.update(self.thread_index.missing_messages(account, message_id))
+                wanted -= tried
+        except Exception as e:
+            print(f"Error fetching thread headers: {e}")
+        finally:
+            if selected and self.context["current_folder"] != original:
+                self.select_folder(original, readonly=selected["readonly"])
+        return found
+
+    def _fetch_thread_headers(self, message_ids: List[str]) -> set:
+        """Index the threading headers of the given Message-IDs in the current folder, return those found"""
+        uids = set()
+        for chunk in chunked([message_id for message_id in message_ids if message_id.isascii()],
+                             self.THREAD_SEARCH_CHUNK_SIZE):
+            criteria = ' '.join(f'HEADER Message-ID {quote_string(message_id)}' for message_id in chunk)
+            query = 'OR ' * (len(chunk) - 1) + criteria
+            status, data = self.imap_conn.uid('SEARCH', None, query)
+            if status == "OK":
+                uids.update(int(uid) for uid in (data[0] or b"").split())
+
+        emails = []
+        for chunk in chunked(sorted(uids), self.fetch_chunk_size):
+            status, data = self.imap_conn.uid(
+                'FETCH', build_uid_set(chunk), f'(UID BODY.PEEK[HEADER.FIELDS ({self.THREAD_HEADER_FIELDS})])')
+            if status != "OK":
+                continue
+            for message in parse_fetch_response(data):
+                if message["uid"] is None:
+                    continue
+                headers = self._parse_header_fields(message, self.THREAD_HEADER_FIELDS)
+                emails.append({
+                    "id": str(message["uid"]),
+                    "message_id": headers.get("Message-ID"),
+                    "references": parse_references(headers.get("References"), headers.get("In-Reply-To")),
+                    "subject": self._decode_header(headers["Subject"]),
+                    "from": self._extract_address(self._decode_header(headers["From"])),
+                    "date": headers["Date"]
+                })
+
+        self._index_threads(emails)
+        return {normalize_message_id(email_data["message_id"]) for email_data in emails} & set(message_ids)
+
     def get_context(self):
         """Get the current MCP context"""
         return self.context
@@ -439,12 +1814,13 @@ class EmailMCP:
         """
         self.context.update(updates)
 
-    def get_unread_emails(self, limit: int = 5):
+    def get_unread_emails(self, limit: int = 5, headers_only: bool = False):
         """
         Get unread emails from the current folder
         
         Args:
             limit: Maximum number of unread emails to retrieve
+            headers_only: Return EmailEnvelope records whose body loads on first access
             
         Returns:
             List of unread email objects
@@ -455,28 +1831,20 @@ class EmailMCP:
             
         try:
             # Search for unread emails
-            status, data = self.imap_conn.search(None, 'UNSEEN')
-            if status != 'OK':
+            self._ensure_selected()
+            email_ids = self._newest_uids('UNSEEN', limit)
+            if email_ids is None:
                 print("Error searching for unread emails")
                 return []
-                
-            email_ids = data[0].split()
             if not email_ids:
                 print("No unread emails found")
                 return []
-                
-            # Get most recent unread emails
-            email_ids = email_ids[-min(limit, len(email_ids)):]
             
             # Fetch unread emails
-            emails = []
-            for email_id in email_ids:
-                try:
-                    email_data = self.fetch_email(email_id)
-                    if email_data:
-                        emails.append(email_data)
-                except Exception as e:
-                    print(f"Error fetching email {email_id}: {e}")
+            if headers_only:
+                emails = self.list_envelopes(email_ids)
+            else:
+                emails = self.fetch_emails(email_ids)
             
             # Update context
             self.context["unread_emails"] = emails
@@ -501,36 +1869,22 @@ class EmailMCP:
             return False
             
         try:
-            # Select drafts folder (create if not exists)
-            drafts_folder = "Drafts"
-            if not self.select_folder(drafts_folder):
-                # Try different common names for drafts folder
-                for folder_name in ["Draft", "DRAFTS", "Drafts", "[Gmail]/Drafts"]:
-                    if self.select_folder(folder_name):
-                        drafts_folder = folder_name
-                        break
-                else:
-                    print(f"Could not find or create drafts folder")
-                    return False
-            
-            # Create email message
-            msg = MIMEMultipart()
-            msg['From'] = draft_data.get('from', self.settings['username'])
-            msg['To'] = draft_data.get('to', '')
-            msg['Subject'] = draft_data.get('subject', '')
-            
-            # Add body
-            body = draft_data.get('body', '')
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Convert to string
-            raw_message = msg.as_string()
-            
-            # Save to drafts folder
-            result = self.imap_conn.append(drafts_folder, '\\Draft', None, raw_message.encode('utf-8'))
+            raw_message = self._build_draft_message(draft_data)
+            drafts_folder = self.get_special_folder("drafts", "Drafts")
+
+            # APPEND does not need the folder selected
+            result = self.imap_conn.append(quote_mailbox(drafts_folder), '(\\Draft)', None, raw_message)
+            if result[0] != 'OK':
+                # The cached folder may have been renamed or deleted, look again once
+                self.invalidate_folders()
+                rediscovered = self.get_special_folder("drafts", "Drafts")
+                if rediscovered != drafts_folder:
+                    drafts_folder = rediscovered
+                    result = self.imap_conn.append(quote_mailbox(drafts_folder), '(\\Draft)', None, raw_message)
             
             if result[0] == 'OK':
                 print(f"Draft saved to {drafts_folder} folder")
+                _status_cache.invalidate(self.get_account_id(), drafts_folder)
                 # Update context
                 if not self.context.get('drafts'):
                     self.context['drafts'] = []
@@ -546,9 +1900,96 @@ class EmailMCP:
             self.context['error'] = str(e)
             return False
 
+    def _build_draft_message(self, draft_data: Dict[str, Any]) -> bytes:
+        """Build the raw RFC822 message saved for a draft"""
+        # Create email message
+        msg = MIMEMultipart()
+        msg['From'] = draft_data.get('from', self.settings['username'])
+        msg['To'] = draft_data.get('to', '')
+        msg['Subject'] = draft_data.get('subject', '')
+
+        # Add body
+        body = draft_data.get('body', '')
+        msg.attach(MIMEText(body, 'plain'))
+
+        # Convert to string
+        return msg.as_string().encode('utf-8')
+
+    def _build_outgoing_message(self, email_data: Dict[str, Any]):
+        """
+        Build an outgoing message from email data
+        
+        Returns:
+            Tuple of (sender, recipient list, message bytes)
+        """
+        msg = MIMEMultipart()
+        msg['From'] = email_data.get('from') or self.settings['username']
+        msg['To'] = email_data.get('to', '')
+        msg['Subject'] = email_data.get('subject', '')
+        msg.attach(MIMEText(email_data.get('body', ''), 'plain'))
+
+        to_list = [addr.strip() for addr in email_data.get('to', '').split(',') if addr.strip()]
+        if not to_list:
+            raise ValueError("No recipients specified")
+        return msg['From'], to_list, msg.as_bytes()
+
+    def _record_sent_email(self, email_data: Dict[str, Any], status: str, outbox_id: Optional[int] = None):
+        sent_email = {
+            "to": email_data.get('to', ''),
+            "subject": email_data.get('subject', ''),
+            "body": email_data.get('body', ''),
+            "from": email_data.get('from') or self.settings['username'],
+            "timestamp": email_data.get('timestamp', ''),
+            "folder": "sent",
+            "status": status
+        }
+        if outbox_id is not None:
+            sent_email["outbox_id"] = outbox_id
+
+        if not self.context.get('sent_emails'):
+            self.context['sent_emails'] = []
+        self.context['sent_emails'].append(sent_email)
+
+    def queue_email(self, email_data: Dict[str, Any]) -> Optional[int]:
+        """
+        Write an email to the outbound spool for background delivery
+        
+        Returns as soon as the message is stored on disk; the spool worker
+        delivers it over a reused SMTP session and retries temporary failures.
+        
+        Args:
+            email_data: Dictionary with email data (to, subject, body, etc.)
+            
+        Returns:
+            Outbox id to query with get_send_status(), or None on failure
+        """
+        if not self.settings:
+            print("No email settings available")
+            self.context['error'] = "No email settings available"
+            return None
+
+        try:
+            sender, to_list, message = self._build_outgoing_message(email_data)
+            outbox_id = get_smtp_spool().enqueue(self.settings, sender, to_list, message,
+                                                 email_data.get('subject', ''))
+            print(f"Email to {', '.join(to_list)} queued for delivery (outbox id {outbox_id})")
+            self._record_sent_email(email_data, "queued", outbox_id)
+            return outbox_id
+        except Exception as e:
+            error_msg = str(e)
+            print(f"Error queueing email: {error_msg}")
+            self.context['error'] = error_msg
+            return None
+
+    def get_send_status(self, outbox_id: int) -> Optional[Dict[str, Any]]:
+        """Delivery state of a queued email (status is queued, sending, sent or failed)"""
+        return get_smtp_spool().get_status(outbox_id)
+
     def send_email(self, email_data: Dict[str, Any]) -> bool:
         """
-        Send an email using SMTP
+        Send an email using SMTP, waiting for the server to accept it
+        
+        Prefer queue_email(), which returns without waiting for SMTP.
         
         Args:
             email_data: Dictionary with email data (to, subject, body, etc.)
@@ -562,60 +2003,19 @@ class EmailMCP:
             return False
             
         try:
-            # Create email message
-            msg = MIMEMultipart()
-            msg['From'] = email_data.get('from', self.settings['username'])
-            msg['To'] = email_data.get('to', '')
-            msg['Subject'] = email_data.get('subject', '')
-            
-            # Add body
-            body = email_data.get('body', '')
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Determine SMTP settings based on IMAP settings
-            smtp_host = self.settings.get('smtp_host') or self.settings['host'].replace('imap', 'smtp')
-            smtp_port = self.settings.get('smtp_port') or 587  # Default to 587 for TLS
-            
-            # Create SMTP connection
-            if self.settings.get('tls', True):
-                smtp_conn = smtplib.SMTP(smtp_host, smtp_port)
-                smtp_conn.starttls()
-            else:
-                smtp_conn = smtplib.SMTP(smtp_host, smtp_port)
-            
-            # Login with credentials
-            smtp_conn.login(self.settings['username'], self.settings['password'])
-            
-            # Send email
-            to_list = [addr.strip() for addr in email_data.get('to', '').split(',') if addr.strip()]
-            if not to_list:
-                raise ValueError("No recipients specified")
-                
-            smtp_conn.sendmail(
-                msg['From'],
-                to_list,
-                msg.as_string()
-            )
-            
-            # Close connection
-            smtp_conn.quit()
-            
-            print(f"Email sent successfully to {msg['To']}")
+            sender, to_list, message = self._build_outgoing_message(email_data)
+
+            smtp_conn = open_smtp_session(self.settings)
+            try:
+                smtp_conn.sendmail(sender, to_list, message)
+            finally:
+                try:
+                    smtp_conn.quit()
+                except Exception:
+                    smtp_conn.close()
             
-            # Update context
-            sent_email = {
-                "to": email_data.get('to', ''),
-                "subject": email_data.get('subject', ''),
-                "body": email_data.get('body', ''),
-                "from": email_data.get('from', self.settings['username']),
-                "timestamp": email_data.get('timestamp', ''),
-                "folder": "sent"
-            }
-            
-            if not self.context.get('sent_emails'):
-                self.context['sent_emails'] = []
-                
-            self.context['sent_emails'].append(sent_email)
+            print(f"Email sent successfully to {', '.join(to_list)}")
+            self._record_sent_email(email_data, "sent")
             return True
             
         except Exception as e:
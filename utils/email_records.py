@@ -0,0 +1,291 @@
+"""
+Compact email records returned by EmailMCP
+
+Records use __slots__ instead of a per-message dictionary, share (intern)
+the strings that repeat across a folder such as the folder name and
+addresses, and keep bodies undecoded until they are read. They support
+read-only dictionary access (email["subject"], email.get("body")) so code
+written against the old email dictionaries keeps working; to_dict() turns
+them into plain dictionaries at the JSON boundary.
+"""
+import sys
+from typing import Callable, Dict, List, Any, Hashable, Optional, Sequence, Tuple
+
+from utils.html_text import DEFAULT_MAX_CHARS, html_to_text
+
+
+class MessageUnavailableError(Exception):
+    """The body of an envelope could not be loaded from the folder it was listed in"""
+
+
+def _intern(value: Any) -> Any:
+    """Share one copy of strings that repeat across many records"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class LazyBody:
+    """Transfer-decoded body bytes, decoded to text (and converted from HTML) on first use"""
+
+    __slots__ = ("data", "charset", "html", "key", "max_chars")
+
+    def __init__(self, data: bytes, charset: str = "", html: bool = False,
+                 key: Optional[Hashable] = None, max_chars: int = DEFAULT_MAX_CHARS):
+        """
+        Initialize the body
+
+        Args:
+            data: Body bytes with the transfer encoding already removed
+            charset: Charset of the bytes (utf-8 if empty or unknown)
+            html: The body is HTML and is converted to plain text
+            key: Message identity for the HTML conversion memo
+            max_chars: Output limit of the HTML conversion
+        """
+        self.data = data
+        self.charset = charset
+        self.html = html
+        self.key = key
+        self.max_chars = max_chars
+
+    def decode(self) -> str:
+        try:
+            text = self.data.decode(self.charset or "utf-8", errors="replace")
+        except LookupError:
+            text = self.data.decode("utf-8", errors="replace")
+        if self.html:
+            text = html_to_text(text, self.key, self.max_chars)
+        return text
+
+
+class EmailRecord:
+    """
+    A downloaded email
+
+    Example:
+        email = mcp.fetch_email(uid)
+        print(email["from"], email.subject)
+        payload = email.to_dict()
+    """
+
+    FIELDS = ("id", "message_id", "subject", "from", "to", "date",
+              "read", "has_attachments", "folder", "uidvalidity", "references")
+
+    __slots__ = ("id", "message_id", "subject", "sender", "to", "date",
+                 "read", "folder", "uidvalidity", "references", "_attachments", "_body")
+
+    def __init__(self,
+                 id: str,
+                 message_id: Optional[str] = None,
+                 subject: str = "",
+                 sender: str = "",
+                 to: str = "",
+                 date: Optional[str] = None,
+                 read: bool = False,
+                 folder: str = "",
+                 attachments: Sequence[Tuple[str, str]] = (),
+                 body: Any = "",
+                 references: Sequence[str] = (),
+                 uidvalidity: Optional[int] = None):
+        """
+        Initialize the record
+
+        Args:
+            id: Email UID as a string
+            message_id: Message-ID header
+            subject: Decoded subject
+            sender: Sender address
+            to: Decoded To header
+            date: Date header
+            read: Whether the email has the \\Seen flag
+            folder: Folder the email is in
+            attachments: (filename, content_type) pairs
+            body: Body text, or a LazyBody decoded on first access
+            references: Message IDs of the ancestors from References and
+                In-Reply-To, oldest first
+            uidvalidity: UIDVALIDITY of the folder the UID belongs to
+        """
+        self.id = id
+        self.message_id = message_id
+        self.subject = subject
+        self.sender = _intern(sender)
+        self.to = _intern(to)
+        self.date = date
+        self.read = read
+        self.folder = _intern(folder)
+        self.uidvalidity = uidvalidity
+        self.references = tuple(references or ())
+        self._attachments = tuple((_intern(name), _intern(content_type)) for name, content_type in attachments)
+        self._body = body
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EmailRecord":
+        """Build a record from an email dictionary"""
+        return cls(
+            id=data.get("id"),
+            message_id=data.get("message_id"),
+            subject=data.get("subject") or "",
+            sender=data.get("from") or "",
+            to=data.get("to") or "",
+            date=data.get("date"),
+            read=bool(data.get("read")),
+            folder=data.get("folder") or "",
+            attachments=[(item.get("filename"), item.get("content_type"))
+                         for item in data.get("attachments") or []],
+            body=data.get("body") or "",
+            references=data.get("references") or (),
+            uidvalidity=data.get("uidvalidity")
+        )
+
+    @property
+    def body(self) -> str:
+        if isinstance(self._body, LazyBody):
+            self._body = self._body.decode()
+        return self._body
+
+    @property
+    def is_decoded(self) -> bool:
+        """Whether the body text has been decoded"""
+        return not isinstance(self._body, LazyBody)
+
+    @property
+    def has_attachments(self) -> bool:
+        return bool(self._attachments)
+
+    @property
+    def attachments(self) -> List[Dict[str, Any]]:
+        return [{"filename": name, "content_type": content_type}
+                for name, content_type in self._attachments]
+
+    def __getitem__(self, key: str):
+        if key == "from":
+            return self.sender
+        if key == "references":
+            return list(self.references)
+        if key in self.FIELDS or key in ("body", "attachments"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS or key in ("body", "attachments")
+
+    def get(self, key: str, default: Any = None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def keys(self):
+        return list(self.FIELDS) + ["body", "attachments"]
+
+    def to_dict(self, include_body: bool = True) -> Dict[str, Any]:
+        """
+        Convert to a plain dictionary for JSON serialization
+
+        Args:
+            include_body: Include the body (decoding it if needed)
+
+        Returns:
+            Email dictionary
+        """
+        result = {field: self[field] for field in self.FIELDS}
+        result["attachments"] = self.attachments
+        if include_body:
+            result["body"] = self.body
+        return result
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(id={self.id!r}, subject={self.subject!r})"
+
+
+class EmailEnvelope(EmailRecord):
+    """
+    Header-only view of an email with lazily loaded body and attachments
+
+    Created from a header/BODYSTRUCTURE fetch, so listing does not move
+    message bodies. The first access to body or attachments downloads the
+    full message through the loader callback, which is bound to the folder
+    and UIDVALIDITY the envelope was listed from. A body that cannot be
+    loaded raises MessageUnavailableError instead of reading as empty.
+
+    Supports read-only dictionary access (email["subject"]) so it can be
+    used wherever the email records returned by fetch_email are.
+    """
+
+    FIELDS = ("id", "message_id", "subject", "from", "to", "date",
+              "read", "flags", "size", "has_attachments", "folder", "uidvalidity", "references")
+
+    __slots__ = ("flags", "size", "_loader", "_full")
+
+    def __init__(self, data: Dict[str, Any], loader: Optional[Callable[[], Any]] = None):
+        """
+        Initialize the envelope
+
+        Args:
+            data: Envelope fields (see FIELDS), plus optional attachment_names
+            loader: Callable returning the full email (record or dictionary),
+                raising MessageUnavailableError if it cannot
+        """
+        super().__init__(
+            id=data.get("id"),
+            message_id=data.get("message_id"),
+            subject=data.get("subject"),
+            sender=data.get("from"),
+            to=data.get("to"),
+            date=data.get("date"),
+            read=data.get("read"),
+            folder=data.get("folder"),
+            attachments=data.get("attachment_names") or (),
+            body=None,
+            references=data.get("references") or (),
+            uidvalidity=data.get("uidvalidity")
+        )
+        self.flags = tuple(_intern(flag) for flag in data.get("flags") or ())
+        self.size = data.get("size")
+        self._loader = loader
+        self._full = None
+
+    def _load(self):
+        if self._full is None:
+            # A failed load is not remembered, the next access tries again
+            self._full = (self._loader() if self._loader else None) or {}
+        return self._full
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the body has been downloaded"""
+        return self._full is not None
+
+    @property
+    def body(self) -> str:
+        return self._load().get("body", "")
+
+    @property
+    def attachments(self) -> List[Dict[str, Any]]:
+        full = self._load()
+        if "attachments" in full:
+            return full["attachments"]
+        return super().attachments
+
+    def __getitem__(self, key: str):
+        if key == "flags":
+            return list(self.flags)
+        return super().__getitem__(key)
+
+    def to_dict(self, include_body: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Convert to a plain dictionary for JSON serialization
+
+        Args:
+            include_body: Include body and attachments; by default they are
+                only included when already loaded, so serializing never
+                triggers a download
+
+        Returns:
+            Email dictionary
+        """
+        result = {field: self[field] for field in self.FIELDS}
+        result["attachments"] = EmailRecord.attachments.fget(self)
+        if include_body or (include_body is None and self.is_loaded):
+            result["body"] = self.body
+            result["attachments"] = self.attachments
+        return result
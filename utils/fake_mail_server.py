@@ -0,0 +1,899 @@
+"""
+In-process fake IMAP and SMTP servers for the MailoBot tests
+
+Each server runs on a background thread on a free localhost port and keeps
+its mailboxes (or received messages) in plain Python objects the tests can
+inspect and change directly. Only the protocol the mail code uses is
+implemented, but extensions are strict: commands of an extension that is
+not advertised (UID EXPUNGE without UIDPLUS, UID MOVE without MOVE) or not
+enabled (VANISHED without ENABLE QRESYNC) are rejected like a real server
+would reject them.
+
+Example:
+    server = FakeIMAPServer(capabilities=FakeIMAPServer.DEFAULT_CAPABILITIES + ("QRESYNC",))
+    server.start()
+    server.mailbox("INBOX").add(make_message(1))
+    mcp = EmailMCP(server.settings())
+    ...
+    server.stop()
+"""
+import email
+import re
+import socketserver
+import threading
+from email.message import Message
+from email.utils import formatdate
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+
+_ATOM_RE = re.compile(rb'[^\s()"{\[\]\x00]+(?:\[[^\]]*\](?:<[\d.]+>)?)?')
+_LITERAL_RE = re.compile(rb'\{(\d+)\+?\}$')
+
+
+def make_message(number: int, subject: Optional[str] = None, body: Optional[str] = None,
+                 sender: Optional[str] = None, message_id: Optional[str] = None,
+                 references: Optional[List[str]] = None, attachment: bool = False) -> bytes:
+    """
+    Build a small RFC 822 message
+
+    Args:
+        number: Distinguishes the defaults (subject, sender, Message-ID, date)
+        subject: Subject header
+        body: Plain text body
+        sender: From address
+        message_id: Message-ID header
+        references: Ancestor Message-IDs, oldest first
+        attachment: Add a small base64 attachment
+
+    Returns:
+        Raw message with CRLF line breaks
+    """
+    headers = [
+        f"From: Sender {number} <{sender or f'sender{number}@example.com'}>",
+        "To: me@example.com",
+        f"Subject: {subject or f'Message {number}'}",
+        f"Date: {formatdate(1700000000 + number * 60)}",
+        f"Message-ID: {message_id or f'<message{number}@example.com>'}",
+        "MIME-Version: 1.0"
+    ]
+    if references:
+        headers.append(f"In-Reply-To: {references[-1]}")
+        headers.append(f"References: {' '.join(references)}")
+    text = body if body is not None else f"Body of message {number}"
+
+    if attachment:
+        headers.append('Content-Type: multipart/mixed; boundary="part-boundary"')
+        lines = headers + ["", "--part-boundary", "Content-Type: text/plain; charset=utf-8", "", text,
+                           "--part-boundary", "Content-Type: application/octet-stream",
+                           'Content-Disposition: attachment; filename="data.bin"',
+                           "Content-Transfer-Encoding: base64", "", "AAECAwQFBgc=", "--part-boundary--", ""]
+    else:
+        headers.append("Content-Type: text/plain; charset=utf-8")
+        lines = headers + ["", text, ""]
+    return "\r\n".join(lines).encode("utf-8")
+
+
+class FakeMessage:
+    """A message stored in a fake mailbox"""
+
+    def __init__(self, uid: int, raw: bytes, flags: Iterable[str], modseq: int):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags)
+        self.modseq = modseq
+
+
+class FakeMailbox:
+    """Messages of a fake folder with their UIDs and modification sequences"""
+
+    def __init__(self, name: str, uidvalidity: int = 1000, special_use: Optional[str] = None):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.special_use = special_use
+        self.messages: List[FakeMessage] = []
+        self.uidnext = 1
+        self.highestmodseq = 1
+        # UID -> modseq of its expunge, reported as VANISHED under QRESYNC
+        self.expunged: Dict[int, int] = {}
+
+    def add(self, raw: bytes, flags: Iterable[str] = ()) -> int:
+        """Append a message and return its UID"""
+        self.highestmodseq += 1
+        uid = self.uidnext
+        self.messages.append(FakeMessage(uid, raw, flags, self.highestmodseq))
+        self.uidnext += 1
+        return uid
+
+    def uids(self) -> List[int]:
+        return [message.uid for message in self.messages]
+
+    def get(self, uid: int) -> Optional[FakeMessage]:
+        return next((message for message in self.messages if message.uid == uid), None)
+
+    def set_flags(self, uid: int, flags: Iterable[str], add: bool = True):
+        """Change flags as another client would, bumping the modseq"""
+        message = self.get(uid)
+        if add:
+            message.flags |= set(flags)
+        else:
+            message.flags -= set(flags)
+        self.highestmodseq += 1
+        message.modseq = self.highestmodseq
+
+    def expunge(self, uids: Optional[Iterable[int]] = None) -> List[int]:
+        """
+        Remove messages as another client would
+
+        Args:
+            uids: UIDs to remove (every message flagged \\Deleted if None)
+
+        Returns:
+            UIDs removed
+        """
+        if uids is None:
+            selected = {message.uid for message in self.messages if "\\Deleted" in message.flags}
+        else:
+            selected = set(uids)
+        removed = [message.uid for message in self.messages if message.uid in selected]
+        if removed:
+            self.highestmodseq += 1
+            for uid in removed:
+                self.expunged[uid] = self.highestmodseq
+            self.messages = [message for message in self.messages if message.uid not in selected]
+        return removed
+
+    def reset_uidvalidity(self):
+        """Renumber the folder, as after a server-side rebuild"""
+        self.uidvalidity += 1
+        self.expunged = {}
+
+
+def parse_arguments(data: bytes, literals: Optional[List[bytes]] = None) -> List[Any]:
+    """
+    Split IMAP command arguments into atoms, quoted strings and nested lists
+
+    Atoms are returned as str, quoted strings and literals as bytes,
+    parenthesized lists as lists.
+
+    Args:
+        data: Arguments, every literal replaced by a NUL byte
+        literals: Contents of the literals in order
+    """
+    literals = list(literals or ())
+    stack: List[List[Any]] = [[]]
+    position = 0
+    while position < len(data):
+        char = data[position:position + 1]
+        if char.isspace():
+            position += 1
+        elif char == b'(':
+            stack.append([])
+            position += 1
+        elif char == b')':
+            items = stack.pop()
+            stack[-1].append(items)
+            position += 1
+        elif char == b'"':
+            end = position + 1
+            value = b""
+            while data[end:end + 1] != b'"':
+                if data[end:end + 1] == b'\\':
+                    end += 1
+                value += data[end:end + 1]
+                end += 1
+            stack[-1].append(value)
+            position = end + 1
+        elif char == b'\x00':
+            stack[-1].append(literals.pop(0))
+            position += 1
+        else:
+            match = _ATOM_RE.match(data, position)
+            stack[-1].append(match.group(0).decode("ascii"))
+            position = match.end()
+    return stack[0]
+
+
+def _keywords(value: Any) -> Any:
+    """Upper-case the atoms of parsed arguments (keywords are case-insensitive)"""
+    if isinstance(value, list):
+        return [_keywords(item) for item in value]
+    return value.upper() if isinstance(value, str) else value
+
+
+def _expand_uid_set(spec: str, uids: List[int]) -> List[int]:
+    """UIDs of a mailbox named by a sequence set such as 1:3,7,9:*"""
+    largest = max(uids) if uids else 0
+    wanted = set()
+    ranges = []
+    for part in spec.split(","):
+        low, _, high = part.partition(":")
+        low_value = largest if low == "*" else int(low)
+        high_value = low_value if not high else (largest if high == "*" else int(high))
+        ranges.append((min(low_value, high_value), max(low_value, high_value)))
+    for uid in uids:
+        if any(low <= uid <= high for low, high in ranges):
+            wanted.add(uid)
+    return sorted(wanted)
+
+
+def _compress_uids(uids: Iterable[int]) -> str:
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(low) if low == high else f"{low}:{high}" for low, high in ranges)
+
+
+def _literal(value: bytes) -> bytes:
+    return b"{%d}\r\n" % len(value) + value
+
+
+def _bodystructure(part: Message) -> bytes:
+    if part.is_multipart():
+        children = b"".join(_bodystructure(child) for child in part.get_payload())
+        return b"(" + children + b' "' + part.get_content_subtype().upper().encode() + b'")'
+    payload = part.get_payload().encode("utf-8")
+    charset = (part.get_content_charset() or "us-ascii").encode()
+    encoding = str(part.get("Content-Transfer-Encoding") or "7BIT").upper().encode()
+    fields = (b'"' + part.get_content_maintype().upper().encode() + b'" "'
+              + part.get_content_subtype().upper().encode() + b'" ("CHARSET" "' + charset
+              + b'") NIL NIL "' + encoding + b'" ' + str(len(payload)).encode())
+    if part.get_content_maintype() == "text":
+        fields += b" " + str(payload.count(b"\n")).encode()
+    filename = part.get_filename()
+    if filename:
+        fields += b' NIL ("ATTACHMENT" ("FILENAME" "' + filename.encode() + b'")) NIL'
+    return b"(" + fields + b")"
+
+
+def _section(raw: bytes, section: str) -> bytes:
+    """Content of a BODY[section] of a message"""
+    header, _, text = raw.partition(b"\r\n\r\n")
+    if section == "":
+        return raw
+    if section == "HEADER":
+        return header + b"\r\n\r\n"
+    if section == "TEXT":
+        return text
+    match = re.match(r'HEADER\.FIELDS \(([^)]*)\)', section)
+    if match:
+        wanted = set(match.group(1).upper().split())
+        message = email.message_from_bytes(raw)
+        lines = [f"{name}: {value}" for name, value in message.items() if name.upper() in wanted]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+    part = email.message_from_bytes(raw)
+    for number in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+    return part.get_payload().encode("utf-8")
+
+
+class _IMAPSession(socketserver.StreamRequestHandler):
+    """One client connection of the fake IMAP server"""
+
+    def handle(self):
+        self.state: "FakeIMAPServer" = self.server.fake
+        self.selected: Optional[FakeMailbox] = None
+        self.readonly = False
+        self.enabled = set()
+        self.known_messages = 0
+        with self.state.lock:
+            self.state.connections += 1
+        self.send(b"* OK fake IMAP server ready\r\n")
+        while True:
+            command_line = self.read_command()
+            if command_line is None:
+                return
+            line, literals = command_line
+            tag, _, rest = line.partition(b" ")
+            name, _, arguments = rest.partition(b" ")
+            command = name.decode("ascii", errors="replace").upper()
+            if command == "UID":
+                name, _, arguments = arguments.partition(b" ")
+                command = "UID " + name.decode("ascii", errors="replace").upper()
+            with self.state.lock:
+                self.state.log.append(f"{command} {arguments.decode('utf-8', errors='replace')}".strip())
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            tag = tag.decode("ascii", errors="replace")
+            if handler is None:
+                self.send(f"{tag} BAD unknown command {command}\r\n")
+                continue
+            try:
+                with self.state.lock:
+                    done = handler(tag, parse_arguments(arguments, literals))
+            except Exception as e:
+                self.send(f"{tag} BAD {type(e).__name__}: {e}\r\n")
+                continue
+            if done:
+                return
+
+    def read_command(self) -> Optional[Tuple[bytes, List[bytes]]]:
+        """Read a command line and its literals, sending continuations for them"""
+        line = self.rfile.readline()
+        if not line:
+            return None
+        line = line.rstrip(b"\r\n")
+        literals = []
+        while True:
+            match = _LITERAL_RE.search(line)
+            if not match:
+                break
+            if not match.group(0).endswith(b"+}"):
+                self.send(b"+ ready\r\n")
+            literals.append(self.rfile.read(int(match.group(1))))
+            # The literal is replaced by a NUL byte in the parsed line
+            line = line[:match.start()] + b"\x00" + self.rfile.readline().rstrip(b"\r\n")
+        return line, literals
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def require(self, capability: str):
+        if capability not in self.state.capabilities:
+            raise ValueError(f"{capability} not supported")
+
+    def require_selected(self) -> FakeMailbox:
+        if self.selected is None:
+            raise ValueError("no mailbox selected")
+        return self.selected
+
+    # Connection state
+
+    def do_CAPABILITY(self, tag, arguments):
+        self.send(f"* CAPABILITY {' '.join(self.state.capabilities)}\r\n{tag} OK done\r\n")
+
+    def do_LOGIN(self, tag, arguments):
+        self.state.logins += 1
+        self.send(f"{tag} OK logged in\r\n")
+
+    def do_LOGOUT(self, tag, arguments):
+        self.send(f"* BYE logging out\r\n{tag} OK bye\r\n")
+        return True
+
+    def do_NOOP(self, tag, arguments):
+        if self.selected is not None and len(self.selected.messages) != self.known_messages:
+            self.known_messages = len(self.selected.messages)
+            self.send(f"* {self.known_messages} EXISTS\r\n")
+        self.send(f"{tag} OK noop\r\n")
+
+    def do_ENABLE(self, tag, arguments):
+        self.require("ENABLE")
+        enabled = [name for name in _keywords(arguments) if name in self.state.capabilities]
+        self.enabled.update(enabled)
+        if "QRESYNC" in enabled:
+            self.enabled.add("CONDSTORE")
+        self.send(f"* ENABLED {' '.join(enabled)}\r\n{tag} OK enabled\r\n")
+
+    # Mailboxes
+
+    def do_SELECT(self, tag, arguments, readonly=False):
+        name = _mailbox_name(arguments[0])
+        mailbox = self.state.mailboxes.get(name)
+        if mailbox is None:
+            self.selected = None
+            self.send(f"{tag} NO no such mailbox\r\n")
+            return
+        self.selected = mailbox
+        self.readonly = readonly
+        self.known_messages = len(mailbox.messages)
+        self.send(f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n"
+                  f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+                  f"* OK [UIDNEXT {mailbox.uidnext}] next UID\r\n"
+                  f"* OK [HIGHESTMODSEQ {mailbox.highestmodseq}] modseq\r\n"
+                  f"{tag} OK [{'READ-ONLY' if readonly else 'READ-WRITE'}] selected\r\n")
+
+    def do_EXAMINE(self, tag, arguments):
+        self.do_SELECT(tag, arguments, readonly=True)
+
+    def do_STATUS(self, tag, arguments):
+        name = _mailbox_name(arguments[0])
+        mailbox = self.state.mailboxes.get(name)
+        if mailbox is None:
+            self.send(f"{tag} NO no such mailbox\r\n")
+            return
+        values = {
+            "MESSAGES": len(mailbox.messages),
+            "RECENT": 0,
+            "UNSEEN": sum(1 for message in mailbox.messages if "\\Seen" not in message.flags),
+            "UIDNEXT": mailbox.uidnext,
+            "UIDVALIDITY": mailbox.uidvalidity,
+            "HIGHESTMODSEQ": mailbox.highestmodseq
+        }
+        items = " ".join(f"{item} {values[item]}" for item in _keywords(arguments[1]))
+        self.send(f'* STATUS "{name}" ({items})\r\n{tag} OK status\r\n')
+
+    def do_LIST(self, tag, arguments):
+        lines = ""
+        for mailbox in self.state.mailboxes.values():
+            flags = " ".join(filter(None, ["\\HasNoChildren", mailbox.special_use]))
+            lines += f'* LIST ({flags}) "/" "{mailbox.name}"\r\n'
+        self.send(lines + f"{tag} OK list\r\n")
+
+    def do_APPEND(self, tag, arguments):
+        mailbox = self.state.mailboxes.get(_mailbox_name(arguments[0]))
+        if mailbox is None:
+            self.send(f"{tag} NO [TRYCREATE] no such mailbox\r\n")
+            return
+        flags = next((item for item in arguments[1:-1] if isinstance(item, list)), [])
+        uid = mailbox.add(arguments[-1], flags)
+        code = f"[APPENDUID {mailbox.uidvalidity} {uid}] " if "UIDPLUS" in self.state.capabilities else ""
+        self.send(f"{tag} OK {code}appended\r\n")
+
+    # Searching
+
+    def do_SEARCH(self, tag, arguments):
+        mailbox = self.require_selected()
+        matches = self.search(arguments)
+        sequence = [number for number, message in enumerate(mailbox.messages, 1) if message.uid in matches]
+        self.send(f"* SEARCH {' '.join(map(str, sequence))}".rstrip() + f"\r\n{tag} OK search\r\n")
+
+    def do_UID_SEARCH(self, tag, arguments):
+        self.require_selected()
+        arguments = _keywords(arguments)
+        returns = None
+        if arguments and arguments[0] == "RETURN":
+            self.require("ESEARCH")
+            returns, arguments = arguments[1], arguments[2:]
+            if "PARTIAL" in returns:
+                self.require("PARTIAL")
+        matches = self.search(arguments)
+        if returns is None:
+            self.send(f"* SEARCH {' '.join(map(str, matches))}".rstrip() + f"\r\n{tag} OK search\r\n")
+        else:
+            self.send_esearch(tag, returns, matches)
+
+    def do_UID_SORT(self, tag, arguments):
+        self.require("SORT")
+        self.require_selected()
+        arguments = _keywords(arguments)
+        returns = None
+        if arguments and arguments[0] == "RETURN":
+            self.require("ESORT")
+            returns, arguments = arguments[1], arguments[2:]
+            if "PARTIAL" in returns:
+                self.require("CONTEXT=SORT")
+        keys, arguments = arguments[0], arguments[2:]
+        matches = self.search(arguments)
+        if "REVERSE" in keys:
+            matches.reverse()
+        if returns is None:
+            self.send(f"* SORT {' '.join(map(str, matches))}".rstrip() + f"\r\n{tag} OK sort\r\n")
+        else:
+            self.send_esearch(tag, returns, matches, ordered=True)
+
+    def send_esearch(self, tag, returns, matches: List[int], ordered: bool = False):
+        """Send an ESEARCH response; ordered (SORT) results are listed in their order, not as ranges"""
+        def uid_set(uids):
+            return ",".join(map(str, uids)) if ordered else _compress_uids(uids)
+
+        parts = []
+        for position, item in enumerate(returns):
+            if item == "COUNT":
+                parts.append(f"COUNT {len(matches)}")
+            elif item == "MIN" and matches:
+                parts.append(f"MIN {min(matches)}")
+            elif item == "MAX" and matches:
+                parts.append(f"MAX {max(matches)}")
+            elif item == "ALL" and matches:
+                parts.append(f"ALL {uid_set(matches)}")
+            elif item == "PARTIAL":
+                window = returns[position + 1]
+                low, high = (int(value) for value in re.match(r'(-?\d+):(-?\d+)$', window).groups())
+                first, last = sorted((abs(low), abs(high)))
+                if low < 0:
+                    # Negative positions count back from the last match
+                    selected = matches[max(0, len(matches) - last):len(matches) - first + 1]
+                else:
+                    selected = matches[first - 1:last]
+                parts.append(f"PARTIAL ({window} {uid_set(selected) or 'NIL'})")
+        self.send(f'* ESEARCH (TAG "{tag}") UID {" ".join(parts)}'.rstrip() + f"\r\n{tag} OK search\r\n")
+
+    def search(self, arguments: List[Any]) -> List[int]:
+        """UIDs of the selected mailbox matching search keys, in UID order"""
+        mailbox = self.require_selected()
+        keys = _keywords(arguments)
+        if keys and keys[0] == "CHARSET":
+            keys = keys[2:]
+        return [message.uid for message in mailbox.messages if self.matches(message, keys, mailbox)]
+
+    def matches(self, message: FakeMessage, keys: List[Any], mailbox: FakeMailbox) -> bool:
+        keys = list(keys)
+        while keys:
+            if not self.match_key(message, keys, mailbox):
+                return False
+        return True
+
+    def match_key(self, message: FakeMessage, keys: List[Any], mailbox: FakeMailbox) -> bool:
+        """Evaluate (and consume) the first search key"""
+        key = keys.pop(0)
+        if isinstance(key, list):
+            return self.matches(message, key, mailbox)
+        if key == "ALL":
+            return True
+        if key == "NOT":
+            return not self.match_key(message, keys, mailbox)
+        if key == "OR":
+            first = self.match_key(message, keys, mailbox)
+            second = self.match_key(message, keys, mailbox)
+            return first or second
+        flag_keys = {"SEEN": "\\Seen", "DELETED": "\\Deleted", "FLAGGED": "\\Flagged",
+                     "ANSWERED": "\\Answered", "DRAFT": "\\Draft"}
+        if key in flag_keys:
+            return flag_keys[key] in message.flags
+        if key.startswith("UN") and key[2:] in flag_keys:
+            return flag_keys[key[2:]] not in message.flags
+        if key == "UID":
+            return message.uid in _expand_uid_set(keys.pop(0), mailbox.uids())
+        parsed = email.message_from_bytes(message.raw)
+        if key == "HEADER":
+            name, value = keys.pop(0), _text(keys.pop(0))
+            return value.lower() in str(parsed.get(name, "")).lower()
+        if key in ("FROM", "TO", "SUBJECT"):
+            return _text(keys.pop(0)).lower() in str(parsed.get(key, "")).lower()
+        if key in ("BODY", "TEXT"):
+            return _text(keys.pop(0)).lower().encode() in message.raw.lower()
+        if key in ("SINCE", "BEFORE", "ON", "LARGER", "SMALLER", "MODSEQ"):
+            keys.pop(0)
+            return True
+        raise ValueError(f"unsupported search key {key}")
+
+    # Fetching and changing messages
+
+    def do_FETCH(self, tag, arguments):
+        mailbox = self.require_selected()
+        numbers = _expand_uid_set(arguments[0], list(range(1, len(mailbox.messages) + 1)))
+        uids = _compress_uids(mailbox.messages[number - 1].uid for number in numbers)
+        self.do_UID_FETCH(tag, [uids or "0"] + arguments[1:])
+
+    def do_UID_FETCH(self, tag, arguments):
+        mailbox = self.require_selected()
+        wanted = set(_expand_uid_set(arguments[0], mailbox.uids()))
+        items = _keywords(arguments[1] if isinstance(arguments[1], list) else [arguments[1]])
+        changed_since = None
+        vanished = False
+        if len(arguments) > 2:
+            modifiers = _keywords(arguments[2])
+            if "CHANGEDSINCE" in modifiers:
+                self.require("CONDSTORE")
+                changed_since = int(modifiers[modifiers.index("CHANGEDSINCE") + 1])
+            if "VANISHED" in modifiers:
+                if "QRESYNC" not in self.enabled or changed_since is None:
+                    raise ValueError("VANISHED requires an enabled QRESYNC and CHANGEDSINCE")
+                vanished = True
+
+        response = b""
+        if vanished:
+            low, high = _uid_set_bounds(arguments[0], mailbox)
+            gone = [uid for uid, modseq in mailbox.expunged.items()
+                    if modseq > changed_since and low <= uid <= high]
+            if gone:
+                response += f"* VANISHED (EARLIER) {_compress_uids(gone)}\r\n".encode()
+        for number, message in enumerate(mailbox.messages, 1):
+            if message.uid not in wanted:
+                continue
+            if changed_since is not None and message.modseq <= changed_since:
+                continue
+            response += b"* %d FETCH (" % number + self.fetch_items(message, items) + b")\r\n"
+        self.send(response + f"{tag} OK fetch\r\n".encode())
+
+    def fetch_items(self, message: FakeMessage, items: List[str]) -> bytes:
+        """FETCH response items of a message; UID is always included, FLAGS also when \\Seen is set"""
+        parts = [b"UID %d" % message.uid]
+        sets_seen = False
+        for item in items:
+            if item in ("UID", "FLAGS"):
+                continue
+            if item == "MODSEQ":
+                parts.append(b"MODSEQ (%d)" % message.modseq)
+            elif item == "RFC822.SIZE":
+                parts.append(b"RFC822.SIZE %d" % len(message.raw))
+            elif item == "INTERNALDATE":
+                parts.append(b'INTERNALDATE "01-Jan-2024 00:00:00 +0000"')
+            elif item == "BODYSTRUCTURE":
+                parts.append(b"BODYSTRUCTURE " + _bodystructure(email.message_from_bytes(message.raw)))
+            elif item == "RFC822":
+                parts.append(b"RFC822 " + _literal(message.raw))
+                sets_seen = True
+            elif item.startswith("BODY"):
+                match = re.match(r'BODY(\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?$', item)
+                data = _section(message.raw, match.group(2))
+                name = f"BODY[{match.group(2)}]"
+                if match.group(3) is not None:
+                    offset = int(match.group(3))
+                    data = data[offset:offset + int(match.group(4))]
+                    name += f"<{offset}>"
+                parts.append(name.encode() + b" " + _literal(data))
+                sets_seen = sets_seen or not match.group(1)
+            else:
+                raise ValueError(f"unsupported fetch item {item}")
+        if sets_seen and not self.readonly and "\\Seen" not in message.flags:
+            message.flags.add("\\Seen")
+            self.selected.highestmodseq += 1
+            message.modseq = self.selected.highestmodseq
+        if "FLAGS" in items or sets_seen:
+            parts.insert(1, b"FLAGS (" + " ".join(sorted(message.flags)).encode() + b")")
+        return b" ".join(parts)
+
+    def do_STORE(self, tag, arguments):
+        mailbox = self.require_selected()
+        numbers = _expand_uid_set(arguments[0], list(range(1, len(mailbox.messages) + 1)))
+        uids = _compress_uids(mailbox.messages[number - 1].uid for number in numbers)
+        self.do_UID_STORE(tag, [uids or "0"] + arguments[1:])
+
+    def do_UID_STORE(self, tag, arguments):
+        mailbox = self.require_selected()
+        if self.readonly:
+            raise ValueError("mailbox is read-only")
+        wanted = set(_expand_uid_set(arguments[0], mailbox.uids()))
+        operation = arguments[1].upper()
+        flags = set(arguments[2] if isinstance(arguments[2], list) else [arguments[2]])
+        response = ""
+        for number, message in enumerate(mailbox.messages, 1):
+            if message.uid not in wanted:
+                continue
+            if operation.startswith("+"):
+                message.flags |= flags
+            elif operation.startswith("-"):
+                message.flags -= flags
+            else:
+                message.flags = set(flags)
+            mailbox.highestmodseq += 1
+            message.modseq = mailbox.highestmodseq
+            if not operation.endswith(".SILENT"):
+                response += f"* {number} FETCH (UID {message.uid} FLAGS ({' '.join(sorted(message.flags))}))\r\n"
+        self.send(response + f"{tag} OK store\r\n")
+
+    def do_UID_COPY(self, tag, arguments):
+        mailbox = self.require_selected()
+        target = self.state.mailboxes.get(_mailbox_name(arguments[1]))
+        if target is None:
+            self.send(f"{tag} NO [TRYCREATE] no such mailbox\r\n")
+            return
+        for message in mailbox.messages:
+            if message.uid in _expand_uid_set(arguments[0], mailbox.uids()):
+                target.add(message.raw, message.flags)
+        self.send(f"{tag} OK copied\r\n")
+
+    def do_UID_MOVE(self, tag, arguments):
+        self.require("MOVE")
+        mailbox = self.require_selected()
+        target = self.state.mailboxes.get(_mailbox_name(arguments[1]))
+        if target is None:
+            self.send(f"{tag} NO [TRYCREATE] no such mailbox\r\n")
+            return
+        selected = _expand_uid_set(arguments[0], mailbox.uids())
+        for uid in selected:
+            message = mailbox.get(uid)
+            target.add(message.raw, message.flags)
+        mailbox.expunge(selected)
+        self.known_messages = len(mailbox.messages)
+        self.send(f"{tag} OK moved\r\n")
+
+    def do_EXPUNGE(self, tag, arguments):
+        mailbox = self.require_selected()
+        mailbox.expunge()
+        self.known_messages = len(mailbox.messages)
+        self.send(f"{tag} OK expunged\r\n")
+
+    def do_UID_EXPUNGE(self, tag, arguments):
+        self.require("UIDPLUS")
+        mailbox = self.require_selected()
+        selected = set(_expand_uid_set(arguments[0], mailbox.uids()))
+        mailbox.expunge([message.uid for message in mailbox.messages
+                         if message.uid in selected and "\\Deleted" in message.flags])
+        self.known_messages = len(mailbox.messages)
+        self.send(f"{tag} OK expunged\r\n")
+
+
+def _mailbox_name(value: Any) -> str:
+    name = value.decode("utf-8") if isinstance(value, bytes) else str(value)
+    return "INBOX" if name.upper() == "INBOX" else name
+
+
+def _text(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+
+def _uid_set_bounds(spec: str, mailbox: FakeMailbox) -> Tuple[int, int]:
+    largest = max([mailbox.uidnext - 1] + list(mailbox.expunged))
+    bounds = []
+    for part in spec.split(","):
+        for value in part.split(":"):
+            bounds.append(largest if value == "*" else int(value))
+    return min(bounds), max(bounds)
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeIMAPServer:
+    """
+    Fake IMAP server with INBOX, Drafts, Sent, Archive and Trash folders
+
+    Attributes:
+        mailboxes: Folder name -> FakeMailbox
+        capabilities: Advertised capabilities
+        log: Commands received ("UID FETCH 1:3 (UID FLAGS)"), oldest first
+    """
+
+    DEFAULT_CAPABILITIES = ("IMAP4rev1", "UIDPLUS", "MOVE", "SPECIAL-USE",
+                            "CONDSTORE", "ESEARCH", "SORT", "ENABLE")
+
+    def __init__(self, capabilities: Iterable[str] = DEFAULT_CAPABILITIES, username: str = "user"):
+        """
+        Initialize the server
+
+        Args:
+            capabilities: Advertised capabilities
+            username: Login name placed in settings()
+        """
+        self.capabilities = tuple(capabilities)
+        self.username = username
+        self.lock = threading.RLock()
+        self.log: List[str] = []
+        self.logins = 0
+        self.connections = 0
+        self.mailboxes: Dict[str, FakeMailbox] = {}
+        for name, special_use in (("INBOX", None), ("Drafts", "\\Drafts"), ("Sent", "\\Sent"),
+                                  ("Archive", "\\Archive"), ("Trash", "\\Trash")):
+            self.mailboxes[name] = FakeMailbox(name, special_use=special_use)
+        self._server: Optional[_ThreadingServer] = None
+
+    def start(self) -> "FakeIMAPServer":
+        """Start serving on a free localhost port"""
+        self._server = _ThreadingServer(("127.0.0.1", 0), _IMAPSession)
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), name="fake-imap", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def mailbox(self, name: str) -> FakeMailbox:
+        return self.mailboxes[name]
+
+    def commands(self, name: str) -> List[str]:
+        """Logged commands starting with name, e.g. commands("UID EXPUNGE")"""
+        with self.lock:
+            return [line for line in self.log if line == name or line.startswith(name + " ")]
+
+    def settings(self, **overrides) -> Dict[str, Any]:
+        """
+        Email settings for this server
+
+        The username includes the port so every server is its own account
+        in the process-wide caches. Local caches are disabled; tests attach
+        stores under a temporary directory where they need them.
+        """
+        settings = {
+            "host": "127.0.0.1",
+            "port": self.port,
+            "username": f"{self.username}{self.port}",
+            "password": "secret",
+            "tls": False,
+            "cache_messages": False,
+            "index_messages": False,
+            "index_threads": False
+        }
+        settings.update(overrides)
+        return settings
+
+
+class _SMTPSession(socketserver.StreamRequestHandler):
+    """One client connection of the fake SMTP server"""
+
+    def handle(self):
+        state: "FakeSMTPServer" = self.server.fake
+        with state.lock:
+            state.connections += 1
+        envelope: Dict[str, Any] = {"sender": None, "recipients": []}
+        self.reply("220 fake SMTP server ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            with state.lock:
+                state.log.append(verb)
+            if verb in ("EHLO", "HELO"):
+                self.wfile.write(b"250-fake\r\n250 AUTH PLAIN LOGIN\r\n")
+                self.wfile.flush()
+            elif verb == "AUTH":
+                self.reply("235 authenticated")
+            elif verb == "MAIL":
+                envelope = {"sender": command.split(":", 1)[1].strip(), "recipients": []}
+                self.reply("250 ok")
+            elif verb == "RCPT":
+                recipient = command.split(":", 1)[1].strip().strip("<>")
+                with state.lock:
+                    rejected = state.reject.get(recipient)
+                if rejected:
+                    self.reply(rejected)
+                else:
+                    envelope["recipients"].append(recipient)
+                    self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 end with .")
+                data = b""
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b".\r\n", b""):
+                        break
+                    data += data_line
+                with state.lock:
+                    state.messages.append(dict(envelope, data=data))
+                self.reply("250 queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 ok")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("500 unknown command")
+
+    def reply(self, text: str):
+        self.wfile.write(text.encode("utf-8") + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeSMTPServer:
+    """
+    Fake SMTP server that records the messages it accepts
+
+    Attributes:
+        messages: Accepted messages (sender, recipients, data)
+        reject: Recipient -> SMTP reply sent instead of accepting it,
+            e.g. {"nobody@example.com": "550 no such user"}
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages: List[Dict[str, Any]] = []
+        self.reject: Dict[str, str] = {}
+        self.log: List[str] = []
+        self.connections = 0
+        self._server: Optional[_ThreadingServer] = None
+
+    def start(self) -> "FakeSMTPServer":
+        """Start serving on a free localhost port"""
+        self._server = _ThreadingServer(("127.0.0.1", 0), _SMTPSession)
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), name="fake-smtp", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def settings(self, **overrides) -> Dict[str, Any]:
+        """Email settings sending through this server"""
+        settings = {
+            "host": "imap.example.com",
+            "username": f"user{self.port}",
+            "password": "secret",
+            "smtp_host": "127.0.0.1",
+            "smtp_port": self.port,
+            "tls": False
+        }
+        settings.update(overrides)
+        return settings
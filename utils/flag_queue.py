@@ -0,0 +1,220 @@
+"""
+Write-behind queue for IMAP flag changes
+
+Marking messages read/unread or flagged in quick succession (e.g. while a
+user pages through a folder) would otherwise cost one STORE round trip per
+click. Changes are queued per account and folder, coalesced (the last change
+of a flag on a UID wins) and flushed after a short delay as a few UID STORE
+commands over compressed UID sets. Every change remembers the UIDVALIDITY
+it was queued under and is dropped if the folder's UIDs were reset before
+it was sent. Queues are flushed when the process exits.
+"""
+import atexit
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+
+def _account_id(settings: Dict[str, Any]) -> str:
+    """Same identifier as EmailMCP.get_account_id()"""
+    return f"{settings.get('username', '')}@{settings.get('host', '')}"
+
+
+class FlagQueue:
+    """
+    Coalescing write-behind queue for the flag changes of one account
+
+    Example:
+        queue = get_flag_queue(settings)
+        queue.queue("INBOX", [101, 102], ["\\Seen"], add=True)
+        queue.queue("INBOX", [102], ["\\Seen"], add=False)   # replaces the change above
+        queue.flush()                                         # one STORE for UID 101
+    """
+
+    # Seconds changes are held back waiting for more changes to coalesce
+    DEFAULT_FLUSH_DELAY = 2.0
+
+    def __init__(self, settings: Dict[str, Any], flush_delay: float = DEFAULT_FLUSH_DELAY):
+        """
+        Initialize the queue
+
+        Args:
+            settings: Email settings of the account
+            flush_delay: Seconds to wait after the first queued change before flushing
+        """
+        self.settings = settings
+        self.flush_delay = flush_delay
+        # (folder, uidvalidity) -> uid -> flag -> add
+        self._pending: Dict[Tuple[str, Optional[int]], Dict[int, Dict[str, bool]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._stats = {
+            "queued": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "commands": 0,
+            "errors": 0,
+            "dropped": 0
+        }
+
+    def queue(self, folder: str, uids: List[Any], flags: List[str], add: bool = True,
+              uidvalidity: Optional[int] = None):
+        """
+        Queue a flag change and schedule a flush
+
+        Args:
+            folder: Folder the UIDs belong to
+            uids: Email UIDs
+            flags: Flags to change
+            add: Add the flags (True) or remove them (False)
+            uidvalidity: UIDVALIDITY the UIDs belong to; the change is dropped
+                if the folder reports another one when it is sent
+        """
+        with self._lock:
+            changes = self._pending.setdefault((folder, uidvalidity), {})
+            for uid in uids:
+                uid_flags = changes.setdefault(int(uid), {})
+                for flag in flags:
+                    if flag in uid_flags:
+                        self._stats["coalesced"] += 1
+                    uid_flags[flag] = add
+                    self._stats["queued"] += 1
+            self._schedule()
+
+    def pending_count(self) -> int:
+        """Number of queued (uid, flag) changes"""
+        with self._lock:
+            return sum(len(uid_flags) for changes in self._pending.values() for uid_flags in changes.values())
+
+    def flush(self) -> bool:
+        """
+        Send all queued changes now
+
+        Returns:
+            bool: True if every change was stored
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return True
+
+        # Serialize flushes so changes of the same UID are applied in order
+        with self._flush_lock:
+            return self._send(pending)
+
+    def close(self):
+        """Flush remaining changes and stop the timer"""
+        self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue counters plus the number of pending changes"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending"] = self.pending_count()
+        return stats
+
+    def _schedule(self):
+        """Start the flush timer unless one is running (called with the lock held)"""
+        if self._timer is None and self._pending:
+            self._timer = threading.Timer(self.flush_delay, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing flag changes: {e}")
+
+    def _send(self, pending: Dict[Tuple[str, Optional[int]], Dict[int, Dict[str, bool]]]) -> bool:
+        from utils.email_mcp import EmailMCP
+
+        mcp = EmailMCP(self.settings)
+        success = True
+        try:
+            if not mcp.connect():
+                self._requeue(pending)
+                return False
+
+            for (folder, uidvalidity), changes in pending.items():
+                # Group UIDs by (flag, add) so each group is a single STORE per chunk
+                groups: Dict[Tuple[str, bool], List[int]] = {}
+                for uid, uid_flags in changes.items():
+                    for flag, add in uid_flags.items():
+                        groups.setdefault((flag, add), []).append(uid)
+
+                if not mcp.select_folder(folder):
+                    self._requeue({(folder, uidvalidity): changes})
+                    success = False
+                    continue
+
+                if uidvalidity is not None and mcp.context.get("uidvalidity") != uidvalidity:
+                    # The UIDs now name other messages
+                    print(f"Dropping {len(changes)} flag changes of {folder}: UIDVALIDITY changed")
+                    with self._lock:
+                        self._stats["dropped"] += len(changes)
+                    continue
+
+                for (flag, add), uids in groups.items():
+                    stored = mcp.set_flags(sorted(uids), [flag], add=add)
+                    with self._lock:
+                        self._stats["commands"] += 1
+                        if not stored:
+                            self._stats["errors"] += 1
+                    success = success and stored
+
+            with self._lock:
+                self._stats["flushes"] += 1
+            return success
+        except Exception as e:
+            print(f"Error flushing flag changes: {e}")
+            self._requeue(pending)
+            return False
+        finally:
+            mcp.disconnect()
+
+    def _requeue(self, pending: Dict[Tuple[str, Optional[int]], Dict[int, Dict[str, bool]]]):
+        """Put changes that could not be sent back, keeping newer queued changes, and retry later"""
+        with self._lock:
+            self._stats["errors"] += 1
+            for key, changes in pending.items():
+                current = self._pending.setdefault(key, {})
+                for uid, uid_flags in changes.items():
+                    merged = dict(uid_flags)
+                    merged.update(current.get(uid, {}))
+                    current[uid] = merged
+            self._schedule()
+
+
+_queues: Dict[str, FlagQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_flag_queue(settings: Dict[str, Any]) -> FlagQueue:
+    """Get the process-wide flag queue of an account"""
+    account = _account_id(settings)
+    queue = _queues.get(account)
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(account)
+            if queue is None:
+                queue = FlagQueue(settings, float(settings.get('flag_flush_delay', FlagQueue.DEFAULT_FLUSH_DELAY)))
+                _queues[account] = queue
+    return queue
+
+
+def flush_all() -> bool:
+    """Flush the queues of all accounts (e.g. before shutdown)"""
+    with _queues_lock:
+        queues = list(_queues.values())
+    return all([queue.flush() for queue in queues])
+
+
+# Changes still held back when the app or action server stops are sent on exit
+atexit.register(flush_all)
@@ -0,0 +1,215 @@
+"""
+HTML to plain text conversion for MailoBot
+
+Single pass over the markup with html.parser: script, style and other
+non-content elements are dropped, entities are decoded, whitespace is
+collapsed and block elements become line breaks. Conversion stops as soon
+as the output limit is reached, so the tail of a huge marketing mail is
+never parsed. Results are memoized per message.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Dict, List, Any, Hashable, Optional
+
+# Maximum characters of text produced for one document
+DEFAULT_MAX_CHARS = 100000
+
+# Converted documents kept in the memo
+DEFAULT_CACHE_SIZE = 512
+
+# Markup is fed to the parser in slices of this size so conversion can stop early
+_FEED_SIZE = 16 * 1024
+
+# Elements whose content is never shown
+_SKIP_TAGS = frozenset(("script", "style", "head", "title", "noscript", "template", "svg", "object", "iframe"))
+
+# Elements that start a new line
+_BLOCK_TAGS = frozenset((
+    "address", "article", "aside", "blockquote", "br", "center", "dd", "div", "dl", "dt",
+    "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table", "tbody",
+    "tfoot", "thead", "tr", "ul"
+))
+
+# Elements separated from their neighbours by a space
+_CELL_TAGS = frozenset(("td", "th"))
+
+_SPACE_RE = re.compile(r'[ \t\r\f\v\u00a0]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of a document up to max_chars characters"""
+
+    def __init__(self, max_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.pieces: List[str] = []
+        self.length = 0
+        self.done = False
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            # Unclosed <head> content ends where the body starts
+            self._skip_depth = 0
+        elif tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self._newline()
+        elif tag in _CELL_TAGS:
+            self._space()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self._newline()
+
+    def handle_data(self, data):
+        if self._skip_depth or self.done:
+            return
+        text = _SPACE_RE.sub(' ', data.replace('\n', ' '))
+        if text.startswith(' ') and (not self.pieces or self.pieces[-1].endswith((' ', '\n'))):
+            text = text[1:]
+        if text:
+            self._append(text)
+
+    def _space(self):
+        if self.pieces and not self.pieces[-1].endswith((' ', '\n')):
+            self._append(' ')
+
+    def _newline(self):
+        if self.pieces and not self.pieces[-1].endswith('\n'):
+            self._append('\n')
+
+    def _append(self, text: str):
+        if self.done:
+            return
+        remaining = self.max_chars - self.length
+        if len(text) >= remaining:
+            text = text[:remaining]
+            self.done = True
+        self.pieces.append(text)
+        self.length += len(text)
+
+    def text(self) -> str:
+        lines = [line.strip() for line in ''.join(self.pieces).split('\n')]
+        return _BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def convert_html(html: str, max_chars: int = DEFAULT_MAX_CHARS, partial: bool = False) -> str:
+    """
+    Convert HTML to plain text without memoization
+
+    Args:
+        html: HTML document or fragment
+        max_chars: Stop once this many characters of text were produced
+        partial: The markup was cut off (e.g. a byte range), drop an unterminated trailing tag
+
+    Returns:
+        Plain text with one line per block element
+    """
+    parser = _TextExtractor(max_chars)
+    for start in range(0, len(html), _FEED_SIZE):
+        parser.feed(html[start:start + _FEED_SIZE])
+        if parser.done:
+            break
+    if not parser.done and not partial:
+        parser.close()
+    return parser.text()
+
+
+class HTMLTextCache:
+    """
+    Memo of converted documents, keyed per message
+
+    Example:
+        text = get_html_text_cache().convert(html, key=(account, folder, uidvalidity, uid))
+    """
+
+    def __init__(self, size: int = DEFAULT_CACHE_SIZE):
+        """
+        Initialize the memo
+
+        Args:
+            size: Converted documents kept (least recently used are evicted)
+        """
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def convert(self, html: str, key: Optional[Hashable] = None, max_chars: int = DEFAULT_MAX_CHARS,
+                partial: bool = False) -> str:
+        """
+        Convert HTML to plain text, reusing an earlier conversion of the same message
+
+        Args:
+            html: HTML document or fragment
+            key: Identifies the message (e.g. account, folder, UIDVALIDITY and UID);
+                the markup is hashed when no key is given
+            max_chars: Stop once this many characters of text were produced
+            partial: The markup was cut off, drop an unterminated trailing tag
+
+        Returns:
+            Plain text
+        """
+        if not html:
+            return ""
+        if key is None:
+            key = hashlib.sha1(html.encode('utf-8', errors='replace')).hexdigest()
+        cache_key = (key, max_chars, partial)
+
+        with self._lock:
+            text = self._entries.get(cache_key)
+            if text is not None:
+                self._entries.move_to_end(cache_key)
+                self._stats["hits"] += 1
+                return text
+            self._stats["misses"] += 1
+
+        text = convert_html(html, max_chars, partial)
+        with self._lock:
+            self._entries[cache_key] = text
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return text
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+_default_cache: Optional[HTMLTextCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_html_text_cache() -> HTMLTextCache:
+    """Get the process-wide HTML conversion memo"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = HTMLTextCache()
+    return _default_cache
+
+
+def html_to_text(html: str, key: Optional[Hashable] = None, max_chars: int = DEFAULT_MAX_CHARS,
+                 partial: bool = False) -> str:
+    """Convert HTML to plain text through the process-wide memo, see HTMLTextCache.convert()"""
+    return get_html_text_cache().convert(html, key, max_chars, partial)
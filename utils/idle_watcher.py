@@ -0,0 +1,295 @@
+"""
+IMAP IDLE push listener for MailoBot
+
+Keeps one dedicated IDLE session per watched folder and notifies in-process
+subscribers as soon as new UIDs show up. Servers that do not advertise IDLE
+are watched with NOOP polling and an adaptive backoff instead.
+"""
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Any, Optional
+
+from utils.email_mcp import EmailMCP
+
+
+class _FolderWatcher(threading.Thread):
+    """Background thread watching a single folder"""
+
+    def __init__(self, watcher: "IdleWatcher", folder: str):
+        super().__init__(name=f"idle-watcher-{folder}", daemon=True)
+        self.watcher = watcher
+        self.folder = folder
+        self.mcp: Optional[EmailMCP] = None
+        self.uidnext: Optional[int] = None
+        self.poll_interval = watcher.poll_min_interval
+        self._stop_event = threading.Event()
+        self._done_lock = threading.Lock()
+        self._done_sent = False
+        self._idle_tag: Optional[bytes] = None
+
+    def stop(self):
+        self._stop_event.set()
+        self._send_done()
+
+    def run(self):
+        backoff = self.watcher.poll_min_interval
+        while not self._stop_event.is_set():
+            try:
+                self._connect()
+                backoff = self.watcher.poll_min_interval
+                while not self._stop_event.is_set():
+                    if self.mcp.has_capability("IDLE"):
+                        activity = self._idle_once()
+                    else:
+                        activity = self._poll_once()
+                    if activity:
+                        self._check_new_uids()
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                print(f"IDLE watcher for {self.folder} lost its connection: {e}")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.watcher.poll_max_interval)
+            finally:
+                self._disconnect()
+
+    def _connect(self):
+        # IDLE blocks the session for minutes, so it never comes from the shared pool
+        self.mcp = EmailMCP(self.watcher.settings, use_pool=False)
+        if not self.mcp.connect():
+            raise ConnectionError(self.mcp.get_context().get('error', 'Unknown error'))
+        if not self.mcp.select_folder(self.folder):
+            raise ConnectionError(f"Could not select folder {self.folder}")
+
+        uidnext = self.mcp.context.get("uidnext")
+        if self.uidnext is None or uidnext is None:
+            self.uidnext = uidnext
+        else:
+            # Reconnected, catch up on anything that arrived while we were away
+            self._check_new_uids()
+
+    def _disconnect(self):
+        if self.mcp:
+            self.mcp.disconnect()
+            self.mcp = None
+
+    def _idle_once(self) -> bool:
+        """
+        Run one IDLE cycle
+
+        Returns:
+            True if the server reported new messages (EXISTS)
+        """
+        conn = self.mcp.imap_conn
+        # A dead connection must not block forever, the timer below sends DONE well before this
+        conn.sock.settimeout(self.watcher.idle_timeout + 60)
+
+        tag = conn._new_tag()
+        with self._done_lock:
+            self._idle_tag = tag
+            self._done_sent = False
+        conn.send(tag + b' IDLE\r\n')
+
+        line = conn.readline()
+        if not line.startswith(b'+'):
+            raise conn.error(f"IDLE rejected: {line!r}")
+
+        # Re-arm before the server drops us (RFC 2177 allows 29 minutes)
+        timer = threading.Timer(self.watcher.idle_timeout, self._send_done)
+        timer.daemon = True
+        timer.start()
+
+        activity = False
+        try:
+            while True:
+                line = conn.readline()
+                if not line:
+                    raise conn.abort("Connection closed during IDLE")
+                if line.startswith(tag):
+                    if b' OK' not in line[len(tag):len(tag) + 4]:
+                        raise conn.error(f"IDLE failed: {line!r}")
+                    break
+                if line.startswith(b'* BYE'):
+                    raise conn.abort("Server closed the IDLE session")
+                if line.startswith(b'*') and line.rstrip().upper().endswith(b'EXISTS'):
+                    activity = True
+                    self._send_done()
+        finally:
+            timer.cancel()
+            with self._done_lock:
+                self._idle_tag = None
+
+        return activity
+
+    def _send_done(self):
+        """End the current IDLE command, safe to call from any thread"""
+        with self._done_lock:
+            if self._idle_tag is None or self._done_sent or not self.mcp:
+                return
+            self._done_sent = True
+            try:
+                self.mcp.imap_conn.send(b'DONE\r\n')
+            except Exception:
+                pass
+
+    def _poll_once(self) -> bool:
+        """
+        NOOP-poll the folder, backing off while nothing happens
+
+        Returns:
+            True if the server reported new messages (EXISTS)
+        """
+        if self._stop_event.wait(self.poll_interval):
+            return False
+
+        conn = self.mcp.imap_conn
+        conn.untagged_responses.pop('EXISTS', None)
+        status, _ = conn.noop()
+        if status != "OK":
+            raise conn.error("NOOP failed")
+
+        if conn.untagged_responses.pop('EXISTS', None):
+            self.poll_interval = self.watcher.poll_min_interval
+            return True
+
+        self.poll_interval = min(self.poll_interval * self.watcher.poll_backoff_factor,
+                                 self.watcher.poll_max_interval)
+        return False
+
+    def _check_new_uids(self):
+        """Find UIDs at or above the last known UIDNEXT and notify subscribers"""
+        start = self.uidnext or 1
+        status, data = self.mcp.imap_conn.uid('SEARCH', None, f'UID {start}:*')
+        if status != "OK" or not data or not data[0]:
+            return
+
+        uids = sorted(uid for uid in (int(u) for u in data[0].split()) if uid >= start)
+        if not uids:
+            return
+
+        self.uidnext = uids[-1] + 1
+        self.watcher._publish({
+            "type": "new_mail",
+            "account": self.mcp.get_account_id(),
+            "folder": self.folder,
+            "uids": uids,
+            "timestamp": time.time()
+        })
+
+
+class IdleWatcher:
+    """
+    Server-side new-mail watcher with an in-process subscriber API
+
+    Example:
+        watcher = IdleWatcher(settings, folders=["INBOX"])
+        token = watcher.subscribe(lambda event: print(event["uids"]))
+        watcher.start()
+    """
+
+    # Re-arm IDLE after this many seconds, below the 29 minute server limit
+    DEFAULT_IDLE_TIMEOUT = 25 * 60
+
+    def __init__(self,
+                 settings: Dict[str, Any],
+                 folders: Optional[List[str]] = None,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 poll_min_interval: float = 5.0,
+                 poll_max_interval: float = 300.0,
+                 poll_backoff_factor: float = 2.0):
+        """
+        Initialize the watcher
+
+        Args:
+            settings: Dictionary with IMAP settings
+            folders: Folders to watch (defaults to INBOX)
+            idle_timeout: Seconds before an IDLE command is re-armed
+            poll_min_interval: Shortest NOOP poll interval when IDLE is not supported
+            poll_max_interval: Longest NOOP poll interval after repeated quiet polls
+            poll_backoff_factor: Multiplier applied to the poll interval after a quiet poll
+        """
+        self.settings = settings
+        self.idle_timeout = idle_timeout
+        self.poll_min_interval = poll_min_interval
+        self.poll_max_interval = poll_max_interval
+        self.poll_backoff_factor = poll_backoff_factor
+
+        self._folders = list(folders or ["INBOX"])
+        self._threads: Dict[str, _FolderWatcher] = {}
+        self._subscribers: Dict[int, Callable[[Dict[str, Any]], None]] = {}
+        self._token_counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self._running = False
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]) -> int:
+        """
+        Register a callback for new-mail events
+
+        The callback receives a dictionary with type, account, folder, uids
+        and timestamp. It runs on the watcher thread, so it should be quick.
+
+        Returns:
+            Token to pass to unsubscribe()
+        """
+        with self._lock:
+            token = next(self._token_counter)
+            self._subscribers[token] = callback
+            return token
+
+    def unsubscribe(self, token: int):
+        """Remove a callback registered with subscribe()"""
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    def watch(self, folder: str):
+        """Start watching an additional folder"""
+        with self._lock:
+            if folder not in self._folders:
+                self._folders.append(folder)
+            if self._running and folder not in self._threads:
+                self._start_folder(folder)
+
+    def unwatch(self, folder: str):
+        """Stop watching a folder"""
+        with self._lock:
+            if folder in self._folders:
+                self._folders.remove(folder)
+            thread = self._threads.pop(folder, None)
+        if thread:
+            thread.stop()
+
+    def start(self):
+        """Start one watcher thread per folder"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for folder in self._folders:
+                self._start_folder(folder)
+
+    def stop(self):
+        """Stop all watcher threads"""
+        with self._lock:
+            self._running = False
+            threads = list(self._threads.values())
+            self._threads.clear()
+        for thread in threads:
+            thread.stop()
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def _start_folder(self, folder: str):
+        thread = _FolderWatcher(self, folder)
+        self._threads[folder] = thread
+        thread.start()
+
+    def _publish(self, event: Dict[str, Any]):
+        with self._lock:
+            callbacks = list(self._subscribers.values())
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Error in new-mail subscriber: {e}")
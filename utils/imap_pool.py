@@ -0,0 +1,375 @@
+"""
+Connection pool for authenticated IMAP sessions used by EmailMCP
+"""
+import hashlib
+import imaplib
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+
+class _LineLimitMixin:
+    """
+    Per-connection limit for response lines
+
+    Long UID SEARCH results can exceed imaplib's default line limit. Message
+    literals are read separately and never count against it, so the limit
+    is raised only on our own connections instead of patching imaplib._MAXLINE
+    for the whole process.
+    """
+
+    max_line = 1000000
+
+    def readline(self):
+        line = self.file.readline(self.max_line + 1)
+        if len(line) > self.max_line:
+            raise self.error(f"got more than {self.max_line} bytes")
+        return line
+
+
+class _SelectedMailboxMixin:
+    """
+    Remembers the mailbox a session has selected
+
+    Pooled sessions outlive the EmailMCP that selected a folder, so the
+    selection is kept on the connection itself. EmailMCP.select_folder sets
+    selected_mailbox to a dictionary with folder, readonly, uidvalidity,
+    uidnext, highestmodseq and exists, or None when nothing is selected.
+    """
+
+    selected_mailbox: Optional[Dict[str, Any]] = None
+
+
+class _EnabledExtensionsMixin:
+    """
+    Remembers the extensions ENABLEd on a session
+
+    ENABLE is only accepted before a mailbox is selected, so it is sent
+    right after login and the result is kept on the connection, which a
+    pooled session carries from one EmailMCP to the next.
+    """
+
+    enabled_extensions: frozenset = frozenset()
+
+
+class IMAP4(_EnabledExtensionsMixin, _SelectedMailboxMixin, _LineLimitMixin, imaplib.IMAP4):
+    pass
+
+
+class IMAP4_SSL(_EnabledExtensionsMixin, _SelectedMailboxMixin, _LineLimitMixin, imaplib.IMAP4_SSL):
+    pass
+
+
+def _enable_extensions(conn: imaplib.IMAP4):
+    """Refresh the capabilities after login and ENABLE QRESYNC if the server offers it"""
+    try:
+        # Servers often advertise more once authenticated
+        status, data = conn.capability()
+        if status == "OK" and data and data[-1]:
+            conn.capabilities = tuple(data[-1].decode('ascii', errors='replace').upper().split())
+    except conn.abort:
+        raise
+    except conn.error as e:
+        print(f"Could not refresh IMAP capabilities: {e}")
+
+    if "QRESYNC" not in conn.capabilities or "ENABLE" not in conn.capabilities:
+        return
+    try:
+        status, _ = conn.enable("QRESYNC")
+        if status == "OK":
+            # QRESYNC implies CONDSTORE
+            conn.enabled_extensions = frozenset(("QRESYNC", "CONDSTORE"))
+    except conn.abort:
+        raise
+    except conn.error as e:
+        print(f"Could not enable QRESYNC: {e}")
+
+
+def create_imap_connection(settings: Dict[str, Any]) -> imaplib.IMAP4:
+    """
+    Open a new IMAP connection and log in
+
+    Args:
+        settings: Dictionary with IMAP settings (host, port, username, password, tls)
+
+    Returns:
+        An authenticated imaplib connection
+    """
+    if settings.get('tls', True):
+        conn = IMAP4_SSL(settings['host'], int(settings.get('port', 993)))
+    else:
+        conn = IMAP4(settings['host'], int(settings.get('port', 143)))
+
+    try:
+        conn.login(settings['username'], settings['password'])
+        _enable_extensions(conn)
+    except Exception:
+        try:
+            conn.shutdown()
+        except Exception:
+            pass
+        raise
+    return conn
+
+
+def account_key(settings: Dict[str, Any]) -> Tuple:
+    """
+    Build the pool key identifying an account
+
+    The password is only included as a digest so that changed credentials
+    get fresh sessions without keeping the secret in the key itself.
+    """
+    password = str(settings.get('password', '')).encode('utf-8')
+    return (
+        settings.get('host'),
+        int(settings.get('port', 993 if settings.get('tls', True) else 143)),
+        settings.get('username'),
+        bool(settings.get('tls', True)),
+        hashlib.sha256(password).hexdigest()[:16]
+    )
+
+
+class _PooledSession:
+    """Bookkeeping for a single pooled IMAP session"""
+
+    __slots__ = ("conn", "created_at", "last_used", "last_checked")
+
+    def __init__(self, conn: imaplib.IMAP4):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.last_checked = now
+
+
+class IMAPConnectionPool:
+    """
+    Pool of already-authenticated IMAP sessions keyed by account
+
+    Sessions are health-checked with NOOP before being handed out again,
+    evicted after sitting idle for too long, and the number of sessions
+    open at once for one account is capped.
+    """
+
+    def __init__(self,
+                 max_per_account: int = 4,
+                 idle_timeout: float = 300.0,
+                 health_check_interval: float = 30.0,
+                 acquire_timeout: float = 30.0):
+        """
+        Initialize the pool
+
+        Args:
+            max_per_account: Maximum number of sessions (idle + in use) per account
+            idle_timeout: Seconds an idle session is kept before it is logged out
+            health_check_interval: Idle seconds after which a session is NOOP-checked on reuse
+            acquire_timeout: Seconds to wait for a free slot before giving up
+        """
+        self.max_per_account = max_per_account
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        # One condition for every account: waiters for different accounts
+        # share it, so a freed slot must wake all of them (notify_all)
+        self._lock = threading.Condition()
+        self._idle: Dict[Tuple, List[_PooledSession]] = {}
+        self._in_use: Dict[int, Tuple[Tuple, _PooledSession]] = {}
+        self._open_count: Dict[Tuple, int] = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+            "timeouts": 0
+        }
+
+    def acquire(self, settings: Dict[str, Any]) -> imaplib.IMAP4:
+        """
+        Get an authenticated session for the account described by settings
+
+        Args:
+            settings: Dictionary with IMAP settings
+
+        Returns:
+            An authenticated imaplib connection
+
+        Raises:
+            TimeoutError: If the account is at its session cap for too long
+        """
+        key = account_key(settings)
+        deadline = time.monotonic() + self.acquire_timeout
+
+        while True:
+            session = None
+            with self._lock:
+                self._evict_idle_locked()
+                idle = self._idle.get(key)
+                if idle:
+                    # Most recently used first, it is the most likely to be alive
+                    session = idle.pop()
+                elif self._open_count.get(key, 0) < self.max_per_account:
+                    # Reserve a slot, the login happens outside the lock
+                    self._open_count[key] = self._open_count.get(key, 0) + 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise TimeoutError(
+                            f"No IMAP session available for {settings.get('username')} "
+                            f"after {self.acquire_timeout}s")
+                    self._lock.wait(remaining)
+                    continue
+
+            if session is not None:
+                if self._check_health(session):
+                    with self._lock:
+                        self._stats["hits"] += 1
+                        session.last_used = time.monotonic()
+                        self._in_use[id(session.conn)] = (key, session)
+                    return session.conn
+                # Dead session, drop it and try again
+                self._close_session(key, session)
+                continue
+
+            try:
+                conn = create_imap_connection(settings)
+            except Exception:
+                with self._lock:
+                    self._open_count[key] -= 1
+                    self._lock.notify_all()
+                raise
+
+            session = _PooledSession(conn)
+            with self._lock:
+                self._stats["misses"] += 1
+                self._in_use[id(conn)] = (key, session)
+            return conn
+
+    def release(self, conn: imaplib.IMAP4, discard: bool = False):
+        """
+        Return a session to the pool
+
+        Args:
+            conn: Connection previously obtained from acquire()
+            discard: Log the session out instead of keeping it for reuse
+        """
+        with self._lock:
+            entry = self._in_use.pop(id(conn), None)
+
+        if entry is None:
+            # Not ours, just close it
+            try:
+                conn.logout()
+            except Exception:
+                pass
+            return
+
+        key, session = entry
+        if discard or getattr(conn, 'state', None) == 'LOGOUT':
+            with self._lock:
+                self._stats["discarded"] += 1
+            self._close_session(key, session)
+            return
+
+        with self._lock:
+            session.last_used = time.monotonic()
+            self._idle.setdefault(key, []).append(session)
+            self._lock.notify_all()
+
+    def evict_idle(self):
+        """Log out every session that has been idle longer than idle_timeout"""
+        with self._lock:
+            self._evict_idle_locked()
+
+    def close_all(self):
+        """Log out every idle session and forget about sessions in use"""
+        with self._lock:
+            idle = [(key, s) for key, sessions in self._idle.items() for s in sessions]
+            self._idle.clear()
+            self._in_use.clear()
+            self._open_count.clear()
+            self._lock.notify_all()
+
+        for _, session in idle:
+            self._logout(session.conn)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and current session counts"""
+        with self._lock:
+            stats = dict(self._stats)
+            total = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / total if total else 0.0
+            stats["idle_sessions"] = sum(len(s) for s in self._idle.values())
+            stats["in_use_sessions"] = len(self._in_use)
+            stats["accounts"] = len([k for k, n in self._open_count.items() if n > 0])
+            return stats
+
+    def _check_health(self, session: _PooledSession) -> bool:
+        """NOOP a session that has been idle for a while"""
+        now = time.monotonic()
+        if now - session.last_checked < self.health_check_interval:
+            return True
+        try:
+            status, _ = session.conn.noop()
+            session.last_checked = now
+            if status == "OK":
+                return True
+        except Exception as e:
+            print(f"Pooled IMAP session failed health check: {e}")
+        with self._lock:
+            self._stats["health_check_failures"] += 1
+        return False
+
+    def _evict_idle_locked(self):
+        """Drop expired idle sessions, caller must hold the lock"""
+        now = time.monotonic()
+        expired = []
+        for key, sessions in self._idle.items():
+            keep = []
+            for session in sessions:
+                if now - session.last_used > self.idle_timeout:
+                    expired.append(session)
+                    self._open_count[key] -= 1
+                else:
+                    keep.append(session)
+            self._idle[key] = keep
+
+        if expired:
+            self._stats["evictions"] += len(expired)
+            self._lock.notify_all()
+            # Logging out can block, do it off the caller's path
+            threading.Thread(target=self._logout_all, args=(expired,), daemon=True).start()
+
+    def _close_session(self, key: Tuple, session: _PooledSession):
+        """Log out a session and free its slot"""
+        with self._lock:
+            self._open_count[key] = max(0, self._open_count.get(key, 0) - 1)
+            self._lock.notify_all()
+        self._logout(session.conn)
+
+    def _logout_all(self, sessions: List[_PooledSession]):
+        for session in sessions:
+            self._logout(session.conn)
+
+    @staticmethod
+    def _logout(conn: imaplib.IMAP4):
+        try:
+            conn.logout()
+        except Exception:
+            pass
+
+
+_default_pool: Optional[IMAPConnectionPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool() -> IMAPConnectionPool:
+    """Get the process-wide IMAP connection pool"""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = IMAPConnectionPool()
+    return _default_pool
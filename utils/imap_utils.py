@@ -0,0 +1,501 @@
+"""
+Helpers for building IMAP commands and parsing IMAP responses
+"""
+import re
+from typing import Dict, List, Any, Iterable, Optional
+
+# Data item name that precedes a literal, e.g. RFC822 {1234} or BODY[1.2]<0> {512}
+_LITERAL_ITEM_RE = re.compile(
+    rb'(?:^|[ (])((?:BODY|BINARY)(?:\.PEEK)?\[[^\]]*\](?:<\d+>)?|RFC822(?:\.HEADER|\.TEXT)?) \{(\d+)\}$',
+    re.IGNORECASE)
+_LITERAL_MARKER_RE = re.compile(rb'\{(\d+)\}$')
+# FETCH items carrying the full message
+_MESSAGE_LITERAL_RE = re.compile(rb'(?:RFC822|BODY(?:\.PEEK)?\[\]) \{(\d+)\}$', re.IGNORECASE)
+_MESSAGE_START_RE = re.compile(rb'^(\d+) \(')
+_UID_RE = re.compile(rb'\bUID (\d+)')
+_FLAGS_RE = re.compile(rb'\bFLAGS \(([^)]*)\)')
+_SIZE_RE = re.compile(rb'\bRFC822\.SIZE (\d+)')
+_MODSEQ_RE = re.compile(rb'\bMODSEQ \((\d+)\)')
+
+
+def build_uid_set(uids: Iterable[Any]) -> str:
+    """
+    Compress UIDs into an IMAP sequence set
+
+    Args:
+        uids: UIDs as ints, strings or bytes
+
+    Returns:
+        Sequence set string such as "1:5,8,10:12"
+    """
+    values = sorted({int(u.decode() if isinstance(u, bytes) else u) for u in uids})
+    if not values:
+        return ""
+
+    ranges = []
+    start = prev = values[0]
+    for value in values[1:]:
+        if value == prev + 1:
+            prev = value
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = value
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def expand_uid_set(uid_set: str) -> List[int]:
+    """
+    Expand a sequence set such as "1:3,7" into [1, 2, 3, 7]
+
+    Order is kept, so the sort-ordered sets of ESORT ("9,8:6") expand to
+    [9, 8, 7, 6].
+    """
+    uids = []
+    for part in uid_set.strip().split(','):
+        if not part:
+            continue
+        if ':' in part:
+            start, end = (int(value) for value in part.split(':'))
+            step = 1 if end >= start else -1
+            uids.extend(range(start, end + step, step))
+        else:
+            uids.append(int(part))
+    return uids
+
+
+def chunked(items: List[Any], size: int) -> Iterable[List[Any]]:
+    """Yield successive slices of at most size items"""
+    size = max(1, int(size))
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _normalize_item_name(name: bytes) -> str:
+    """BODY.PEEK[1] and body[1] both come back as BODY[1]"""
+    return name.decode('ascii', errors='replace').upper().replace('.PEEK', '')
+
+
+def parse_fetch_response(data: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Parse the data returned by imaplib for a (UID) FETCH command
+
+    imaplib hands back a flat list where every literal is a (prefix, literal)
+    tuple and the text following the last literal of a message is a separate
+    bytes item. This regroups that list per message.
+
+    Args:
+        data: Data list returned by imaplib fetch()/uid('FETCH', ...)
+
+    Returns:
+        List of dictionaries in response order, each with keys:
+        seq, uid, flags, size, modseq, text (non-literal attributes) and
+        literals (mapping of data item name to bytes)
+    """
+    messages = []
+    current = None
+
+    for item in data or []:
+        if item is None:
+            continue
+
+        if isinstance(item, tuple):
+            prefix, literal = item[0], item[1]
+            start = _MESSAGE_START_RE.match(prefix)
+            if start:
+                current = {"seq": int(start.group(1)), "text": b"", "literals": {}}
+                messages.append(current)
+                prefix = prefix[start.end() - 1:]
+            elif current is None:
+                continue
+
+            named = _LITERAL_ITEM_RE.search(prefix)
+            if named:
+                current["literals"][_normalize_item_name(named.group(1))] = literal
+                current["text"] += prefix[:named.start(1)]
+            else:
+                # A literal inside a structure (e.g. an ENVELOPE string), keep it inline
+                marker = _LITERAL_MARKER_RE.search(prefix)
+                head = prefix[:marker.start()] if marker else prefix
+                quoted = literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+                current["text"] += head + b'"' + quoted + b'"'
+            continue
+
+        if not isinstance(item, bytes):
+            continue
+
+        start = _MESSAGE_START_RE.match(item)
+        if start:
+            # Message without literals, e.g. a FLAGS-only response
+            current = {"seq": int(start.group(1)), "text": item[start.end() - 1:], "literals": {}}
+            messages.append(current)
+        elif current is not None:
+            current["text"] += item
+
+    for message in messages:
+        text = message["text"]
+        uid = _UID_RE.search(text)
+        flags = _FLAGS_RE.search(text)
+        size = _SIZE_RE.search(text)
+        modseq = _MODSEQ_RE.search(text)
+        message["uid"] = int(uid.group(1)) if uid else None
+        message["flags"] = flags.group(1).decode('ascii', errors='replace').split() if flags else []
+        message["size"] = int(size.group(1)) if size else None
+        message["modseq"] = int(modseq.group(1)) if modseq else None
+
+    return messages
+
+
+def is_message_literal(prefix: bytes) -> bool:
+    """Whether a response line announces a literal holding a full message (RFC822 or BODY[])"""
+    return bool(_MESSAGE_LITERAL_RE.search(prefix))
+
+
+def get_literal(message: Dict[str, Any], *names: str) -> Optional[bytes]:
+    """Get the first literal present under any of the given data item names"""
+    for name in names:
+        value = message["literals"].get(name.upper())
+        if value is not None:
+            return value
+    return None
+
+
+def quote_mailbox(name: str) -> str:
+    """Quote a mailbox name for use as a command argument if it needs it"""
+    if name.startswith('"') and name.endswith('"') and len(name) > 1:
+        return name
+    if name and re.fullmatch(r'[A-Za-z0-9_./\-\[\]&]+', name):
+        return name
+    return quote_string(name)
+
+
+def quote_string(value: str) -> str:
+    """Quote a value as an IMAP quoted string"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def parse_status_response(data: List[Any]) -> Dict[str, Dict[str, int]]:
+    """
+    Parse untagged STATUS responses
+
+    Args:
+        data: Data list returned by imaplib status() or collected STATUS responses
+
+    Returns:
+        Mapping of mailbox name to {item: value}, e.g. {"INBOX": {"MESSAGES": 10}}
+    """
+    result = {}
+    for item in data or []:
+        if isinstance(item, tuple):
+            # Mailbox name sent as a literal
+            item = b'"' + item[1] + b'"' + (item[0].rsplit(b'}', 1)[-1] if b'}' in item[0] else b'')
+        if not isinstance(item, bytes):
+            continue
+        match = re.match(rb'^\s*("(?:[^"\\]|\\.)*"|\S+)\s*\((.*)\)\s*$', item)
+        if not match:
+            continue
+        name = match.group(1)
+        if name.startswith(b'"'):
+            name = name[1:-1].replace(b'\\"', b'"').replace(b'\\\\', b'\\')
+        tokens = match.group(2).split()
+        values = {}
+        for key, value in zip(tokens[0::2], tokens[1::2]):
+            try:
+                values[key.decode().upper()] = int(value)
+            except ValueError:
+                continue
+        result[name.decode('utf-8', errors='replace')] = values
+    return result
+
+
+# Special-use attributes (RFC 6154) and the folder roles they mark
+SPECIAL_USE_ROLES = {
+    "\\DRAFTS": "drafts",
+    "\\SENT": "sent",
+    "\\TRASH": "trash",
+    "\\ARCHIVE": "archive",
+    "\\JUNK": "junk"
+}
+
+# Common folder names per role, for servers that do not report special-use attributes
+_ROLE_NAME_GUESSES = {
+    "drafts": ["drafts", "draft", "[gmail]/drafts", "inbox.drafts"],
+    "sent": ["sent", "sent items", "sent messages", "sent mail", "[gmail]/sent mail", "inbox.sent"],
+    "trash": ["trash", "deleted items", "deleted messages", "[gmail]/trash", "[gmail]/bin", "inbox.trash"],
+    "archive": ["archive", "archives", "[gmail]/all mail", "inbox.archive"],
+    "junk": ["junk", "spam", "junk e-mail", "junk email", "[gmail]/spam", "inbox.junk", "inbox.spam"]
+}
+
+
+def parse_list_response(data: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Parse untagged LIST responses
+
+    Args:
+        data: Data list returned by imaplib list() or collected LIST responses,
+            e.g. [b'(\\HasNoChildren \\Drafts) "/" "Drafts"']
+
+    Returns:
+        List of {"name", "delimiter", "flags"} dictionaries; names are kept
+        as sent by the server so they can be used in commands again
+    """
+    folders = []
+    for item in data or []:
+        if isinstance(item, tuple):
+            # Mailbox name sent as a literal
+            item = item[0].rsplit(b'{', 1)[0] + b'"' + item[1].replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+        if not isinstance(item, bytes):
+            continue
+        match = re.match(rb'^\s*\(([^)]*)\)\s+("(?:[^"\\]|\\.)*"|NIL)\s+("(?:[^"\\]|\\.)*"|\S+)', item, re.IGNORECASE)
+        if not match:
+            continue
+        delimiter = match.group(2)
+        name = match.group(3)
+        if name.startswith(b'"'):
+            name = name[1:-1].replace(b'\\"', b'"').replace(b'\\\\', b'\\')
+        folders.append({
+            "name": name.decode('utf-8', errors='replace'),
+            "delimiter": None if delimiter.upper() == b'NIL' else delimiter[1:-1].decode('utf-8', errors='replace'),
+            "flags": [flag.decode('ascii', errors='replace') for flag in match.group(1).split()]
+        })
+    return folders
+
+
+def resolve_special_folders(folders: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Map folder roles (drafts, sent, trash, archive, junk) to folder names
+
+    Special-use attributes win; roles without one are guessed from common names.
+
+    Args:
+        folders: Folders as returned by parse_list_response()
+
+    Returns:
+        Mapping of role to folder name for the roles that were found
+    """
+    roles: Dict[str, str] = {}
+    for folder in folders:
+        for flag in folder["flags"]:
+            role = SPECIAL_USE_ROLES.get(flag.upper())
+            if role and role not in roles:
+                roles[role] = folder["name"]
+
+    by_name = {folder["name"].lower(): folder["name"] for folder in folders
+               if "\\NOSELECT" not in (flag.upper() for flag in folder["flags"])}
+    for role, guesses in _ROLE_NAME_GUESSES.items():
+        if role in roles:
+            continue
+        for guess in guesses:
+            if guess in by_name:
+                roles[role] = by_name[guess]
+                break
+    return roles
+
+
+def parse_esearch_response(data: List[Any]) -> Dict[str, Any]:
+    """
+    Parse the result of a SEARCH/SORT with RETURN options (RFC 4731, RFC 5267)
+
+    Args:
+        data: Items of the ESEARCH untagged response, e.g.
+            [b'(TAG "A5") UID COUNT 3 MIN 4 MAX 9']
+
+    Returns:
+        Dictionary with the returned items: COUNT, MIN, MAX and MODSEQ as
+        ints, ALL as a list of UIDs, PARTIAL as a list of UIDs (in sort order
+        for ESORT), plus UID (bool). Empty if nothing was returned.
+    """
+    result: Dict[str, Any] = {}
+    for item in data or []:
+        if item is None:
+            continue
+        text = item.decode('ascii', errors='replace') if isinstance(item, bytes) else str(item)
+        text = re.sub(r'^\s*\(TAG "[^"]*"\)\s*', '', text)
+        if re.match(r'UID\b', text, re.IGNORECASE):
+            result["UID"] = True
+            text = text[3:]
+        for name, value in re.findall(r'([A-Za-z]+)\s+(\([^)]*\)|\S+)', text):
+            name = name.upper()
+            if name == "PARTIAL":
+                # (<range> <uids>), the UID set is NIL (or missing) when nothing matched
+                parts = value.strip('()').split()
+                result[name] = expand_uid_set(parts[1]) if len(parts) > 1 and parts[1] != "NIL" else []
+            elif name == "ALL":
+                result[name] = expand_uid_set(value)
+            elif value.isdigit():
+                result[name] = int(value)
+    return result
+
+
+def get_response_code(conn, name: str) -> Optional[int]:
+    """
+    Read a numeric response code (e.g. UIDVALIDITY) left by the last command
+
+    imaplib files "* OK [UIDVALIDITY 123]" style codes under their name
+    in untagged_responses without consuming them.
+    """
+    values = conn.untagged_responses.get(name.upper())
+    if not values:
+        return None
+    try:
+        value = values[-1]
+        return int(value.decode() if isinstance(value, bytes) else value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_sexp(text: bytes, pos: int = 0):
+    """
+    Parse one parenthesized IMAP value (as used by BODYSTRUCTURE/ENVELOPE)
+
+    Strings come back as bytes, NIL as None, numbers as int and
+    parenthesized lists as Python lists.
+
+    Args:
+        text: Response text
+        pos: Offset of the value to parse
+
+    Returns:
+        Tuple of (value, offset just past the value)
+    """
+    length = len(text)
+    while pos < length and text[pos:pos + 1] == b' ':
+        pos += 1
+    if pos >= length:
+        return None, pos
+
+    char = text[pos:pos + 1]
+    if char == b'(':
+        items = []
+        pos += 1
+        while True:
+            while pos < length and text[pos:pos + 1] == b' ':
+                pos += 1
+            if pos >= length:
+                return items, pos
+            if text[pos:pos + 1] == b')':
+                return items, pos + 1
+            value, pos = parse_sexp(text, pos)
+            items.append(value)
+
+    if char == b'"':
+        out = bytearray()
+        pos += 1
+        while pos < length:
+            c = text[pos:pos + 1]
+            if c == b'\\' and pos + 1 < length:
+                out += text[pos + 1:pos + 2]
+                pos += 2
+                continue
+            if c == b'"':
+                return bytes(out), pos + 1
+            out += c
+            pos += 1
+        return bytes(out), pos
+
+    end = pos
+    while end < length and text[end:end + 1] not in (b' ', b'(', b')'):
+        end += 1
+    atom = text[pos:end]
+    if atom.upper() == b'NIL':
+        return None, end
+    if atom.isdigit():
+        return int(atom), end
+    return atom, end
+
+
+def extract_fetch_item(text: bytes, name: str):
+    """
+    Extract and parse a structured FETCH data item, e.g. BODYSTRUCTURE
+
+    Args:
+        text: Non-literal text of a message from parse_fetch_response()
+        name: Data item name
+
+    Returns:
+        Parsed value or None if the item is missing
+    """
+    match = re.search(rb'\b' + re.escape(name.encode()) + rb' ', text, re.IGNORECASE)
+    if not match:
+        return None
+    value, _ = parse_sexp(text, match.end())
+    return value
+
+
+def _to_str(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+
+def _param_dict(value) -> Dict[str, str]:
+    """Turn ("NAME" "value" ...) into a lowercase-keyed dictionary"""
+    if not isinstance(value, list):
+        return {}
+    return {_to_str(k).lower(): _to_str(v) for k, v in zip(value[0::2], value[1::2])}
+
+
+def walk_bodystructure(structure, section: str = "") -> List[Dict[str, Any]]:
+    """
+    Flatten a parsed BODYSTRUCTURE into its leaf parts
+
+    Args:
+        structure: Value returned by extract_fetch_item(text, 'BODYSTRUCTURE')
+        section: Section number prefix (used for recursion)
+
+    Returns:
+        List of dictionaries with keys section (e.g. "1.2"), content_type,
+        charset, encoding, size, disposition, filename and is_attachment
+    """
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        # multipart: child parts followed by the subtype and extension data
+        parts = []
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            child_section = f"{section}.{index}" if section else str(index)
+            parts.extend(walk_bodystructure(child, child_section))
+        return parts
+
+    main_type = _to_str(structure[0]).lower()
+    sub_type = _to_str(structure[1] if len(structure) > 1 else "").lower()
+    params = _param_dict(structure[2] if len(structure) > 2 else None)
+    encoding = _to_str(structure[5] if len(structure) > 5 else "").lower() or "7bit"
+    size = structure[6] if len(structure) > 6 and isinstance(structure[6], int) else 0
+
+    # Extension data starts after the type specific fields
+    ext_start = 7
+    if main_type == "text":
+        ext_start = 8
+    elif main_type == "message" and sub_type == "rfc822":
+        ext_start = 10
+    disposition_value = structure[ext_start + 1] if len(structure) > ext_start + 1 else None
+
+    disposition = ""
+    disposition_params = {}
+    if isinstance(disposition_value, list) and disposition_value:
+        disposition = _to_str(disposition_value[0]).lower()
+        disposition_params = _param_dict(disposition_value[1] if len(disposition_value) > 1 else None)
+
+    filename = disposition_params.get("filename") or params.get("name") or ""
+    is_attachment = disposition == "attachment" or (
+        bool(filename) and main_type not in ("text", "multipart")) or (
+        main_type == "message" and sub_type == "rfc822")
+
+    return [{
+        "section": section or "1",
+        "content_type": f"{main_type}/{sub_type}",
+        "charset": params.get("charset", ""),
+        "encoding": encoding,
+        "size": size,
+        "disposition": disposition,
+        "filename": filename,
+        "is_attachment": is_attachment
+    }]
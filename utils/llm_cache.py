@@ -0,0 +1,248 @@
+"""
+Persistent cache of LLM responses for MailoBot
+
+Completions are keyed by a hash of the model, the request parameters and
+the messages, and kept in SQLite with a TTL and a size bound (least recently
+used entries are evicted). Recently used entries are also held in memory, so
+repeating a prompt neither touches the network nor the disk.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+# Request fields that do not change the completion
+_IGNORED_FIELDS = ("stream", "user")
+
+
+def _default_cache_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'cache', 'llm_cache.db')
+
+
+def make_cache_key(payload: Dict[str, Any]) -> str:
+    """Hash of everything in a chat completions request that determines the answer"""
+    relevant = {key: value for key, value in payload.items() if key not in _IGNORED_FIELDS}
+    encoded = json.dumps(relevant, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite-backed response cache with TTL and LRU eviction
+
+    Example:
+        cache = get_llm_cache()
+        key = make_cache_key(payload)
+        hit = cache.get(key)
+        if hit is None:
+            cache.put(key, payload["model"], content, usage)
+    """
+
+    # Seconds a cached response is served
+    DEFAULT_TTL = 7 * 24 * 3600
+
+    # Responses kept on disk
+    DEFAULT_MAX_ENTRIES = 5000
+
+    # Responses kept in memory
+    DEFAULT_MEMORY_ENTRIES = 256
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, memory_entries: int = DEFAULT_MEMORY_ENTRIES):
+        """
+        Initialize the cache
+
+        Args:
+            path: SQLite database file (defaults to settings/cache/llm_cache.db)
+            ttl: Seconds a cached response is served
+            max_entries: Responses kept on disk (least recently used are evicted)
+            memory_entries: Responses also kept in memory
+        """
+        self.path = path or _default_cache_path()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_access ON responses (last_access);
+        """)
+        self._db.commit()
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # key -> last access not yet written to disk
+        self._touched: Dict[str, float] = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0,
+            "saved_prompt_tokens": 0,
+            "saved_completion_tokens": 0
+        }
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached response
+
+        Returns:
+            Dictionary with content, prompt_tokens and completion_tokens, or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                row = self._db.execute(
+                    "SELECT content, prompt_tokens, completion_tokens, created FROM responses WHERE key=?",
+                    (key,)).fetchone()
+                entry = dict(row) if row is not None else None
+
+            if entry is None or now - entry["created"] > self.ttl:
+                if entry is not None:
+                    self._drop(key)
+                self._stats["misses"] += 1
+                return None
+
+            self._remember(key, entry)
+            # Access times are written with the next store instead of on every hit
+            self._touched[key] = now
+            self._stats["hits"] += 1
+            self._stats["saved_prompt_tokens"] += entry["prompt_tokens"]
+            self._stats["saved_completion_tokens"] += entry["completion_tokens"]
+            return entry
+
+    def put(self, key: str, model: Optional[str], content: str, usage: Optional[Dict[str, Any]] = None):
+        """
+        Store a response
+
+        Args:
+            key: Key from make_cache_key()
+            model: Model that produced the response
+            content: Response text
+            usage: Token usage reported by the API (prompt_tokens, completion_tokens)
+        """
+        usage = usage or {}
+        now = time.time()
+        entry = {
+            "content": content,
+            "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+            "completion_tokens": int(usage.get("completion_tokens") or 0),
+            "created": now
+        }
+        with self._lock:
+            try:
+                self._flush_touched()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, model, content, prompt_tokens, completion_tokens, created, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, content, entry["prompt_tokens"], entry["completion_tokens"], now, now))
+                self._evict()
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"Error storing LLM response: {e}")
+                return
+            self._remember(key, entry)
+            self._stats["stores"] += 1
+
+    def count_bypass(self):
+        """Count a request that was not looked up (e.g. sampled with a high temperature)"""
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def clear(self):
+        """Remove all cached responses"""
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache counters plus hit rate and number of stored responses"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _drop(self, key: str):
+        self._memory.pop(key, None)
+        self._touched.pop(key, None)
+        self._db.execute("DELETE FROM responses WHERE key=?", (key,))
+        self._db.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE responses SET last_access=? WHERE key=?",
+                                 [(accessed, key) for key, accessed in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self):
+        """Drop expired responses and the least recently used ones beyond max_entries"""
+        deleted = self._db.execute("DELETE FROM responses WHERE created<?", (time.time() - self.ttl,)).rowcount
+        excess = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            deleted += self._db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_access LIMIT ?)", (excess,)).rowcount
+        if deleted:
+            self._stats["evictions"] += deleted
+            # Entries evicted on disk must not be served from memory
+            keys = set(self._memory)
+            if keys:
+                placeholders = ",".join("?" * len(keys))
+                present = {row[0] for row in self._db.execute(
+                    f"SELECT key FROM responses WHERE key IN ({placeholders})", list(keys))}
+                for key in keys - present:
+                    self._memory.pop(key, None)
+
+
+_default_cache: Optional[LLMCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_llm_cache(settings: Optional[Dict[str, Any]] = None) -> LLMCache:
+    """
+    Get the process-wide LLM response cache
+
+    Args:
+        settings: The cache section of config/openai.yml (ttl, max_entries),
+            only used when the cache is created
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                settings = settings or {}
+                _default_cache = LLMCache(
+                    ttl=float(settings.get('ttl', LLMCache.DEFAULT_TTL)),
+                    max_entries=int(settings.get('max_entries', LLMCache.DEFAULT_MAX_ENTRIES)))
+    return _default_cache
@@ -0,0 +1,315 @@
+"""
+Request coalescing and rate limiting for LLM calls
+
+SingleFlight merges identical requests that are in flight at the same time
+into one upstream call. RateLimiter spaces requests with a token bucket,
+caps how many run at once and pauses when the provider says so (429 with
+Retry-After, or x-ratelimit-remaining-* reaching zero). Callers over budget
+wait in line in arrival order instead of failing.
+"""
+import email.utils
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a rate limit reset value such as "1s", "6m0s", "250ms" or "12" into seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds from now"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs a function once per key among concurrent callers
+
+    Example:
+        flights = SingleFlight()
+        text = flights.do(make_cache_key(payload), lambda: call_api(payload))
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {"calls": 0, "shared": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Call fn, or wait for the identical call already running
+
+        Args:
+            key: Identifies the request
+            fn: Performs the request
+
+        Returns:
+            The result of fn (the exception of fn is raised to every caller)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["shared"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["calls"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class RateLimiter:
+    """
+    Token bucket plus concurrency cap, with pauses requested by the provider
+
+    Example:
+        limiter = RateLimiter(requests_per_minute=500, max_concurrent=8)
+        limiter.acquire()
+        try:
+            response = session.post(...)
+            limiter.update_from_headers(response.headers, response.status_code)
+        finally:
+            limiter.release()
+    """
+
+    DEFAULT_REQUESTS_PER_MINUTE = 500
+    DEFAULT_MAX_CONCURRENT = 8
+
+    # Seconds a caller waits in line before giving up
+    DEFAULT_MAX_WAIT = 120.0
+
+    def __init__(self, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 max_concurrent: int = DEFAULT_MAX_CONCURRENT, burst: Optional[int] = None,
+                 max_wait: float = DEFAULT_MAX_WAIT):
+        """
+        Initialize the limiter
+
+        Args:
+            requests_per_minute: Sustained request rate
+            max_concurrent: Requests allowed in flight at once
+            burst: Bucket size (defaults to max_concurrent)
+            max_wait: Seconds acquire() waits before raising TimeoutError
+        """
+        self._cond = threading.Condition()
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._active = 0
+        self._paused_until = 0.0
+        # Callers are served in arrival order, tickets of callers that gave up are skipped
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()
+        self._stats = {
+            "acquired": 0,
+            "waited": 0,
+            "wait_seconds": 0.0,
+            "throttled": 0,
+            "pauses": 0,
+            "timeouts": 0
+        }
+        self.configure(requests_per_minute, max_concurrent, burst, max_wait)
+        self._tokens = float(self.burst)
+
+    def configure(self, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                  max_concurrent: int = DEFAULT_MAX_CONCURRENT, burst: Optional[int] = None,
+                  max_wait: float = DEFAULT_MAX_WAIT):
+        """Change the limits (e.g. after the config file changed)"""
+        with self._cond:
+            self.rate = max(float(requests_per_minute), 1.0) / 60.0
+            self.max_concurrent = max(1, int(max_concurrent))
+            self.burst = max(1, int(burst or self.max_concurrent))
+            self.max_wait = max_wait
+            self._tokens = min(self._tokens, float(self.burst))
+            self._cond.notify_all()
+
+    def acquire(self):
+        """
+        Wait for a request slot
+
+        Raises:
+            TimeoutError: If no slot became free within max_wait seconds
+        """
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            waited = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    # Only the caller at the front of the line can take a slot
+                    delay = self._delay(now) if ticket == self._serving else None
+                    if delay is not None and delay <= 0:
+                        break
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise TimeoutError("Timed out waiting for an LLM request slot")
+                    waited = True
+                    self._cond.wait(remaining if delay is None else min(delay, remaining))
+            except BaseException:
+                self._abandoned.add(ticket)
+                self._advance()
+                self._cond.notify_all()
+                raise
+
+            self._tokens -= 1.0
+            self._active += 1
+            self._serving += 1
+            self._advance()
+            self._stats["acquired"] += 1
+            if waited:
+                self._stats["waited"] += 1
+                self._stats["wait_seconds"] += time.monotonic() - started
+            self._cond.notify_all()
+
+    def release(self):
+        """Give back a request slot"""
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Hold back all requests for the given number of seconds"""
+        if seconds <= 0:
+            return
+        with self._cond:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self._stats["pauses"] += 1
+            self._cond.notify_all()
+
+    def update_from_headers(self, headers: Mapping[str, str], status_code: int = 200):
+        """
+        Apply the rate limit information of a response
+
+        Honors Retry-After (on 429 and 503) and the x-ratelimit-* headers:
+        when the remaining requests or tokens reach zero, requests pause until
+        the advertised reset; the advertised request limit becomes the rate.
+        """
+        if status_code == 429:
+            with self._cond:
+                self._stats["throttled"] += 1
+
+        delay = None
+        if status_code in (429, 503):
+            delay = parse_retry_after(headers.get("retry-after"))
+            if delay is None:
+                delay = parse_reset_duration(headers.get("retry-after-ms"))
+                delay = delay / 1000.0 if delay is not None else None
+
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.strip() in ("0", "0.0"):
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset is not None:
+                    delay = max(delay or 0.0, reset)
+
+        if delay is None and status_code == 429:
+            # Throttled without a hint, back off for a second
+            delay = 1.0
+        if delay:
+            self.pause(delay)
+
+        limit = headers.get("x-ratelimit-limit-requests")
+        if limit:
+            try:
+                rate = float(limit) / 60.0
+            except ValueError:
+                rate = None
+            if rate and rate < self.rate:
+                with self._cond:
+                    self.rate = rate
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["active"] = self._active
+            stats["queued"] = self._next_ticket - self._serving
+            stats["paused_for"] = round(max(0.0, self._paused_until - time.monotonic()), 3)
+            stats["requests_per_minute"] = round(self.rate * 60.0, 1)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        return stats
+
+    def _refill(self, now: float):
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _delay(self, now: float) -> Optional[float]:
+        """Seconds until the caller at the front may go, None if it waits for a release"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._active >= self.max_concurrent:
+            return None
+        if self._tokens < 1.0:
+            return (1.0 - self._tokens) / self.rate
+        return 0.0
+
+    def _advance(self):
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
@@ -0,0 +1,299 @@
+"""
+UID-based incremental mailbox synchronization for MailoBot
+
+Keeps a checkpoint (UIDVALIDITY, UIDNEXT, HIGHESTMODSEQ) per account and
+folder so that a periodic check costs a single STATUS command and only
+messages that arrived since the last run are downloaded.
+"""
+import re
+import time
+from typing import Dict, List, Any, Optional
+
+from utils.email_mcp import EmailMCP
+from utils.imap_utils import expand_uid_set, parse_fetch_response
+from utils.sync_state import SyncStateStore, get_sync_state_store
+
+
+class MailboxSync:
+    """
+    Incremental synchronization engine on top of EmailMCP
+
+    New messages are found by UID (UIDNEXT checkpoint), flag changes are
+    pulled with CONDSTORE's CHANGEDSINCE (plus VANISHED under QRESYNC), and a
+    full resync only happens when the folder's UIDVALIDITY changes. Without
+    QRESYNC, expunges are found by diffing the indexed UIDs against the
+    server's when the message count says something disappeared.
+
+    A full resync only downloads the newest initial_limit messages; later
+    runs backfill older ones in batches, moving a cursor down to UID 1,
+    and the checkpoint is marked complete once every message is indexed.
+    """
+
+    # Messages downloaded on the first sync of a folder (newest first)
+    DEFAULT_INITIAL_LIMIT = 50
+
+    def __init__(self, mcp: EmailMCP, state_store: Optional[SyncStateStore] = None,
+                 initial_limit: int = DEFAULT_INITIAL_LIMIT):
+        """
+        Initialize the sync engine
+
+        Args:
+            mcp: Connected EmailMCP instance
+            state_store: Checkpoint store (defaults to the store of the EmailMCP,
+                the shared settings/cache/sync_state.db)
+            initial_limit: Newest messages downloaded when a folder is (re)synced from
+                scratch, also the size of a backfill batch
+        """
+        self.mcp = mcp
+        self.state_store = state_store or getattr(mcp, "sync_state", None) or get_sync_state_store()
+        self.initial_limit = initial_limit
+
+    def _status(self, folder: str) -> Dict[str, int]:
+        return self.mcp.get_folder_status(
+            folder, ["MESSAGES", "UIDNEXT", "UIDVALIDITY", "HIGHESTMODSEQ"], use_cache=False)
+
+    def has_changes(self, folder: str = "INBOX") -> bool:
+        """
+        Check with a single STATUS call whether a folder changed since the last sync
+
+        Args:
+            folder: Mailbox folder name
+
+        Returns:
+            True if new mail, flag changes or expunges may have happened
+        """
+        checkpoint = self.state_store.get(self.mcp.get_account_id(), folder)
+        if not checkpoint:
+            return True
+
+        status = self._status(folder)
+        if not status:
+            return True
+        return self._status_changed(checkpoint, status)
+
+    def sync(self, folder: str = "INBOX", max_messages: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Bring a folder up to date with its last checkpoint
+
+        Args:
+            folder: Mailbox folder name
+            max_messages: Download at most this many messages in this run,
+                the rest is picked up by the next call (has_more is set)
+
+        Returns:
+            Dictionary with keys:
+                changed: Whether anything changed since the last checkpoint
+                full_resync: Whether the folder was synced from scratch
+                new_emails: Newly downloaded EmailRecord objects (oldest first)
+                flag_changes: {uid: [flags]} for messages whose flags changed
+                vanished: UIDs expunged since the last sync
+                backfilled: Number of older messages indexed by the backfill
+                has_more: Whether new or older messages remain to be downloaded
+        """
+        result = {
+            "folder": folder,
+            "changed": False,
+            "full_resync": False,
+            "new_emails": [],
+            "flag_changes": {},
+            "vanished": [],
+            "backfilled": 0,
+            "has_more": False
+        }
+
+        if not self.mcp.is_connected():
+            result["error"] = "Not connected"
+            return result
+
+        account = self.mcp.get_account_id()
+        checkpoint = self.state_store.get(account, folder)
+        status = self._status(folder)
+
+        if checkpoint and status and not self._status_changed(checkpoint, status):
+            if not checkpoint.get("complete") and checkpoint.get("uidvalidity") == status.get("UIDVALIDITY"):
+                result["backfilled"] = self.backfill(folder, max_messages)
+                result["has_more"] = bool(result["backfilled"]) and not self.is_complete(folder)
+            return result
+
+        result["changed"] = True
+        condstore = self.mcp.has_capability("CONDSTORE")
+        # ENABLE QRESYNC is sent by the connection pool right after login
+        qresync = self.mcp.is_enabled("QRESYNC")
+
+        # A fresh SELECT, the checkpoint needs the current UIDNEXT and HIGHESTMODSEQ
+        if not self.mcp.select_folder(folder, force=True):
+            result["error"] = f"Could not select folder {folder}"
+            return result
+
+        uidvalidity = self.mcp.context.get("uidvalidity") or status.get("UIDVALIDITY")
+        highestmodseq = self.mcp.context.get("highestmodseq") or status.get("HIGHESTMODSEQ")
+
+        if not checkpoint or checkpoint.get("uidvalidity") != uidvalidity:
+            # Unknown folder or UIDs were reset by the server, start over
+            result["full_resync"] = True
+            cursor = self._initial_cursor()
+            # Older messages skipped by the initial limit are left to backfill()
+            checkpoint = {"uidvalidity": uidvalidity, "uidnext": cursor, "complete": cursor == 1,
+                          "backfill_cursor": cursor}
+        elif condstore and checkpoint.get("highestmodseq") and highestmodseq != checkpoint["highestmodseq"]:
+            flag_changes, vanished = self._fetch_changes(checkpoint, qresync)
+            result["flag_changes"] = flag_changes
+            result["vanished"] = vanished
+
+        new_uids = self._new_uids(checkpoint.get("uidnext") or 1)
+        if not result["full_resync"] and not qresync:
+            # Fewer messages than the checkpoint plus the new ones means some were expunged
+            expected = None if checkpoint.get("messages") is None else checkpoint["messages"] + len(new_uids)
+            if status.get("MESSAGES") is None or status["MESSAGES"] != expected:
+                result["vanished"] = self._diff_vanished(account, folder, uidvalidity)
+        if max_messages is not None and len(new_uids) > max_messages:
+            result["has_more"] = True
+            new_uids = new_uids[:max_messages]
+
+        if new_uids:
+            # Sync runs in the background, the place to decode bodies for the full-text index
+            result["new_emails"] = self.mcp.fetch_emails(new_uids, index_bodies=True)
+
+        # New mail is indexed by fetch_emails, keep the rest of the indexes current
+        if self.mcp.search_index and result["flag_changes"]:
+            try:
+                self.mcp.search_index.update_flags(account, folder, uidvalidity, result["flag_changes"])
+            except Exception as e:
+                print(f"Error updating search index: {e}")
+        self.mcp.forget_emails(result["vanished"])
+
+        # Only advance past what was actually downloaded
+        if result["has_more"]:
+            uidnext = new_uids[-1] + 1
+        else:
+            uidnext = self.mcp.context.get("uidnext") or status.get("UIDNEXT") or (
+                new_uids[-1] + 1 if new_uids else checkpoint.get("uidnext"))
+
+        self.state_store.set(account, folder, {
+            "uidvalidity": uidvalidity,
+            "uidnext": uidnext,
+            "highestmodseq": highestmodseq,
+            "messages": status.get("MESSAGES") if not result["has_more"] else None,
+            "complete": bool(checkpoint.get("complete")),
+            "backfill_cursor": checkpoint.get("backfill_cursor"),
+            "last_sync": time.time()
+        })
+
+        if not checkpoint.get("complete"):
+            # The first run stops at the initial limit, later ones fill in older mail
+            if not result["full_resync"] and not result["has_more"]:
+                budget = None if max_messages is None else max_messages - len(new_uids)
+                if budget is None or budget > 0:
+                    result["backfilled"] = self.backfill(folder, budget)
+            if result["full_resync"] or result["backfilled"]:
+                result["has_more"] = result["has_more"] or not self.is_complete(folder)
+        return result
+
+    def backfill(self, folder: str = "INBOX", max_messages: Optional[int] = None) -> int:
+        """
+        Index messages older than the backfill cursor of an incomplete folder
+
+        Downloads the newest messages below the cursor, at most max_messages
+        (defaults to initial_limit) per call, and moves the cursor down to
+        the oldest of them. The checkpoint is marked complete once no older
+        message is left, so an interrupted backfill resumes where it stopped.
+
+        Args:
+            folder: Mailbox folder name
+            max_messages: Download at most this many messages in this call
+
+        Returns:
+            Number of messages downloaded
+        """
+        account = self.mcp.get_account_id()
+        checkpoint = self.state_store.get(account, folder)
+        if not checkpoint or checkpoint.get("complete"):
+            return 0
+        if not self.mcp.select_folder(folder):
+            return 0
+        if self.mcp.context.get("uidvalidity") != checkpoint.get("uidvalidity"):
+            # The next sync starts over from scratch
+            return 0
+
+        cursor = checkpoint.get("backfill_cursor") or checkpoint.get("uidnext") or 1
+        older = self.mcp.search_uids(f"UID 1:{cursor - 1}") if cursor > 1 else []
+        if older is None:
+            return 0
+        older = [uid for uid in older if uid < cursor]
+        batch = older[-(max_messages or self.initial_limit):] if older else []
+        if batch and not self.mcp.fetch_emails(batch, index_bodies=True):
+            # Keep the cursor, the next call tries the same batch again
+            return 0
+
+        self.state_store.set(account, folder, dict(
+            checkpoint, backfill_cursor=batch[0] if batch else 1, complete=len(batch) == len(older)))
+        return len(batch)
+
+    def is_complete(self, folder: str = "INBOX") -> bool:
+        """Whether every message of a folder has been downloaded at least once"""
+        checkpoint = self.state_store.get(self.mcp.get_account_id(), folder)
+        return bool(checkpoint and checkpoint.get("complete"))
+
+    @staticmethod
+    def _status_changed(checkpoint: Dict[str, Any], status: Dict[str, int]) -> bool:
+        if status.get("UIDVALIDITY") != checkpoint.get("uidvalidity"):
+            return True
+        if status.get("UIDNEXT") != checkpoint.get("uidnext"):
+            return True
+        if status.get("MESSAGES") != checkpoint.get("messages"):
+            return True
+        return "HIGHESTMODSEQ" in status and status["HIGHESTMODSEQ"] != checkpoint.get("highestmodseq")
+
+    def _initial_cursor(self) -> int:
+        """UID to start from when (re)syncing a folder from scratch, 1 if every message fits"""
+        uids = self.mcp.search_uids('ALL')
+        if not uids or len(uids) <= self.initial_limit:
+            return 1
+        return uids[-self.initial_limit]
+
+    def _new_uids(self, uidnext: int) -> List[int]:
+        """UIDs at or above the checkpoint cursor, in ascending order"""
+        status, data = self.mcp.imap_conn.uid('SEARCH', None, f'UID {uidnext}:*')
+        if status != "OK" or not data or not data[0]:
+            return []
+        # "n:*" always matches the highest UID, even when it is below n
+        return sorted(uid for uid in (int(u) for u in data[0].split()) if uid >= uidnext)
+
+    def _diff_vanished(self, account: str, folder: str, uidvalidity: int) -> List[int]:
+        """UIDs held locally that the server no longer has (for servers without QRESYNC)"""
+        if not self.mcp.search_index:
+            return []
+        try:
+            known = self.mcp.search_index.uids(account, folder, uidvalidity)
+        except Exception as e:
+            print(f"Error reading search index: {e}")
+            return []
+        if not known:
+            return []
+        present = self.mcp.search_uids(f"UID {known[0]}:{known[-1]}")
+        if present is None:
+            return []
+        return sorted(set(known) - set(present))
+
+    def _fetch_changes(self, checkpoint: Dict[str, Any], qresync: bool = False):
+        """Pull flag changes (and vanished UIDs under QRESYNC) since the checkpoint"""
+        known = f"1:{max(1, (checkpoint.get('uidnext') or 2) - 1)}"
+        modifier = f"(CHANGEDSINCE {checkpoint['highestmodseq']}"
+        modifier += " VANISHED)" if qresync else ")"
+
+        flag_changes = {}
+        vanished = []
+        try:
+            status, data = self.mcp.imap_conn.uid('FETCH', known, '(UID FLAGS)', modifier)
+            if status == "OK":
+                for message in parse_fetch_response(data):
+                    if message["uid"] is not None:
+                        flag_changes[message["uid"]] = message["flags"]
+
+            for line in self.mcp.imap_conn.untagged_responses.pop('VANISHED', []):
+                text = line.decode() if isinstance(line, bytes) else str(line)
+                vanished.extend(expand_uid_set(re.sub(r'^\(EARLIER\)\s*', '', text)))
+        except Exception as e:
+            print(f"Error fetching changes since modseq {checkpoint.get('highestmodseq')}: {e}")
+
+        return flag_changes, vanished
@@ -0,0 +1,349 @@
+"""
+Server-side message references for MailoBot
+
+Actions hand compact envelopes with an opaque ref (plus a short preview) to
+the tracker and the frontend instead of full email bodies. The ref maps to
+(account, folder, UIDVALIDITY, UID) in a small SQLite table, and the body is
+loaded on demand through the /api/messages/<ref> endpoint, so the size of
+each turn no longer depends on how long the emails are.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Iterable, Optional
+
+from utils.email_mcp import EmailMCP
+
+# Characters of body text included in a compact envelope
+DEFAULT_PREVIEW_CHARS = 160
+
+# Newest messages of a thread downloaded for a draft prompt
+DEFAULT_THREAD_MESSAGES = 10
+
+
+def _default_refs_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'cache', 'message_refs.db')
+
+
+def make_ref(account: str, folder: str, uidvalidity: int, uid: Any) -> str:
+    """Stable opaque reference of a message (the same message always gets the same ref)"""
+    identity = f"{account}\0{folder}\0{uidvalidity}\0{uid}".encode('utf-8')
+    return hashlib.sha1(identity).hexdigest()[:20]
+
+
+class MessageRefStore:
+    """
+    Maps message refs to their location on the IMAP server
+
+    Example:
+        refs = get_message_ref_store()
+        ref = refs.register(account, "INBOX", uidvalidity, 42)
+        location = refs.resolve(ref)
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the store
+
+        Args:
+            path: SQLite database file (defaults to settings/cache/message_refs.db)
+        """
+        self.path = path or _default_refs_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS refs (
+                ref TEXT PRIMARY KEY,
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                message_id TEXT,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_refs_access ON refs (last_access);
+        """)
+        self._db.commit()
+
+    def register(self, account: str, folder: str, uidvalidity: int, uid: Any,
+                 message_id: Optional[str] = None) -> str:
+        """Record a message and return its ref"""
+        return self.register_many([(account, folder, uidvalidity, uid, message_id)])[0]
+
+    def register_many(self, messages: Iterable[tuple]) -> List[str]:
+        """
+        Record several messages in one transaction
+
+        Args:
+            messages: (account, folder, uidvalidity, uid, message_id) tuples
+
+        Returns:
+            Refs in the same order
+        """
+        now = time.time()
+        refs = []
+        with self._lock:
+            for account, folder, uidvalidity, uid, message_id in messages:
+                ref = make_ref(account, folder, uidvalidity, uid)
+                self._db.execute(
+                    "INSERT INTO refs (ref, account, folder, uidvalidity, uid, message_id, created, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(ref) DO UPDATE SET last_access=excluded.last_access",
+                    (ref, account, folder, int(uidvalidity), int(uid), message_id, now, now))
+                refs.append(ref)
+            self._db.commit()
+        return refs
+
+    def resolve(self, ref: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up where a referenced message lives
+
+        Returns:
+            Dictionary with account, folder, uidvalidity, uid and message_id, or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT account, folder, uidvalidity, uid, message_id FROM refs WHERE ref=?", (ref,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE refs SET last_access=? WHERE ref=?", (time.time(), ref))
+            self._db.commit()
+        return dict(row)
+
+    def purge(self, older_than: float = 30 * 24 * 3600) -> int:
+        """Forget refs not used for the given number of seconds"""
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM refs WHERE last_access<?", (time.time() - older_than,)).rowcount
+            self._db.commit()
+        return deleted
+
+
+_default_store: Optional[MessageRefStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_message_ref_store() -> MessageRefStore:
+    """Get the process-wide message ref store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = MessageRefStore()
+    return _default_store
+
+
+def _preview(email: Any, preview_chars: int) -> str:
+    # Envelopes would download the message to produce a preview, only use loaded bodies
+    if getattr(email, "is_loaded", True) is False or preview_chars <= 0:
+        return ""
+    body = email.get("body") or ""
+    text = re.sub(r'\s+', ' ', body[:preview_chars * 2]).strip()
+    return text[:preview_chars] + ("..." if len(text) > preview_chars or len(body) > preview_chars * 2 else "")
+
+
+def compact_emails(mcp: EmailMCP, emails: Iterable[Any],
+                   preview_chars: int = DEFAULT_PREVIEW_CHARS) -> List[Dict[str, Any]]:
+    """
+    Turn emails into compact envelopes with a ref instead of the body
+
+    Args:
+        mcp: EmailMCP the emails were fetched with (provides the account and UIDVALIDITY)
+        emails: EmailRecord, EmailEnvelope or email dictionaries (e.g. local search hits)
+        preview_chars: Characters of body text to include as preview
+
+    Returns:
+        List of dictionaries with ref, id, message_id, subject, from, to, date,
+        read, has_attachments, folder and preview
+    """
+    account = mcp.get_account_id()
+    current_folder = mcp.context.get("current_folder")
+    current_uidvalidity = mcp.context.get("uidvalidity")
+
+    envelopes = []
+    locations = []
+    for email_data in emails:
+        folder = email_data.get("folder") or current_folder
+        uidvalidity = email_data.get("uidvalidity") or (current_uidvalidity if folder == current_folder else None)
+        envelope = {
+            "ref": None,
+            "id": email_data.get("id"),
+            "message_id": email_data.get("message_id"),
+            "subject": email_data.get("subject") or "",
+            "from": email_data.get("from") or "",
+            "to": email_data.get("to") or "",
+            "date": email_data.get("date"),
+            "read": bool(email_data.get("read")),
+            "has_attachments": bool(email_data.get("has_attachments")),
+            "folder": folder,
+            "preview": _preview(email_data, preview_chars)
+        }
+        envelopes.append(envelope)
+        if uidvalidity and envelope["id"] is not None:
+            locations.append((envelope, (account, folder, uidvalidity, envelope["id"], envelope["message_id"])))
+
+    if locations:
+        try:
+            refs = get_message_ref_store().register_many([location for _, location in locations])
+            for (envelope, _), ref in zip(locations, refs):
+                envelope["ref"] = ref
+        except Exception as e:
+            print(f"Error registering message refs: {e}")
+    return envelopes
+
+
+def load_referenced_email(settings: Dict[str, Any], ref: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the full email behind a ref
+
+    Args:
+        settings: Email settings of the account the ref belongs to
+        ref: Message ref from compact_emails()
+
+    Returns:
+        Email dictionary (with body and attachments) or None if the ref is
+        unknown, belongs to another account or the message no longer exists
+    """
+    location = get_message_ref_store().resolve(ref)
+    if location is None:
+        return None
+
+    mcp = EmailMCP(settings)
+    if location["account"] != mcp.get_account_id():
+        return None
+    try:
+        if not mcp.connect() or not mcp.select_folder(location["folder"], readonly=True):
+            return None
+        if mcp.context.get("uidvalidity") != location["uidvalidity"]:
+            # The folder was recreated, its UIDs now name other messages
+            return None
+        email_data = mcp.fetch_email(location["uid"])
+        if email_data is None:
+            return None
+        result = email_data.to_dict() if hasattr(email_data, "to_dict") else dict(email_data)
+        result["ref"] = ref
+        return result
+    except Exception as e:
+        print(f"Error loading referenced email: {e}")
+        return None
+    finally:
+        mcp.disconnect()
+
+
+def load_thread_refs(settings: Dict[str, Any], ref: Optional[str] = None, uid: Any = None,
+                     folder: str = "INBOX", max_messages: int = DEFAULT_THREAD_MESSAGES) -> List[str]:
+    """
+    Refs of the messages of the conversation a message belongs to
+
+    The thread is looked up in the local thread index (see
+    EmailMCP.get_thread); no body is downloaded. The refs are small enough
+    for a slot, load_thread_emails() turns them into emails when the draft
+    prompt is rendered.
+
+    Args:
+        settings: Email settings of the account
+        ref: Message ref from compact_emails() of any message of the thread
+        uid: UID of the message in folder, used when no ref is given
+        folder: Folder of uid
+        max_messages: Newest messages of the thread to include
+
+    Returns:
+        Refs in chronological order, empty if the message is unknown
+    """
+    message_id = None
+    location = None
+    if ref:
+        location = get_message_ref_store().resolve(ref)
+        if location is None:
+            return []
+        folder, uid, message_id = location["folder"], location["uid"], location["message_id"]
+    if uid is None:
+        return []
+
+    mcp = EmailMCP(settings)
+    account = mcp.get_account_id()
+    if location and location["account"] != account:
+        return []
+    try:
+        if not mcp.connect() or not mcp.select_folder(folder, readonly=True):
+            return []
+        if not message_id:
+            # Listing the envelope also links the message into the thread index
+            envelopes = mcp.list_envelopes([uid])
+            if not envelopes:
+                return []
+            message_id = envelopes[0]["message_id"]
+
+        entries = mcp.get_thread(message_id)[-max_messages:]
+        return get_message_ref_store().register_many([
+            (account, entry["folder"], entry["uidvalidity"], entry["id"], entry["message_id"])
+            for entry in entries])
+    except Exception as e:
+        print(f"Error loading email thread: {e}")
+        return []
+    finally:
+        mcp.disconnect()
+
+
+def load_thread_emails(settings: Dict[str, Any], refs: List[str]) -> List[Dict[str, Any]]:
+    """
+    Load the emails behind thread refs, one batched fetch per folder
+
+    Args:
+        settings: Email settings of the account
+        refs: Refs from load_thread_refs(), in chronological order
+
+    Returns:
+        Emails (message_id, subject, from, date, body) in the order of the
+        refs; unknown refs and messages that no longer exist are left out
+    """
+    mcp = EmailMCP(settings)
+    store = get_message_ref_store()
+    entries = [location for location in (store.resolve(ref) for ref in refs)
+               if location and location["account"] == mcp.get_account_id()]
+    if not entries:
+        return []
+
+    try:
+        if not mcp.connect():
+            return []
+        by_folder = {}
+        for entry in entries:
+            by_folder.setdefault((entry["folder"], entry["uidvalidity"]), []).append(entry["uid"])
+
+        loaded = {}
+        for (folder, uidvalidity), uids in by_folder.items():
+            if not mcp.select_folder(folder, readonly=True):
+                continue
+            if mcp.context.get("uidvalidity") != uidvalidity:
+                # The folder was recreated since the message was indexed
+                continue
+            for email_data in mcp.fetch_emails(uids):
+                loaded[(folder, str(email_data["id"]))] = email_data
+
+        thread = []
+        for entry in entries:
+            email_data = loaded.get((entry["folder"], str(entry["uid"])))
+            if email_data is None:
+                continue
+            thread.append({
+                "message_id": entry["message_id"],
+                "subject": email_data.get("subject") or "",
+                "from": email_data.get("from") or "",
+                "date": email_data.get("date"),
+                "body": email_data.get("body") or ""
+            })
+        return thread
+    except Exception as e:
+        print(f"Error loading email thread: {e}")
+        return []
+    finally:
+        mcp.disconnect()
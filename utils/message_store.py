@@ -0,0 +1,307 @@
+"""
+Persistent local store of raw messages for MailoBot
+
+Metadata lives in SQLite, raw messages are content-addressed blobs on disk.
+Entries are keyed by (account, folder, UIDVALIDITY, UID), so a message is
+downloaded at most once and a UIDVALIDITY change invalidates the folder.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Iterable, Optional
+
+
+def _default_cache_dir() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'cache')
+
+
+class BlobWriter:
+    """
+    A message blob written incrementally (e.g. straight from the socket)
+
+    Data goes to a temporary file next to the blobs while it is hashed, and
+    commit() moves it into place under its content hash.
+    """
+
+    def __init__(self, store: "MessageStore"):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.blob_dir, suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def commit(self, account: str, folder: str, uidvalidity: int, uid: int):
+        """Finish the blob and record it for the given message"""
+        self._file.close()
+        self.store._add_blob(account, folder, uidvalidity, uid,
+                             self._hash.hexdigest(), self.size, self.tmp_path)
+
+    def abort(self):
+        """Discard the partially written blob"""
+        try:
+            self._file.close()
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class MessageStore:
+    """
+    SQLite metadata plus content-addressed blob files with size-based LRU eviction
+    """
+
+    # Total size of stored blobs before least recently used entries are evicted
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 verify_hash: bool = False):
+        """
+        Initialize the store
+
+        Args:
+            cache_dir: Directory holding messages.db and blobs/ (defaults to settings/cache)
+            max_bytes: Maximum total blob size kept on disk
+            verify_hash: Re-hash blobs on read to detect corruption (size is always checked)
+        """
+        self.cache_dir = cache_dir or _default_cache_dir()
+        self.blob_dir = os.path.join(self.cache_dir, 'blobs')
+        self.max_bytes = max_bytes
+        self.verify_hash = verify_hash
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalid": 0}
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.cache_dir, 'messages.db'), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                blob_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (account, folder, uidvalidity, uid)
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_messages_access ON messages (last_access)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_messages_blob ON messages (blob_hash)")
+        self._db.commit()
+
+    def _blob_path(self, blob_hash: str) -> str:
+        return os.path.join(self.blob_dir, blob_hash[:2], blob_hash)
+
+    def get(self, account: str, folder: str, uidvalidity: int, uid: int) -> Optional[bytes]:
+        """
+        Read a stored message
+
+        Returns:
+            Raw message bytes, or None if not stored or no longer valid
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT blob_hash, size FROM messages WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                (account, folder, uidvalidity, int(uid))).fetchone()
+            if not row:
+                self._stats["misses"] += 1
+                return None
+
+            blob_hash, size = row
+            raw = self._read_blob(blob_hash, size)
+            if raw is None:
+                # Blob went missing or is corrupt, forget the entry
+                self._stats["invalid"] += 1
+                self._stats["misses"] += 1
+                self._delete_entry(account, folder, uidvalidity, uid, blob_hash)
+                self._db.commit()
+                return None
+
+            self._db.execute(
+                "UPDATE messages SET last_access=? WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                (time.time(), account, folder, uidvalidity, int(uid)))
+            self._db.commit()
+            self._stats["hits"] += 1
+            return raw
+
+    def get_path(self, account: str, folder: str, uidvalidity: int, uid: int) -> Optional[str]:
+        """
+        Get the blob file path of a stored message, for streaming reads
+
+        Returns:
+            Path of the raw message file, or None if not stored or no longer valid
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT blob_hash, size FROM messages WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                (account, folder, uidvalidity, int(uid))).fetchone()
+            if not row:
+                self._stats["misses"] += 1
+                return None
+
+            blob_hash, size = row
+            path = self._blob_path(blob_hash)
+            try:
+                valid = os.path.getsize(path) == size
+            except OSError:
+                valid = False
+            if not valid:
+                self._stats["invalid"] += 1
+                self._stats["misses"] += 1
+                self._delete_entry(account, folder, uidvalidity, uid, blob_hash)
+                self._db.commit()
+                return None
+
+            self._db.execute(
+                "UPDATE messages SET last_access=? WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                (time.time(), account, folder, uidvalidity, int(uid)))
+            self._db.commit()
+            self._stats["hits"] += 1
+            return path
+
+    def put(self, account: str, folder: str, uidvalidity: int, uid: int, raw: bytes):
+        """Store a raw message and evict old entries if over the size budget"""
+        writer = self.open_writer()
+        try:
+            writer.write(raw)
+        except Exception:
+            writer.abort()
+            raise
+        writer.commit(account, folder, uidvalidity, uid)
+
+    def open_writer(self) -> BlobWriter:
+        """Start writing a message incrementally, see BlobWriter"""
+        return BlobWriter(self)
+
+    def _add_blob(self, account: str, folder: str, uidvalidity: int, uid: int,
+                  blob_hash: str, size: int, tmp_path: str):
+        """Move a finished temporary file into place and record the entry"""
+        path = self._blob_path(blob_hash)
+
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (account, folder, uidvalidity, int(uid), blob_hash, size, now, now))
+            self._stats["stores"] += 1
+            self._evict_locked()
+            self._db.commit()
+
+    def purge_stale(self, account: str, folder: str, uidvalidity: int) -> int:
+        """
+        Drop entries of a folder stored under a different UIDVALIDITY
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uidvalidity, uid, blob_hash FROM messages WHERE account=? AND folder=? AND uidvalidity!=?",
+                (account, folder, uidvalidity)).fetchall()
+            for old_validity, uid, blob_hash in rows:
+                self._delete_entry(account, folder, old_validity, uid, blob_hash)
+            self._stats["invalid"] += len(rows)
+            self._db.commit()
+            return len(rows)
+
+    def remove(self, account: str, folder: str, uidvalidity: int, uids: Iterable[int]) -> int:
+        """
+        Drop entries of messages that left a folder
+
+        Returns:
+            Number of entries removed
+        """
+        removed = 0
+        with self._lock:
+            for uid in uids:
+                row = self._db.execute(
+                    "SELECT blob_hash FROM messages WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                    (account, folder, uidvalidity, int(uid))).fetchone()
+                if row:
+                    self._delete_entry(account, folder, uidvalidity, uid, row[0])
+                    removed += 1
+            self._db.commit()
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and the current store size"""
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM messages").fetchone()
+            stats = dict(self._stats)
+        stats["entries"] = count
+        stats["bytes"] = total
+        return stats
+
+    def _read_blob(self, blob_hash: str, size: int) -> Optional[bytes]:
+        try:
+            with open(self._blob_path(blob_hash), 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return None
+        if len(raw) != size:
+            return None
+        if self.verify_hash and hashlib.sha256(raw).hexdigest() != blob_hash:
+            return None
+        return raw
+
+    def _delete_entry(self, account: str, folder: str, uidvalidity: int, uid: int, blob_hash: str):
+        """Remove a row and its blob once nothing else references it, caller holds the lock"""
+        self._db.execute(
+            "DELETE FROM messages WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+            (account, folder, uidvalidity, int(uid)))
+        still_used = self._db.execute(
+            "SELECT 1 FROM messages WHERE blob_hash=? LIMIT 1", (blob_hash,)).fetchone()
+        if not still_used:
+            try:
+                os.remove(self._blob_path(blob_hash))
+            except OSError:
+                pass
+
+    def _evict_locked(self):
+        """Evict least recently used entries until under max_bytes, caller holds the lock"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._db.execute(
+            "SELECT account, folder, uidvalidity, uid, blob_hash, size FROM messages ORDER BY last_access")
+        victims = []
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            victims.append(row)
+            total -= row[5]
+
+        for account, folder, uidvalidity, uid, blob_hash, _ in victims:
+            self._delete_entry(account, folder, uidvalidity, uid, blob_hash)
+        self._stats["evictions"] += len(victims)
+
+
+_default_store: Optional[MessageStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_message_store() -> MessageStore:
+    """Get the process-wide message store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = MessageStore()
+    return _default_store
@@ -0,0 +1,299 @@
+"""
+Streaming MIME parser for MailoBot
+
+Parses a message fed in chunks as it arrives from the socket (or from the
+local message store). Part headers are parsed with email.parser.BytesFeedParser,
+part bodies are transfer-decoded line by line into spooled temporary files
+that move to disk once they grow past a threshold. Text bodies and attachment
+metadata come out of a single pass, and memory per message stays bounded by
+the spool threshold instead of the message size.
+"""
+import base64
+import binascii
+import quopri
+import re
+import tempfile
+from email.message import Message
+from email.parser import BytesFeedParser
+from typing import Dict, List, Any, Iterable, Optional
+
+# Parts larger than this are moved from memory to a temporary file
+DEFAULT_SPOOL_THRESHOLD = 256 * 1024
+
+# Chunk size used when feeding from files or in-memory bytes
+FEED_CHUNK_SIZE = 64 * 1024
+
+_BLANK_LINES = (b'\r\n', b'\n', b'')
+
+
+class StreamedPart:
+    """A leaf MIME part whose decoded content is spooled"""
+
+    def __init__(self, headers: Message, spool_threshold: int):
+        self.headers = headers
+        self.content_type = headers.get_content_type()
+        self.charset = headers.get_content_charset() or ""
+        self.filename = headers.get_filename() or ""
+        self.disposition = str(headers.get("Content-Disposition") or "")
+        self.has_disposition = headers.get("Content-Disposition") is not None
+        self.encoding = str(headers.get("Content-Transfer-Encoding", "7bit")).strip().lower()
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        self._pending = b""
+
+    @property
+    def is_attachment(self) -> bool:
+        return "attachment" in self.disposition
+
+    @property
+    def spooled_to_disk(self) -> bool:
+        return bool(getattr(self.file, '_rolled', False))
+
+    def write_line(self, line: bytes, partial: bool = False) -> bool:
+        """
+        Transfer-decode a raw body line and append it to the spool
+
+        Args:
+            line: Line content without its line break
+            partial: The line is not complete yet, the rest follows in the next call
+
+        Returns:
+            True if the line ends in a quoted-printable soft line break
+        """
+        soft_break = False
+        if self.encoding == "base64":
+            data = self._pending + re.sub(rb'[^A-Za-z0-9+/=]', b'', line)
+            usable = len(data) - len(data) % 4
+            self._pending = data[usable:]
+            try:
+                decoded = base64.b64decode(data[:usable]) if usable else b""
+            except (binascii.Error, ValueError):
+                decoded = b""
+        elif self.encoding == "quoted-printable":
+            data = self._pending + line
+            self._pending = b""
+            if partial:
+                # An =XX escape may be cut by the flush, keep its start for the rest of the line
+                cut = data.rfind(b"=", max(len(data) - 2, 0))
+                if cut >= 0:
+                    data, self._pending = data[:cut], data[cut:]
+            elif data.endswith(b"="):
+                # Soft line break, the next line continues this one
+                data = data[:-1]
+                soft_break = True
+            decoded = quopri.decodestring(data)
+        else:
+            decoded = line
+        if decoded:
+            self.file.write(decoded)
+            self.size += len(decoded)
+        return soft_break
+
+    def write_eol(self, eol: bytes):
+        """Append a line break between two body lines (insignificant in base64)"""
+        if self.encoding != "base64":
+            self.file.write(eol)
+            self.size += len(eol)
+
+    def read(self, limit: Optional[int] = None) -> bytes:
+        """Read the decoded content (optionally only the first limit bytes)"""
+        self.file.seek(0)
+        return self.file.read() if limit is None else self.file.read(limit)
+
+    def text(self, limit: Optional[int] = None) -> str:
+        """Decode the content as text using the part charset"""
+        data = self.read(limit)
+        try:
+            return data.decode(self.charset or "utf-8", errors="replace")
+        except LookupError:
+            return data.decode("utf-8", errors="replace")
+
+    def close(self):
+        try:
+            self.file.close()
+        except Exception:
+            pass
+
+
+class ParsedEmail:
+    """Result of a streaming parse: top-level headers plus leaf parts"""
+
+    def __init__(self, headers: Message, parts: List[StreamedPart], is_multipart: bool):
+        self.headers = headers
+        self.parts = parts
+        self.is_multipart = is_multipart
+
+    def get(self, name: str, default: Any = None):
+        return self.headers.get(name, default)
+
+    def __getitem__(self, name: str):
+        return self.headers[name]
+
+    @property
+    def attachments(self) -> List[Dict[str, Any]]:
+        """Attachment metadata (parts with a Content-Disposition and a filename)"""
+        return [{
+            "filename": part.filename,
+            "content_type": part.content_type,
+            "size": part.size
+        } for part in self.parts if part.has_disposition and part.filename]
+
+    def find_body_part(self, content_type: str) -> Optional[StreamedPart]:
+        """First non-attachment part of the given content type"""
+        for part in self.parts:
+            if part.content_type == content_type and not part.is_attachment:
+                return part
+        return None
+
+    def close(self):
+        """Release spooled part files"""
+        for part in self.parts:
+            part.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StreamingMimeParser:
+    """
+    Incremental MIME parser
+
+    Example:
+        parser = StreamingMimeParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        with parser.close() as parsed:
+            body = parsed.find_body_part("text/plain").text()
+    """
+
+    def __init__(self, spool_threshold: int = DEFAULT_SPOOL_THRESHOLD):
+        """
+        Initialize the parser
+
+        Args:
+            spool_threshold: Bytes a part may hold in memory before it is spooled to disk
+        """
+        self.spool_threshold = spool_threshold
+        self._buffer = b""
+        self._boundaries: List[bytes] = []
+        self._state = "headers"
+        self._header_parser = BytesFeedParser()
+        self._top_headers: Optional[Message] = None
+        self._top_multipart = False
+        self._part: Optional[StreamedPart] = None
+        self._pending_eol = b""
+        self._parts: List[StreamedPart] = []
+
+    def feed(self, data: bytes):
+        """Feed the next chunk of the raw message"""
+        self._buffer += data
+        start = 0
+        while True:
+            end = self._buffer.find(b'\n', start)
+            if end < 0:
+                break
+            self._process_line(self._buffer[start:end + 1])
+            start = end + 1
+        self._buffer = self._buffer[start:]
+
+        # Very long lines inside a body are flushed without waiting for the newline
+        if self._state == "body" and len(self._buffer) > self.spool_threshold:
+            self._write_body(self._buffer, eol=b"", partial=True)
+            self._buffer = b""
+
+    def close(self) -> ParsedEmail:
+        """Finish parsing and return the parsed message"""
+        if self._buffer:
+            self._process_line(self._buffer)
+            self._buffer = b""
+        if self._state == "headers":
+            self._finish_headers()
+        self._flush_part()
+        return ParsedEmail(self._top_headers or Message(), self._parts, self._top_multipart)
+
+    def _process_line(self, line: bytes):
+        if self._boundaries and line.startswith(b'--'):
+            stripped = line.rstrip()
+            for depth in range(len(self._boundaries) - 1, -1, -1):
+                boundary = self._boundaries[depth]
+                if stripped == b'--' + boundary:
+                    self._flush_part()
+                    del self._boundaries[depth + 1:]
+                    self._state = "headers"
+                    self._header_parser = BytesFeedParser()
+                    return
+                if stripped == b'--' + boundary + b'--':
+                    self._flush_part()
+                    del self._boundaries[depth:]
+                    self._state = "epilogue"
+                    return
+
+        if self._state == "headers":
+            self._header_parser.feed(line)
+            if line in _BLANK_LINES or line.strip() == b"":
+                self._finish_headers()
+        elif self._state == "body":
+            content, eol = _split_eol(line)
+            self._write_body(content, eol)
+        # preamble and epilogue lines are ignored
+
+    def _finish_headers(self):
+        headers = self._header_parser.close()
+        if self._top_headers is None:
+            self._top_headers = headers
+            self._top_multipart = headers.get_content_maintype() == "multipart"
+
+        boundary = headers.get_boundary() if headers.get_content_maintype() == "multipart" else None
+        if boundary:
+            self._boundaries.append(boundary.encode('utf-8', errors='replace'))
+            self._state = "preamble"
+        else:
+            self._part = StreamedPart(headers, self.spool_threshold)
+            self._pending_eol = b""
+            self._state = "body"
+
+    def _write_body(self, content: bytes, eol: bytes, partial: bool = False):
+        # The line break before a boundary belongs to the boundary, so delay it
+        if self._part is None:
+            return
+        if self._pending_eol:
+            self._part.write_eol(self._pending_eol)
+        soft_break = self._part.write_line(content, partial)
+        self._pending_eol = b"" if soft_break else eol
+
+    def _flush_part(self):
+        if self._part is not None:
+            self._parts.append(self._part)
+            self._part = None
+            self._pending_eol = b""
+
+
+def _split_eol(line: bytes):
+    if line.endswith(b'\r\n'):
+        return line[:-2], b'\r\n'
+    if line.endswith(b'\n'):
+        return line[:-1], b'\n'
+    return line, b""
+
+
+def parse_chunks(chunks: Iterable[bytes], spool_threshold: int = DEFAULT_SPOOL_THRESHOLD) -> ParsedEmail:
+    """Parse a message from an iterable of byte chunks"""
+    parser = StreamingMimeParser(spool_threshold)
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+def parse_bytes(raw: bytes, spool_threshold: int = DEFAULT_SPOOL_THRESHOLD) -> ParsedEmail:
+    """Parse an in-memory message"""
+    return parse_chunks((raw[i:i + FEED_CHUNK_SIZE] for i in range(0, len(raw), FEED_CHUNK_SIZE)),
+                        spool_threshold)
+
+
+def parse_file(path: str, spool_threshold: int = DEFAULT_SPOOL_THRESHOLD) -> ParsedEmail:
+    """Parse a message stored in a file without reading it into memory at once"""
+    with open(path, 'rb') as f:
+        return parse_chunks(iter(lambda: f.read(FEED_CHUNK_SIZE), b""), spool_threshold)
@@ -1,150 +1,470 @@
 import os
+import threading
+import time
 import yaml
 import requests
 import json
-from typing import Dict, List, Any, Optional, Text
+from requests.adapters import HTTPAdapter
+from typing import Dict, Iterator, List, Any, Optional, Text, Tuple
+
+from utils.llm_cache import LLMCache, get_llm_cache, make_cache_key
+from utils.llm_limiter import RateLimiter, SingleFlight
+
+
+def _default_config_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'config', 'openai.yml')
+
+
+def _get_default_config() -> Dict[str, Any]:
+    """Get default configuration when config file is not available"""
+    return {
+        "api": {"endpoint": "https://api.openai.com/v1", "api_key_env": "OPENAI_API_KEY"},
+        "models": {"default": "gpt-3.5-turbo", "draft_generator": "gpt-3.5-turbo"},
+        "parameters": {
+            "rephraser": {"temperature": 0.3, "max_tokens": 50},
+            "draft_generator": {"temperature": 0.7, "max_tokens": 800}
+        },
+        "prompts": {
+            "main_flow": "You are an AI email assistant."
+        }
+    }
+
+
+class _ConfigCache:
+    """Parsed config files, re-read only when their modification time changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> (mtime, config)
+        self._entries: Dict[str, Tuple[Optional[float], Dict[str, Any]]] = {}
+        self.reloads = 0
+
+    def load(self, config_path: str) -> Dict[str, Any]:
+        try:
+            mtime = os.stat(config_path).st_mtime
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            entry = self._entries.get(config_path)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+
+            config = self._read(config_path, mtime)
+            if entry is not None:
+                self.reloads += 1
+            self._entries[config_path] = (mtime, config)
+            return config
+
+    @staticmethod
+    def _read(config_path: str, mtime: Optional[float]) -> Dict[str, Any]:
+        if mtime is None:
+            print(f"OpenAI config file not found at: {config_path}")
+            # Provide minimal default configuration
+            return _get_default_config()
+        try:
+            with open(config_path, 'r') as file:
+                return yaml.safe_load(file) or _get_default_config()
+        except Exception as e:
+            print(f"Error loading OpenAI config: {e}")
+            return _get_default_config()
+
+
+_config_cache = _ConfigCache()
+
+
+def load_openai_config(config_path: Optional[str] = None) -> Dict[str, Any]:
+    """Load the OpenAI configuration, parsing the YAML file only when it changed"""
+    return _config_cache.load(config_path or _default_config_path())
+
 
 class OpenAIClient:
     """
     A utility class for interacting with OpenAI APIs for CALM rephrasing
+
+    Requests go through one pooled HTTP session, so repeated calls reuse the
+    open keep-alive connection instead of paying DNS, TCP and TLS setup each
+    time. Use get_openai_client() to share one client across the process.
+
+    Completions sampled at a low temperature are cached (see utils/llm_cache.py
+    and the cache section of config/openai.yml), so repeated prompts are
+    answered without a request. Identical completions requested at the same
+    time share one request, and all requests pass a rate limiter that queues
+    callers over the quota (rate_limit section of config/openai.yml).
     """
-    
+
+    # Seconds to wait for the connection and for the response
+    DEFAULT_CONNECT_TIMEOUT = 5.0
+    DEFAULT_READ_TIMEOUT = 60.0
+
+    # Keep-alive connections kept per host
+    DEFAULT_POOL_SIZE = 10
+
+    # Requests sampled above this temperature are not cached, their answers are meant to vary
+    DEFAULT_CACHE_MAX_TEMPERATURE = 0.3
+
+    # Times a request throttled with 429/503 is retried after the advertised pause
+    DEFAULT_MAX_RETRIES = 3
+
     def __init__(self, config_path: str = None):
         """Initialize the OpenAI client with configuration"""
         # Use absolute path based on the module location
-        if config_path is None:
-            current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            config_path = os.path.join(current_dir, 'config', 'openai.yml')
-        
-        self.config = self._load_config(config_path)
-        self.api_key = os.environ.get(self.config['api']['api_key_env'])
-        if not self.api_key:
-            raise ValueError(f"OpenAI API key not found in environment variable {self.config['api']['api_key_env']}")
-        
+        self.config_path = config_path or _default_config_path()
+        self._lock = threading.Lock()
+        self._config = None
+        self.limiter = RateLimiter()
+        self._flights = SingleFlight()
+        self._refresh()
+
+        pool_size = int(self.config['api'].get('pool_size', self.DEFAULT_POOL_SIZE))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._stats = {"requests": 0, "errors": 0, "streams": 0, "last_first_token_ms": None}
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """Current configuration (reloaded when the config file changed)"""
+        self._refresh()
+        return self._config
+
+    def _refresh(self):
+        """Pick up a changed config file and recompute the API settings derived from it"""
+        config = load_openai_config(self.config_path)
+        if config is self._config:
+            return
+
+        api = config['api']
+        api_key = os.environ.get(api['api_key_env'])
+        if not api_key:
+            raise ValueError(f"OpenAI API key not found in environment variable {api['api_key_env']}")
+
         # Set base URL and headers
-        self.base_url = self.config['api']['endpoint']
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
+        headers = {
+            "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
-        
+
         # Add organization header if available
-        org_id_env = self.config['api'].get('organization_env')
+        org_id_env = api.get('organization_env')
         if org_id_env and os.environ.get(org_id_env):
-            self.headers["OpenAI-Organization"] = os.environ.get(org_id_env)
-    
-    def _load_config(self, config_path: str) -> Dict[str, Any]:
-        """Load OpenAI configuration from YAML file"""
-        try:
-            if os.path.exists(config_path):
-                with open(config_path, 'r') as file:
-                    return yaml.safe_load(file)
-            else:
-                print(f"OpenAI config file not found at: {config_path}")
-                # Provide minimal default configuration
-                return self._get_default_config()
-        except Exception as e:
-            print(f"Error loading OpenAI config: {e}")
-            return self._get_default_config()
-    
-    def _get_default_config(self) -> Dict[str, Any]:
-        """Get default configuration when config file is not available"""
+            headers["OpenAI-Organization"] = os.environ.get(org_id_env)
+
+        with self._lock:
+            self.api_key = api_key
+            self.base_url = api['endpoint']
+            self.headers = headers
+            self.timeout = (float(api.get('connect_timeout', self.DEFAULT_CONNECT_TIMEOUT)),
+                            float(api.get('read_timeout', self.DEFAULT_READ_TIMEOUT)))
+            self._config = config
+
+        rate_limit = config.get('rate_limit') or {}
+        self.max_retries = int(rate_limit.get('max_retries', self.DEFAULT_MAX_RETRIES))
+        self.limiter.configure(
+            requests_per_minute=float(rate_limit.get('requests_per_minute', RateLimiter.DEFAULT_REQUESTS_PER_MINUTE)),
+            max_concurrent=int(rate_limit.get('max_concurrent', RateLimiter.DEFAULT_MAX_CONCURRENT)),
+            burst=rate_limit.get('burst'),
+            max_wait=float(rate_limit.get('max_wait', RateLimiter.DEFAULT_MAX_WAIT)))
+
+    def _post(self, path: str, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """
+        POST to the API over the pooled session
+
+        Waits for a slot of the rate limiter and retries requests throttled
+        with 429/503 once the pause the server asked for is over. A streamed
+        response keeps its slot until the caller calls self.limiter.release().
+        """
+        self._refresh()
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            keep_slot = False
+            with self._lock:
+                self._stats["requests"] += 1
+            try:
+                response = self.session.post(f"{self.base_url}{path}", headers=self.headers, json=payload,
+                                             timeout=self.timeout, stream=stream)
+                self.limiter.update_from_headers(response.headers, response.status_code)
+                if response.status_code in (429, 503) and attempt < self.max_retries:
+                    # The limiter now holds every caller back until the pause is over
+                    response.close()
+                    continue
+                response.raise_for_status()
+                keep_slot = stream
+                return response
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            finally:
+                if not keep_slot:
+                    self.limiter.release()
+
+    def _response_cache(self, payload: Dict[str, Any], cache: Optional[bool]) -> Optional[LLMCache]:
+        """
+        Cache to use for a request, None if the request bypasses it
+
+        Args:
+            payload: Chat completions request
+            cache: True to always use the cache, False to never use it,
+                None to use it for deterministic requests only
+        """
+        settings = self.config.get('cache') or {}
+        if cache is False or not settings.get('enabled', True):
+            return None
+
+        llm_cache = get_llm_cache(settings)
+        if cache is None:
+            # The API samples at temperature 1 when none is given
+            temperature = float(payload.get('temperature', 1.0))
+            max_temperature = float(settings.get('max_temperature', self.DEFAULT_CACHE_MAX_TEMPERATURE))
+            if temperature > max_temperature or int(payload.get('n', 1)) > 1:
+                llm_cache.count_bypass()
+                return None
+        return llm_cache
+
+    def _build_payload(self, messages: List[Dict[str, Any]], model: Optional[Text], task: Text,
+                       params: Dict[str, Any]) -> Dict[str, Any]:
+        config = self.config
+        if not model:
+            model = config['models'].get(task, config['models']['default'])
+
         return {
-            "api": {"endpoint": "https://api.openai.com/v1", "api_key_env": "OPENAI_API_KEY"},
-            "models": {"default": "gpt-3.5-turbo", "draft_generator": "gpt-3.5-turbo"},
-            "parameters": {
-                "rephraser": {"temperature": 0.3, "max_tokens": 50},
-                "draft_generator": {"temperature": 0.7, "max_tokens": 800}
-            },
-            "prompts": {
-                "main_flow": "You are an AI email assistant."
-            }
+            "model": model,
+            "messages": messages,
+            **config['parameters'].get(task, {}),
+            **params
         }
-    
+
+    def chat_completion(self, messages: List[Dict[str, Any]], model: Text = None,
+                        task: Text = "draft_generator", cache: Optional[bool] = None, **params) -> Text:
+        """
+        Run a chat completion and return the text of the first choice
+
+        Args:
+            messages: Chat messages (role and content)
+            model: Specific model to use (overrides configuration)
+            task: The task type to use for model and parameters
+            cache: Force (True) or skip (False) the response cache; by default
+                only requests at or below the configured temperature are cached
+            **params: Request parameters overriding the configured ones
+
+        Returns:
+            The generated text
+        """
+        payload = self._build_payload(messages, model, task, params)
+
+        key = make_cache_key(payload)
+        llm_cache = self._response_cache(payload, cache)
+        if llm_cache:
+            hit = llm_cache.get(key)
+            if hit is not None:
+                return hit["content"]
+
+        def request() -> Text:
+            result = self._post("/chat/completions", payload).json()
+            if 'choices' in result and len(result['choices']) > 0:
+                content = result['choices'][0]['message']['content'].strip()
+                if llm_cache:
+                    llm_cache.put(key, payload["model"], content, result.get('usage'))
+                return content
+            raise ValueError("No content in OpenAI response")
+
+        # Callers asking for the same completion at the same time share one request
+        return self._flights.do(key, request)
+
+    def chat_completion_stream(self, messages: List[Dict[str, Any]], model: Text = None,
+                               task: Text = "draft_generator", cache: Optional[bool] = None,
+                               **params) -> Iterator[Text]:
+        """
+        Run a chat completion and yield the text as the server generates it
+
+        The response is read as server-sent events ("data: {...}" lines
+        ending with "data: [DONE]"), so the first words arrive long before
+        the completion is finished.
+
+        Args:
+            messages: Chat messages (role and content)
+            model: Specific model to use (overrides configuration)
+            task: The task type to use for model and parameters
+            cache: Force (True) or skip (False) the response cache, see chat_completion();
+                a cached response is yielded as a single fragment
+            **params: Request parameters overriding the configured ones
+
+        Yields:
+            Text fragments in order
+        """
+        payload = self._build_payload(messages, model, task, params)
+
+        llm_cache = self._response_cache(payload, cache)
+        key = make_cache_key(payload) if llm_cache else None
+        if llm_cache:
+            hit = llm_cache.get(key)
+            if hit is not None:
+                yield hit["content"]
+                return
+
+        payload["stream"] = True
+        pieces = []
+        completed = False
+        started = time.monotonic()
+        first_token = True
+        response = self._post("/chat/completions", payload, stream=True)
+        # text/event-stream without a charset would otherwise be decoded as ISO-8859-1
+        response.encoding = "utf-8"
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    completed = True
+                    break
+                chunk = json.loads(data)
+                for choice in chunk.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if not text:
+                        continue
+                    if first_token:
+                        first_token = False
+                        with self._lock:
+                            self._stats["streams"] += 1
+                            self._stats["last_first_token_ms"] = round((time.monotonic() - started) * 1000)
+                    pieces.append(text)
+                    yield text
+        finally:
+            response.close()
+            self.limiter.release()
+
+        if llm_cache and completed and pieces:
+            # Streams report no usage, the saved tokens of these entries are not counted
+            llm_cache.put(key, payload["model"], ''.join(pieces).strip())
+
+    def generate_text_stream(self, prompt: Text, model: Text = None, task: Text = "draft_generator",
+                             cache: Optional[bool] = None) -> Iterator[Text]:
+        """
+        Generate text using OpenAI models, yielding it as it is generated
+
+        Args:
+            prompt: The prompt text to generate from
+            model: Specific model to use (overrides configuration)
+            task: The task type to use for parameters (draft_generator, summarizer, etc.)
+
+        Yields:
+            Text fragments in order
+        """
+        return self.chat_completion_stream([{"role": "user", "content": prompt}], model=model, task=task,
+                                           cache=cache)
+
     def rephrase(self, text: Text, active_flow: Text = "main_flow") -> Text:
         """
         Rephrase user input using OpenAI
-        
+
         Args:
             text: The original user text to rephrase
             active_flow: The current conversation flow context
-            
+
         Returns:
             The rephrased text
         """
         # Get the appropriate system prompt for the flow
-        system_prompt = self.config['prompts'].get(
-            active_flow, 
-            self.config['prompts']['main_flow']
+        config = self.config
+        system_prompt = config['prompts'].get(
+            active_flow,
+            config['prompts']['main_flow']
         )
-        
-        # Get model and parameters
-        model = self.config['models'].get('rephraser', self.config['models']['default'])
-        params = self.config['parameters'].get('rephraser', {})
-        
-        # Prepare the API request
-        url = f"{self.base_url}/chat/completions"
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Rephrase this user input to match an intent: '{text}'"}
-            ],
-            **params
-        }
-        
+
+        # Get model for the rephraser, falling back to the default model
+        model = config['models'].get('rephraser', config['models']['default'])
+
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            
-            result = response.json()
-            if 'choices' in result and len(result['choices']) > 0:
-                rephrased = result['choices'][0]['message']['content'].strip()
-                return rephrased
-            else:
-                return text  # Return original if rephrasing failed
+            return self.chat_completion(
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Rephrase this user input to match an intent: '{text}'"}
+                ],
+                model=model,
+                task="rephraser")
         except Exception as e:
             print(f"Error in OpenAI rephrasing: {e}")
             return text  # Return original if rephrasing failed
-    
-    def generate_text(self, prompt: Text, model: Text = None, task: Text = "draft_generator") -> Text:
+
+    def generate_text(self, prompt: Text, model: Text = None, task: Text = "draft_generator",
+                      cache: Optional[bool] = None) -> Text:
         """
         Generate text using OpenAI models
-        
+
         Args:
             prompt: The prompt text to generate from
             model: Specific model to use (overrides configuration)
             task: The task type to use for parameters (draft_generator, summarizer, etc.)
-            
+            cache: Force (True) or skip (False) the response cache, see chat_completion()
+
         Returns:
             The generated text
         """
-        # Get model and parameters from config
-        if not model:
-            model = self.config['models'].get(task, self.config['models']['default'])
-        
-        params = self.config['parameters'].get(task, {})
-        
-        # Prepare the API request
-        url = f"{self.base_url}/chat/completions"
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            **params
-        }
-        
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            
-            result = response.json()
-            if 'choices' in result and len(result['choices']) > 0:
-                generated_text = result['choices'][0]['message']['content'].strip()
-                return generated_text
-            else:
-                raise ValueError("No content in OpenAI response")
+            return self.chat_completion([{"role": "user", "content": prompt}], model=model, task=task,
+                                        cache=cache)
         except Exception as e:
             print(f"Error in OpenAI text generation: {e}")
             raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Request and connection counters
+
+        Returns:
+            Dictionary with requests, errors, streams, last_first_token_ms
+            (time to the first streamed text), connections_opened,
+            connections_reused, config_reloads, the response cache
+            counters (cache), the rate limiter counters (rate_limit) and
+            the requests shared between identical calls (single_flight)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+
+        # urllib3 counts the connections each host pool had to open
+        opened = 0
+        try:
+            for adapter in set(self.session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        opened += pool.num_connections
+        except Exception as e:
+            print(f"Error reading connection pool stats: {e}")
+
+        stats["connections_opened"] = opened
+        stats["connections_reused"] = max(0, stats["requests"] - opened)
+        stats["config_reloads"] = _config_cache.reloads
+        stats["rate_limit"] = self.limiter.get_stats()
+        stats["single_flight"] = self._flights.get_stats()
+        if (self.config.get('cache') or {}).get('enabled', True):
+            stats["cache"] = get_llm_cache(self.config.get('cache')).get_stats()
+        return stats
+
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+
+
+_default_client: Optional[OpenAIClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_openai_client() -> OpenAIClient:
+    """
+    Get the process-wide OpenAI client
+
+    Raises:
+        ValueError: If the API key environment variable is not set
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = OpenAIClient()
+    return _default_client
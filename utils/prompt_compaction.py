@@ -0,0 +1,338 @@
+"""
+Token-aware compaction of email threads for prompts
+
+Threads are split into turns (newest first), reconstructing older turns
+from quoted reply chains. Quoted history already present in another turn,
+signatures and legal footers are dropped. The remaining turns are then
+fitted into a token budget, newest first, so the prompt stays bounded
+however long the thread is.
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Union
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Tokens of thread text put into a prompt by default
+DEFAULT_THREAD_TOKEN_BUDGET = 1500
+
+# Marker left where a turn was cut to fit the budget
+TRUNCATION_MARKER = "[...]"
+
+# "On Mon, 1 Jan 2024 at 10:00, Jane <jane@example.com> wrote:" and translations
+_ATTRIBUTION_RE = re.compile(
+    r'^\s*(on|am|le|el|il|op)\b.{0,200}\b(wrote|schrieb|a écrit|escribió|ha scritto|schreef)\s*:\s*$',
+    re.IGNORECASE)
+_ORIGINAL_MESSAGE_RE = re.compile(
+    r'^\s*-{2,}\s*(original message|forwarded message|ursprüngliche nachricht)\s*-{2,}\s*$', re.IGNORECASE)
+# Outlook reply header: "From: ..." directly followed by "Sent:" / "Date:"
+_OUTLOOK_FROM_RE = re.compile(r'^\s*\*?(from|von|de)\s*:\*?\s+\S', re.IGNORECASE)
+_OUTLOOK_NEXT_RE = re.compile(r'^\s*\*?(sent|date|gesendet|envoyé|to)\s*:', re.IGNORECASE)
+
+_SIGNATURE_DELIMITER_RE = re.compile(r'^--\s?$')
+_MOBILE_SIGNATURE_RE = re.compile(
+    r'^\s*(sent from my|sent from mail for|get outlook for|von meinem .* gesendet)', re.IGNORECASE)
+_SIGN_OFF_RE = re.compile(
+    r'^\s*(best|best regards|kind regards|regards|warm regards|cheers|thanks|thank you|many thanks|'
+    r'sincerely|yours sincerely|yours truly|all the best|mit freundlichen grüßen|viele grüße|cordialement)'
+    r'[,.!]?\s*$', re.IGNORECASE)
+# Lines after a sign-off that still count as signature (name, title, phone, ...)
+_MAX_SIGNATURE_LINES = 6
+_POSTSCRIPT_RE = re.compile(r'^\s*p\.?\s*(p\.?\s*)?s\b', re.IGNORECASE)
+_CONTACT_RE = re.compile(r'(@|https?://|www\.|\+?\d[\d\s().-]{6,}\d)')
+
+# A legal footer is a long block of boilerplate, set off by a separator
+# line or opening like a disclaimer; mentioning "confidential" is not enough
+_FOOTER_SEPARATOR_RE = re.compile(r'^\s*(-{2,}|_{3,}|\*{3,}|={3,})\s*$')
+_DISCLAIMER_START_RE = re.compile(
+    r'^\s*(disclaimer|confidentiality notice|legal notice|privileged and confidential|'
+    r'this (e-?mail|message)( and any (files|attachments)( transmitted with it)?)? (is|are|may|contains?)\b|'
+    r'the (information|contents?) (contained )?(in|of) this (e-?mail|message))', re.IGNORECASE)
+_DISCLAIMER_RE = re.compile(
+    r'(intended (solely |only )*for the (use of the )?(addressee|intended recipient|person)|intended recipient|'
+    r'if you have received this (e-?mail|message|communication) in error|'
+    r'this (e-?mail|message) and any (files|attachments)|may contain (confidential|privileged)|'
+    r'(disclosure|distribution|copying) .{0,80}(prohibited|not permitted))',
+    re.IGNORECASE)
+# Shorter text is never treated as a disclaimer
+_MIN_DISCLAIMER_LENGTH = 150
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+# Turns shorter than this are only dropped as duplicates on an exact match
+_MIN_CONTAINED_LENGTH = 40
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: Optional[str]):
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+    except (KeyError, ValueError):
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Count the tokens of a text
+
+    Args:
+        text: Text to count
+        model: Model whose tokenizer is used (tiktoken only)
+
+    Returns:
+        Token count (an estimate when tiktoken is not installed)
+    """
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text, disallowed_special=()))
+    # Words average about 1.3 tokens, punctuation is one token each
+    words = _WORD_RE.findall(text)
+    return int(sum(1.3 if word[0].isalnum() or word[0] == '_' else 1.0 for word in words)) + 1
+
+
+def _truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Cut text to roughly max_tokens tokens at a word boundary"""
+    if max_tokens <= 0:
+        return ""
+    if tiktoken is not None:
+        encoding = _encoding(model)
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    else:
+        if count_tokens(text) <= max_tokens:
+            return text
+        # Binary search on the character length, count_tokens() is monotonic enough
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        cut = text[:low]
+    space = cut.rfind(' ')
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip()
+
+
+def _unquote(lines: List[str]) -> List[str]:
+    """Remove one level of "> " quoting"""
+    result = []
+    for line in lines:
+        if line.startswith('> '):
+            result.append(line[2:])
+        elif line.startswith('>'):
+            result.append(line[1:])
+        else:
+            result.append(line)
+    return result
+
+
+def _reply_boundary(lines: List[str]) -> Optional[int]:
+    """Index of the line where the quoted history of a message starts"""
+    for i, line in enumerate(lines):
+        if _ATTRIBUTION_RE.match(line) or _ORIGINAL_MESSAGE_RE.match(line):
+            return i
+        if _OUTLOOK_FROM_RE.match(line) and i + 1 < len(lines) and _OUTLOOK_NEXT_RE.match(lines[i + 1]):
+            return i
+        if line.startswith('>'):
+            return i
+    return None
+
+
+def _split_attributed_turns(text: str) -> List[tuple]:
+    """(attribution, text) of each turn, newest first; attribution is the "On ... wrote:" line or None"""
+    turns = []
+    attribution = None
+    lines = text.replace('\r\n', '\n').split('\n')
+    while lines:
+        boundary = _reply_boundary(lines)
+        if boundary is None:
+            turns.append((attribution, '\n'.join(lines)))
+            break
+
+        if lines[boundary].startswith('>'):
+            # A quoted block without attribution; text below it (inline replies) stays in this turn
+            end = boundary
+            while end < len(lines) and (lines[end].startswith('>') or not lines[end].strip()):
+                end += 1
+            turns.append((attribution, '\n'.join(lines[:boundary] + lines[end:])))
+            attribution = None
+            lines = _unquote(lines[boundary:end])
+            continue
+
+        turns.append((attribution, '\n'.join(lines[:boundary])))
+        # The attribution line names the author of the next turn, separators name nobody
+        line = lines[boundary].strip()
+        attribution = line if _ATTRIBUTION_RE.match(line) else None
+        rest = lines[boundary + 1:]
+        quoted = [line for line in rest if line.strip()]
+        if quoted and sum(line.startswith('>') for line in quoted) >= len(quoted) / 2:
+            rest = _unquote(rest)
+        lines = rest
+    return [(attribution, turn) for attribution, turn in turns if turn.strip()]
+
+
+def split_turns(text: str) -> List[str]:
+    """
+    Split an email (or pasted thread) into turns, newest first
+
+    The text above the first attribution line ("On ... wrote:"), original
+    message separator, Outlook reply header or quoted block is the newest
+    turn; the quoted history below it is unquoted and split again.
+
+    Args:
+        text: Email body or thread text
+
+    Returns:
+        Turn texts, newest first
+    """
+    return [turn for _, turn in _split_attributed_turns(text)]
+
+
+def _is_signature_line(line: str) -> bool:
+    """Whether a line after a sign-off looks like part of a signature (name, title, contact details)"""
+    line = line.strip()
+    if not line:
+        return True
+    if _POSTSCRIPT_RE.match(line):
+        return False
+    if _CONTACT_RE.search(line):
+        return len(line) <= 80
+    words = line.split()
+    # Sentences are content: "See you on Monday." or "Can you check?"
+    if re.search(r'[.?!]\s|[?!]$', line) or (line.endswith('.') and len(words) >= 3):
+        return False
+    return len(line) <= 50 and len(words) <= 6
+
+
+def strip_signature(text: str) -> str:
+    """Remove the signature block (after "-- ", a mobile footer or a closing sign-off)"""
+    lines = text.rstrip().split('\n')
+    for i, line in enumerate(lines):
+        if _SIGNATURE_DELIMITER_RE.match(line) or _MOBILE_SIGNATURE_RE.match(line):
+            return '\n'.join(lines[:i]).rstrip()
+
+    # A sign-off near the end: keep it, drop the lines after it only if they form a signature
+    for i in range(len(lines) - 1, max(-1, len(lines) - _MAX_SIGNATURE_LINES - 2), -1):
+        if _SIGN_OFF_RE.match(lines[i]):
+            tail = [line for line in lines[i + 1:] if line.strip()]
+            if len(tail) <= _MAX_SIGNATURE_LINES and all(_is_signature_line(line) for line in tail):
+                return '\n'.join(lines[:i + 1]).rstrip()
+            break
+    return '\n'.join(lines).rstrip()
+
+
+def _is_disclaimer(text: str) -> bool:
+    return len(text.strip()) >= _MIN_DISCLAIMER_LENGTH and bool(_DISCLAIMER_RE.search(text))
+
+
+def strip_disclaimer(text: str) -> str:
+    """
+    Remove a legal footer at the end of a message
+
+    Only long boilerplate is removed: the text after the last separator
+    line ("--", "____"), or a last paragraph that opens like a disclaimer
+    ("This email and any attachments are ...", "CONFIDENTIALITY NOTICE").
+    """
+    lines = text.rstrip().split('\n')
+    for i in range(len(lines) - 1, 0, -1):
+        if _FOOTER_SEPARATOR_RE.match(lines[i]):
+            if _is_disclaimer('\n'.join(lines[i + 1:])):
+                return '\n'.join(lines[:i]).rstrip()
+            break
+
+    paragraphs = re.split(r'\n\s*\n', text.rstrip())
+    if len(paragraphs) > 1 and _DISCLAIMER_START_RE.match(paragraphs[-1]) and _is_disclaimer(paragraphs[-1]):
+        paragraphs.pop()
+    return '\n\n'.join(paragraphs).rstrip()
+
+
+def _fingerprint(text: str) -> str:
+    return re.sub(r'\W+', ' ', text).strip().lower()
+
+
+def clean_turn(text: str) -> str:
+    """Drop disclaimers and the signature of a turn and squeeze blank lines"""
+    text = strip_signature(strip_disclaimer(text))
+    text = re.sub(r'[ \t]+\n', '\n', text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+def _thread_turns(thread: Union[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Turns (text plus optional from/date), newest first, without duplicated quoted history"""
+    if isinstance(thread, str):
+        messages = [{"body": thread}]
+    else:
+        messages = [message if hasattr(message, "get") else {"body": str(message)} for message in thread]
+
+    # Walk the thread oldest first, so a turn is kept where it was written
+    # (with its sender and date) and the quoted copies in later replies are dropped
+    turns = []
+    seen = set()
+    for message in messages:
+        attributed = _split_attributed_turns(message.get("body") or "")
+        for i, (attribution, text) in reversed(list(enumerate(attributed))):
+            text = clean_turn(text)
+            fingerprint = _fingerprint(text)
+            if not fingerprint:
+                continue
+            # Quoted history that another turn already holds (or contains) adds nothing
+            if fingerprint in seen or (len(fingerprint) >= _MIN_CONTAINED_LENGTH
+                                       and any(fingerprint in other for other in seen)):
+                continue
+            seen.add(fingerprint)
+            if i == 0:
+                header = " - ".join(str(value) for value in (message.get("from"), message.get("date")) if value)
+            else:
+                header = attribution
+            turns.append({"header": header, "text": text})
+    turns.reverse()
+    return turns
+
+
+def compact_thread(thread: Union[str, List[Any], None], budget: int = DEFAULT_THREAD_TOKEN_BUDGET,
+                   model: Optional[str] = None) -> str:
+    """
+    Compact an email thread to fit a token budget
+
+    Args:
+        thread: Thread text, or the emails of the thread (dictionaries or
+            records with from, date and body) in chronological order
+        budget: Maximum tokens of the result
+        model: Model whose tokenizer is used for counting
+
+    Returns:
+        The newest turns that fit the budget, in chronological order
+    """
+    if not thread:
+        return ""
+
+    turns = _thread_turns(thread)
+    kept = []
+    used = 0
+    for turn in turns:
+        block = f"[{turn['header']}]\n{turn['text']}" if turn["header"] else turn["text"]
+        tokens = count_tokens(block, model) + 1
+        if used + tokens > budget:
+            # Keep the start of the turn that no longer fits, older turns are dropped
+            remaining = budget - used - count_tokens(TRUNCATION_MARKER, model) - 1
+            if remaining > 20:
+                kept.append(_truncate_to_tokens(block, remaining, model) + " " + TRUNCATION_MARKER)
+            break
+        kept.append(block)
+        used += tokens
+
+    result = '\n\n'.join(reversed(kept))
+    print(f"Compacted email thread: {len(turns)} turn(s), {len(kept)} kept, "
+          f"~{count_tokens(result, model)} of {budget} tokens")
+    return result
@@ -0,0 +1,368 @@
+"""
+Local full-text search index over synced mail for MailoBot
+
+Backed by SQLite FTS5, updated incrementally as messages are fetched or
+synced, so searches run locally instead of as IMAP SEARCH scans.
+"""
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Any, Iterable, Optional
+
+from utils.email_records import EmailEnvelope, EmailRecord
+
+
+def _default_index_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'cache', 'search.db')
+
+
+def _date_to_timestamp(value: Any) -> Optional[float]:
+    """Convert an RFC 2822 date, ISO date, IMAP date (01-Jan-2024) or datetime to a timestamp"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day).timestamp()
+
+    text = str(value).strip()
+    for fmt in ("%d-%b-%Y", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(text).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _attachment_names(email_data: Any) -> List[List[str]]:
+    """[filename, content_type] pairs of an email, without downloading an envelope's body"""
+    if isinstance(email_data, EmailRecord):
+        # EmailEnvelope.attachments loads the full message, the names from BODYSTRUCTURE suffice
+        attachments = EmailRecord.attachments.fget(email_data)
+    else:
+        attachments = email_data.get("attachments") or []
+    return [[item.get("filename") or "", item.get("content_type") or ""] for item in attachments]
+
+
+def _body_text(email_data: Any, decode: bool) -> Optional[str]:
+    """Body text to index, or None if it is not decoded (or downloaded) yet and decode is off"""
+    if isinstance(email_data, EmailEnvelope):
+        # Never download a body just to index it
+        return email_data.body if email_data.is_loaded else None
+    if isinstance(email_data, EmailRecord) and not email_data.is_decoded and not decode:
+        return None
+    return email_data.get("body") or ""
+
+
+def _fts_terms(text: str, column: Optional[str] = None) -> str:
+    """Turn free text into an FTS5 expression of quoted prefix terms (ANDed)"""
+    terms = [t for t in re.split(r'\s+', text.strip()) if t]
+    quoted = ['"' + t.replace('"', '""') + '"*' for t in terms]
+    if not quoted:
+        return ""
+    expression = " ".join(quoted)
+    return f"{column} : ({expression})" if column else expression
+
+
+class SearchIndex:
+    """
+    SQLite FTS5 index of subject, sender, recipients and body text
+
+    Example:
+        index = get_search_index()
+        index.index_emails(account, "INBOX", uidvalidity, emails)
+        page = index.search(account, text="invoice", unread=True)
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the index
+
+        Args:
+            path: SQLite database file (defaults to settings/cache/search.db)
+        """
+        self.path = path or _default_index_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                message_id TEXT,
+                subject TEXT,
+                sender TEXT,
+                recipients TEXT,
+                date TEXT,
+                date_ts REAL,
+                read INTEGER NOT NULL DEFAULT 0,
+                has_attachments INTEGER NOT NULL DEFAULT 0,
+                attachments TEXT,
+                UNIQUE (account, folder, uidvalidity, uid)
+            );
+            CREATE INDEX IF NOT EXISTS idx_docs_date ON docs (account, date_ts);
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+                subject, sender, recipients, body,
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+        """)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(docs)")}
+        if "attachments" not in columns:
+            # Index created before attachment names were stored
+            self._db.execute("ALTER TABLE docs ADD COLUMN attachments TEXT")
+        self._db.commit()
+
+    def index_emails(self, account: str, folder: str, uidvalidity: int, emails: Iterable[Dict[str, Any]],
+                     decode_bodies: bool = True) -> int:
+        """
+        Add or update emails in the index
+
+        Bodies that are still undecoded (or envelopes that were never
+        loaded) only have their headers indexed unless decode_bodies is
+        set; the body text indexed for them earlier is kept.
+
+        Args:
+            account: Account identifier (EmailMCP.get_account_id())
+            folder: Folder the emails belong to
+            uidvalidity: UIDVALIDITY of the folder
+            emails: Email records or dictionaries as returned by EmailMCP.fetch_emails
+            decode_bodies: Decode lazy bodies to index their text
+
+        Returns:
+            Number of emails indexed
+        """
+        count = 0
+        with self._lock:
+            for email_data in emails:
+                uid = int(email_data["id"])
+                row = (
+                    account, folder, uidvalidity, uid,
+                    email_data.get("message_id"), email_data.get("subject") or "",
+                    email_data.get("from") or "", email_data.get("to") or "",
+                    email_data.get("date") or "", _date_to_timestamp(email_data.get("date")),
+                    1 if email_data.get("read") else 0,
+                    1 if email_data.get("has_attachments") else 0,
+                    json.dumps(_attachment_names(email_data))
+                )
+                existing = self._db.execute(
+                    "SELECT id FROM docs WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                    (account, folder, uidvalidity, uid)).fetchone()
+                body = _body_text(email_data, decode_bodies)
+                if existing:
+                    doc_id = existing["id"]
+                    self._db.execute(
+                        "UPDATE docs SET message_id=?, subject=?, sender=?, recipients=?, date=?, "
+                        "date_ts=?, read=?, has_attachments=?, attachments=? WHERE id=?", row[4:] + (doc_id,))
+                    if body is None:
+                        indexed = self._db.execute("SELECT body FROM docs_fts WHERE rowid=?", (doc_id,)).fetchone()
+                        body = indexed["body"] if indexed else None
+                    self._db.execute("DELETE FROM docs_fts WHERE rowid=?", (doc_id,))
+                else:
+                    doc_id = self._db.execute(
+                        "INSERT INTO docs (account, folder, uidvalidity, uid, message_id, subject, sender, "
+                        "recipients, date, date_ts, read, has_attachments, attachments) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        row).lastrowid
+                self._db.execute(
+                    "INSERT INTO docs_fts (rowid, subject, sender, recipients, body) VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, row[5], row[6], row[7], body or ""))
+                count += 1
+            self._db.commit()
+        return count
+
+    def update_flags(self, account: str, folder: str, uidvalidity: int, flag_changes: Dict[int, List[str]]):
+        """Apply flag changes ({uid: [flags]}) reported by a sync"""
+        with self._lock:
+            for uid, flags in flag_changes.items():
+                self._db.execute(
+                    "UPDATE docs SET read=? WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                    (1 if '\\Seen' in flags else 0, account, folder, uidvalidity, int(uid)))
+            self._db.commit()
+
+    def remove(self, account: str, folder: str, uids: Optional[Iterable[int]] = None,
+               keep_uidvalidity: Optional[int] = None):
+        """
+        Remove documents from the index
+
+        Args:
+            account: Account identifier
+            folder: Folder name
+            uids: UIDs to remove (all of the folder if None)
+            keep_uidvalidity: Only remove documents stored under a different UIDVALIDITY
+        """
+        query = "SELECT id FROM docs WHERE account=? AND folder=?"
+        params: List[Any] = [account, folder]
+        if keep_uidvalidity is not None:
+            query += " AND uidvalidity!=?"
+            params.append(keep_uidvalidity)
+
+        with self._lock:
+            if uids is None:
+                ids = [row["id"] for row in self._db.execute(query, params)]
+            else:
+                ids = []
+                for uid in uids:
+                    row = self._db.execute(query + " AND uid=?", params + [int(uid)]).fetchone()
+                    if row:
+                        ids.append(row["id"])
+            for doc_id in ids:
+                self._db.execute("DELETE FROM docs_fts WHERE rowid=?", (doc_id,))
+                self._db.execute("DELETE FROM docs WHERE id=?", (doc_id,))
+            self._db.commit()
+
+    def uids(self, account: str, folder: str, uidvalidity: int) -> List[int]:
+        """UIDs of the indexed documents of a folder, ascending"""
+        with self._lock:
+            return [row["uid"] for row in self._db.execute(
+                "SELECT uid FROM docs WHERE account=? AND folder=? AND uidvalidity=? ORDER BY uid",
+                (account, folder, uidvalidity))]
+
+    def count(self, account: str, folder: Optional[str] = None) -> int:
+        """Number of indexed documents for an account (and folder)"""
+        query = "SELECT COUNT(*) FROM docs WHERE account=?"
+        params: List[Any] = [account]
+        if folder:
+            query += " AND folder=?"
+            params.append(folder)
+        with self._lock:
+            return self._db.execute(query, params).fetchone()[0]
+
+    def search(self,
+               account: str,
+               text: Optional[str] = None,
+               folder: Optional[str] = None,
+               sender: Optional[str] = None,
+               subject: Optional[str] = None,
+               since: Any = None,
+               until: Any = None,
+               unread: Optional[bool] = None,
+               has_attachments: Optional[bool] = None,
+               page: int = 1,
+               page_size: int = 20) -> Dict[str, Any]:
+        """
+        Search indexed mail
+
+        Args:
+            account: Account identifier
+            text: Free text matched against subject, sender, recipients and body
+            folder: Restrict to a folder
+            sender: Terms that must appear in the sender
+            subject: Terms that must appear in the subject
+            since: Only mail on or after this date
+            until: Only mail before this date
+            unread: Only unread (True) or read (False) mail
+            has_attachments: Only mail with (True) or without (False) attachments
+            page: 1-based page number
+            page_size: Results per page
+
+        Returns:
+            Dictionary with total, page, page_size and results (email
+            dictionaries, best match first, or newest first without text)
+        """
+        match_parts = [expr for expr in (
+            _fts_terms(text) if text else "",
+            _fts_terms(sender, "sender") if sender else "",
+            _fts_terms(subject, "subject") if subject else "") if expr]
+
+        where = ["d.account = ?"]
+        params: List[Any] = [account]
+        if folder:
+            where.append("d.folder = ?")
+            params.append(folder)
+        since_ts = _date_to_timestamp(since)
+        if since_ts is not None:
+            where.append("d.date_ts >= ?")
+            params.append(since_ts)
+        until_ts = _date_to_timestamp(until)
+        if until_ts is not None:
+            where.append("d.date_ts < ?")
+            params.append(until_ts)
+        if unread is not None:
+            where.append("d.read = ?")
+            params.append(0 if unread else 1)
+        if has_attachments is not None:
+            where.append("d.has_attachments = ?")
+            params.append(1 if has_attachments else 0)
+
+        if match_parts:
+            source = "docs_fts f JOIN docs d ON d.id = f.rowid"
+            where.insert(0, "docs_fts MATCH ?")
+            params.insert(0, " AND ".join(f"({part})" for part in match_parts))
+            order = "bm25(docs_fts, 5.0, 3.0, 1.0, 1.0), d.date_ts DESC"
+        else:
+            source = "docs d JOIN docs_fts f ON f.rowid = d.id"
+            order = "d.date_ts DESC"
+
+        page = max(1, int(page))
+        page_size = max(1, int(page_size))
+        where_sql = " AND ".join(where)
+
+        with self._lock:
+            try:
+                total = self._db.execute(
+                    f"SELECT COUNT(*) FROM {source} WHERE {where_sql}", params).fetchone()[0]
+                rows = self._db.execute(
+                    f"SELECT d.*, f.body AS body FROM {source} WHERE {where_sql} "
+                    f"ORDER BY {order} LIMIT ? OFFSET ?",
+                    params + [page_size, (page - 1) * page_size]).fetchall()
+            except sqlite3.OperationalError as e:
+                print(f"Error searching local index: {e}")
+                return {"total": 0, "page": page, "page_size": page_size, "results": []}
+
+        return {
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "results": [self._row_to_email(row) for row in rows]
+        }
+
+    @staticmethod
+    def _row_to_email(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": str(row["uid"]),
+            "message_id": row["message_id"],
+            "subject": row["subject"],
+            "from": row["sender"],
+            "to": row["recipients"],
+            "date": row["date"],
+            "body": row["body"],
+            "read": bool(row["read"]),
+            "has_attachments": bool(row["has_attachments"]),
+            "attachments": [{"filename": name, "content_type": content_type}
+                            for name, content_type in json.loads(row["attachments"] or "[]")],
+            "folder": row["folder"],
+            "uidvalidity": row["uidvalidity"]
+        }
+
+
+_default_index: Optional[SearchIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    """Get the process-wide search index"""
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = SearchIndex()
+    return _default_index
@@ -0,0 +1,527 @@
+"""
+Persistent outbound mail spool for MailoBot
+
+Outgoing messages are written to a SQLite outbox and delivered by a
+background worker, so sending an email returns as soon as the message is
+safely on disk. The worker keeps one authenticated SMTP session per account
+and reuses it across messages (RSET between transactions), retries
+temporary failures with exponential backoff and records the delivery state
+of every message so it can be queried afterwards.
+
+Credentials are never written to the outbox: the worker gets them from the
+accounts registered by enqueue() and, after a restart, from the account
+configured in settings/imap_settings.json.
+"""
+import json
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+# Delivery states of spooled messages
+STATUS_QUEUED = "queued"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+
+def _default_spool_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'cache', 'outbox.db')
+
+
+def _default_settings_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'imap_settings.json')
+
+
+def _account_id(settings: Dict[str, Any]) -> str:
+    """Same identifier as EmailMCP.get_account_id()"""
+    return f"{settings.get('username', '')}@{settings.get('host', '')}"
+
+
+def open_smtp_session(settings: Dict[str, Any], timeout: float = 30.0) -> smtplib.SMTP:
+    """
+    Open an authenticated SMTP session for an account
+
+    The SMTP server defaults to the IMAP host with "imap" replaced by "smtp",
+    port 587 with STARTTLS (disable with tls=False).
+
+    Args:
+        settings: Email settings (host, username, password, smtp_host, smtp_port, tls)
+        timeout: Socket timeout in seconds
+
+    Returns:
+        Logged in smtplib.SMTP session
+    """
+    smtp_host = settings.get('smtp_host') or settings['host'].replace('imap', 'smtp')
+    smtp_port = int(settings.get('smtp_port') or 587)
+
+    conn = smtplib.SMTP(smtp_host, smtp_port, timeout=timeout)
+    try:
+        if settings.get('tls', True):
+            conn.starttls()
+        conn.login(settings['username'], settings['password'])
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Whether an SMTP error is a permanent (5xx) rejection that retrying will not fix"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return isinstance(error, ValueError)
+
+
+class _SMTPSession:
+    """An authenticated SMTP session kept open between deliveries"""
+
+    __slots__ = ("conn", "last_used", "messages")
+
+    def __init__(self, conn: smtplib.SMTP):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.messages = 0
+
+    def close(self):
+        try:
+            self.conn.quit()
+        except Exception:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+
+
+class SMTPSpool:
+    """
+    Durable outbox with a delivery worker reusing SMTP sessions
+
+    Example:
+        spool = get_smtp_spool()
+        message_id = spool.enqueue(settings, sender, ["bob@example.com"], raw_bytes, "Hello")
+        print(spool.get_status(message_id)["status"])
+    """
+
+    # Delivery attempts before a message is marked failed
+    DEFAULT_MAX_ATTEMPTS = 6
+
+    # First retry delay in seconds, doubled after every failed attempt
+    DEFAULT_RETRY_DELAY = 30.0
+
+    # Upper bound for the retry delay
+    MAX_RETRY_DELAY = 3600.0
+
+    # Idle SMTP sessions are closed after this many seconds (servers drop them anyway)
+    SESSION_IDLE_TIMEOUT = 60.0
+
+    # Seconds a worker may hold a message before another worker can take it over
+    SEND_LEASE = 300.0
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 retry_delay: float = DEFAULT_RETRY_DELAY):
+        """
+        Initialize the spool
+
+        Args:
+            path: SQLite database file (defaults to settings/cache/outbox.db)
+            max_attempts: Delivery attempts before a message is marked failed
+            retry_delay: First retry delay in seconds
+        """
+        self.path = path or _default_spool_path()
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # The outbox must survive a crash right after enqueue() returns
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                account TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                subject TEXT,
+                message BLOB NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT,
+                created REAL NOT NULL,
+                sent_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt);
+        """)
+        self._db.commit()
+
+        self._accounts: Dict[str, Dict[str, Any]] = {}
+        self._sessions: Dict[str, _SMTPSession] = {}
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "sessions_opened": 0,
+            "sessions_reused": 0
+        }
+
+    def register_account(self, settings: Dict[str, Any]):
+        """Make an account's credentials available to the worker (they are not stored in the spool)"""
+        with self._lock:
+            self._accounts[_account_id(settings)] = settings
+
+    def load_accounts(self, settings_path: Optional[str] = None) -> int:
+        """
+        Register the account configured in the settings file
+
+        Messages spooled before a restart can only be delivered once their
+        account is registered again, so this is done when the spool is created.
+
+        Args:
+            settings_path: Email settings JSON file (defaults to settings/imap_settings.json)
+
+        Returns:
+            Number of accounts registered
+        """
+        settings_path = settings_path or _default_settings_path()
+        try:
+            if not os.path.exists(settings_path):
+                return 0
+            with open(settings_path, 'r') as f:
+                settings = json.load(f)
+        except Exception as e:
+            print(f"Error loading email settings for the outbox: {e}")
+            return 0
+        if not settings or not settings.get('host') or not settings.get('username'):
+            return 0
+
+        self.register_account(settings)
+        with self._lock:
+            accounts = list(self._accounts)
+            placeholders = ",".join("?" * len(accounts))
+            orphaned = self._db.execute(
+                f"SELECT COUNT(*) FROM outbox WHERE status IN (?, ?) AND account NOT IN ({placeholders})",
+                [STATUS_QUEUED, STATUS_SENDING] + accounts).fetchone()[0]
+        if orphaned:
+            print(f"{orphaned} spooled emails belong to accounts that are no longer configured")
+        return 1
+
+    def enqueue(self, settings: Dict[str, Any], sender: str, recipients: List[str],
+                message: bytes, subject: str = "") -> int:
+        """
+        Write a message to the outbox and wake the delivery worker
+
+        Args:
+            settings: Email settings of the sending account
+            sender: Envelope sender
+            recipients: Envelope recipients
+            message: Complete RFC 822 message
+            subject: Subject, kept for status listings
+
+        Returns:
+            Outbox id of the message (committed to disk when this returns)
+        """
+        if not recipients:
+            raise ValueError("No recipients specified")
+
+        self.register_account(settings)
+        with self._lock:
+            message_id = self._db.execute(
+                "INSERT INTO outbox (account, sender, recipients, subject, message, status, next_attempt, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (_account_id(settings), sender, json.dumps(recipients), subject or "",
+                 sqlite3.Binary(message), STATUS_QUEUED, time.time(), time.time())).lastrowid
+            self._db.commit()
+
+        self.start()
+        self._wakeup.set()
+        return message_id
+
+    def get_status(self, message_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Get the delivery state of a spooled message
+
+        Returns:
+            Dictionary with id, account, recipients, subject, status, attempts,
+            next_attempt, last_error, created and sent_at, or None if unknown
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, account, recipients, subject, status, attempts, next_attempt, last_error, "
+                "created, sent_at FROM outbox WHERE id=?", (int(message_id),)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_messages(self, account: Optional[str] = None, status: Optional[str] = None,
+                      limit: int = 50) -> List[Dict[str, Any]]:
+        """List spooled messages, newest first, optionally filtered by account and status"""
+        query = ("SELECT id, account, recipients, subject, status, attempts, next_attempt, last_error, "
+                 "created, sent_at FROM outbox WHERE 1=1")
+        params: List[Any] = []
+        if account:
+            query += " AND account=?"
+            params.append(account)
+        if status:
+            query += " AND status=?"
+            params.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def retry(self, message_id: int) -> bool:
+        """Queue a failed message for another round of delivery attempts"""
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE outbox SET status=?, attempts=0, next_attempt=? WHERE id=? AND status=?",
+                (STATUS_QUEUED, time.time(), int(message_id), STATUS_FAILED)).rowcount
+            self._db.commit()
+        if updated:
+            self._wakeup.set()
+        return bool(updated)
+
+    def purge_sent(self, older_than: float = 7 * 24 * 3600) -> int:
+        """Delete delivered messages older than the given number of seconds"""
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM outbox WHERE status=? AND sent_at<?",
+                (STATUS_SENT, time.time() - older_than)).rowcount
+            self._db.commit()
+        return deleted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Delivery counters of this process plus the number of spooled messages per status"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open_sessions"] = len(self._sessions)
+            stats["outbox"] = {row["status"]: row["n"] for row in self._db.execute(
+                "SELECT status, COUNT(*) AS n FROM outbox GROUP BY status")}
+        return stats
+
+    def start(self):
+        """Start the delivery worker if it is not running"""
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._stop_event.clear()
+            self._worker = threading.Thread(target=self._worker_loop, name="smtp-spool", daemon=True)
+            self._worker.start()
+
+    def stop(self, wait: bool = True):
+        """Stop the delivery worker and close the SMTP sessions"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if wait and self._worker:
+            self._worker.join()
+        self._worker = None
+
+    def deliver_due(self) -> int:
+        """
+        Deliver every message that is due now
+
+        Returns:
+            Number of messages delivered
+        """
+        delivered = 0
+        while not self._stop_event.is_set():
+            row = self._claim_next()
+            if row is None:
+                break
+            if self._deliver(row):
+                delivered += 1
+        return delivered
+
+    def _worker_loop(self):
+        try:
+            while not self._stop_event.is_set():
+                self._wakeup.clear()
+                try:
+                    self.deliver_due()
+                except Exception as e:
+                    print(f"Error delivering spooled email: {e}")
+                self._close_idle_sessions()
+                self._wakeup.wait(self._seconds_until_due())
+        finally:
+            self._close_sessions()
+
+    def _claim_next(self) -> Optional[sqlite3.Row]:
+        """Take the next due message of a registered account, leasing it to this worker"""
+        now = time.time()
+        with self._lock:
+            accounts = list(self._accounts)
+            if not accounts:
+                return None
+            placeholders = ",".join("?" * len(accounts))
+            row = self._db.execute(
+                f"SELECT * FROM outbox WHERE status IN (?, ?) AND next_attempt<=? AND account IN ({placeholders}) "
+                "ORDER BY next_attempt, id LIMIT 1",
+                [STATUS_QUEUED, STATUS_SENDING, now] + accounts).fetchone()
+            if row is None:
+                return None
+            # A message left in "sending" past its lease belongs to a worker that died
+            claimed = self._db.execute(
+                "UPDATE outbox SET status=?, next_attempt=? WHERE id=? AND status=? AND next_attempt=?",
+                (STATUS_SENDING, now + self.SEND_LEASE, row["id"], row["status"], row["next_attempt"])).rowcount
+            self._db.commit()
+        return row if claimed else None
+
+    def _seconds_until_due(self) -> Optional[float]:
+        with self._lock:
+            accounts = list(self._accounts)
+            if not accounts:
+                return None
+            placeholders = ",".join("?" * len(accounts))
+            row = self._db.execute(
+                f"SELECT MIN(next_attempt) AS due FROM outbox WHERE status IN (?, ?) AND account IN ({placeholders})",
+                [STATUS_QUEUED, STATUS_SENDING] + accounts).fetchone()
+        if row is None or row["due"] is None:
+            return self.SESSION_IDLE_TIMEOUT if self._sessions else None
+        wait = max(0.0, row["due"] - time.time())
+        return min(wait, self.SESSION_IDLE_TIMEOUT) if self._sessions else wait
+
+    def _deliver(self, row: sqlite3.Row) -> bool:
+        account = row["account"]
+        with self._lock:
+            settings = self._accounts.get(account)
+        attempts = row["attempts"] + 1
+        try:
+            session = self._get_session(account, settings)
+            try:
+                session.conn.sendmail(row["sender"], json.loads(row["recipients"]), bytes(row["message"]))
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped the idle session, reconnect once
+                self._drop_session(account)
+                session = self._get_session(account, settings)
+                session.conn.sendmail(row["sender"], json.loads(row["recipients"]), bytes(row["message"]))
+            session.messages += 1
+            session.last_used = time.monotonic()
+        except Exception as e:
+            if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+                # Rejections leave the session usable (smtplib resets it), anything else may not
+                self._drop_session(account)
+            self._record_failure(row["id"], attempts, e)
+            return False
+
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status=?, attempts=?, last_error=NULL, sent_at=? WHERE id=?",
+                (STATUS_SENT, attempts, time.time(), row["id"]))
+            self._db.commit()
+            self._stats["sent"] += 1
+        print(f"Spooled email {row['id']} sent to {', '.join(json.loads(row['recipients']))}")
+        return True
+
+    def _record_failure(self, message_id: int, attempts: int, error: Exception):
+        permanent = _is_permanent(error)
+        with self._lock:
+            if permanent or attempts >= self.max_attempts:
+                self._db.execute(
+                    "UPDATE outbox SET status=?, attempts=?, last_error=? WHERE id=?",
+                    (STATUS_FAILED, attempts, str(error), message_id))
+                self._stats["failed"] += 1
+                print(f"Giving up on spooled email {message_id}: {error}")
+            else:
+                delay = min(self.retry_delay * (2 ** (attempts - 1)), self.MAX_RETRY_DELAY)
+                self._db.execute(
+                    "UPDATE outbox SET status=?, attempts=?, last_error=?, next_attempt=? WHERE id=?",
+                    (STATUS_QUEUED, attempts, str(error), time.time() + delay, message_id))
+                self._stats["retried"] += 1
+                print(f"Error sending spooled email {message_id}, retrying in {delay:.0f}s: {error}")
+            self._db.commit()
+
+    def _get_session(self, account: str, settings: Dict[str, Any]) -> _SMTPSession:
+        """Reuse the account's open session (reset with RSET) or log in again"""
+        session = self._sessions.get(account)
+        if session is not None:
+            try:
+                code, _ = session.conn.rset()
+                if code == 250:
+                    self._stats["sessions_reused"] += 1
+                    return session
+            except smtplib.SMTPException:
+                pass
+            self._drop_session(account)
+
+        session = _SMTPSession(open_smtp_session(settings))
+        self._sessions[account] = session
+        self._stats["sessions_opened"] += 1
+        return session
+
+    def _drop_session(self, account: str):
+        session = self._sessions.pop(account, None)
+        if session is not None:
+            session.close()
+
+    def _close_idle_sessions(self):
+        now = time.monotonic()
+        for account, session in list(self._sessions.items()):
+            if now - session.last_used >= self.SESSION_IDLE_TIMEOUT:
+                self._drop_session(account)
+
+    def _close_sessions(self):
+        for account in list(self._sessions):
+            self._drop_session(account)
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "account": row["account"],
+            "recipients": json.loads(row["recipients"]),
+            "subject": row["subject"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "next_attempt": row["next_attempt"] if row["status"] == STATUS_QUEUED else None,
+            "last_error": row["last_error"],
+            "created": row["created"],
+            "sent_at": row["sent_at"]
+        }
+
+
+_default_spool: Optional[SMTPSpool] = None
+_default_spool_lock = threading.Lock()
+
+
+def get_smtp_spool() -> SMTPSpool:
+    """
+    Get the process-wide outbound spool
+
+    The first call registers the configured account but starts no thread;
+    the worker starts with the first enqueue() or with start_smtp_spool().
+    """
+    global _default_spool
+    if _default_spool is None:
+        with _default_spool_lock:
+            if _default_spool is None:
+                spool = SMTPSpool()
+                spool.load_accounts()
+                _default_spool = spool
+    return _default_spool
+
+
+def start_smtp_spool() -> SMTPSpool:
+    """
+    Start the delivery worker of the process-wide spool
+
+    Call it from the server that owns delivery, so messages left in the
+    outbox by the previous run are sent.
+    """
+    spool = get_smtp_spool()
+    spool.start()
+    return spool
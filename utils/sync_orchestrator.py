@@ -0,0 +1,339 @@
+"""
+Parallel multi-account, multi-folder sync for MailoBot
+
+Runs MailboxSync for many (account, folder) jobs on a bounded pool of
+worker threads. Each account has its own queue and a cap on concurrently
+running jobs (and therefore IMAP sessions); accounts are served round-robin
+and large folders are synced in slices of at most slice_size messages, so a
+huge mailbox is interleaved with the others instead of starving them.
+"""
+import collections
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Any, Optional, Tuple
+
+from utils.email_mcp import EmailMCP
+from utils.mail_sync import MailboxSync
+from utils.sync_state import SyncStateStore, get_sync_state_store
+
+
+def _account_id(settings: Dict[str, Any]) -> str:
+    """Same identifier as EmailMCP.get_account_id()"""
+    return f"{settings.get('username', '')}@{settings.get('host', '')}"
+
+
+class SyncJob:
+    """A folder of an account kept in sync by the orchestrator"""
+
+    __slots__ = ("settings", "account", "folder", "queued", "running",
+                 "slices", "messages", "errors", "last_result", "last_error", "last_sync")
+
+    def __init__(self, settings: Dict[str, Any], folder: str):
+        self.settings = settings
+        self.account = _account_id(settings)
+        self.folder = folder
+        self.queued = False
+        self.running = False
+        self.slices = 0
+        self.messages = 0
+        self.errors = 0
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self.last_sync: Optional[float] = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.account, self.folder
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "account": self.account,
+            "folder": self.folder,
+            "queued": self.queued,
+            "running": self.running,
+            "slices": self.slices,
+            "messages": self.messages,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_sync": self.last_sync
+        }
+
+
+class SyncOrchestrator:
+    """
+    Bounded worker pool running incremental syncs fairly across accounts
+
+    Example:
+        orchestrator = SyncOrchestrator(max_workers=8, max_per_account=2)
+        orchestrator.add_job(work_settings, "INBOX")
+        orchestrator.add_job(work_settings, "Support")
+        orchestrator.add_job(personal_settings, "INBOX")
+        orchestrator.start(interval=60)
+        print(orchestrator.get_metrics())
+    """
+
+    # New messages downloaded per job before it goes back to the end of its queue
+    DEFAULT_SLICE_SIZE = 100
+
+    def __init__(self,
+                 max_workers: int = 4,
+                 max_per_account: int = 2,
+                 slice_size: int = DEFAULT_SLICE_SIZE,
+                 state_store: Optional[SyncStateStore] = None,
+                 initial_limit: int = MailboxSync.DEFAULT_INITIAL_LIMIT,
+                 on_result: Optional[Callable[[SyncJob, Dict[str, Any]], None]] = None):
+        """
+        Initialize the orchestrator
+
+        Args:
+            max_workers: Worker threads, i.e. jobs running at the same time
+            max_per_account: Jobs (IMAP sessions) running at the same time per account;
+                keep this at or below the connection pool's max_per_account
+            slice_size: New messages downloaded per run of a job
+            state_store: Checkpoint store shared by all jobs (defaults to the shared settings/cache/sync_state.db)
+            initial_limit: Newest messages downloaded when a folder is synced from scratch
+            on_result: Called with the job and the MailboxSync.sync() result of every slice
+        """
+        self.max_workers = max_workers
+        self.max_per_account = max_per_account
+        self.slice_size = slice_size
+        self.state_store = state_store or get_sync_state_store()
+        self.initial_limit = initial_limit
+        self.on_result = on_result
+
+        self._jobs: Dict[Tuple[str, str], SyncJob] = {}
+        self._queues: Dict[str, Deque[SyncJob]] = {}
+        self._rotation: Deque[str] = collections.deque()
+        self._running_per_account: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._scheduler: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._started_at: Optional[float] = None
+
+        self._metrics = {
+            "slices": 0,
+            "jobs_completed": 0,
+            "errors": 0,
+            "messages": 0,
+            "busy_seconds": 0.0,
+            "max_queue_depth": 0
+        }
+
+    def add_job(self, settings: Dict[str, Any], folder: str = "INBOX") -> SyncJob:
+        """Register a folder of an account to keep in sync"""
+        job = SyncJob(settings, folder)
+        with self._cond:
+            existing = self._jobs.get(job.key)
+            if existing:
+                existing.settings = settings
+                return existing
+            self._jobs[job.key] = job
+            return job
+
+    def remove_job(self, settings: Dict[str, Any], folder: str = "INBOX"):
+        """Stop syncing a folder (a slice that is already running finishes)"""
+        key = (_account_id(settings), folder)
+        with self._cond:
+            job = self._jobs.pop(key, None)
+            if job and job.queued:
+                self._queues[job.account].remove(job)
+                job.queued = False
+
+    def get_jobs(self) -> List[Dict[str, Any]]:
+        """State of all registered jobs"""
+        with self._cond:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def schedule_all(self) -> int:
+        """
+        Queue every registered job that is not already queued or running
+
+        Returns:
+            Number of jobs queued
+        """
+        with self._cond:
+            count = 0
+            for job in self._jobs.values():
+                if not job.queued and not job.running:
+                    self._enqueue_locked(job)
+                    count += 1
+            self._cond.notify_all()
+            return count
+
+    def run_once(self, timeout: Optional[float] = None) -> bool:
+        """
+        Sync all jobs until nothing is left to download
+
+        Starts the workers if needed and blocks until every queue is drained.
+
+        Args:
+            timeout: Maximum seconds to wait
+
+        Returns:
+            True if all jobs finished within the timeout
+        """
+        self._start_workers()
+        self.schedule_all()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._queue_depth_locked() or any(job.running for job in self._jobs.values()):
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def start(self, interval: float = 60.0):
+        """Start the workers and re-queue all jobs every interval seconds"""
+        self._start_workers()
+        if self._scheduler and self._scheduler.is_alive():
+            return
+
+        def schedule_loop():
+            while not self._stop_event.is_set():
+                self.schedule_all()
+                self._stop_event.wait(interval)
+
+        self._scheduler = threading.Thread(target=schedule_loop, name="sync-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def stop(self, wait: bool = True):
+        """Stop scheduling and let the workers exit after their current slice"""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._workers = []
+        self._scheduler = None
+
+    def is_running(self) -> bool:
+        return any(worker.is_alive() for worker in self._workers)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get throughput and queue statistics
+
+        Returns:
+            Dictionary with counters (slices, jobs_completed, errors, messages),
+            queue_depth, max_queue_depth, running, workers, utilization,
+            messages_per_second and per-account queued/running counts
+        """
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = self._queue_depth_locked()
+            metrics["running"] = sum(self._running_per_account.values())
+            metrics["workers"] = len(self._workers)
+            metrics["accounts"] = {
+                account: {"queued": len(queue), "running": self._running_per_account.get(account, 0)}
+                for account, queue in self._queues.items()
+            }
+            started_at = self._started_at
+
+        elapsed = time.monotonic() - started_at if started_at else 0.0
+        metrics["messages_per_second"] = metrics["messages"] / elapsed if elapsed > 0 else 0.0
+        capacity = elapsed * max(metrics["workers"], 1)
+        metrics["utilization"] = metrics["busy_seconds"] / capacity if capacity > 0 else 0.0
+        return metrics
+
+    def _start_workers(self):
+        with self._cond:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            if self._workers:
+                return
+            self._stop_event.clear()
+            if self._started_at is None:
+                self._started_at = time.monotonic()
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"sync-worker-{i}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def _enqueue_locked(self, job: SyncJob):
+        queue = self._queues.setdefault(job.account, collections.deque())
+        if job.account not in self._rotation:
+            self._rotation.append(job.account)
+        queue.append(job)
+        job.queued = True
+        self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._queue_depth_locked())
+
+    def _queue_depth_locked(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _next_job_locked(self) -> Optional[SyncJob]:
+        """Take the next job, visiting accounts round-robin and skipping those at their limit"""
+        for _ in range(len(self._rotation)):
+            account = self._rotation[0]
+            self._rotation.rotate(-1)
+            queue = self._queues.get(account)
+            if queue and self._running_per_account.get(account, 0) < self.max_per_account:
+                job = queue.popleft()
+                job.queued = False
+                job.running = True
+                self._running_per_account[account] = self._running_per_account.get(account, 0) + 1
+                return job
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stop_event.is_set():
+                    job = self._next_job_locked()
+                    if job:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+
+            started = time.monotonic()
+            result, error = self._run_slice(job)
+            duration = time.monotonic() - started
+
+            with self._cond:
+                job.running = False
+                self._running_per_account[job.account] -= 1
+                job.slices += 1
+                job.last_sync = time.time()
+                job.last_result = result
+                job.last_error = error
+                self._metrics["slices"] += 1
+                self._metrics["busy_seconds"] += duration
+                if error:
+                    job.errors += 1
+                    self._metrics["errors"] += 1
+                else:
+                    new_count = len(result.get("new_emails", []))
+                    job.messages += new_count
+                    self._metrics["messages"] += new_count
+                    if result.get("has_more") and job.key in self._jobs and not self._stop_event.is_set():
+                        # Back to the end of the account's queue so other folders get a turn
+                        self._enqueue_locked(job)
+                    else:
+                        self._metrics["jobs_completed"] += 1
+                self._cond.notify_all()
+
+            if result and self.on_result:
+                try:
+                    self.on_result(job, result)
+                except Exception as e:
+                    print(f"Error in sync result callback: {e}")
+
+    def _run_slice(self, job: SyncJob) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Sync up to slice_size new messages of a job on its own session"""
+        mcp = EmailMCP(job.settings)
+        try:
+            if not mcp.connect():
+                return None, mcp.get_context().get('error', 'Could not connect')
+            sync = MailboxSync(mcp, self.state_store, self.initial_limit)
+            result = sync.sync(job.folder, max_messages=self.slice_size)
+            if result.get("error"):
+                return None, result["error"]
+            return result, None
+        except Exception as e:
+            print(f"Error syncing {job.account}/{job.folder}: {e}")
+            return None, str(e)
+        finally:
+            mcp.disconnect()
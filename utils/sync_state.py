@@ -0,0 +1,94 @@
+"""
+Per-folder sync checkpoints for MailoBot
+
+The checkpoint written by MailboxSync after each run (UIDVALIDITY, UIDNEXT,
+HIGHESTMODSEQ, message count) is also what tells EmailMCP whether the local
+search index holds every message of a folder.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+def _default_state_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'cache', 'sync_state.db')
+
+
+class SyncStateStore:
+    """
+    SQLite backed store of per-folder sync checkpoints
+
+    Every read goes to the database and every write replaces a single
+    folder's row, so the web server, the action server and sync workers
+    see each other's checkpoints and never overwrite other folders.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the store
+
+        Args:
+            path: SQLite database file (defaults to settings/cache/sync_state.db)
+        """
+        self.path = path or _default_state_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                checkpoint TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (account, folder)
+            );
+        """)
+        self._db.commit()
+
+    def get(self, account: str, folder: str) -> Optional[Dict[str, Any]]:
+        """Get the checkpoint for a folder, or None if it was never synced"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT checkpoint FROM checkpoints WHERE account=? AND folder=?", (account, folder)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row["checkpoint"]) or None
+        except ValueError as e:
+            print(f"Error loading sync state: {e}")
+            return None
+
+    def set(self, account: str, folder: str, checkpoint: Dict[str, Any]):
+        """Persist the checkpoint for a folder"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO checkpoints (account, folder, checkpoint, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (account, folder) DO UPDATE SET checkpoint=excluded.checkpoint, updated=excluded.updated",
+                (account, folder, json.dumps(checkpoint), time.time()))
+            self._db.commit()
+
+    def clear(self, account: str, folder: str):
+        """Forget the checkpoint for a folder, forcing a full resync"""
+        with self._lock:
+            self._db.execute("DELETE FROM checkpoints WHERE account=? AND folder=?", (account, folder))
+            self._db.commit()
+
+
+_default_store: Optional[SyncStateStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_sync_state_store() -> SyncStateStore:
+    """Get the process-wide sync checkpoint store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = SyncStateStore()
+    return _default_store
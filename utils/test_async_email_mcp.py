@@ -0,0 +1,54 @@
+"""
+Tests for AsyncEmailMCP against the fake IMAP server
+"""
+import asyncio
+
+import pytest
+
+from utils.async_email_mcp import AsyncEmailMCP
+from utils.fake_mail_server import FakeIMAPServer
+
+BASIC_CAPABILITIES = ("IMAP4rev1",)
+EXTENDED_CAPABILITIES = FakeIMAPServer.DEFAULT_CAPABILITIES + ("ESORT", "CONTEXT=SORT", "PARTIAL")
+
+
+def _run(imap_server, scenario):
+    """Run scenario(client) on a connected AsyncEmailMCP and return its result"""
+    async def main():
+        client = AsyncEmailMCP(imap_server.settings())
+        assert await client.connect()
+        try:
+            return await scenario(client)
+        finally:
+            await client.disconnect()
+    return asyncio.run(main())
+
+
+def _first(imap_server, name: str) -> int:
+    return next(index for index, command in enumerate(imap_server.log) if command.startswith(name + " "))
+
+
+@pytest.mark.parametrize("imap_capabilities", [BASIC_CAPABILITIES, EXTENDED_CAPABILITIES])
+def test_fetch_without_select(imap_server):
+    emails = _run(imap_server, lambda client: client.fetch_emails([2, 3]))
+
+    assert [email["id"] for email in emails] == ["2", "3"]
+    assert [email["subject"] for email in emails] == ["Message 2", "Message 3"]
+    assert _first(imap_server, "SELECT") < _first(imap_server, "UID FETCH")
+
+
+@pytest.mark.parametrize("imap_capabilities", [BASIC_CAPABILITIES])
+def test_mark_as_read_selects_the_folder(imap_server):
+    assert _run(imap_server, lambda client: client.mark_as_read(4))
+    assert "\\Seen" in imap_server.mailbox("INBOX").get(4).flags
+
+
+@pytest.mark.parametrize("imap_capabilities", [BASIC_CAPABILITIES, EXTENDED_CAPABILITIES])
+def test_unread_count_and_recent_emails(imap_server):
+    async def scenario(client):
+        return await client.get_unread_count(), await client.get_recent_emails(3)
+
+    unread, recent = _run(imap_server, scenario)
+
+    assert unread == 10
+    assert [email["id"] for email in recent] == ["10", "9", "8"]
@@ -0,0 +1,25 @@
+"""
+Tests for rendering the draft prompt
+"""
+import pytest
+
+pytest.importorskip("jinja2")
+pytest.importorskip("requests")
+
+from utils.draft_generation import render_draft_prompt
+from utils.fake_mail_server import make_message
+from utils.message_refs import load_thread_refs
+
+
+def test_thread_refs_are_expanded_only_when_rendering(imap_server, ref_store, threads):
+    inbox = imap_server.mailbox("INBOX")
+    inbox.add(make_message(11, body="Can we raise the budget?", message_id="<budget@example.com>"))
+    inbox.add(make_message(12, body="Only by ten percent.", references=["<budget@example.com>"]))
+    settings = imap_server.settings(index_threads=True)
+    variables = {"subject": "Budget", "tone": "friendly",
+                 "email_thread": {"refs": load_thread_refs(settings, uid=12)}}
+
+    prompt = render_draft_prompt(variables, settings)
+
+    assert "Only by ten percent." in prompt and "Can we raise the budget?" in prompt
+    assert "Only by ten percent." not in render_draft_prompt(variables)
@@ -0,0 +1,33 @@
+"""
+Tests for header-only envelopes and their lazily loaded bodies
+"""
+import pytest
+
+from utils.email_records import MessageUnavailableError
+from utils.fake_mail_server import make_message
+
+
+def test_envelope_body_loads_from_its_folder_after_a_switch(mcp, imap_server):
+    imap_server.mailbox("Archive").add(make_message(99, body="Archived body"))
+    assert mcp.select_folder("INBOX")
+    envelopes = mcp.get_unread_emails(limit=3, headers_only=True)
+    assert [envelope["id"] for envelope in envelopes] == ["10", "9", "8"]
+    assert not envelopes[0].is_loaded
+
+    assert mcp.select_folder("Archive")
+    assert envelopes[0].body.strip() == "Body of message 10"
+
+    # The session is back in the folder it was in
+    assert mcp.imap_conn.selected_mailbox["folder"] == "Archive"
+    assert mcp.context["current_folder"] == "Archive"
+    assert mcp.fetch_email(1).body.strip() == "Archived body"
+
+
+def test_envelope_body_unavailable_after_uidvalidity_change(mcp, imap_server):
+    assert mcp.select_folder("INBOX")
+    envelope = mcp.get_unread_emails(limit=1, headers_only=True)[0]
+    assert mcp.select_folder("Archive")
+    imap_server.mailbox("INBOX").reset_uidvalidity()
+
+    with pytest.raises(MessageUnavailableError):
+        envelope.body
@@ -0,0 +1,73 @@
+"""
+Tests for EmailMCP bulk mailbox changes (delete, move, expunge)
+"""
+import pytest
+
+WITHOUT_UIDPLUS = ("IMAP4rev1", "CONDSTORE", "ESEARCH")
+
+
+@pytest.fixture
+def indexed_inbox(mcp, search_index):
+    """Select the INBOX and index all of its messages"""
+    assert mcp.select_folder("INBOX")
+    mcp.fetch_emails(list(range(1, 11)))
+    assert len(search_index.uids(mcp.get_account_id(), "INBOX", 1000)) == 10
+    return mcp
+
+
+def test_delete_expunges_only_the_given_uids(indexed_inbox, imap_server, search_index):
+    inbox = imap_server.mailbox("INBOX")
+    # Another client's pending delete must survive ours
+    inbox.set_flags(1, ["\\Deleted"])
+
+    assert indexed_inbox.delete_emails([3, 4])
+
+    assert inbox.uids() == [1, 2, 5, 6, 7, 8, 9, 10]
+    assert imap_server.commands("UID EXPUNGE") == ["UID EXPUNGE 3:4"]
+    assert sorted(search_index.uids(indexed_inbox.get_account_id(), "INBOX", 1000)) == [1, 2, 5, 6, 7, 8, 9, 10]
+
+
+@pytest.mark.parametrize("imap_capabilities", [WITHOUT_UIDPLUS])
+def test_delete_without_uidplus_does_not_expunge(indexed_inbox, imap_server):
+    inbox = imap_server.mailbox("INBOX")
+    inbox.set_flags(1, ["\\Deleted"])
+
+    assert not indexed_inbox.delete_emails([3, 4])
+
+    assert inbox.uids() == list(range(1, 11))
+    assert imap_server.commands("EXPUNGE") == [] and imap_server.commands("UID EXPUNGE") == []
+    assert all("\\Deleted" in inbox.get(uid).flags for uid in (1, 3, 4))
+
+
+def test_move_refreshes_the_counters_of_both_folders(mcp):
+    assert mcp.select_folder("INBOX")
+    assert mcp.get_folders_status(["INBOX", "Archive"])["INBOX"]["MESSAGES"] == 10
+
+    assert mcp.move_emails([5, 6], "Archive")
+
+    status = mcp.get_folders_status(["INBOX", "Archive"])
+    assert status["INBOX"]["MESSAGES"] == 8
+    assert status["Archive"]["MESSAGES"] == 2
+
+
+@pytest.mark.parametrize("imap_capabilities", [WITHOUT_UIDPLUS])
+def test_move_without_uidplus_leaves_originals_flagged(indexed_inbox, imap_server):
+    inbox = imap_server.mailbox("INBOX")
+
+    assert indexed_inbox.move_emails([5], "Archive")
+
+    assert len(imap_server.mailbox("Archive").messages) == 1
+    assert 5 in inbox.uids() and "\\Deleted" in inbox.get(5).flags
+    assert imap_server.commands("EXPUNGE") == []
+
+
+@pytest.mark.parametrize("imap_capabilities", [WITHOUT_UIDPLUS])
+def test_expunge_all_forgets_every_deleted_email(indexed_inbox, imap_server, search_index):
+    inbox = imap_server.mailbox("INBOX")
+    inbox.set_flags(1, ["\\Deleted"])
+    indexed_inbox.delete_emails([3, 4])
+
+    assert indexed_inbox.expunge()
+
+    assert inbox.uids() == [2, 5, 6, 7, 8, 9, 10]
+    assert sorted(search_index.uids(indexed_inbox.get_account_id(), "INBOX", 1000)) == [2, 5, 6, 7, 8, 9, 10]
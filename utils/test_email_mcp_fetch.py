@@ -0,0 +1,43 @@
+"""
+Tests for batched multi-message FETCH in EmailMCP listings
+"""
+
+
+def body_fetches(imap_server):
+    return [command for command in imap_server.commands("UID FETCH") if "BODY.PEEK[]" in command]
+
+
+def test_recent_emails_are_fetched_in_one_command(mcp, imap_server):
+    assert mcp.select_folder("INBOX")
+
+    emails = mcp.get_recent_emails(limit=5)
+
+    assert [email["id"] for email in emails] == ["10", "9", "8", "7", "6"]
+    assert emails[0]["subject"] == "Message 10"
+    assert body_fetches(imap_server) == ["UID FETCH 6:10 (UID FLAGS BODY.PEEK[])"]
+
+
+def test_fetch_emails_chunks_and_keeps_the_requested_order(mcp, imap_server):
+    assert mcp.select_folder("INBOX")
+
+    emails = mcp.fetch_emails([9, 2, 5, 3, 7], chunk_size=2)
+
+    assert [email["id"] for email in emails] == ["9", "2", "5", "3", "7"]
+    assert len(body_fetches(imap_server)) == 3
+
+
+def test_unread_emails_skip_read_mail(mcp, imap_server):
+    imap_server.mailbox("INBOX").set_flags(10, ["\\Seen"])
+    assert mcp.select_folder("INBOX")
+
+    emails = mcp.get_unread_emails(limit=3)
+
+    assert [email["id"] for email in emails] == ["9", "8", "7"]
+    assert not any(email["read"] for email in emails)
+    assert len(body_fetches(imap_server)) == 1
+
+
+def test_missing_uids_are_left_out(mcp, imap_server):
+    assert mcp.select_folder("INBOX")
+
+    assert [email["id"] for email in mcp.fetch_emails([4, 99, 5])] == ["4", "5"]
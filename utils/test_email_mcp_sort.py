@@ -0,0 +1,51 @@
+"""
+Tests for newest-first listings and counts with SORT/ESEARCH and their fallbacks
+"""
+import pytest
+
+BASE = ("IMAP4rev1",)
+LISTING_CAPABILITIES = {
+    "esort": (BASE + ("SORT", "ESORT", "CONTEXT=SORT", "ESEARCH"), "UID SORT RETURN (PARTIAL"),
+    "sort": (BASE + ("SORT",), "UID SORT (REVERSE DATE)"),
+    "partial": (BASE + ("ESEARCH", "PARTIAL"), "UID SEARCH RETURN (PARTIAL"),
+    "esearch": (BASE + ("ESEARCH",), "UID SEARCH RETURN (ALL)"),
+    "plain": (BASE, "UID SEARCH ALL"),
+}
+
+
+@pytest.fixture(params=sorted(LISTING_CAPABILITIES))
+def listing(request):
+    return LISTING_CAPABILITIES[request.param]
+
+
+@pytest.fixture
+def imap_capabilities(listing):
+    return listing[0]
+
+
+def test_newest_emails_come_first_with_every_method(mcp, imap_server, listing):
+    assert mcp.select_folder("INBOX")
+
+    envelopes = mcp.get_recent_emails(limit=3, headers_only=True)
+
+    assert [envelope["id"] for envelope in envelopes] == ["10", "9", "8"]
+    assert any(command.startswith(listing[1]) for command in imap_server.log)
+
+
+def test_search_pages_step_back_in_time(mcp, listing):
+    assert mcp.select_folder("INBOX")
+
+    page = mcp.search_emails({"limit": 3, "page": 2, "headers_only": True})
+
+    assert [envelope["id"] for envelope in page] == ["7", "6", "5"]
+
+
+def test_counts_use_a_single_esearch_when_available(mcp, imap_server, listing):
+    imap_server.mailbox("INBOX").set_flags(10, ["\\Seen"])
+    assert mcp.select_folder("INBOX")
+
+    summary = mcp.summarize_search({"unread": True})
+
+    assert summary == {"count": 9, "min_uid": 1, "max_uid": 9}
+    if "ESEARCH" in listing[0]:
+        assert imap_server.commands("UID SEARCH") == ["UID SEARCH RETURN (COUNT MIN MAX) UNSEEN"]
@@ -0,0 +1,42 @@
+"""
+Tests for byte-budgeted previews fetched with partial BODY.PEEK ranges
+"""
+from utils.fake_mail_server import make_message
+
+LONG_BODY = "Quarterly report. " * 200
+
+
+def test_preview_fetches_only_the_start_of_a_long_body(mcp, imap_server):
+    imap_server.mailbox("INBOX").add(make_message(11, body=LONG_BODY))
+    assert mcp.select_folder("INBOX")
+
+    long, short = mcp.fetch_previews([11, 3], max_bytes=64)
+
+    assert long["id"] == "11" and long["truncated"]
+    assert long["preview"].startswith("Quarterly report. Quarterly report.")
+    assert len(long["preview"]) <= 64
+    assert short == {"id": "3", "preview": "Body of message 3", "content_type": "text/plain", "truncated": False}
+    assert any("<0.64>" in command for command in imap_server.commands("UID FETCH"))
+    assert "\\Seen" not in imap_server.mailbox("INBOX").get(11).flags
+
+
+def test_preview_reads_the_text_part_of_a_message_with_attachments(mcp, imap_server):
+    imap_server.mailbox("INBOX").add(make_message(11, body="See the attached file", attachment=True))
+    assert mcp.select_folder("INBOX")
+
+    preview = mcp.fetch_previews([11])[0]
+
+    assert preview["preview"] == "See the attached file"
+    assert any("BODY.PEEK[1]<0." in command for command in imap_server.commands("UID FETCH"))
+
+
+def test_request_budget_is_spread_over_the_messages(mcp, imap_server):
+    inbox = imap_server.mailbox("INBOX")
+    for number in range(11, 15):
+        inbox.add(make_message(number, body=LONG_BODY))
+    assert mcp.select_folder("INBOX")
+
+    previews = mcp.fetch_previews([11, 12, 13, 14], max_bytes=4096, max_total_bytes=100)
+
+    assert all(preview["truncated"] and 0 < len(preview["preview"]) <= 25 for preview in previews)
+    assert any("<0.25>" in command for command in imap_server.commands("UID FETCH"))
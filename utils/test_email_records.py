@@ -0,0 +1,31 @@
+"""
+Tests for EmailRecord bodies staying undecoded until they are read
+"""
+from utils.fake_mail_server import make_message
+from utils.mail_sync import MailboxSync
+
+
+def body_hits(search_index, mcp, text):
+    return [hit["id"] for hit in search_index.search(mcp.get_account_id(), text=text)["results"]]
+
+
+def test_fetch_indexes_headers_without_decoding_bodies(mcp, imap_server, search_index):
+    imap_server.mailbox("INBOX").add(make_message(11, body="Quarterly figures attached"))
+    assert mcp.select_folder("INBOX")
+
+    email = mcp.fetch_emails([11])[0]
+
+    assert not email.is_decoded
+    assert body_hits(search_index, mcp, "Message 11") == ["11"]
+    assert body_hits(search_index, mcp, "quarterly") == []
+    assert email.body.strip() == "Quarterly figures attached"
+
+
+def test_sync_indexes_bodies_and_later_fetches_keep_them(mcp, imap_server, search_index):
+    imap_server.mailbox("INBOX").add(make_message(11, body="Quarterly figures attached"))
+    MailboxSync(mcp, initial_limit=50).sync("INBOX")
+    assert body_hits(search_index, mcp, "quarterly") == ["11"]
+
+    # Fetching again re-indexes the headers only and keeps the body text
+    assert not mcp.fetch_emails([11])[0].is_decoded
+    assert body_hits(search_index, mcp, "quarterly") == ["11"]
@@ -0,0 +1,61 @@
+"""
+Tests for the write-behind flag queue
+"""
+import socket
+import time
+
+from utils.flag_queue import FlagQueue
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_failed_flush_is_retried_by_the_timer(imap_server):
+    settings = imap_server.settings()
+    queue = FlagQueue(dict(settings, port=_closed_port()), flush_delay=0.05)
+    queue.queue("INBOX", [6], ["\\Flagged"], add=True, uidvalidity=1000)
+
+    assert _wait_for(lambda: queue.get_stats()["errors"] >= 1)
+    assert queue.pending_count() == 1
+
+    # The server is reachable again, the rescheduled flush delivers the change
+    queue.settings = settings
+    assert _wait_for(lambda: queue.pending_count() == 0)
+    assert _wait_for(lambda: "\\Flagged" in imap_server.mailbox("INBOX").get(6).flags)
+
+
+def test_requeued_changes_keep_newer_changes(imap_server):
+    settings = imap_server.settings()
+    queue = FlagQueue(dict(settings, port=_closed_port()), flush_delay=60)
+    queue.queue("INBOX", [2], ["\\Seen"], add=True, uidvalidity=1000)
+    assert not queue.flush()
+
+    queue.queue("INBOX", [2], ["\\Seen"], add=False, uidvalidity=1000)
+    queue.settings = settings
+    imap_server.mailbox("INBOX").set_flags(2, ["\\Seen"])
+    assert queue.flush()
+
+    assert "\\Seen" not in imap_server.mailbox("INBOX").get(2).flags
+
+
+def test_changes_are_dropped_after_uidvalidity_change(imap_server):
+    queue = FlagQueue(imap_server.settings(), flush_delay=60)
+    queue.queue("INBOX", [7], ["\\Flagged"], add=True, uidvalidity=999)
+
+    assert queue.flush()
+
+    assert queue.get_stats()["dropped"] == 1
+    assert "\\Flagged" not in imap_server.mailbox("INBOX").get(7).flags
+    assert imap_server.commands("UID STORE") == []
@@ -0,0 +1,42 @@
+"""
+Tests for converting HTML mail bodies to plain text
+"""
+from utils.html_text import HTMLTextCache, convert_html
+
+
+def test_scripts_and_styles_are_dropped():
+    html = ("<html><head><title>Newsletter</title><style>p { color: red }</style></head>"
+            "<body><script>track()</script><p>Hello there</p></body></html>")
+
+    assert convert_html(html) == "Hello there"
+
+
+def test_block_elements_become_lines_and_cells_spaces():
+    html = ("<div>First&nbsp;line</div><p>Fish &amp; chips</p>"
+            "<table><tr><td>A</td><td>B</td></tr></table>")
+
+    assert convert_html(html) == "First line\nFish & chips\nA B"
+
+
+def test_conversion_stops_at_max_chars():
+    html = "<p>" + "x" * 50 + "</p>" + "<p>tail</p>" * 1000
+
+    assert convert_html(html, max_chars=20) == "x" * 20
+
+
+def test_partial_markup_drops_the_unterminated_tag():
+    assert convert_html('<p>Hello</p><a href="http://exa', partial=True) == "Hello"
+
+
+def test_conversions_are_memoized_per_key():
+    cache = HTMLTextCache(size=2)
+
+    assert cache.convert("<p>One</p>", key=1) == "One"
+    # The key wins over the markup, a message is converted once
+    assert cache.convert("<p>Changed</p>", key=1) == "One"
+    assert cache.convert("<p>Two</p>", key=2) == "Two"
+    assert cache.convert("<p>Three</p>", key=3) == "Three"
+    assert cache.convert("<p>Again</p>", key=1) == "Again"
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 4, 2)
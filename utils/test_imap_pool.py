@@ -0,0 +1,93 @@
+"""
+Tests for the pooled IMAP sessions
+"""
+import threading
+import time
+
+import pytest
+
+from utils.email_mcp import EmailMCP
+from utils.imap_pool import IMAPConnectionPool
+
+
+@pytest.fixture
+def pool():
+    pool = IMAPConnectionPool(max_per_account=2, acquire_timeout=0.2)
+    yield pool
+    pool.close_all()
+
+
+def test_released_session_is_reused(pool, imap_server):
+    settings = imap_server.settings()
+    conn = pool.acquire(settings)
+    pool.release(conn)
+
+    assert pool.acquire(settings) is conn
+    assert imap_server.logins == 1
+    assert pool.get_stats()["hits"] == 1
+
+
+def test_account_cap_times_out(pool, imap_server):
+    settings = imap_server.settings()
+    first, second = pool.acquire(settings), pool.acquire(settings)
+
+    with pytest.raises(TimeoutError):
+        pool.acquire(settings)
+
+    pool.release(first)
+    assert pool.acquire(settings) is first
+    pool.release(second)
+
+
+def test_discarded_session_frees_its_slot(pool, imap_server):
+    settings = imap_server.settings()
+    first, second = pool.acquire(settings), pool.acquire(settings)
+    pool.release(first, discard=True)
+
+    third = pool.acquire(settings)
+
+    assert third is not first
+    assert imap_server.logins == 3
+    pool.release(second)
+    pool.release(third)
+
+
+def test_email_mcp_returns_its_session_on_disconnect(imap_server):
+    mcp = EmailMCP(imap_server.settings())
+    assert mcp.connect()
+    conn = mcp.imap_conn
+    mcp.disconnect()
+
+    other = EmailMCP(imap_server.settings())
+    assert other.connect()
+    assert other.imap_conn is conn
+    other.disconnect()
+
+
+def test_released_session_wakes_a_waiter_of_its_own_account(imap_server):
+    pool = IMAPConnectionPool(max_per_account=1, acquire_timeout=1.0)
+    first = imap_server.settings()
+    second = imap_server.settings(username="other")
+    held = {name: pool.acquire(settings) for name, settings in (("first", first), ("second", second))}
+    acquired = {}
+
+    def wait_for(name, settings):
+        start = time.monotonic()
+        conn = pool.acquire(settings)
+        acquired[name] = time.monotonic() - start
+        pool.release(conn)
+
+    # The other account's waiter queues up first and would take a single notify()
+    waiters = [threading.Thread(target=wait_for, args=("second", second)),
+               threading.Thread(target=wait_for, args=("first", first))]
+    for waiter in waiters:
+        waiter.start()
+        time.sleep(0.1)
+
+    pool.release(held["first"])
+    waiters[1].join()
+    pool.release(held["second"])
+    waiters[0].join()
+    pool.close_all()
+
+    assert acquired["first"] < 0.5
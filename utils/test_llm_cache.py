@@ -0,0 +1,45 @@
+"""
+Tests for the persistent LLM response cache
+"""
+from utils.llm_cache import LLMCache, make_cache_key
+
+PAYLOAD = {"model": "test-model", "temperature": 0, "messages": [{"role": "user", "content": "Hi"}]}
+
+
+def test_key_ignores_fields_that_do_not_change_the_answer():
+    assert make_cache_key(dict(PAYLOAD, stream=True, user="jane")) == make_cache_key(PAYLOAD)
+    assert make_cache_key(dict(PAYLOAD, temperature=0.2)) != make_cache_key(PAYLOAD)
+
+
+def test_responses_survive_a_restart_and_count_saved_tokens(tmp_path):
+    path = str(tmp_path / "llm_cache.db")
+    key = make_cache_key(PAYLOAD)
+    LLMCache(path).put(key, "test-model", "Hello!", {"prompt_tokens": 12, "completion_tokens": 3})
+
+    cache = LLMCache(path)
+    assert cache.get(key)["content"] == "Hello!"
+    assert cache.get("unknown") is None
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert (stats["saved_prompt_tokens"], stats["saved_completion_tokens"]) == (12, 3)
+
+
+def test_expired_responses_are_not_served(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.db"), ttl=-1)
+    cache.put("key", "test-model", "Hello!")
+
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.db"), max_entries=2, memory_entries=1)
+    cache.put("first", "test-model", "1")
+    cache.put("second", "test-model", "2")
+    assert cache.get("first")["content"] == "1"
+
+    cache.put("third", "test-model", "3")
+
+    assert cache.get("second") is None
+    assert [cache.get(key)["content"] for key in ("first", "third")] == ["1", "3"]
+    assert cache.get_stats()["evictions"] == 1
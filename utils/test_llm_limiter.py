@@ -0,0 +1,111 @@
+"""
+Tests for request coalescing and rate limiting of LLM calls
+"""
+import threading
+import time
+
+import pytest
+
+from utils.llm_limiter import RateLimiter, SingleFlight, parse_reset_duration, parse_retry_after
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+
+def test_reset_durations_and_retry_after_are_parsed():
+    assert parse_reset_duration("6m0s") == 360.0
+    assert parse_reset_duration("250ms") == 0.25
+    assert parse_reset_duration("12") == 12.0
+    assert parse_reset_duration("soon") is None
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT") == 0.0
+
+
+def test_identical_concurrent_calls_share_one_request():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def request():
+        calls.append(1)
+        release.wait(2)
+        return "answer"
+
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(flights.do("key", request))) for _ in range(3)]
+    for caller in callers:
+        caller.start()
+    wait_for(lambda: flights.get_stats()["shared"] == 2)
+    release.set()
+    for caller in callers:
+        caller.join(2)
+
+    assert results == ["answer"] * 3
+    assert len(calls) == 1
+    assert flights.get_stats()["in_flight"] == 0
+
+
+def test_errors_of_a_shared_call_reach_every_caller():
+    flights = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def request():
+        release.wait(2)
+        raise ValueError("upstream failed")
+
+    def call():
+        try:
+            flights.do("key", request)
+        except ValueError as e:
+            errors.append(str(e))
+
+    callers = [threading.Thread(target=call) for _ in range(2)]
+    for caller in callers:
+        caller.start()
+    wait_for(lambda: flights.get_stats()["shared"] == 1)
+    release.set()
+    for caller in callers:
+        caller.join(2)
+
+    assert errors == ["upstream failed"] * 2
+
+
+def test_callers_over_the_concurrency_cap_wait_for_a_release():
+    limiter = RateLimiter(requests_per_minute=6000, max_concurrent=1, max_wait=2)
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+
+    wait_for(lambda: limiter.get_stats()["queued"] == 1)
+    assert not acquired.is_set()
+    limiter.release()
+    waiter.join(2)
+
+    assert acquired.is_set()
+    assert limiter.get_stats()["waited"] == 1
+
+
+def test_acquire_gives_up_after_max_wait():
+    limiter = RateLimiter(max_concurrent=1, max_wait=0.05)
+    limiter.acquire()
+
+    with pytest.raises(TimeoutError):
+        limiter.acquire()
+    assert limiter.get_stats()["queued"] == 0
+
+
+def test_throttled_responses_pause_requests_and_lower_the_rate():
+    limiter = RateLimiter(requests_per_minute=500)
+
+    limiter.update_from_headers({"retry-after": "5", "x-ratelimit-limit-requests": "60"}, 429)
+
+    stats = limiter.get_stats()
+    assert stats["throttled"] == 1
+    assert 4 < stats["paused_for"] <= 5
+    assert stats["requests_per_minute"] == 60.0
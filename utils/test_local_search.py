@@ -0,0 +1,64 @@
+"""
+Tests for answering searches from the local index
+"""
+from utils.fake_mail_server import make_message
+from utils.mail_sync import MailboxSync
+
+
+def test_partially_indexed_folder_is_searched_on_the_server(mcp, imap_server, sync_state):
+    # Only the newest four messages are downloaded by the first sync
+    MailboxSync(mcp, initial_limit=4).sync("INBOX")
+    assert not sync_state.get(mcp.get_account_id(), "INBOX")["complete"]
+    assert not mcp.is_fully_indexed("INBOX")
+
+    results = mcp.search_emails({"sender": "sender1@example.com", "limit": 5})
+
+    assert [email["id"] for email in results] == ["1"]
+    assert imap_server.commands("UID SORT")
+
+
+def test_fully_indexed_folder_is_searched_locally(mcp, imap_server):
+    MailboxSync(mcp, initial_limit=50).sync("INBOX")
+    assert mcp.is_fully_indexed("INBOX")
+    imap_server.log.clear()
+
+    results = mcp.search_emails({"sender": "sender1@example.com", "limit": 5})
+
+    assert [email["id"] for email in results] == ["1"]
+    assert not imap_server.commands("UID SORT") and not imap_server.commands("UID SEARCH")
+
+
+def test_new_mail_makes_the_index_incomplete(mcp, imap_server):
+    MailboxSync(mcp, initial_limit=50).sync("INBOX")
+    imap_server.mailbox("INBOX").add(make_message(11))
+    mcp.status_cache_ttl = 0
+
+    assert not mcp.is_fully_indexed("INBOX")
+    assert [email["id"] for email in mcp.search_emails({"sender": "sender11@example.com"})] == ["11"]
+
+
+def test_text_search_of_a_partial_index_falls_back_to_the_server(mcp, imap_server):
+    MailboxSync(mcp, initial_limit=4).sync("INBOX")
+
+    results = mcp.search_emails({"text": "Body of message 2", "from": "sender2@example.com",
+                                 "headers_only": True})
+
+    assert [email["id"] for email in results] == ["2"]
+    assert any('TEXT "Body of message 2"' in command for command in imap_server.commands("UID SORT"))
+
+
+def test_local_results_carry_attachment_names(mcp, imap_server):
+    imap_server.mailbox("INBOX").add(make_message(11, attachment=True))
+    MailboxSync(mcp, initial_limit=50).sync("INBOX")
+    imap_server.log.clear()
+    expected = [{"filename": "data.bin", "content_type": "application/octet-stream"}]
+
+    record = mcp.search_emails({"sender": "sender11@example.com"})[0]
+    envelope = mcp.search_emails({"sender": "sender11@example.com", "headers_only": True})[0]
+    plain = mcp.search_emails({"sender": "sender10@example.com", "headers_only": True})[0]
+
+    assert record.has_attachments and record.attachments == expected
+    assert envelope.has_attachments and envelope.to_dict()["attachments"] == expected
+    assert not envelope.is_loaded
+    assert not plain.has_attachments
+    assert not imap_server.commands("UID FETCH")
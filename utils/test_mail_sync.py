@@ -0,0 +1,67 @@
+"""
+Tests for MailboxSync change tracking
+"""
+import pytest
+
+from utils.fake_mail_server import FakeIMAPServer
+from utils.mail_sync import MailboxSync
+
+QRESYNC_CAPABILITIES = FakeIMAPServer.DEFAULT_CAPABILITIES + ("QRESYNC",)
+
+
+@pytest.mark.parametrize("imap_capabilities", [QRESYNC_CAPABILITIES])
+def test_qresync_enabled_at_login(mcp, imap_server):
+    assert mcp.is_enabled("QRESYNC")
+    assert mcp.is_enabled("CONDSTORE")
+    assert imap_server.commands("ENABLE") == ["ENABLE QRESYNC"]
+
+
+def test_qresync_not_enabled_unless_advertised(mcp, imap_server):
+    assert not mcp.is_enabled("QRESYNC")
+    assert imap_server.commands("ENABLE") == []
+
+
+@pytest.mark.parametrize("imap_capabilities", [QRESYNC_CAPABILITIES])
+def test_sync_reports_vanished_uids_with_qresync(mcp, imap_server, search_index):
+    sync = MailboxSync(mcp, initial_limit=50)
+    assert len(sync.sync("INBOX")["new_emails"]) == 10
+
+    imap_server.mailbox("INBOX").expunge([3, 5])
+    result = sync.sync("INBOX")
+
+    assert sorted(result["vanished"]) == [3, 5]
+    assert any("VANISHED" in command for command in imap_server.commands("UID FETCH"))
+    assert sorted(search_index.uids(mcp.get_account_id(), "INBOX", 1000)) == [1, 2, 4, 6, 7, 8, 9, 10]
+
+
+def test_sync_diffs_uids_without_qresync(mcp, imap_server, search_index):
+    sync = MailboxSync(mcp, initial_limit=50)
+    sync.sync("INBOX")
+
+    imap_server.mailbox("INBOX").expunge([3, 5])
+    result = sync.sync("INBOX")
+
+    assert sorted(result["vanished"]) == [3, 5]
+    assert not any("VANISHED" in command for command in imap_server.commands("UID FETCH"))
+    assert sorted(search_index.uids(mcp.get_account_id(), "INBOX", 1000)) == [1, 2, 4, 6, 7, 8, 9, 10]
+
+
+def test_backfill_resumes_until_the_folder_is_complete(mcp, search_index, sync_state):
+    sync = MailboxSync(mcp, initial_limit=4)
+    account = mcp.get_account_id()
+
+    first = sync.sync("INBOX")
+    assert len(first["new_emails"]) == 4 and first["has_more"]
+    assert sync_state.get(account, "INBOX")["backfill_cursor"] == 7
+
+    # Nothing new on the server, the following runs only fill in older mail
+    second = sync.sync("INBOX")
+    assert second["new_emails"] == [] and second["backfilled"] == 4 and second["has_more"]
+    assert sorted(search_index.uids(account, "INBOX", 1000)) == list(range(3, 11))
+    assert not mcp.is_fully_indexed("INBOX")
+
+    third = sync.sync("INBOX")
+    assert third["backfilled"] == 2 and not third["has_more"]
+    assert sync_state.get(account, "INBOX")["complete"]
+    assert mcp.is_fully_indexed("INBOX")
+    assert sync.sync("INBOX")["backfilled"] == 0
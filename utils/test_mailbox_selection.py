@@ -0,0 +1,55 @@
+"""
+Tests for the remembered mailbox selection and read-only message fetches
+"""
+from utils.email_mcp import EmailMCP
+
+
+def test_fetch_does_not_set_seen_on_a_read_write_selection(mcp, imap_server):
+    assert mcp.select_folder("INBOX")
+    assert not mcp.imap_conn.selected_mailbox["readonly"]
+
+    assert mcp.fetch_email(5).body.strip() == "Body of message 5"
+    assert "\\Seen" not in imap_server.mailbox("INBOX").get(5).flags
+
+
+def test_read_only_select_is_not_served_by_a_pooled_read_write_selection(mcp, imap_server,
+                                                                         search_index, sync_state):
+    assert mcp.mark_as_read(4)
+    assert not mcp.imap_conn.selected_mailbox["readonly"]
+    mcp.disconnect()
+
+    reader = EmailMCP(imap_server.settings())
+    reader.search_index = search_index
+    reader.sync_state = sync_state
+    try:
+        assert reader.connect()
+        assert imap_server.logins == 1
+        assert reader.select_folder("INBOX", readonly=True)
+        assert reader.imap_conn.selected_mailbox["readonly"]
+        assert imap_server.commands("EXAMINE")
+        assert reader.fetch_email(5) is not None
+    finally:
+        reader.disconnect()
+
+    flags = imap_server.mailbox("INBOX")
+    assert "\\Seen" in flags.get(4).flags
+    assert "\\Seen" not in flags.get(5).flags
+
+
+def test_read_write_select_upgrades_an_examine(mcp, imap_server):
+    assert mcp.select_folder("INBOX", readonly=True)
+    assert mcp.select_folder("INBOX", readonly=True)
+    assert len(imap_server.commands("EXAMINE")) == 1
+
+    assert mcp.select_folder("INBOX")
+    assert not mcp.imap_conn.selected_mailbox["readonly"]
+    assert len(imap_server.commands("SELECT")) == 1
+
+
+def test_reads_keep_the_current_selection(mcp, imap_server):
+    assert mcp.select_folder("INBOX")
+    mcp.fetch_email(3)
+    mcp.get_unread_emails(limit=2, headers_only=True)
+
+    assert imap_server.commands("SELECT") == ["SELECT INBOX"]
+    assert imap_server.commands("EXAMINE") == []
@@ -0,0 +1,69 @@
+"""
+Tests for message refs and the draft threads loaded through them
+"""
+from utils.fake_mail_server import make_message
+from utils.message_refs import (compact_emails, load_referenced_email, load_thread_emails,
+                                 load_thread_refs, make_ref)
+
+
+def add_thread(imap_server):
+    inbox = imap_server.mailbox("INBOX")
+    inbox.add(make_message(11, subject="Budget", body="Can we raise the budget?",
+                           message_id="<budget@example.com>"))
+    inbox.add(make_message(12, subject="Re: Budget", body="Only by ten percent.",
+                           message_id="<budget-reply@example.com>", references=["<budget@example.com>"]))
+
+
+def test_thread_refs_are_found_without_downloading_bodies(imap_server, ref_store, threads):
+    add_thread(imap_server)
+    settings = imap_server.settings(index_threads=True)
+
+    refs = load_thread_refs(settings, uid=12, folder="INBOX")
+
+    assert [ref_store.resolve(ref)["uid"] for ref in refs] == [11, 12]
+    assert not any("BODY.PEEK[]" in command for command in imap_server.commands("UID FETCH"))
+
+    thread = load_thread_emails(settings, refs)
+    assert [email["message_id"] for email in thread] == ["<budget@example.com>", "<budget-reply@example.com>"]
+    assert thread[1]["body"].strip() == "Only by ten percent."
+
+
+def test_thread_emails_skip_refs_of_other_accounts(imap_server, ref_store, threads):
+    add_thread(imap_server)
+    refs = load_thread_refs(imap_server.settings(index_threads=True), uid=12, folder="INBOX")
+
+    assert load_thread_emails(imap_server.settings(username="someone-else"), refs) == []
+    assert load_thread_emails(imap_server.settings(), ["unknown"]) == []
+
+
+def test_compact_emails_registers_refs_and_previews_only_loaded_bodies(mcp, imap_server, ref_store):
+    assert mcp.select_folder("INBOX", readonly=True)
+    envelopes = compact_emails(mcp, mcp.get_unread_emails(limit=2, headers_only=True))
+
+    assert [envelope["preview"] for envelope in envelopes] == ["", ""]
+    assert not any("BODY.PEEK[]" in command for command in imap_server.commands("UID FETCH"))
+    assert envelopes[0]["ref"] == make_ref(mcp.get_account_id(), "INBOX", 1000, "10")
+    assert ref_store.resolve(envelopes[0]["ref"])["uid"] == 10
+
+    full = compact_emails(mcp, [mcp.fetch_email(10)], preview_chars=7)[0]
+    assert full["ref"] == envelopes[0]["ref"]
+    assert full["preview"] == "Body of..."
+
+
+def test_unused_refs_are_purged(ref_store):
+    ref = ref_store.register("account", "INBOX", 1000, 5, "<message5@example.com>")
+    assert ref_store.purge() == 0
+
+    assert ref_store.purge(older_than=-1) == 1
+    assert ref_store.resolve(ref) is None
+
+
+def test_referenced_email_loads_only_for_its_account(mcp, imap_server, ref_store):
+    assert mcp.select_folder("INBOX", readonly=True)
+    ref = compact_emails(mcp, mcp.get_unread_emails(limit=1, headers_only=True))[0]["ref"]
+    mcp.disconnect()
+
+    assert load_referenced_email(imap_server.settings(username="someone-else"), ref) is None
+    email = load_referenced_email(imap_server.settings(), ref)
+    assert email["ref"] == ref
+    assert email["body"].strip() == "Body of message 10"
@@ -0,0 +1,31 @@
+"""
+Tests for the streaming MIME parser
+"""
+import pytest
+
+from utils.mime_stream import StreamingMimeParser, parse_bytes
+
+QP_HEADERS = (b"Content-Type: text/plain; charset=utf-8\r\n"
+              b"Content-Transfer-Encoding: quoted-printable\r\n\r\n")
+
+
+def _parse_in_chunks(raw: bytes, chunk_size: int, spool_threshold: int) -> str:
+    parser = StreamingMimeParser(spool_threshold=spool_threshold)
+    for start in range(0, len(raw), chunk_size):
+        parser.feed(raw[start:start + chunk_size])
+    with parser.close() as parsed:
+        return parsed.find_body_part("text/plain").text()
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 24))
+def test_quoted_printable_escape_split_by_a_flush(chunk_size):
+    # Lines longer than the spool threshold are flushed before their newline arrives
+    raw = QP_HEADERS + b"caf=C3=A9 " * 20 + b"end=\r\nnext line\r\n"
+    text = _parse_in_chunks(raw, chunk_size, spool_threshold=16)
+    assert text == "café " * 20 + "endnext line"
+
+
+def test_quoted_printable_whole_message():
+    raw = QP_HEADERS + b"soft=\r\nbreak =3D equals\r\nsecond line\r\n"
+    with parse_bytes(raw) as parsed:
+        assert parsed.find_body_part("text/plain").text() == "softbreak = equals\r\nsecond line"
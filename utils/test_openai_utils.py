@@ -0,0 +1,149 @@
+"""
+Tests for the shared OpenAI client, without network access
+"""
+import json
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+from utils import llm_cache, openai_utils
+from utils.llm_cache import LLMCache
+from utils.openai_utils import OpenAIClient, get_openai_client, load_openai_config
+
+CONFIG = """
+api:
+  endpoint: {endpoint}
+  api_key_env: TEST_OPENAI_API_KEY
+models:
+  default: test-model
+cache:
+  enabled: false
+parameters:
+  draft_generator:
+    temperature: 0.7
+"""
+
+
+class FakeResponse:
+    def __init__(self, body=None, lines=()):
+        self.status_code = 200
+        self.headers = {}
+        self.encoding = None
+        self.closed = False
+        self._body = body
+        self._lines = lines
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._body
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self._lines)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """Records requests and answers them with the queued responses"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        self.requests.append({"url": url, "payload": json, "stream": stream})
+        return self.responses.pop(0)
+
+
+def stream(*fragments):
+    lines = [": keep-alive", ""]
+    lines += ["data: " + json.dumps({"choices": [{"delta": {"content": text}}]}) for text in fragments]
+    return FakeResponse(lines=lines + ["data: [DONE]"])
+
+
+def completion(text):
+    return FakeResponse({"choices": [{"message": {"content": text}}]})
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("TEST_OPENAI_API_KEY", "sk-test")
+    path = tmp_path / "openai.yml"
+    path.write_text(CONFIG.format(endpoint="https://one.example/v1"))
+    return str(path)
+
+
+def rewrite(path, endpoint):
+    with open(path, "w") as file:
+        file.write(CONFIG.format(endpoint=endpoint))
+    # Make sure the change is visible even on filesystems with coarse timestamps
+    mtime = os.stat(path).st_mtime + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_config_is_parsed_again_only_after_it_changed(config_path):
+    config = load_openai_config(config_path)
+    assert load_openai_config(config_path) is config
+
+    rewrite(config_path, "https://two.example/v1")
+    assert load_openai_config(config_path)["api"]["endpoint"] == "https://two.example/v1"
+
+
+def test_requests_share_the_session_and_follow_config_changes(config_path):
+    client = OpenAIClient(config_path)
+    client.session = FakeSession(completion("first"), completion("second"))
+
+    assert client.chat_completion([{"role": "user", "content": "Hi"}]) == "first"
+    rewrite(config_path, "https://two.example/v1")
+    assert client.chat_completion([{"role": "user", "content": "Hi again"}]) == "second"
+
+    urls = [request["url"] for request in client.session.requests]
+    assert urls == ["https://one.example/v1/chat/completions", "https://two.example/v1/chat/completions"]
+    assert client.session.requests[0]["payload"]["model"] == "test-model"
+
+
+def test_process_shares_one_client(monkeypatch, config_path):
+    monkeypatch.setattr(openai_utils, "_default_client", None)
+    monkeypatch.setattr(openai_utils, "_default_config_path", lambda: config_path)
+
+    assert get_openai_client() is get_openai_client()
+
+
+def test_missing_api_key_is_reported(config_path, monkeypatch):
+    monkeypatch.delenv("TEST_OPENAI_API_KEY")
+
+    with pytest.raises(ValueError):
+        OpenAIClient(config_path)
+
+
+def test_stream_yields_fragments_and_gives_back_its_slot(config_path):
+    client = OpenAIClient(config_path)
+    response = stream("Dear ", "Jane, ", "caf\u00e9?")
+    client.session = FakeSession(response)
+
+    assert list(client.generate_text_stream("Write a draft")) == ["Dear ", "Jane, ", "caf\u00e9?"]
+    assert client.session.requests[0]["payload"]["stream"] is True
+    assert response.closed and response.encoding == "utf-8"
+    assert client.limiter.get_stats()["active"] == 0
+    assert client.get_stats()["streams"] == 1
+
+
+def test_deterministic_stream_is_served_from_the_cache(config_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "_default_cache", LLMCache(str(tmp_path / "llm_cache.db")))
+    with open(config_path) as file:
+        config = file.read().replace("enabled: false", "enabled: true")
+    with open(config_path, "w") as file:
+        file.write(config)
+    client = OpenAIClient(config_path)
+    client.session = FakeSession(stream("Thanks, ", "will do."))
+    messages = [{"role": "user", "content": "Reply"}]
+
+    assert list(client.chat_completion_stream(messages, temperature=0)) == ["Thanks, ", "will do."]
+    # The whole answer comes back in one piece, without a request
+    assert list(client.chat_completion_stream(messages, temperature=0)) == ["Thanks, will do."]
+    assert len(client.session.requests) == 1
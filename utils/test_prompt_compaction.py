@@ -0,0 +1,84 @@
+"""
+Tests for compacting email threads before they go into a prompt
+"""
+from utils.prompt_compaction import (clean_turn, compact_thread, count_tokens, split_turns, strip_disclaimer,
+                                     strip_signature)
+
+DISCLAIMER = ("This email and any attachments are confidential and intended solely for the use of "
+              "the addressee. If you have received this email in error, please notify the sender "
+              "and delete it. Any disclosure or copying is strictly prohibited.")
+
+
+def test_closing_paragraph_mentioning_confidential_is_kept():
+    text = ("Here are the numbers for Q3.\n\n"
+            "Please keep this confidential until the board meeting, the figures are privileged.")
+
+    assert strip_disclaimer(text) == text
+
+
+def test_disclaimer_after_a_separator_is_removed():
+    text = f"Here are the numbers for Q3.\n\nJane\n\n______________\n{DISCLAIMER}"
+
+    assert strip_disclaimer(text) == "Here are the numbers for Q3.\n\nJane"
+
+
+def test_disclaimer_paragraph_is_removed_without_a_separator():
+    text = f"Here are the numbers for Q3.\n\n{DISCLAIMER}"
+
+    assert strip_disclaimer(text) == "Here are the numbers for Q3."
+
+
+def test_signature_after_a_sign_off_is_removed():
+    text = ("Can you review the contract?\n\nThanks,\nJane Doe\nHead of Legal\n"
+            "Acme Corp.\n+1 555 123 4567\njane@acme.example")
+
+    assert strip_signature(text) == "Can you review the contract?\n\nThanks,"
+
+
+def test_postscript_after_a_sign_off_is_kept():
+    text = "Can you review the contract?\n\nThanks,\nJane\n\nP.S. The deadline moved to Friday."
+
+    assert strip_signature(text) == text
+
+
+def test_sentences_after_a_sign_off_are_kept():
+    text = "Draft attached.\n\nThanks!\nI will call you tomorrow to go over it.\nJane"
+
+    assert strip_signature(text) == text
+
+
+def test_clean_turn_drops_footer_and_signature_but_not_content():
+    text = (f"Please keep this confidential for now.\n\nBest regards,\nJane Doe\n"
+            f"Acme Corp.\n\n--\n{DISCLAIMER}")
+
+    assert clean_turn(text) == "Please keep this confidential for now.\n\nBest regards,"
+
+
+def test_reply_is_split_into_turns_newest_first():
+    text = ("Friday works for me.\n\nOn Mon, 3 Jun 2024 at 10:00, Jane <jane@example.com> wrote:\n"
+            "> Can we meet this week?\n>\n> On Sun, 2 Jun 2024, Bob wrote:\n>> Let us catch up.")
+
+    assert [turn.strip() for turn in split_turns(text)] == [
+        "Friday works for me.", "Can we meet this week?", "Let us catch up."]
+
+
+def test_quoted_history_is_kept_once_with_its_sender():
+    thread = [
+        {"from": "jane@example.com", "date": "Mon", "body": "Can we meet this week?"},
+        {"from": "bob@example.com", "date": "Tue",
+         "body": "Friday works for me.\n\nOn Mon, Jane <jane@example.com> wrote:\n> Can we meet this week?"}
+    ]
+
+    assert compact_thread(thread) == ("[jane@example.com - Mon]\nCan we meet this week?\n\n"
+                                      "[bob@example.com - Tue]\nFriday works for me.")
+
+
+def test_long_thread_keeps_the_newest_turns_within_the_budget():
+    thread = [{"from": f"person{n}@example.com", "body": f"Update number {n}. " + "More details follow. " * 20}
+              for n in range(30)]
+
+    result = compact_thread(thread, budget=200)
+
+    assert count_tokens(result) <= 200
+    assert "Update number 29." in result
+    assert "Update number 0." not in result
@@ -0,0 +1,51 @@
+"""
+Tests for the durable SMTP outbox
+"""
+import json
+
+from utils import smtp_spool
+from utils.smtp_spool import SMTPSpool, STATUS_QUEUED, STATUS_SENT
+
+MESSAGE = b"Subject: Hello\r\n\r\nSpooled body\r\n"
+
+
+def test_spooled_mail_is_delivered_after_a_restart(tmp_path, monkeypatch, smtp_server):
+    settings = smtp_server.settings()
+    spool_path = str(tmp_path / "outbox.db")
+
+    # The process exits before its worker gets to the message
+    spool = SMTPSpool(spool_path)
+    monkeypatch.setattr(spool, "start", lambda: None)
+    message_id = spool.enqueue(settings, "me@example.com", ["bob@example.com"], MESSAGE, "Hello")
+    spool.stop()
+    assert spool.get_status(message_id)["status"] == STATUS_QUEUED
+
+    settings_path = tmp_path / "imap_settings.json"
+    settings_path.write_text(json.dumps(settings))
+    restarted = SMTPSpool(spool_path)
+    assert restarted.load_accounts(str(settings_path)) == 1
+    assert restarted.deliver_due() == 1
+
+    assert restarted.get_status(message_id)["status"] == STATUS_SENT
+    assert [message["recipients"] for message in smtp_server.messages] == [["bob@example.com"]]
+    assert b"Spooled body" in smtp_server.messages[0]["data"]
+
+
+def test_load_accounts_without_settings_file(tmp_path):
+    spool = SMTPSpool(str(tmp_path / "outbox.db"))
+    assert spool.load_accounts(str(tmp_path / "missing.json")) == 0
+
+
+def test_process_spool_starts_its_worker_only_when_asked(tmp_path, monkeypatch):
+    monkeypatch.setattr(smtp_spool, "_default_spool", None)
+    monkeypatch.setattr(smtp_spool, "_default_spool_path", lambda: str(tmp_path / "outbox.db"))
+    monkeypatch.setattr(smtp_spool, "_default_settings_path", lambda: str(tmp_path / "imap_settings.json"))
+
+    spool = smtp_spool.get_smtp_spool()
+    assert spool._worker is None
+
+    try:
+        assert smtp_spool.start_smtp_spool() is spool
+        assert spool._worker.is_alive()
+    finally:
+        spool.stop()
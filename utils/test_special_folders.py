@@ -0,0 +1,54 @@
+"""
+Tests for cached special-use folder discovery and saving drafts
+"""
+from utils.email_mcp import EmailMCP
+from utils.fake_mail_server import FakeMailbox
+
+
+def use_drafts_folder(imap_server, name):
+    """Give the \\Drafts role to a new folder called name"""
+    for mailbox in imap_server.mailboxes.values():
+        if mailbox.special_use == "\\Drafts":
+            mailbox.special_use = None
+    imap_server.mailboxes[name] = FakeMailbox(name, special_use="\\Drafts")
+
+
+def test_special_folders_are_listed_once_per_account(mcp, imap_server):
+    assert mcp.get_special_folders() == {"drafts": "Drafts", "sent": "Sent", "archive": "Archive", "trash": "Trash"}
+
+    other = EmailMCP(imap_server.settings())
+    assert other.connect()
+    try:
+        assert other.get_special_folder("sent") == "Sent"
+    finally:
+        other.disconnect()
+    assert len(imap_server.commands("LIST")) == 1
+
+
+def test_folder_roles_fall_back_to_common_names(mcp, imap_server):
+    for mailbox in imap_server.mailboxes.values():
+        mailbox.special_use = None
+
+    assert mcp.get_special_folder("drafts") == "Drafts"
+    assert mcp.get_special_folder("junk") is None
+
+
+def test_draft_is_appended_to_the_special_use_folder_without_select(mcp, imap_server):
+    use_drafts_folder(imap_server, "Brouillons")
+
+    assert mcp.save_draft({"to": "bob@example.com", "subject": "Plan", "body": "Draft body"})
+
+    draft = imap_server.mailbox("Brouillons").messages[0]
+    assert "\\Draft" in draft.flags and b"Draft body" in draft.raw
+    assert imap_server.commands("SELECT") == [] and imap_server.commands("EXAMINE") == []
+
+
+def test_draft_folder_is_rediscovered_when_the_cached_one_is_gone(mcp, imap_server):
+    assert mcp.get_special_folder("drafts") == "Drafts"
+    del imap_server.mailboxes["Drafts"]
+    use_drafts_folder(imap_server, "Entwurf")
+
+    assert mcp.save_draft({"to": "bob@example.com", "subject": "Plan", "body": "Draft body"})
+
+    assert len(imap_server.mailbox("Entwurf").messages) == 1
+    assert len(imap_server.commands("LIST")) == 2
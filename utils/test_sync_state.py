@@ -0,0 +1,20 @@
+"""
+Tests for the per-folder sync checkpoint store
+"""
+from utils.sync_state import SyncStateStore
+
+
+def test_stores_sharing_a_file_see_and_keep_each_others_checkpoints(tmp_path):
+    path = str(tmp_path / "sync_state.db")
+    web, worker = SyncStateStore(path), SyncStateStore(path)
+
+    web.set("me@host", "INBOX", {"uidnext": 11, "complete": True})
+    worker.set("me@host", "Sent", {"uidnext": 4, "complete": False})
+
+    assert worker.get("me@host", "INBOX") == {"uidnext": 11, "complete": True}
+    assert web.get("me@host", "Sent") == {"uidnext": 4, "complete": False}
+
+    worker.set("me@host", "INBOX", {"uidnext": 12, "complete": True})
+    web.clear("me@host", "Sent")
+    assert web.get("me@host", "INBOX")["uidnext"] == 12
+    assert worker.get("me@host", "Sent") is None
@@ -0,0 +1,60 @@
+"""
+Tests for the local thread index and thread lookups through EmailMCP
+"""
+from utils.email_mcp import EmailMCP
+from utils.fake_mail_server import make_message
+from utils.thread_index import ThreadIndex, parse_references
+
+
+def email(uid, message_id, references=(), date="Mon, 03 Jun 2024 10:00:00 +0000"):
+    return {"id": uid, "message_id": message_id, "references": list(references),
+            "subject": "Budget", "from": "jane@example.com", "date": date}
+
+
+def test_references_and_in_reply_to_give_the_ancestors():
+    assert parse_references("<a@x> <b@x>", "<c@x>") == ["<a@x>", "<b@x>", "<c@x>"]
+    assert parse_references(None, "<b@x>") == ["<b@x>"]
+
+
+def test_reply_indexed_before_its_parent_is_linked_later(tmp_path):
+    index = ThreadIndex(str(tmp_path / "threads.db"))
+    index.add_messages("account", "INBOX", 1000, [
+        email(2, "<reply@x>", ["<root@x>"], date="Tue, 04 Jun 2024 10:00:00 +0000")])
+    assert index.missing_messages("account", "<reply@x>") == ["<root@x>"]
+
+    index.add_messages("account", "Sent", 2000, [email(7, "<root@x>")])
+
+    thread = index.get_thread("account", "<reply@x>")
+    assert [(entry["message_id"], entry["depth"], entry["folder"]) for entry in thread] == [
+        ("<root@x>", 0, "Sent"), ("<reply@x>", 1, "INBOX")]
+    assert index.missing_messages("account", "<root@x>") == []
+    assert index.get_thread("other-account", "<root@x>") == []
+
+
+def test_moved_messages_keep_their_place_in_the_thread(tmp_path):
+    index = ThreadIndex(str(tmp_path / "threads.db"))
+    index.add_messages("account", "INBOX", 1000, [email(1, "<root@x>"), email(2, "<reply@x>", ["<root@x>"])])
+
+    index.remove("account", "INBOX", uids=[1])
+
+    assert [entry["message_id"] for entry in index.get_thread("account", "<reply@x>")] == ["<reply@x>"]
+    assert index.missing_messages("account", "<reply@x>") == ["<root@x>"]
+
+
+def test_get_thread_looks_up_missing_ancestors_in_the_sent_folder(imap_server, search_index, sync_state, threads):
+    imap_server.mailbox("Sent").add(make_message(1, subject="Budget", message_id="<budget@example.com>"))
+    imap_server.mailbox("INBOX").add(make_message(11, subject="Re: Budget", message_id="<budget-reply@example.com>",
+                                                  references=["<budget@example.com>"]))
+    mcp = EmailMCP(imap_server.settings(index_threads=True))
+    mcp.search_index = search_index
+    mcp.sync_state = sync_state
+    try:
+        assert mcp.connect() and mcp.select_folder("INBOX")
+        mcp.fetch_emails([11])
+
+        thread = mcp.get_thread("<budget-reply@example.com>")
+    finally:
+        mcp.disconnect()
+
+    assert [(entry["folder"], entry["id"]) for entry in thread] == [("Sent", "1"), ("INBOX", "11")]
+    assert threads.missing_messages(mcp.get_account_id(), "<budget@example.com>") == []
@@ -0,0 +1,283 @@
+"""
+Conversation threading index for MailoBot
+
+Messages are linked into threads from their Message-ID, In-Reply-To and
+References headers, following the JWZ threading algorithm: every message
+ID seen (including referenced messages that are not available locally)
+gets a container, each container points at its parent, and containers
+that end up connected share a thread ID. The index is updated
+incrementally as messages are fetched or synced and lives in SQLite, so
+the thread of a message is an indexed lookup proportional to the size of
+the thread, never a scan of the mailbox.
+"""
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Any, Iterable, Optional
+
+from utils.search_index import _date_to_timestamp
+
+_MESSAGE_ID_RE = re.compile(r'<[^<>\s]+>')
+
+# Parent links followed before a chain is considered broken (guards against loops)
+_MAX_DEPTH = 1000
+
+
+def _default_thread_index_path() -> str:
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(current_dir, 'settings', 'cache', 'threads.db')
+
+
+def normalize_message_id(value: Any) -> Optional[str]:
+    """The <id@host> part of a Message-ID header, None if there is none"""
+    if not value:
+        return None
+    match = _MESSAGE_ID_RE.search(str(value))
+    return match.group(0) if match else None
+
+
+def parse_references(references: Any = None, in_reply_to: Any = None) -> List[str]:
+    """
+    Ancestors of a message from its References and In-Reply-To headers
+
+    Args:
+        references: References header (oldest ancestor first)
+        in_reply_to: In-Reply-To header
+
+    Returns:
+        Message IDs of the ancestors, oldest first; the last one is the parent
+    """
+    ids = []
+    for message_id in _MESSAGE_ID_RE.findall(str(references or "")):
+        if message_id not in ids:
+            ids.append(message_id)
+    # In-Reply-To names the parent when References is missing or was cut short
+    parent = normalize_message_id(in_reply_to)
+    if parent and parent not in ids:
+        ids.append(parent)
+    return ids
+
+
+class ThreadIndex:
+    """
+    SQLite index of message containers and their parent links
+
+    Example:
+        index = get_thread_index()
+        index.add_messages(account, "INBOX", uidvalidity, emails)
+        thread = index.get_thread(account, "<id@example.com>")
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the index
+
+        Args:
+            path: SQLite database file (defaults to settings/cache/threads.db)
+        """
+        self.path = path or _default_thread_index_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # A container without folder is a message that is referenced but not available locally
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS containers (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                parent_id TEXT,
+                folder TEXT,
+                uidvalidity INTEGER,
+                uid INTEGER,
+                subject TEXT,
+                sender TEXT,
+                date TEXT,
+                date_ts REAL,
+                PRIMARY KEY (account, message_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_containers_thread ON containers (account, thread_id);
+            CREATE INDEX IF NOT EXISTS idx_containers_location ON containers (account, folder, uid);
+        """)
+        self._db.commit()
+
+    def add_messages(self, account: str, folder: str, uidvalidity: int, emails: Iterable[Any]) -> int:
+        """
+        Add messages to the index, linking them into their threads
+
+        Args:
+            account: Account identifier (EmailMCP.get_account_id())
+            folder: Folder the emails belong to
+            uidvalidity: UIDVALIDITY of the folder
+            emails: Email records or dictionaries with id, message_id,
+                references, subject, from and date
+
+        Returns:
+            Number of messages indexed
+        """
+        count = 0
+        with self._lock:
+            for email_data in emails:
+                message_id = normalize_message_id(email_data.get("message_id"))
+                if not message_id:
+                    continue
+                references = [ref for ref in email_data.get("references") or () if ref != message_id]
+                self._link(account, message_id, references)
+                self._db.execute(
+                    "UPDATE containers SET folder=?, uidvalidity=?, uid=?, subject=?, sender=?, date=?, date_ts=? "
+                    "WHERE account=? AND message_id=?",
+                    (folder, uidvalidity, int(email_data["id"]), email_data.get("subject") or "",
+                     email_data.get("from") or "", email_data.get("date") or "",
+                     _date_to_timestamp(email_data.get("date")), account, message_id))
+                count += 1
+            self._db.commit()
+        return count
+
+    def get_thread(self, account: str, message_id: str) -> List[Dict[str, Any]]:
+        """
+        Messages of the thread a message belongs to
+
+        Args:
+            account: Account identifier
+            message_id: Message-ID of any message of the thread
+
+        Returns:
+            Locally available messages of the thread (message_id, parent_id,
+            depth, folder, uidvalidity, id, subject, from, date) in
+            chronological order; empty if the message is not indexed
+        """
+        rows = self._thread_rows(account, message_id)
+        parents = {row["message_id"]: row["parent_id"] for row in rows}
+
+        messages = []
+        for row in rows:
+            if row["folder"] is None:
+                continue
+            depth = 0
+            parent = row["parent_id"]
+            while parent is not None and depth < _MAX_DEPTH:
+                depth += 1
+                parent = parents.get(parent)
+            messages.append({
+                "message_id": row["message_id"],
+                "parent_id": row["parent_id"],
+                "depth": depth,
+                "folder": row["folder"],
+                "uidvalidity": row["uidvalidity"],
+                "id": str(row["uid"]),
+                "subject": row["subject"],
+                "from": row["sender"],
+                "date": row["date"],
+                "date_ts": row["date_ts"]
+            })
+        messages.sort(key=lambda message: (message["date_ts"] is None, message["date_ts"] or 0, message["depth"]))
+        return messages
+
+    def missing_messages(self, account: str, message_id: str) -> List[str]:
+        """Message IDs referenced in the thread of a message that are not available locally"""
+        return [row["message_id"] for row in self._thread_rows(account, message_id) if row["folder"] is None]
+
+    def remove(self, account: str, folder: str, uids: Optional[Iterable[int]] = None,
+               keep_uidvalidity: Optional[int] = None):
+        """
+        Forget where messages are stored, keeping their place in the thread
+
+        Args:
+            account: Account identifier
+            folder: Folder name
+            uids: UIDs that left the folder (all of the folder if None)
+            keep_uidvalidity: Only forget messages stored under a different UIDVALIDITY
+        """
+        query = "UPDATE containers SET folder=NULL, uidvalidity=NULL, uid=NULL WHERE account=? AND folder=?"
+        params: List[Any] = [account, folder]
+        if keep_uidvalidity is not None:
+            query += " AND uidvalidity!=?"
+            params.append(keep_uidvalidity)
+
+        with self._lock:
+            if uids is None:
+                self._db.execute(query, params)
+            else:
+                self._db.executemany(query + " AND uid=?", [params + [int(uid)] for uid in uids])
+            self._db.commit()
+
+    def _thread_rows(self, account: str, message_id: str) -> List[sqlite3.Row]:
+        message_id = normalize_message_id(message_id) or message_id
+        with self._lock:
+            row = self._db.execute(
+                "SELECT thread_id FROM containers WHERE account=? AND message_id=?",
+                (account, message_id)).fetchone()
+            if row is None:
+                return []
+            return self._db.execute(
+                "SELECT * FROM containers WHERE account=? AND thread_id=?",
+                (account, row["thread_id"])).fetchall()
+
+    def _container(self, account: str, message_id: str) -> sqlite3.Row:
+        """Get the container of a message ID, creating an empty one in a thread of its own"""
+        row = self._db.execute(
+            "SELECT message_id, thread_id, parent_id FROM containers WHERE account=? AND message_id=?",
+            (account, message_id)).fetchone()
+        if row is None:
+            self._db.execute(
+                "INSERT INTO containers (account, message_id, thread_id) VALUES (?, ?, ?)",
+                (account, message_id, message_id))
+            row = self._db.execute(
+                "SELECT message_id, thread_id, parent_id FROM containers WHERE account=? AND message_id=?",
+                (account, message_id)).fetchone()
+        return row
+
+    def _is_ancestor(self, account: str, ancestor: str, message_id: Optional[str]) -> bool:
+        """Whether ancestor is message_id itself or one of its parents"""
+        for _ in range(_MAX_DEPTH):
+            if message_id is None:
+                return False
+            if message_id == ancestor:
+                return True
+            row = self._db.execute(
+                "SELECT parent_id FROM containers WHERE account=? AND message_id=?",
+                (account, message_id)).fetchone()
+            message_id = row["parent_id"] if row else None
+        return True
+
+    def _link(self, account: str, message_id: str, references: List[str]):
+        """Link a message and its references parent to child and merge their threads"""
+        chain = references + [message_id]
+        containers = {ref: self._container(account, ref) for ref in chain}
+        for parent, child in zip(chain, chain[1:]):
+            current = containers[child]["parent_id"]
+            # References of other messages only fill in missing links, the message's own parent always wins
+            if current == parent or (current is not None and child != message_id):
+                continue
+            if self._is_ancestor(account, child, parent):
+                continue
+            self._db.execute("UPDATE containers SET parent_id=? WHERE account=? AND message_id=?",
+                             (parent, account, child))
+
+        # Relabel the smaller threads, so a message costs at most the size of the threads it joins
+        thread_ids = {row["thread_id"] for row in containers.values()}
+        if len(thread_ids) < 2:
+            return
+        sizes = {thread_id: self._db.execute(
+            "SELECT COUNT(*) FROM containers WHERE account=? AND thread_id=?",
+            (account, thread_id)).fetchone()[0] for thread_id in thread_ids}
+        largest = max(thread_ids, key=lambda thread_id: sizes[thread_id])
+        for thread_id in thread_ids - {largest}:
+            self._db.execute("UPDATE containers SET thread_id=? WHERE account=? AND thread_id=?",
+                             (largest, account, thread_id))
+
+
+_default_index: Optional[ThreadIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def get_thread_index() -> ThreadIndex:
+    """Get the process-wide thread index"""
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = ThreadIndex()
+    return _default_index